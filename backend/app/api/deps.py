@@ -1,5 +1,5 @@
 import uuid
-from typing import Generator, Set, Callable, Awaitable, Optional
+from typing import Generator, Set, FrozenSet, Callable, Awaitable, Optional
 from fastapi import Depends, HTTPException, status, Request
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -8,6 +8,7 @@ from app.models.user import User, UserRole, Role, RolePermission, Permission
 from app.crud import user as crud_user
 import logging
 from app.core.security import decode_token_to_user_id
+from app.core.permission_index import CompiledPermissions, compile_user_permissions
 
 logger = logging.getLogger(__name__)
 
@@ -18,9 +19,23 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+async def _principal_from_state(request: Request, db: AsyncSession) -> Optional[User]:
+    """
+    AuthMiddleware が解決したユーザーを、DBへ問い合わせずにリクエストのセッションへ取り込む。
+    キャッシュ上のインスタンスは複数リクエストで共有されるため、直接返さずに merge したコピーを返す。
+    """
+    principal = getattr(request.state, "user", None)
+    if principal is None:
+        return None
+    return await db.merge(principal, load=False)
+
 async def get_current_user(
     request: Request, db: AsyncSession = Depends(get_async_db)
 ) -> User:
+    principal = await _principal_from_state(request, db)
+    if principal is not None:
+        return principal
+
     user_id = getattr(request.state, "user_id", None)
     if user_id is None:
         raise HTTPException(
@@ -58,6 +73,10 @@ async def get_current_user_optional(
     オプショナル認証用のユーザー取得関数。
     認証されていない場合はNoneを返し、例外は発生させない。
     """
+    principal = await _principal_from_state(request, db)
+    if principal is not None:
+        return principal
+
     user_id = getattr(request.state, "user_id", None)
     if user_id is None:
         return None
@@ -76,30 +95,29 @@ async def get_current_user_optional(
 
     return db_user
 
+def get_current_permissions(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+) -> CompiledPermissions:
+    """
+    現在のユーザーのコンパイル済み権限集合を返す。
+    AuthMiddleware が解決済みの場合はリクエスト状態の値をそのまま使い、ORM のリレーションは辿らない。
+    """
+    permissions = getattr(request.state, "permissions", None)
+    if permissions is None:
+        permissions = compile_user_permissions(current_user)
+        request.state.permissions = permissions
+    return permissions
+
 def get_current_superuser(
     current_user: User = Depends(get_current_user),
+    permissions: CompiledPermissions = Depends(get_current_permissions),
 ) -> User:
-    # --- 権限チェック --- 
-    has_admin_permission = False
-    if hasattr(current_user, 'user_roles') and current_user.user_roles:
-        for user_role in current_user.user_roles:
-            if hasattr(user_role, 'role') and user_role.role and \
-               hasattr(user_role.role, 'role_permissions') and user_role.role.role_permissions:
-                for rp in user_role.role.role_permissions:
-                    if hasattr(rp, 'permission') and rp.permission and \
-                       hasattr(rp.permission, 'name') and \
-                       rp.permission.name.lower() == "admin_access":
-                        has_admin_permission = True
-                        break
-            if has_admin_permission:
-                break
-
-    if not has_admin_permission:
+    if not permissions.is_superuser:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Insufficient permissions for superuser access",
         )
-    # --- ここまで --- 
     return current_user
 
 def require_permission(*required_permissions: str) -> Callable[[User], Awaitable[User]]:
@@ -114,41 +132,18 @@ def require_permission(*required_permissions: str) -> Callable[[User], Awaitable
         この関数は、必要な権限を持つ認証済みユーザーオブジェクトを返すか、
         HTTPExceptionを発生させる。
     """
+    required: FrozenSet[str] = frozenset(required_permissions)
 
-    async def dependency(current_user: User = Depends(get_current_user)) -> User:
+    async def dependency(
+        current_user: User = Depends(get_current_user),
+        permissions: CompiledPermissions = Depends(get_current_permissions),
+    ) -> User:
         """実際の依存関係チェックを行う内部関数"""
-        # --- ★ 管理者ロールチェックを追加 ---
-        is_admin = False
-        if current_user.user_roles:
-            for user_role_assoc in current_user.user_roles:
-                # lazy='selectin' を想定
-                role: Role = user_role_assoc.role
-                if role and role.name == '管理者': # ロール名で判定
-                    is_admin = True
-                    break
-
-        if is_admin:
+        if permissions.is_admin:
             logger.debug(f"User {current_user.email} is an administrator. Skipping specific permission check for: {required_permissions}")
             return current_user # 管理者は権限チェックをスキップ
-        # --- ★ ここまで ---
-
-        # ユーザーに紐づく権限を取得 (リレーションシップ経由)
-        user_permissions: Set[str] = set()
-        if current_user.user_roles:
-            for user_role_assoc in current_user.user_roles:
-                # lazy='selectin' を想定
-                role: Role = user_role_assoc.role
-                if role and role.permissions:
-                    for perm in role.permissions:
-                        if isinstance(perm, Permission) and hasattr(perm, 'name'):
-                            user_permissions.add(perm.name)
-                        else:
-                            logger.warning(f"Unexpected item in role.permissions: {perm}")
-
-        logger.debug(f"User {current_user.email} permissions: {user_permissions}")
-
-        # 必要な権限がすべてユーザーの権限に含まれているかチェック
-        missing_permissions = set(required_permissions) - user_permissions
+
+        missing_permissions = required - permissions.names
         if missing_permissions:
             logger.warning(f"User {current_user.email} lacks required permissions: {missing_permissions}")
             raise HTTPException(
@@ -166,38 +161,12 @@ async def check_permissions_for_user(user: User, required_permissions: tuple[str
     指定されたユーザーが必要な権限を持っているかを確認します。
     管理者ロールを持つユーザーは常に True を返します。
     """
-    # 管理者ロールチェック
-    is_admin = False
-    if user.user_roles:
-        for user_role_assoc in user.user_roles:
-            role: Role = user_role_assoc.role
-            if role and role.name == '管理者': # ロール名で判定
-                is_admin = True
-                break
-    
-    if is_admin:
+    permissions = compile_user_permissions(user)
+    if permissions.is_admin:
         logger.debug(f"User {user.email} is an administrator. Granting permission for: {required_permissions}")
         return True
 
-    # ユーザーに紐づく権限を取得
-    user_permissions_set: Set[str] = set()
-    if user.user_roles:
-        for user_role_assoc in user.user_roles:
-            role: Role = user_role_assoc.role
-            if role and role.permissions: # role.permissions が RolePermission のリストではなく Permission のリストを直接持つことを期待
-                for perm in role.permissions:
-                    if isinstance(perm, Permission) and hasattr(perm, 'name'):
-                        user_permissions_set.add(perm.name)
-                    else:
-                        # role.permissions が RolePermission オブジェクトのリストである場合、
-                        # perm.permission.name のようにアクセスする必要があるかもしれない。
-                        # これは User モデルと Role モデルのリレーション定義による。
-                        # 既存の require_permission では role.permissions が Permission オブジェクトのリストを指しているように見える。
-                        logger.warning(f"Unexpected item or structure in role.permissions for user {user.email}: {perm}")
-
-
-    # 必要な権限がすべてユーザーの権限に含まれているかチェック
-    missing_permissions = set(required_permissions) - user_permissions_set
+    missing_permissions = permissions.missing(required_permissions)
     if missing_permissions:
         logger.warning(f"User {user.email} lacks required permissions for WebSocket: {missing_permissions}")
         return False
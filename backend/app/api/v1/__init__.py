@@ -23,6 +23,7 @@ from app.api.v1.endpoints.notifications import router as notifications_router
 from app.api.v1.endpoints.push import router as push_router
 from app.api.v1.endpoints.in_app_notification import router as in_app_notification_router
 from app.api.v1.endpoints.admin_notifications import router as admin_notifications_router
+from app.api.v1.endpoints.study_plans import router as study_plans_router
 
 # 各ルーターをメインルーターに追加
 api_router.include_router(admin_router, prefix="/admin", tags=["admin"])
@@ -44,4 +45,4 @@ api_router.include_router(notifications_router, prefix="/notifications", tags=["
 api_router.include_router(push_router, prefix="/push", tags=["push"])
 api_router.include_router(in_app_notification_router, prefix="/in-app-notifications", tags=["in-app-notifications"])
 api_router.include_router(admin_notifications_router, prefix="/admin/notification-settings", tags=["admin-notification-settings"])
-
+api_router.include_router(study_plans_router, prefix="/study-plans", tags=["study-plans"])
@@ -8,7 +8,8 @@ from pydantic import BaseModel, Field # ★ BaseModel と Field をインポー
 
 from app.core.config import settings
 from app.api.deps import get_current_user, require_permission
-from app.services.stripe_service import StripeService # StripeServiceをインポート
+from app.services.stripe_client import stripe_catalog_cache, stripe_client
+from app.services.stripe_webhook_queue import stripe_webhook_queue
 # Pydanticスキーマのインポート (後で追加する可能性あり)
 # from app.schemas.stripe import ProductCreate, ProductUpdate, PriceCreate, PriceUpdate # 例
 
@@ -202,63 +203,69 @@ async def get_products(
     """
     Stripe商品一覧（関連価格情報を含む）を取得する
     metadata.assigned_role (ロールID) からロール名を取得し、assigned_role_nameに設定する。
+    商品数によらず、Stripe への呼び出しは商品一覧と価格一覧 (全商品分) の 2 種類、
+    ロール名の解決は 1 クエリで行う。
     """
     try:
-        products_raw = StripeService.list_products(active=active, limit=limit)
+        products_raw = await stripe_client.list_products(active=active, limit=limit)
+        prices_raw = await stripe_client.list_all_prices(active=True)
+
+        # 価格を商品 ID ごとにまとめる
+        prices_by_product: Dict[str, List[StripePriceResponse]] = {}
+        for price_obj in prices_raw:
+            try:
+                product_field_value = price_obj.get('product')
+                product_id_str = None
+                if isinstance(product_field_value, dict):
+                    product_id_str = product_field_value.get('id')
+                elif isinstance(product_field_value, str):
+                    product_id_str = product_field_value
+                elif hasattr(product_field_value, 'id'):
+                    product_id_str = product_field_value.id
+
+                if product_id_str:
+                    price_data_dict = dict(price_obj)
+                    price_data_dict['product'] = product_id_str
+                    prices_by_product.setdefault(product_id_str, []).append(StripePriceResponse.model_validate(price_data_dict))
+                else:
+                    logger.warning(f"Price {price_obj.get('id')} is missing product ID.")
+            except Exception as price_val_e:
+                logger.error(f"Pydantic validation failed for price {price_obj.get('id')}: {price_val_e}")
+
+        # metadata.assigned_role のロール ID をまとめて解決する
+        role_ids: Set[UUID] = set()
+        for prod_raw in products_raw:
+            role_id_str = (prod_raw.get('metadata') or {}).get('assigned_role')
+            if role_id_str:
+                try:
+                    role_ids.add(UUID(role_id_str))
+                except ValueError:
+                    logger.warning(f"Product {prod_raw.id}: assigned_role '{role_id_str}' in metadata is not a valid UUID. assigned_role_name will be based on Stripe metadata if available or None.")
+        role_names = await crud_role.get_role_names_by_ids(db, list(role_ids))
+
         products_with_prices = []
         for prod_raw in products_raw:
             try:
-                prices_raw = StripeService.list_prices(product_id=prod_raw.id, active=True, limit=100)
-                formatted_prices = []
-                for price_obj in prices_raw:
-                    try:
-                        product_field_value = price_obj.get('product')
-                        product_id_str = None
-                        if isinstance(product_field_value, dict):
-                            product_id_str = product_field_value.get('id')
-                        elif isinstance(product_field_value, str):
-                            product_id_str = product_field_value
-                        elif hasattr(product_field_value, 'id'):
-                            product_id_str = product_field_value.id
-
-                        if product_id_str:
-                            price_data_dict = dict(price_obj)
-                            price_data_dict['product'] = product_id_str
-                            formatted_prices.append(StripePriceResponse.model_validate(price_data_dict))
-                        else:
-                             logger.warning(f"Price {price_obj.get('id')} is missing product ID.")
-                    except Exception as price_val_e:
-                        logger.error(f"Pydantic validation failed for price {price_obj.get('id')}: {price_val_e}")
-                        # continue
-
-                product_resp_data = dict(prod_raw) 
+                product_resp_data = dict(prod_raw)
 
                 assigned_role_name_from_db = None
-                if product_resp_data.get('metadata') and isinstance(product_resp_data['metadata'], dict):
-                    role_id_str = product_resp_data['metadata'].get('assigned_role')
-                    if role_id_str:
-                        try:
-                            role_id_uuid = UUID(role_id_str)
-                            role_obj = await crud_role.get_role(db, role_id=role_id_uuid)
-                            if role_obj:
-                                assigned_role_name_from_db = role_obj.name
-                                logger.info(f"Product {prod_raw.id}: Found role name '{assigned_role_name_from_db}' for role ID '{role_id_str}'")
-                            else:
-                                logger.warning(f"Product {prod_raw.id}: Role with ID '{role_id_str}' not found in DB. assigned_role_name will be based on Stripe metadata if available or None.")
-                        except ValueError:
-                            logger.warning(f"Product {prod_raw.id}: assigned_role '{role_id_str}' in metadata is not a valid UUID. assigned_role_name will be based on Stripe metadata if available or None.")
-                        except Exception as e_role:
-                            logger.error(f"Product {prod_raw.id}: Error fetching role name for ID '{role_id_str}': {e_role}", exc_info=True)
-                
+                metadata = product_resp_data.get('metadata')
+                role_id_str = metadata.get('assigned_role') if isinstance(metadata, dict) else None
+                if role_id_str:
+                    try:
+                        assigned_role_name_from_db = role_names.get(UUID(role_id_str))
+                    except ValueError:
+                        pass
+                    if not assigned_role_name_from_db:
+                        logger.warning(f"Product {prod_raw.id}: assigned_role_name will contain role ID '{role_id_str}' as role was not found in DB, or it was not a valid UUID.")
+
                 product_resp = StripeProductWithPricesResponse.model_validate({
                     **product_resp_data,
-                    'prices': formatted_prices
+                    'prices': prices_by_product.get(prod_raw.id, [])
                 })
 
                 if assigned_role_name_from_db:
                     product_resp.assigned_role_name = assigned_role_name_from_db
-                elif product_resp_data.get('metadata') and product_resp_data['metadata'].get('assigned_role') and not assigned_role_name_from_db:
-                    logger.warning(f"Product {prod_raw.id}: assigned_role_name will contain role ID '{product_resp_data['metadata']['assigned_role']}' as role was not found in DB, or it was not a valid UUID.")
 
                 products_with_prices.append(product_resp)
             except Exception as prod_val_e:
@@ -291,7 +298,7 @@ async def create_stripe_product_and_store_in_db(
             "active": product_in.active,
             "metadata": product_in.metadata
         }
-        created_stripe_product = StripeService.create_product(**stripe_product_params)
+        created_stripe_product = await stripe_client.create_product(**stripe_product_params)
         stripe_product_id = created_stripe_product.id
 
         # 2. DB保存用のデータを作成
@@ -342,7 +349,7 @@ async def update_stripe_product(
                  detail="更新するデータがありません。"
              )
 
-        product = StripeService.update_product(
+        product = await stripe_client.update_product(
             product_id=product_id,
             name=product_data.name,
             description=product_data.description,
@@ -371,7 +378,7 @@ async def archive_stripe_product(
     """
     try:
         # Stripe APIを呼び出して商品をアーカイブ
-        archived_stripe_product = StripeService.archive_product(product_id=product_id)
+        archived_stripe_product = await stripe_client.archive_product(product_id=product_id)
         logger.info(f"Stripe Product {product_id} archived successfully via API.")
 
         # DBのStripeDbProductのactiveフラグをFalseに更新
@@ -420,7 +427,7 @@ async def get_prices(
     Stripe価格一覧を取得します (StripeServiceを使用)
     """
     try:
-        prices_raw = StripeService.list_prices(product_id=product_id, active=active, limit=limit)
+        prices_raw = await stripe_client.list_prices(product_id=product_id, active=active, limit=limit)
         formatted_prices = []
         for price_obj in prices_raw:
             try:
@@ -464,7 +471,7 @@ async def create_stripe_price(
     try:
         # 1. Stripe APIを呼び出してStripeに価格を作成
         recurring_dict = price_data.recurring.model_dump()
-        created_stripe_price = StripeService.create_price(
+        created_stripe_price = await stripe_client.create_price(
             product_id=price_data.product_id, # これはStripeのProduct ID
             unit_amount=price_data.unit_amount,
             currency=price_data.currency,
@@ -564,7 +571,7 @@ async def update_stripe_price(
                  detail="更新するデータがありません。"
              )
 
-        price = StripeService.update_price(
+        price = await stripe_client.update_price(
             price_id=price_id,
             active=price_data.active,
             metadata=price_data.metadata,
@@ -593,7 +600,7 @@ async def archive_stripe_price(
     """
     try:
         # Stripe APIを呼び出して価格を非アクティブ化 (active=False で更新)
-        archived_stripe_price = StripeService.update_price(price_id=price_id, active=False)
+        archived_stripe_price = await stripe_client.update_price(price_id=price_id, active=False)
         logger.info(f"Stripe Price {price_id} marked as inactive successfully via API.")
 
         # DBのSubscriptionPlanのis_activeフラグをFalseに更新
@@ -863,7 +870,8 @@ async def create_stripe_coupon_and_import(
         # stripe.api_key = settings.STRIPE_SECRET_KEY # main.py等での設定を期待
 
         logger.debug(f"Calling Stripe API to create coupon with params: {stripe_coupon_params}")
-        created_stripe_coupon = stripe.Coupon.create(**stripe_coupon_params)
+        created_stripe_coupon = await stripe_client.call(stripe.Coupon.create, **stripe_coupon_params)
+        stripe_catalog_cache.invalidate("coupon")
         logger.info(f"Successfully created Stripe coupon ID: {created_stripe_coupon.id}")
 
         # DB登録用のデータを作成
@@ -1044,6 +1052,21 @@ async def delete_stripe_coupon_and_db(
     
     return None # HTTP 204 No Content の場合は None を返すのが明示的で良い
 
+# ---------- Stripe Webhook 関連のエンドポイント ---------- #
+@router.get(
+    "/stripe/webhook-metrics",
+    summary="Stripe Webhook Queue Metrics",
+    dependencies=[Depends(require_permission('admin_access'))]
+)
+async def admin_get_stripe_webhook_metrics() -> Dict[str, Any]:
+    """
+    このプロセスの Stripe Webhook 処理キューのメトリクス (受信・重複・処理・失敗・再試行の件数、
+    キューの滞留件数、直近 1 分の処理件数、受信から処理開始までの遅延) を返します。
+
+    **必要な権限:** `admin_access`
+    """
+    return stripe_webhook_queue.metrics()
+
 # ---------- ロール関連のエンドポイント ---------- #
 @router.get(
     "/roles",
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response, Request, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.database import get_async_db
 from typing import Any
 from app.core.config import settings
-from app.core.security import verify_password, get_password_hash, create_access_token, create_refresh_token, decode_token
+from app.core.security import create_access_token, create_refresh_token, decode_token
+from app.core import password_hasher
+from app.core.token_revocation import token_revocation
 from app.crud import crud_user
-from app.crud.token import add_token_to_blacklist, is_token_blacklisted, remove_expired_tokens
+from app.crud.token import add_token_to_blacklist, blacklist_tokens_by_user, is_token_blacklisted, remove_expired_tokens
 from app.schemas.auth import (
     LoginResponse, SignUpRequest, EmailVerificationRequest, 
     ForgotPasswordRequest, ResetPasswordRequest,
@@ -51,48 +53,72 @@ async def login(
     try:
         logger.debug(f"ログイン試行: {form_data.username}")
         
-        # ユーザー認証 (get_user_by_email はリレーションをロードしない)
-        authenticated_user = await crud_user.get_user_by_email(db, email=form_data.username)
-        
-        # --- デバッグログ追加 ---
-        if authenticated_user:
-            logger.debug(f"ユーザー発見: {authenticated_user.email}, DBハッシュ: {authenticated_user.hashed_password}")
-            password_match = verify_password(form_data.password, authenticated_user.hashed_password)
-            logger.debug(f"パスワード検証結果 (verify_password): {password_match}")
-        else:
+        # ユーザー認証 (ロール・権限・ログイン情報まで 1 クエリで取得し、成功後に再取得しない)
+        user = await crud_user.get_user_for_login(db, email=form_data.username)
+        if not user:
             logger.debug(f"ユーザーが見つかりません: {form_data.username}")
-            password_match = False # ユーザーがいなければ検証は False
-        # --- デバッグログ追加ここまで ---
-            
-        if not authenticated_user or not password_match: # デバッグ用に検証結果変数を使用
             logger.warning(f"認証失敗: {form_data.username}")
-            if authenticated_user: # ユーザーが存在する場合のみ失敗を記録
-                 await crud_user.record_login_attempt(db=db, user_id=authenticated_user.id, success=False)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="メールアドレスまたはパスワードが正しくありません",
             )
-            
-        logger.debug(f"認証成功: {form_data.username}")
-        
-        # ★ 認証成功後、リレーションを含むユーザー情報を再取得
-        user = await crud_user.get_user(db, user_id=authenticated_user.id)
-        if not user: # 再取得に失敗した場合 (通常は起こらないはず)
-            logger.error(f"認証成功ユーザー {authenticated_user.id} の情報再取得に失敗しました。")
+
+        # ロック中なら bcrypt の検証を行わずに断る
+        login_info = user.login_info
+        if login_info and login_info.locked_until and login_info.locked_until > datetime.utcnow():
+            logger.warning(f"ロック中のアカウントへのログイン試行: {form_data.username}")
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="ユーザー情報の取得に失敗しました。",
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="ログイン試行回数が上限に達したため、アカウントが一時的にロックされています。しばらくしてから再度お試しください。",
             )
-        logger.info(f"User authenticated and re-fetched: {user.id if user else 'USER_NOT_FOUND_POST_AUTH'}")
 
-        # 成功記録
-        try:
-            logger.info(f"Calling record_login_attempt for user_id: {user.id}")
-            await crud_user.record_login_attempt(db=db, user_id=user.id, success=True)
-            logger.info(f"Successfully called record_login_attempt for user_id: {user.id}")
-        except Exception as e_record_login:
-            logger.error(f"Error calling record_login_attempt for user_id: {user.id}: {e_record_login}", exc_info=True)
-        
+        # bcrypt はイベントループを止めないよう専用プールで検証する
+        password_match, rehashed_password = await password_hasher.verify_and_update_password(
+            form_data.password, user.hashed_password
+        )
+        logger.debug(f"パスワード検証結果 (verify_password): {password_match}")
+
+        if not password_match:
+            logger.warning(f"認証失敗: {form_data.username}")
+            try:
+                await crud_user.record_login_failure(db, user_id=user.id)
+            except Exception as e_record_login:
+                logger.error(f"Error recording login failure for user_id: {user.id}: {e_record_login}", exc_info=True)
+                await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="メールアドレスまたはパスワードが正しくありません",
+            )
+
+        logger.debug(f"認証成功: {form_data.username}")
+
+        # 成功記録 (失敗カウンタのリセットと、コスト設定が変わっていればハッシュの置き換えを 1 トランザクションで)
+        if login_info:
+            try:
+                recorded = await crud_user.record_login_success(db, user_id=user.id, rehashed_password=rehashed_password)
+            except Exception as e_record_login:
+                logger.error(f"Error recording login success for user_id: {user.id}: {e_record_login}", exc_info=True)
+                await db.rollback()
+            else:
+                if not recorded:
+                    # 検証中に並行する失敗でロックされた
+                    logger.warning(f"検証中にアカウントがロックされました: {form_data.username}")
+                    raise HTTPException(
+                        status_code=status.HTTP_401_UNAUTHORIZED,
+                        detail="ログイン試行回数が上限に達したため、アカウントが一時的にロックされています。しばらくしてから再度お試しください。",
+                    )
+                if rehashed_password:
+                    logger.info(f"Password hash for user {user.id} upgraded to the current bcrypt cost.")
+        elif rehashed_password:
+            # ログイン情報の行がなくても、古いコストのハッシュは置き換える
+            try:
+                await crud_user.update_password_hash(db, user_id=user.id, hashed_password=rehashed_password)
+            except Exception as e_rehash:
+                logger.error(f"Error upgrading password hash for user_id: {user.id}: {e_rehash}", exc_info=True)
+                await db.rollback()
+            else:
+                logger.info(f"Password hash for user {user.id} upgraded to the current bcrypt cost.")
+
         # リクエストヘッダーの確認
         logger.debug(f"リクエストヘッダー: {{request.headers}}")
 
@@ -180,6 +206,8 @@ async def login(
                 expires_in=int(access_token_expires.total_seconds())
             )
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"ログインエラー: {str(e)}")
         logger.exception("Login error details:")
@@ -329,9 +357,6 @@ async def signup(
                 detail="Email already registered"
             )
         
-        # パスワードのハッシュ化
-        hashed_password = get_password_hash(user_data.password)
-        
         # ユーザーの作成 (UserCreate スキーマを使用して呼び出し)
         user_create_schema = UserCreate(
             email=user_data.email,
@@ -373,6 +398,8 @@ async def signup(
                 "role": role_name # レスポンスにはロール名を返す
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Signup error: {str(e)}")
         raise HTTPException(
@@ -733,14 +760,14 @@ async def change_password(
             )
         
         # 現在のパスワードを検証
-        if not verify_password(password_data["current_password"], user.hashed_password):
+        if not await password_hasher.verify_password(password_data["current_password"], user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="現在のパスワードが正しくありません"
             )
         
         # 新しいパスワードのハッシュ化と保存
-        hashed_password = get_password_hash(password_data["new_password"])
+        hashed_password = await password_hasher.hash_password(password_data["new_password"])
         user.hashed_password = hashed_password
         
         # ユーザーのすべてのアクティブトークンを無効化するためのコード
@@ -762,6 +789,8 @@ async def change_password(
                 except Exception as e:
                     logger.error(f"トークンブラックリスト登録エラー: {str(e)}")
         
+        # 変更前に発行されたトークン (リフレッシュトークンを含む) をすべて無効にする
+        await blacklist_tokens_by_user(db, str(user.id), reason=TokenBlacklistReason.PASSWORD_CHANGE)
         await db.commit()
         
         return {
@@ -799,8 +828,9 @@ async def refresh_token(
         token_jti = payload["jti"]
         expires_at = datetime.fromtimestamp(payload.get("exp")) # 有効期限取得
 
-        # トークンがブラックリストに登録されているか確認
-        if await is_token_blacklisted(db, token_jti=token_jti):
+        # トークンが失効していないか確認 (パスワード変更などによる一括失効はメモリ上のフィルターで判定、
+        # リフレッシュトークンの再利用は他プロセスでの失効を待たずに検出できるよう DB でも確認する)
+        if token_revocation.is_revoked(token_jti, payload["sub"], payload.get("iat")) or await is_token_blacklisted(db, token_jti=token_jti):
              logger.error(f"リフレッシュトークンエラー: 401: このトークンは無効化されています (is_token_blacklisted check)") # ★ エラーログ追加
              raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -941,7 +971,6 @@ async def verify_email(
 @router.post("/resend-verification", response_model=dict)
 async def resend_verification(
     request: Request,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_async_db)
 ) -> Any:
     """
@@ -968,12 +997,8 @@ async def resend_verification(
         if user.is_verified:
             return {"message": "メールアドレスはすでに検証済みです"}
         
-        # 検証メールを送信
-        background_tasks.add_task(
-            send_verification_email,
-            user.email,
-            user.full_name
-        )
+        # 検証メールを送信 (送信キューに積むだけなので待っても遅くならない)
+        await send_verification_email(user.email, user.full_name)
         
         return {"message": "検証メールを再送信しました"}
     except Exception as e:
@@ -986,7 +1011,6 @@ async def resend_verification(
 @router.post("/forgot-password", response_model=dict)
 async def forgot_password(
     forgot_data: ForgotPasswordRequest,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_async_db)
 ) -> Any:
     """
@@ -1010,13 +1034,8 @@ async def forgot_password(
             expires_delta=timedelta(hours=24)
         )
         
-        # パスワードリセットメールを送信
-        background_tasks.add_task(
-            send_password_reset_email,
-            user.email,
-            user.full_name,
-            reset_token
-        )
+        # パスワードリセットメールを送信 (送信キューに積むだけなので待っても遅くならない)
+        await send_password_reset_email(user.email, user.full_name, reset_token)
         
         return {"message": "パスワードリセットリンクを送信しました"}
     except Exception as e:
@@ -1066,11 +1085,15 @@ async def reset_password(
             )
         
         # パスワードをハッシュ化して更新
-        hashed_password = get_password_hash(reset_data.new_password)
+        hashed_password = await password_hasher.hash_password(reset_data.new_password)
         user.hashed_password = hashed_password
+        # リセット前に発行されたトークン (リフレッシュトークンを含む) をすべて無効にする
+        await blacklist_tokens_by_user(db, str(user.id), reason=TokenBlacklistReason.PASSWORD_CHANGE)
         await db.commit()
         
         return {"message": "パスワードがリセットされました"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"パスワードリセットエラー: {str(e)}")
         raise HTTPException(
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Request, Depends, BackgroundTasks, status, WebSocket, WebSocketDisconnect, Query
+from fastapi import APIRouter, HTTPException, Request, Response, Depends, BackgroundTasks, status, WebSocket, WebSocketDisconnect, Query
 from fastapi.responses import StreamingResponse
 from typing import List, Dict, Optional
 from datetime import datetime
@@ -6,8 +6,11 @@ import logging
 from app.schemas.chat import ChatRequest, ChatResponse, Message, ChatMessageCreate, ChatMessage as ChatMessageSchema, ChatSessionCreate, ChatType, ChatSessionStatus, ChatSessionSummary, ChatSession, ChatMessageResponse
 from app.core.config import settings
 from app.services.openai_service import stream_openai_response
+from app.services.chat_persistence import chat_write_behind
+from app.services.conversation_cache import conversation_cache
+from app.services.context_window import chat_context_window
 import uuid
-from openai import AsyncOpenAI
+from app.services.llm_clients import get_openai_client
 from app.api.deps import get_current_user, User, require_permission, get_current_user_from_token, check_permissions_for_user
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.database import get_async_db
@@ -20,6 +23,7 @@ from app.crud.chat import (
     update_session_status,
     get_archived_chat_sessions,
     get_chat_session_by_id,
+    encode_session_cursor,
     get_chat_messages as get_chat_messages_history
 )
 from fastapi.middleware.cors import CORSMiddleware
@@ -35,12 +39,13 @@ from app import models, crud
 from app.api import deps
 from app.models.chat import MessageSender
 from app.services.ai_service import get_self_analysis_agent_response
-from app.services.agents.self_analysis_langchain.main import SelfAnalysisOrchestrator
-from app.crud.async_chat import get_user_chat_sessions
+from app.services.agents.self_analysis_langchain.main import self_analysis_orchestrator
+from app.services.self_analysis_report import load_self_analysis_report
 import json
 import asyncio
 from app.models.enums import ChatType as ChatTypeEnum, SessionStatus as ChatSessionStatusEnum # Enumを別名でインポート
 from starlette.websockets import WebSocketState # WebSocketState をインポート
+from sqlalchemy import inspect as sa_inspect
 
 router = APIRouter()
 
@@ -91,7 +96,16 @@ async def websocket_chat_endpoint(
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Insufficient permissions")
             return
 
+        # この接続で解決済みのセッション (未フラッシュの新規セッションを再検索しないため)
+        known_sessions: Dict[str, models.ChatSession] = {}
+        # この接続で最後に積んだ書き込み。次ターンの履歴読み込み前に待つ
+        last_write: Optional[asyncio.Future] = None
+        previous_turn_write: Optional[asyncio.Future] = None
+
         while True:
+            # 前ターンの読み取りトランザクションを閉じ、待機中は接続をプールへ返す
+            if db.in_transaction():
+                await db.commit()
             data = await websocket.receive_text()
             logger.debug(f"Received raw data via WebSocket from {current_user.email}: {data[:200]}")
 
@@ -112,12 +126,26 @@ async def websocket_chat_endpoint(
 
             logger.info(f"Processing chat request for user {current_user.email}, session: {chat_request.session_id}, type: {chat_request.chat_type}")
 
-            chat_session = await get_or_create_chat_session(
-                db=db,
-                user_id=current_user.id,
-                session_id=chat_request.session_id, # ここで UUID オブジェクトが渡される可能性がある
-                chat_type=chat_request.chat_type.value
-            )
+            previous_turn_write = last_write
+            # セッション作成・メッセージ保存はすべて chat_write_behind に積み、
+            # 最初のトークンまでの経路では commit を待たない
+            chat_session = known_sessions.get(str(chat_request.session_id)) if chat_request.session_id else None
+            is_new_session = False
+            if chat_session is None:
+                chat_session = await get_or_create_chat_session(
+                    db=db,
+                    user_id=current_user.id,
+                    session_id=chat_request.session_id, # ここで UUID オブジェクトが渡される可能性がある
+                    chat_type=chat_request.chat_type.value,
+                    persist=False
+                )
+                if sa_inspect(chat_session).transient:
+                    is_new_session = True
+                    last_write = await chat_write_behind.add_session(chat_session)
+                else:
+                    # タイトルをメモリ上で更新しても db 側で UPDATE されないよう切り離す
+                    db.expunge(chat_session)
+                known_sessions[str(chat_session.id)] = chat_session
             actual_session_id = str(chat_session.id)
             logger.info(f"Using chat session ID: {actual_session_id}")
 
@@ -127,63 +155,47 @@ async def websocket_chat_endpoint(
                     user_message_prefix = chat_request.message.replace('\n', ' ').strip()
                     title = user_message_prefix[:30].strip() + "..." if len(user_message_prefix) > 30 else user_message_prefix.strip()
                     if title:
-                        await update_session_title(db, chat_session.id, current_user.id, title)
-                        logger.info(f"Session title updated to '{title}' for session {actual_session_id}")
+                        chat_session.title = title
+                        last_write = await chat_write_behind.update_title(chat_session.id, title)
+                        logger.info(f"Session title update queued as '{title}' for session {actual_session_id}")
                 except Exception as e:
                     logger.error(f"Failed to update session title for {actual_session_id}: {e}", exc_info=True)
-            
-            user_message_db_obj = await save_chat_message(
-                db=db, session_id=UUID(actual_session_id), content=chat_request.message,
-                user_id=current_user.id, sender_type="USER"
+
+            context = None
+            if not is_new_session:
+                # 前ターンの書き込みが反映されてから差分を読む。通常は既に完了している
+                if previous_turn_write is not None and not previous_turn_write.done():
+                    await previous_turn_write
+                # 会話キャッシュは前回以降の新着だけを読み込み、ロール変換・トークン予算での切り詰めも済んでいる
+                context = await conversation_cache.refresh(
+                    db, chat_session.id,
+                    summary=chat_session.context_summary,
+                    summary_upto=chat_session.context_summary_message_id,
+                )
+
+            # 履歴を読んだ後に積むので、今回のユーザーメッセージは下で明示的に追加される
+            last_write = await chat_write_behind.add_message(
+                session_id=chat_session.id, content=chat_request.message,
+                sender=MessageSender.USER, user_id=current_user.id
             )
-            logger.info(f"User message saved (ID: {user_message_db_obj.id}) for session {actual_session_id}")
-
-            session_messages_history = await get_chat_messages_history(db, actual_session_id)
-            formatted_history = []
-            if isinstance(session_messages_history, list):
-                for msg_item in session_messages_history:
-                    if isinstance(msg_item, dict):
-                        formatted_history.append({"role": msg_item.get("role", "unknown"), "content": msg_item.get("content", "")})
-                    else: logger.warning(f"Unexpected item type in session_messages_history: {type(msg_item)}")
-            
+            logger.info(f"User message queued for session {actual_session_id}")
+
             system_message_content = settings.INSTRUCTION
             if chat_request.chat_type == ChatTypeEnum.FAQ:
                 system_message_content = "あなたは総合型選抜に関する質問に答えるFAQボットです。"
 
-            # messages_for_openai の準備段階
-            temp_messages = [
-                {"role": "system", "content": system_message_content},
-                *formatted_history,
-            ]
-            # ユーザーの最新メッセージを追加 (重複を避けるチェックはそのまま)
-            if not any(m['role'] == 'user' and m['content'] == chat_request.message for m in formatted_history):
-                 temp_messages.append({"role": "user", "content": chat_request.message})
-            
-            # OpenAI APIに渡す最終的な messages_for_openai リストを生成
-            # ここで 'ai' ロールを 'assistant' に強制的に変換する
-            messages_for_openai = []
-            for msg in temp_messages:
-                role = msg.get("role")
-                content = msg.get("content")
-                # MessageSender.AI.value は "ai"
-                if role == MessageSender.AI.value: 
-                    messages_for_openai.append({"role": "assistant", "content": content})
-                elif role in ["user", "system", "assistant"]: # 有効なロールはそのまま
-                    messages_for_openai.append({"role": role, "content": content})
-                else: # 不明なロールの場合はログを残し、'user'ロールとして扱う (またはエラー処理)
-                    logger.warning(f"Unknown role '{role}' in message preparation for OpenAI. Original message: {msg}")
-                    messages_for_openai.append({"role": "user", "content": content}) # 安全策
+            # system プロンプト + 要約 + 予算に収まる直近の履歴 + 今回のメッセージ
+            messages_for_openai = chat_context_window.build(
+                system_message_content,
+                context.messages if context else [],
+                context.token_counts if context else [],
+                chat_request.message,
+                summary=context.summary if context else None,
+            )
 
             # デバッグログで変換後の内容を確認
             logger.debug(f"Final messages for OpenAI API: {messages_for_openai}")
 
-            ai_message_db_obj = await save_chat_message(
-                db=db, session_id=UUID(actual_session_id), content="", sender_type="AI"
-            )
-            logger.info(f"Empty AI message saved (ID: {ai_message_db_obj.id}) for session {actual_session_id}")
-            await db.commit() # 先にAIメッセージのプレースホルダーをコミット
-            await db.refresh(ai_message_db_obj)
-
             # SELF_ANALYSIS 用 AI Service 呼び出し
             if chat_request.chat_type == ChatTypeEnum.SELF_ANALYSIS:
                 # まず簡単なテスト応答を送信
@@ -200,11 +212,10 @@ async def websocket_chat_endpoint(
                 trace_logger.addHandler(ws_handler)
                 try:
                     logger.info(f"Starting SelfAnalysisOrchestrator for session {actual_session_id}")
-                    # 新版LangChain自己分析オーケストレーターを利用
-                    orchestrator = SelfAnalysisOrchestrator()
-                    logger.info(f"Orchestrator created, calling run with {len(messages_for_openai)} messages")
+                    # 新版LangChain自己分析オーケストレーター (共有インスタンス) を利用
+                    logger.info(f"Calling orchestrator with {len(messages_for_openai)} messages")
                     # LangChainオーケストレーター実行 (辞書結果を受け取る)
-                    result = await orchestrator.run(messages_for_openai, actual_session_id)
+                    result = await self_analysis_orchestrator.run(messages_for_openai, actual_session_id)
                     logger.info(f"Orchestrator run completed. Result type: {type(result)}, content: {result}")
                     # ユーザー向け応答抽出
                     reply = None
@@ -252,13 +263,9 @@ async def websocket_chat_endpoint(
                 await websocket.send_text(json.dumps({"type": "chunk", "content": reply or "", "session_id": actual_session_id}))
                 await websocket.send_text(json.dumps({"type": "done", "session_id": actual_session_id}))
                 # AI応答をDBに保存
-                await save_chat_message(
-                    db=db,
-                    session_id=UUID(actual_session_id),
-                    content=reply or "",
-                    sender_type="AI"
+                last_write = await chat_write_behind.add_message(
+                    session_id=chat_session.id, content=reply or "", sender=MessageSender.AI
                 )
-                await db.commit()
                 continue
 
             full_ai_response = ""
@@ -278,13 +285,10 @@ async def websocket_chat_endpoint(
                 
                 logger.info(f"Streaming finished for session {actual_session_id}. Full AI response length: {len(full_ai_response)}")
 
-                if ai_message_db_obj:
-                    ai_message_db_obj.content = full_ai_response
-                    ai_message_db_obj.updated_at = datetime.utcnow()
-                    db.add(ai_message_db_obj)
-                    await db.commit()
-                    await db.refresh(ai_message_db_obj)
-                    logger.info(f"AI response saved/updated for message ID: {ai_message_db_obj.id} in session {actual_session_id}")
+                last_write = await chat_write_behind.add_message(
+                    session_id=chat_session.id, content=full_ai_response, sender=MessageSender.AI
+                )
+                logger.info(f"AI response queued for session {actual_session_id}")
                 
                 # 自己分析評価ロジックは呼び出さない (コメントアウトまたは削除)
                 # if chat_request.chat_type == ChatTypeEnum.SELF_ANALYSIS: 
@@ -355,7 +359,7 @@ async def chat_with_ai(
     try:
         logger.info(f"Sending to OpenAI: {chat_request.message}")
         
-        client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
         
         system_message = "あなたは就職活動中の学生の自己分析をサポートするAIアシスタントです。"
         
@@ -398,12 +402,17 @@ async def chat_with_ai(
 
 @router.get("/sessions/archived")
 async def get_archived_chat_sessions_route(
+    response: Response,
     current_user: User = Depends(require_permission('chat_session_read')),
     db: AsyncSession = Depends(get_async_db),
-    chat_type: str = "general"
+    chat_type: str = "general",
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
 ):
     try:
-        archived_sessions = await get_archived_chat_sessions(db, current_user.id, chat_type)
+        archived_sessions = await get_archived_chat_sessions(db, current_user.id, chat_type, limit=limit, cursor=cursor)
+        if limit is not None and len(archived_sessions) == limit:
+            response.headers["X-Next-Cursor"] = encode_session_cursor(archived_sessions[-1])
         return archived_sessions
     except ValueError as ve:
         logger.error(f"Invalid chat type requested: {chat_type}")
@@ -521,14 +530,18 @@ async def unarchive_chat_session(
 
 @router.get("/sessions", response_model=List[ChatSessionSummary])
 async def get_chat_sessions(
+    response: Response,
     current_user: User = Depends(require_permission('chat_session_read')),
     db: AsyncSession = Depends(get_async_db),
     chat_type_str: Optional[str] = Query(None, alias="chat_type"), # 文字列として受け取り、エイリアスを指定
-    status_str: Optional[str] = Query(None, alias="status")       # 文字列として受け取り、エイリアスを指定
+    status_str: Optional[str] = Query(None, alias="status"),       # 文字列として受け取り、エイリアスを指定
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
 ):
     """
     ユーザーのチャットセッションのリストを取得します。
     オプションでチャットタイプとステータスでフィルタリングできます。
+    limit を指定した場合、続きがあれば次ページ用のカーソルを X-Next-Cursor ヘッダーで返します。
     """
     logger.debug(f"Attempting to fetch sessions for user {current_user.email} with chat_type_str='{chat_type_str}' and status_str='{status_str}'")
     
@@ -564,10 +577,14 @@ async def get_chat_sessions(
             db=db, 
             user_id=current_user.id, 
             chat_type=chat_type_value_for_crud, 
-            status=status_value_for_crud
+            status=status_value_for_crud,
+            limit=limit,
+            cursor=cursor,
         )
         
         logger.debug(f"Retrieved {len(sessions_db)} sessions from DB.")
+        if limit is not None and len(sessions_db) == limit:
+            response.headers["X-Next-Cursor"] = encode_session_cursor(sessions_db[-1])
         # デバッグ: 取得したセッションの最初の1件の型と内容を出力
         # if sessions_db:
         #    logger.debug(f"First session from DB raw type: {type(sessions_db[0])}, content: {sessions_db[0].__dict__ if hasattr(sessions_db[0], '__dict__') else sessions_db[0]}")
@@ -600,6 +617,9 @@ async def get_chat_sessions(
 
         return sessions_db
 
+    except ValueError as ve:
+        logger.warning(f"Invalid parameter in get_chat_sessions for user {current_user.email}: {ve}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
     except Exception as e:
         logger.error(f"Error in get_chat_sessions for user {current_user.email}: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -654,8 +674,7 @@ async def start_self_analysis_chat(
         sender_type="USER"
     )
     # 新版LangChain自己分析オーケストレーターを利用して応答生成
-    orchestrator = SelfAnalysisOrchestrator()
-    result = await orchestrator.run([{"role": "user", "content": chat_request.message}], actual_session_id)
+    result = await self_analysis_orchestrator.run([{"role": "user", "content": chat_request.message}], actual_session_id)
     # ユーザー向け応答抽出
     if isinstance(result, dict):
         reply = result.get("user_visible") or result.get("final_notes") or str(result)
@@ -684,31 +703,8 @@ async def get_self_analysis_report(
     session = await get_chat_session_by_id(db, session_id)
     if not session or session.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view this report")
-    # ノート取得関数
-    from app.services.agents.self_analysis_monono_agent.tools.notes import list_notes as list_notes_fn
-    # Markdown変換
-    from app.services.agents.self_analysis_langchain.markdown import render_markdown_timeline
-
-    # 各ステップのJSONノート
-    future = await list_notes_fn(str(session_id), 'FUTURE')
-    motivation = await list_notes_fn(str(session_id), 'MOTIVATION')
-    history = await list_notes_fn(str(session_id), 'HISTORY')
-    gap = await list_notes_fn(str(session_id), 'GAP')
-    vision = await list_notes_fn(str(session_id), 'VISION')
-    reflect = await list_notes_fn(str(session_id), 'REFLECT')
-    # Markdown年表
-    timeline = history[0].get('timeline', []) if history and isinstance(history[0], dict) else []
-    timeline_md = render_markdown_timeline(timeline)
-
-    return {
-        'future': future,
-        'motivation': motivation,
-        'history': history,
-        'timeline_md': timeline_md,
-        'gap': gap,
-        'vision': vision,
-        'reflect': reflect,
-    }
+    # 全ステップのノートを 1 クエリで取得して組み立てる (ノート更新まではキャッシュを返す)
+    return await load_self_analysis_report(db, str(session_id))
 
 @router.post("/admission", response_model=ChatResponse)
 async def start_admission_chat(
@@ -975,7 +971,7 @@ async def generate_session_title(
         else:
             # OpenAI APIを使ってタイトルを生成
             try:
-                client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+                client = get_openai_client()
                 title_prompt = f"""以下の会話の内容を基に、適切なタイトルを15文字以内で生成してください。
 タイトルは会話の主要なトピックを表現し、ユーザーが後で見返した時に内容が分かりやすいものにしてください。
 
@@ -291,8 +291,8 @@ async def start_quiz_attempt_by_id(
     クイズを受験開始します。
     """
     try:
-        quiz = await crud_quiz.get_quiz(db=db, quiz_id=quiz_id)
-        if not quiz or not quiz.is_active:
+        definition = await crud_quiz.get_quiz_definition(db=db, quiz_id=quiz_id)
+        if not definition or not definition.is_active:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Active quiz not found")
 
         attempt = await crud_quiz.start_quiz_attempt(db=db, quiz_id=quiz_id, user_id=current_user.id)
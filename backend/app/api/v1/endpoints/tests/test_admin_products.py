@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+
+from app.api.v1.endpoints import admin
+
+
+class _StripeObject(dict):
+    """属性でも参照できる dict (StripeObject の代わり)"""
+    __getattr__ = dict.__getitem__
+
+
+def _product(product_id, role_id=None):
+    return _StripeObject({
+        "id": product_id, "name": product_id, "active": True, "created": 1, "updated": 1,
+        "metadata": {"assigned_role": str(role_id)} if role_id else {},
+    })
+
+
+def _price(price_id, product_id):
+    return _StripeObject({
+        "id": price_id, "product": product_id, "unit_amount": 1000, "currency": "jpy", "active": True,
+        "created": 1, "livemode": False, "type": "recurring", "recurring": {"interval": "month", "interval_count": 1},
+    })
+
+
+@pytest.mark.asyncio
+async def test_get_products_makes_a_constant_number_of_calls(monkeypatch):
+    """商品が何件あっても、Stripe の価格取得とロール名の解決は 1 回ずつ。"""
+    role_id = uuid.uuid4()
+    products = [_product(f"prod_{i}", role_id) for i in range(20)]
+    prices = [_price(f"price_{i}", f"prod_{i % 10}") for i in range(15)]
+    calls = []
+
+    async def list_products(active=None, limit=100):
+        calls.append("list_products")
+        return products
+
+    async def list_all_prices(active=True):
+        calls.append("list_all_prices")
+        return prices
+
+    async def get_role_names_by_ids(db, role_ids):
+        calls.append("get_role_names_by_ids")
+        return {role_id: "プレミアム"}
+
+    monkeypatch.setattr(admin.stripe_client, "list_products", list_products, raising=False)
+    monkeypatch.setattr(admin.stripe_client, "list_all_prices", list_all_prices, raising=False)
+    monkeypatch.setattr(admin.crud_role, "get_role_names_by_ids", get_role_names_by_ids)
+
+    result = await admin.get_products(active=None, limit=100, db=None, current_user=None)
+
+    assert calls == ["list_products", "list_all_prices", "get_role_names_by_ids"]
+    assert [len(p.prices) for p in result[:10]] == [2] * 5 + [1] * 5
+    assert all(not p.prices for p in result[10:])
+    assert {p.assigned_role_name for p in result} == {"プレミアム"}
@@ -0,0 +1,51 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.endpoints import auth
+from app.core.exceptions import ServiceUnavailableError
+from app.models.enums import TokenBlacklistReason
+from app.schemas.auth import ResetPasswordRequest
+
+
+@pytest.mark.asyncio
+async def test_reset_password_keeps_the_hasher_backpressure_status(monkeypatch):
+    """ハッシュ用のプールが埋まっているときは 500 ではなく 503 (Retry-After 付き) を返す。"""
+    async def get_user_by_email(db, email):
+        return SimpleNamespace(email=email, hashed_password="old")
+
+    async def hash_password(password):
+        raise ServiceUnavailableError("busy", retry_after=2)
+
+    monkeypatch.setattr(auth, "decode_token", lambda token: {"type": "password_reset", "email": "a@example.com"})
+    monkeypatch.setattr(auth.crud_user, "get_user_by_email", get_user_by_email)
+    monkeypatch.setattr(auth.password_hasher, "hash_password", hash_password)
+
+    with pytest.raises(HTTPException) as exc:
+        await auth.reset_password(ResetPasswordRequest(token="t", new_password="new-password"), db=None)
+    assert exc.value.status_code == 503 and exc.value.headers == {"Retry-After": "2"}
+
+
+@pytest.mark.asyncio
+async def test_reset_password_revokes_earlier_tokens(monkeypatch, fake_session):
+    """リセット前に発行されたトークンを無効にする記録を、パスワードの更新と同じコミットで書く。"""
+    user = SimpleNamespace(id=uuid.uuid4(), email="a@example.com", hashed_password="old")
+
+    async def get_user_by_email(db, email):
+        return user
+
+    async def hash_password(password):
+        return "$2b$12$new"
+
+    monkeypatch.setattr(auth, "decode_token", lambda token: {"type": "password_reset", "email": "a@example.com"})
+    monkeypatch.setattr(auth.crud_user, "get_user_by_email", get_user_by_email)
+    monkeypatch.setattr(auth.password_hasher, "hash_password", hash_password)
+    db = fake_session()
+
+    await auth.reset_password(ResetPasswordRequest(token="t", new_password="new-password"), db=db)
+
+    [event] = db.added
+    assert user.hashed_password == "$2b$12$new" and db.commits == 1
+    assert event.user_id == str(user.id) and event.reason == TokenBlacklistReason.PASSWORD_CHANGE
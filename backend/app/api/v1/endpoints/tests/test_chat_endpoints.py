@@ -40,7 +40,7 @@ def override_dependencies(monkeypatch, dummy_user):
     # DB依存をモック
     monkeypatch.setattr('app.api.deps.get_async_db', lambda: None)
     # crudのget_user_chat_sessionsを非同期でスタブ
-    async def fake_crud_get_user_chat_sessions(db, user_id, chat_type, status):
+    async def fake_crud_get_user_chat_sessions(db, user_id, chat_type, status, limit=None, cursor=None):
         return []
     monkeypatch.setattr('app.crud.chat.get_user_chat_sessions', fake_crud_get_user_chat_sessions)
     # crud_user.get_userを非同期でバイパス
@@ -51,7 +51,7 @@ def override_dependencies(monkeypatch, dummy_user):
     from app.api.deps import get_current_user
     app.dependency_overrides[get_current_user] = lambda: dummy_user
     # chatエンドポイントの get_user_chat_sessions を非同期でスタブ
-    async def fake_chat_get_user_chat_sessions(db, user_id, chat_type, status):
+    async def fake_chat_get_user_chat_sessions(db, user_id, chat_type, status, limit=None, cursor=None):
         return []
     monkeypatch.setattr('app.api.v1.endpoints.chat.get_user_chat_sessions', fake_chat_get_user_chat_sessions)
     # chatエンドポイントの get_async_db をモックしてDB呼び出しを抑制
@@ -76,7 +76,7 @@ async def test_get_sessions_non_empty(monkeypatch, dummy_user):
         "last_message_summary": None,
     }]
     # chatエンドポイントの get_user_chat_sessions を非同期でスタブ（非空ケース）
-    async def fake_nonempty_get_user_chat_sessions(db, user_id, chat_type, status):
+    async def fake_nonempty_get_user_chat_sessions(db, user_id, chat_type, status, limit=None, cursor=None):
         return sample
     monkeypatch.setattr('app.api.v1.endpoints.chat.get_user_chat_sessions', fake_nonempty_get_user_chat_sessions)
     transport = ASGITransport(app=app)
@@ -0,0 +1,63 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.endpoints import users
+
+
+class _Upload:
+    """UploadFile の代わり (broken なら画像として読めない)"""
+
+    def __init__(self, filename, broken=False):
+        self.filename = filename
+        self.broken = broken
+
+
+@pytest.fixture
+def icon_calls(monkeypatch):
+    """S3 と DB の呼び出しを順に記録する"""
+    calls = []
+
+    async def upload_icon(file, user_id, file_extension):
+        calls.append(("upload", file_extension))
+        if file.broken:
+            raise ValueError("not an image")
+        return f"icons/user_{user_id}{file_extension.lower()}"
+
+    async def delete_icon(user_id, file_extension):
+        calls.append(("delete", file_extension))
+        return True
+
+    async def update_user(db, *, db_user, user_in):
+        calls.append(("update", user_in.profile_image_url))
+        db_user.profile_image_url = user_in.profile_image_url
+        return db_user
+
+    monkeypatch.setattr(users.s3_service, "upload_icon", upload_icon)
+    monkeypatch.setattr(users.s3_service, "delete_icon", delete_icon)
+    monkeypatch.setattr(users.crud.user, "update_user", update_user)
+    monkeypatch.setattr(users.schemas.UserResponse, "model_validate", classmethod(lambda cls, user: user))
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_invalid_upload_keeps_the_current_icon(icon_calls):
+    user = SimpleNamespace(id=uuid.uuid4(), profile_image_url="icons/user_1.jpg")
+    with pytest.raises(HTTPException) as exc:
+        await users.upload_user_icon(db=None, file=_Upload("a.png", broken=True), current_user=user)
+    assert exc.value.status_code == 400
+    assert icon_calls == [("upload", ".png")] and user.profile_image_url == "icons/user_1.jpg"
+
+
+@pytest.mark.asyncio
+async def test_old_icon_is_deleted_after_the_new_one_is_saved(icon_calls):
+    user = SimpleNamespace(id="1", profile_image_url="icons/user_1.jpg")
+    await users.upload_user_icon(db=None, file=_Upload("a.PNG"), current_user=user)
+    assert icon_calls == [("upload", ".PNG"), ("update", "icons/user_1.png"), ("delete", ".jpg")]
+
+    # 同じキーへの上書きでは消さない
+    icon_calls.clear()
+    await users.upload_user_icon(db=None, file=_Upload("b.png"), current_user=user)
+    assert icon_calls == [("upload", ".png"), ("update", "icons/user_1.png")]
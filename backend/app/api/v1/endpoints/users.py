@@ -1,13 +1,14 @@
 import os
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from typing import Optional
+
+from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud, schemas, models
 from app.api import deps
-from app.services.s3_service import S3Service
+from app.services.s3_service import ICON_FORMATS, s3_service
 
 router = APIRouter()
-s3_service = S3Service()
 
 @router.post("/me/icon", response_model=schemas.UserResponse, summary="Upload user icon")
 async def upload_user_icon(
@@ -17,25 +18,61 @@ async def upload_user_icon(
     current_user: models.User = Depends(deps.get_current_user)
 ):
     """現在のユーザーのプロフィールアイコンをアップロードします。"""
-    _, file_extension = os.path.splitext(file.filename)
-    allowed_extensions = {".png", ".jpg", ".jpeg", ".gif"}
-    if file_extension.lower() not in allowed_extensions:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid image format. Allowed formats: {', '.join(allowed_extensions)}"
-        )
+    file_extension = _icon_extension(file.filename)
+    old_key = current_user.profile_image_url
 
-    if current_user.profile_image_url:
-        _, old_extension = os.path.splitext(current_user.profile_image_url)
-        if old_extension:
-             await s3_service.delete_icon(str(current_user.id), old_extension)
-
-    object_key = await s3_service.upload_icon(file, str(current_user.id), file_extension)
+    try:
+        object_key = await s3_service.upload_icon(file, str(current_user.id), file_extension)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="The uploaded file is not a valid image.")
     if not object_key:
         raise HTTPException(status_code=500, detail="Failed to upload icon to S3.")
 
     user_update = schemas.UserUpdate(profile_image_url=object_key)
     updated_user = await crud.user.update_user(db, db_user=current_user, user_in=user_update)
+    await _delete_old_icon(str(current_user.id), old_key, object_key)
+
+    return schemas.UserResponse.model_validate(updated_user)
+
+
+@router.post("/me/icon/presigned-upload", response_model=dict, summary="Create a direct icon upload")
+async def create_icon_upload(
+    *,
+    filename: str = Body(..., embed=True),
+    current_user: models.User = Depends(deps.get_current_user)
+):
+    """
+    S3 へ直接アイコンをアップロードするための署名付き POST (url, fields) を発行します。
+    アップロード後に object_key を /me/icon/complete-upload に送ってください。
+    """
+    file_extension = _icon_extension(filename)
+    upload = await s3_service.create_icon_upload(str(current_user.id), file_extension)
+    if not upload:
+        raise HTTPException(status_code=500, detail="Failed to create icon upload.")
+    return upload
+
+
+@router.post("/me/icon/complete-upload", response_model=schemas.UserResponse, summary="Complete a direct icon upload")
+async def complete_icon_upload(
+    *,
+    db: AsyncSession = Depends(deps.get_async_db),
+    object_key: str = Body(..., embed=True),
+    current_user: models.User = Depends(deps.get_current_user)
+):
+    """S3 へ直接アップロードしたアイコンを正規化して、プロフィールアイコンに設定します。"""
+    _icon_extension(object_key)
+    old_key = current_user.profile_image_url
+
+    try:
+        stored_key = await s3_service.complete_icon_upload(str(current_user.id), object_key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="The uploaded file is not a valid image.")
+    if not stored_key:
+        raise HTTPException(status_code=500, detail="Failed to store uploaded icon.")
+
+    user_update = schemas.UserUpdate(profile_image_url=stored_key)
+    updated_user = await crud.user.update_user(db, db_user=current_user, user_in=user_update)
+    await _delete_old_icon(str(current_user.id), old_key, stored_key)
 
     return schemas.UserResponse.model_validate(updated_user)
 
@@ -63,5 +100,23 @@ async def delete_user_icon(
 
     return schemas.UserResponse.model_validate(updated_user)
 
+def _icon_extension(filename: str) -> str:
+    _, file_extension = os.path.splitext(filename or "")
+    if file_extension.lower() not in ICON_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid image format. Allowed formats: {', '.join(ICON_FORMATS)}"
+        )
+    return file_extension
+
+
+async def _delete_old_icon(user_id: str, old_key: Optional[str], new_key: str) -> None:
+    """新しいアイコンを保存して DB を更新したあとに、拡張子の違う古いアイコンを消す"""
+    if not old_key or old_key == new_key:
+        return
+    _, old_extension = os.path.splitext(old_key)
+    if old_extension:
+        await s3_service.delete_icon(user_id, old_extension)
+
 # 注意: ユーザー取得エンドポイント (/users/me など) が更新された UserResponse を返すことを確認してください。
 # deps.get_current_active_user が返す User モデルに profile_image_url が含まれていることも前提です。 
\ No newline at end of file
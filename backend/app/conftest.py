@@ -0,0 +1,100 @@
+# backend/app/conftest.py
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+
+@dataclass
+class Recorded:
+    """FakeSession が受け取った文 (種類・対象テーブル・バインド値)"""
+    kind: str
+    table: Optional[str]
+    params: Any
+    sql: str
+
+
+class FakeResult:
+    """Result の代わり。rows と rowcount だけを持つ"""
+
+    def __init__(self, rows=(), rowcount: Optional[int] = None):
+        self.rows = list(rows)
+        self.rowcount = len(self.rows) if rowcount is None else rowcount
+
+    def all(self):
+        return self.rows
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def scalar(self):
+        row = self.first()
+        return row[0] if isinstance(row, tuple) else row
+
+    def scalars(self):
+        return FakeResult([row[0] if isinstance(row, tuple) else row for row in self.rows])
+
+    def mappings(self):
+        return self
+
+
+class FakeSession:
+    """
+    AsyncSession の代わり (DB には接続しない)。
+    execute() した文を Recorded として記録し、用意した結果 (行のリストか FakeResult) を順に返す。
+    用意した結果が尽きたら rowcount だけを持つ空の結果を返す
+    """
+
+    def __init__(self, *results, rowcount: int = 1):
+        self.results = list(results)
+        self.rowcount = rowcount
+        self.statements: List[Recorded] = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.flushes = 0
+        self.closed = False
+        self.added: List[Any] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+    async def execute(self, stmt, params=None):
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        kind = "INSERT" if stmt.is_insert else "UPDATE" if stmt.is_update else "DELETE" if stmt.is_delete else "SELECT"
+        table = getattr(getattr(stmt, "table", None), "name", None)
+        self.statements.append(Recorded(kind, table, compiled.params if params is None else params, str(compiled)))
+        if not self.results:
+            return FakeResult(rowcount=self.rowcount)
+        result = self.results.pop(0)
+        return result if isinstance(result, FakeResult) else FakeResult(result)
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+    async def flush(self):
+        self.flushes += 1
+
+    @property
+    def writes(self) -> List[tuple]:
+        """書き込んだ (種類, テーブル) の順序"""
+        return [(s.kind, s.table) for s in self.statements if s.kind != "SELECT"]
+
+    def values(self, index: int) -> Dict[str, Any]:
+        """index 番目の文のバインド値"""
+        return self.statements[index].params
+
+
+@pytest.fixture
+def fake_session():
+    """FakeSession(*results, rowcount=...) を作るファクトリー"""
+    return FakeSession
@@ -44,8 +44,16 @@ class Settings(BaseSettings):
     # --- AWS 設定 --- 
     AWS_REGION: str = os.getenv("AWS_REGION", "ap-northeast-1")
     AWS_S3_ICON_BUCKET_NAME: str = os.getenv("AWS_S3_ICON_BUCKET_NAME", "your-icon-bucket-name")
-    # 必要であればエンドポイントURLも設定
-    # AWS_S3_ENDPOINT_URL: Optional[str] = os.getenv("AWS_S3_ENDPOINT_URL") 
+    # ローカル開発・テスト用 (MinIO など) のエンドポイントURL
+    AWS_S3_ENDPOINT_URL: Optional[str] = os.getenv("AWS_S3_ENDPOINT_URL") or None
+    # boto3 を実行するスレッド数 (= S3 への同時接続数) と、マルチパートにする大きさ・パートの大きさ
+    S3_MAX_WORKERS: int = int(os.getenv("S3_MAX_WORKERS", "8"))
+    S3_MULTIPART_THRESHOLD_MB: int = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8"))
+    S3_MULTIPART_CHUNK_MB: int = int(os.getenv("S3_MULTIPART_CHUNK_MB", "8"))
+    # アイコン (長辺をこの大きさまで縮小する) と、署名付き URL で直接アップロードできる大きさ・有効期限
+    ICON_MAX_DIMENSION: int = int(os.getenv("ICON_MAX_DIMENSION", "512"))
+    ICON_MAX_UPLOAD_BYTES: int = int(os.getenv("ICON_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+    S3_PRESIGNED_EXPIRES_SECONDS: int = int(os.getenv("S3_PRESIGNED_EXPIRES_SECONDS", "600"))
     # --- AWS 設定ここまで ---
 
     def __init__(self, **values):
@@ -70,11 +78,31 @@ class Settings(BaseSettings):
     # OpenAI設定
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
+
+    # LLM API 呼び出しで共有する HTTP コネクションプール (app.services.llm_clients)
+    LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "true").lower() == "true"
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS: float = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+    LLM_HTTP_TIMEOUT_SECONDS: float = float(os.getenv("LLM_HTTP_TIMEOUT_SECONDS", "60"))
     
     # Stripe設定
     STRIPE_SECRET_KEY: str = os.getenv("STRIPE_SECRET_KEY", "")
     STRIPE_PUBLISHABLE_KEY: str = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
     STRIPE_WEBHOOK_SECRET: str = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    # Stripe API 呼び出し用のスレッド数 (= 共有コネクションプールのサイズ) とタイムアウト
+    STRIPE_MAX_WORKERS: int = int(os.getenv("STRIPE_MAX_WORKERS", "8"))
+    STRIPE_TIMEOUT_SECONDS: float = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "30"))
+    STRIPE_MAX_NETWORK_RETRIES: int = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
+    # 商品・価格・クーポンの読み込みキャッシュ (0 で無効)
+    STRIPE_CATALOG_CACHE_TTL_SECONDS: float = float(os.getenv("STRIPE_CATALOG_CACHE_TTL_SECONDS", "300"))
+    STRIPE_CATALOG_CACHE_MAX_ENTRIES: int = int(os.getenv("STRIPE_CATALOG_CACHE_MAX_ENTRIES", "1000"))
+    # Webhook 処理キュー (ワーカー数・再試行回数と間隔・処理中のまま止まったとみなすまでの秒数)
+    STRIPE_WEBHOOK_WORKERS: int = int(os.getenv("STRIPE_WEBHOOK_WORKERS", "4"))
+    STRIPE_WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("STRIPE_WEBHOOK_MAX_ATTEMPTS", "5"))
+    STRIPE_WEBHOOK_RETRY_BASE_SECONDS: float = float(os.getenv("STRIPE_WEBHOOK_RETRY_BASE_SECONDS", "2"))
+    STRIPE_WEBHOOK_STALE_SECONDS: float = float(os.getenv("STRIPE_WEBHOOK_STALE_SECONDS", "300"))
 
     # Application Settings
     INSTRUCTION: str = load_instruction()
@@ -83,13 +111,72 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 240  # 4時間（240分）に変更 - ロール変更時の待機時間を短縮
     REFRESH_TOKEN_EXPIRE_DAYS: int = 30    # 30日
     JWT_ALGORITHM: str = "HS512" # JWTアルゴリズムを追加
-    
+
+    # ログイン失敗によるアカウントロック
+    LOGIN_MAX_FAILED_ATTEMPTS: int = int(os.getenv("LOGIN_MAX_FAILED_ATTEMPTS", "5"))
+    LOGIN_LOCKOUT_MINUTES: int = int(os.getenv("LOGIN_LOCKOUT_MINUTES", "15"))
+
+    # 失効済みトークン (token_blacklist) を他プロセスから取り込む間隔
+    TOKEN_REVOCATION_REFRESH_SECONDS: float = float(os.getenv("TOKEN_REVOCATION_REFRESH_SECONDS", "5"))
+
+    # パスワードハッシュ (bcrypt) 設定
+    PASSWORD_BCRYPT_ROUNDS: int = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+    # bcrypt 専用スレッド数と、それを超えて待たせる件数の上限 (超えた分は 503 で断る)
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_QUEUE: int = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+    # 認証済みユーザー (ロール・権限込み) のプロセス内キャッシュ設定
+    PRINCIPAL_CACHE_TTL_SECONDS: int = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+    # チャット履歴 (会話コンテキストキャッシュ) 設定
+    CHAT_CONTEXT_CACHE_MAX_SESSIONS: int = int(os.getenv("CHAT_CONTEXT_CACHE_MAX_SESSIONS", "1000"))
+    CHAT_HISTORY_MAX_TOKENS: int = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "16000"))
+    # system プロンプト・要約・直近の履歴・新しいメッセージを合わせたプロンプト全体の上限
+    CHAT_CONTEXT_MAX_TOKENS: int = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "24000"))
+    # 古い会話を畳み込むローリングサマリー
+    CHAT_SUMMARY_MODEL: str = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+    CHAT_SUMMARY_MAX_TOKENS: int = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "800"))
+
+    # 自己分析レポートのキャッシュ (ノートの書き込み時にも破棄される)
+    SELF_ANALYSIS_REPORT_CACHE_TTL_SECONDS: int = int(os.getenv("SELF_ANALYSIS_REPORT_CACHE_TTL_SECONDS", "300"))
+    SELF_ANALYSIS_REPORT_CACHE_MAX_SESSIONS: int = int(os.getenv("SELF_ANALYSIS_REPORT_CACHE_MAX_SESSIONS", "1000"))
+
+    # クイズ定義 (解答キー) のキャッシュ (問題・選択肢の変更時にも破棄される)
+    QUIZ_DEFINITION_CACHE_TTL_SECONDS: float = float(os.getenv("QUIZ_DEFINITION_CACHE_TTL_SECONDS", "300"))
+    QUIZ_DEFINITION_CACHE_MAX_ENTRIES: int = int(os.getenv("QUIZ_DEFINITION_CACHE_MAX_ENTRIES", "1000"))
+
+    # おすすめ (クイズ・大学) の候補プール。ユーザーごとに候補をまとめて抽出し、短い TTL で使い回す
+    RECOMMENDATION_POOL_SIZE: int = int(os.getenv("RECOMMENDATION_POOL_SIZE", "50"))
+    RECOMMENDATION_POOL_TTL_SECONDS: float = float(os.getenv("RECOMMENDATION_POOL_TTL_SECONDS", "60"))
+    RECOMMENDATION_POOL_MAX_ENTRIES: int = int(os.getenv("RECOMMENDATION_POOL_MAX_ENTRIES", "10000"))
+
     # メール設定
     SMTP_SERVER: str = os.getenv("SMTP_SERVER", "smtp.example.com")
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", "587"))
     SMTP_USER: str = os.getenv("SMTP_USER", "")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
     FROM_EMAIL: str = os.getenv("FROM_EMAIL", "noreply@smartao.example.com")
+    SMTP_STARTTLS: bool = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+
+    # メール送信 (ログイン済みの SMTP 接続のプールと、email_outbox の送信ワーカー)
+    SMTP_POOL_SIZE: int = int(os.getenv("SMTP_POOL_SIZE", "4"))
+    SMTP_TIMEOUT_SECONDS: float = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+    SMTP_MAX_IDLE_SECONDS: float = float(os.getenv("SMTP_MAX_IDLE_SECONDS", "60"))
+    EMAIL_BATCH_SIZE: int = int(os.getenv("EMAIL_BATCH_SIZE", "100"))
+    EMAIL_MAX_ATTEMPTS: int = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+    EMAIL_RETRY_BASE_SECONDS: float = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30"))
+    EMAIL_POLL_SECONDS: float = float(os.getenv("EMAIL_POLL_SECONDS", "5"))
+    EMAIL_STALE_SECONDS: float = float(os.getenv("EMAIL_STALE_SECONDS", "600"))
+
+    # 全体通知の展開 (配信時刻の確認間隔と、メール・プッシュへ渡す 1 回あたりの件数)
+    BROADCAST_POLL_SECONDS: float = float(os.getenv("BROADCAST_POLL_SECONDS", "30"))
+    BROADCAST_DELIVERY_CHUNK_SIZE: int = int(os.getenv("BROADCAST_DELIVERY_CHUNK_SIZE", "1000"))
+
+    # Web Push (VAPID 秘密鍵と、一括配信の並列数・タイムアウト)
+    VAPID_PRIVATE_KEY: str = os.getenv("VAPID_PRIVATE_KEY", "")
+    PUSH_MAX_WORKERS: int = int(os.getenv("PUSH_MAX_WORKERS", "32"))
+    PUSH_TIMEOUT_SECONDS: float = float(os.getenv("PUSH_TIMEOUT_SECONDS", "10"))
     
     class Config:
         env_file = ".env"
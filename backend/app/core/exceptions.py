@@ -34,4 +34,10 @@ class UnprocessableEntityError(BaseCustomException):
     """リクエストは理解できたが、処理できない場合のエラー (422 Unprocessable Entity)"""
     # FastAPIのバリデーションエラーは通常422を返す
     def __init__(self, detail: str = "Unprocessable entity"):
-        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=detail) 
\ No newline at end of file
+        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=detail) 
+
+class ServiceUnavailableError(BaseCustomException):
+    """一時的に処理しきれない場合のエラー (503 Service Unavailable)"""
+    def __init__(self, detail: str = "Service temporarily unavailable", retry_after: int = 1):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
+        self.headers = {"Retry-After": str(retry_after)}
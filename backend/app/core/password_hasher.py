@@ -0,0 +1,79 @@
+"""
+パスワードハッシュ (bcrypt) をイベントループの外で実行する非同期 API。
+
+bcrypt の hash / verify は 1 回で数十〜数百ミリ秒 CPU を占有するため、
+ログインやパスワード変更をイベントループ上で直接実行すると、同じワーカーの
+WebSocket チャットのストリーミングなど他のリクエストがすべて止まる。
+
+ここでは専用の固定サイズのスレッドプール (bcrypt は計算中に GIL を解放する) で実行し、
+実行中 + 待機中の件数が上限を超えた場合は ServiceUnavailableError (503) で即座に断る。
+コストパラメータ (settings.PASSWORD_BCRYPT_ROUNDS) を変更した場合は、
+verify_and_update_password がログイン時に新しいコストでのハッシュを返すので、それを保存すればよい。
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+from app.core.exceptions import ServiceUnavailableError
+from app.core.security import pwd_context
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class PasswordHasher:
+    """bcrypt 専用のスレッドプール + 受け付け件数の上限"""
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        # 実行中 + 待機中の上限 (これを超えた分は待たせずに断る)
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def _run(self, fn: Callable[..., T], *args) -> T:
+        if self._in_flight >= self.max_pending:
+            logger.warning(f"Password hasher saturated ({self._in_flight} in flight); rejecting request.")
+            raise ServiceUnavailableError("ただいま混み合っています。しばらくしてから再度お試しください。")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hasher")
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._in_flight -= 1
+
+    async def hash_password(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    async def verify_and_update_password(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        (一致したか, 再ハッシュ後の値) を返す。
+        保存済みハッシュのコストが現在の設定と異なる場合だけ 2 つ目が None 以外になる。
+        """
+        return await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE,
+)
+
+hash_password = password_hasher.hash_password
+verify_password = password_hasher.verify_password
+verify_and_update_password = password_hasher.verify_and_update_password
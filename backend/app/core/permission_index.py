@@ -0,0 +1,97 @@
+"""
+ロールごとの権限集合を一度だけコンパイルして再利用するためのインデックス。
+
+require_permission / get_current_superuser はリクエストのたびに
+User → UserRole → Role → Permission を辿って名前を比較していたが、
+ここでロール単位の frozenset にまとめておくことで、権限チェックは集合演算だけになる。
+ロール/権限の変更時は principal_cache と同じセッションイベントでクリアされる。
+"""
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from app.core.config import settings
+from app.models.user import Role, User
+
+# 管理者ロール名 (このロールを持つユーザーは個別の権限チェックをスキップする)
+ADMIN_ROLE_NAME = "管理者"
+# スーパーユーザー判定に使う権限名
+ADMIN_PERMISSION = "admin_access"
+
+
+@dataclass(frozen=True)
+class CompiledPermissions:
+    """ユーザーが持つロール・権限をまとめた不変オブジェクト"""
+    names: FrozenSet[str] = frozenset()
+    role_names: FrozenSet[str] = frozenset()
+    lower_names: FrozenSet[str] = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "lower_names", frozenset(name.lower() for name in self.names))
+
+    @property
+    def is_admin(self) -> bool:
+        return ADMIN_ROLE_NAME in self.role_names
+
+    @property
+    def is_superuser(self) -> bool:
+        return ADMIN_PERMISSION in self.lower_names
+
+    def missing(self, required: Iterable[str]) -> FrozenSet[str]:
+        return frozenset(required) - self.names
+
+    def has_all(self, required: Iterable[str]) -> bool:
+        return not self.missing(required)
+
+
+class RolePermissionIndex:
+    """
+    role_id → 権限名 frozenset のメモ化テーブル。
+    他プロセスでの変更も拾えるよう、エントリは ttl_seconds で作り直す。
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._by_role: Dict[uuid.UUID, Tuple[float, FrozenSet[str]]] = {}
+        self._lock = threading.Lock()
+
+    def permissions_for_role(self, role: Role) -> FrozenSet[str]:
+        role_id = getattr(role, "id", None)
+        now = time.monotonic()
+        entry = self._by_role.get(role_id) if role_id is not None else None
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        # role.permissions は lazy="selectin" でロード済みの前提
+        compiled = frozenset(
+            perm.name for perm in (getattr(role, "permissions", None) or [])
+            if perm is not None and getattr(perm, "name", None)
+        )
+        if role_id is not None:
+            with self._lock:
+                self._by_role[role_id] = (now + self.ttl_seconds, compiled)
+        return compiled
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_role.clear()
+
+
+role_permission_index = RolePermissionIndex(ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+def compile_user_permissions(user: Optional[User]) -> CompiledPermissions:
+    """ロード済みのユーザーからロール・権限集合を組み立てる"""
+    if user is None or not user.user_roles:
+        return CompiledPermissions()
+
+    names: FrozenSet[str] = frozenset()
+    role_names = set()
+    for user_role in user.user_roles:
+        role = user_role.role
+        if role is None:
+            continue
+        role_names.add(role.name)
+        names |= role_permission_index.permissions_for_role(role)
+    return CompiledPermissions(names=names, role_names=frozenset(role_names))
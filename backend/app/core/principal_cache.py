@@ -0,0 +1,183 @@
+"""
+認証済みプリンシパル (User + ロール + 権限) のプロセス内キャッシュ。
+
+AuthMiddleware がトークンごとに解決したユーザーを (user_id, jti) をキーに保持し、
+get_current_user はリクエスト状態に載ったユーザーをそのまま利用する。
+これにより 1 リクエストあたりのユーザー/ロール/権限ロードは最大 1 回になる。
+
+キャッシュはワーカープロセスごとに独立しているため、他プロセスでの変更は
+TTL (settings.PRINCIPAL_CACHE_TTL_SECONDS) の経過で反映される。
+同一プロセス内の変更は SQLAlchemy のセッションイベントでコミット時に即時無効化する。
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.permission_index import CompiledPermissions, compile_user_permissions, role_permission_index
+from app.models.user import (
+    User, UserRole, UserLoginInfo, Role, Permission, RolePermission, TokenBlacklist
+)
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str]
+
+
+class Principal(NamedTuple):
+    """解決済みユーザーと、そのユーザーのコンパイル済み権限"""
+    user: User
+    permissions: CompiledPermissions
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user=user, permissions=compile_user_permissions(user))
+
+
+# セッションの info に無効化対象を溜めておくキー
+_PENDING_KEY = "_principal_cache_pending"
+
+
+class PrincipalCache:
+    """(user_id, jti) をキーにした TTL 付き LRU キャッシュ"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Principal]]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[CacheKey]] = {}
+        self._keys_by_jti: Dict[str, CacheKey] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """
+        無効化のたびに進むカウンタ。
+        ロード開始前に取得して set() に渡すと、ロード中に無効化が走った場合の
+        古いデータの書き戻しを防げる。
+        """
+        return self._generation
+
+    def get(self, user_id: str, jti: Optional[str]) -> Optional[Principal]:
+        key = (str(user_id), jti or "")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return principal
+
+    def set(self, user_id: str, jti: Optional[str], principal: Principal, generation: Optional[int] = None) -> None:
+        key = (str(user_id), jti or "")
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                logger.debug(f"Principal for user {user_id} was invalidated during load; not caching.")
+                return
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, principal)
+            self._keys_by_user.setdefault(key[0], set()).add(key)
+            if key[1]:
+                self._keys_by_jti[key[1]] = key
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._discard(oldest_key)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in list(self._keys_by_user.get(str(user_id), ())):
+                self._discard(key)
+
+    def invalidate_token(self, jti: str) -> None:
+        with self._lock:
+            self._generation += 1
+            key = self._keys_by_jti.get(jti)
+            if key is not None:
+                self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self._keys_by_jti.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _discard(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+        user_keys = self._keys_by_user.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._keys_by_user[key[0]]
+        if key[1] and self._keys_by_jti.get(key[1]) == key:
+            del self._keys_by_jti[key[1]]
+
+
+principal_cache = PrincipalCache(
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES,
+)
+
+
+# --- セッションイベントによる無効化 ---
+
+def _collect_invalidations(session: Session) -> Set[Tuple[str, Optional[str]]]:
+    pending: Set[Tuple[str, Optional[str]]] = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Role, Permission, RolePermission)):
+            # ロール/権限の変更は多数のユーザーに波及するため全消去
+            pending.add(("all", None))
+        elif isinstance(obj, User):
+            if obj.id is not None:
+                pending.add(("user", str(obj.id)))
+        elif isinstance(obj, (UserRole, UserLoginInfo)):
+            if obj.user_id is not None:
+                pending.add(("user", str(obj.user_id)))
+        elif isinstance(obj, TokenBlacklist):
+            if obj.token_jti:
+                pending.add(("token", obj.token_jti))
+            if obj.user_id is not None:
+                pending.add(("user", str(obj.user_id)))
+    return pending
+
+
+@event.listens_for(Session, "after_flush")
+def _record_principal_changes(session: Session, flush_context) -> None:
+    pending = _collect_invalidations(session)
+    if pending:
+        session.info.setdefault(_PENDING_KEY, set()).update(pending)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_principal_invalidations(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    if ("all", None) in pending:
+        role_permission_index.clear()
+        principal_cache.clear()
+        return
+    for kind, value in pending:
+        if kind == "user":
+            principal_cache.invalidate_user(value)
+        elif kind == "token":
+            principal_cache.invalidate_token(value)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_principal_invalidations(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
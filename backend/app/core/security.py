@@ -10,7 +10,8 @@ from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 import logging
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# rounds を変更すると、既存ユーザーのハッシュはログイン時に新しいコストで再ハッシュされる (app.core.password_hasher)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS)
 
 # --- AUTH_SECRET からキーを導出 --- 
 # このキーは AuthMiddleware でも使用される
@@ -158,12 +159,14 @@ def verify_token_against_security_events(token: str, db: Session, user_id: str)
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     プレーンパスワードとハッシュ化されたパスワードを比較
+    (同期版。イベントループ上では app.core.password_hasher.verify_password を使う)
     """
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """
     パスワードをハッシュ化
+    (同期版。イベントループ上では app.core.password_hasher.hash_password を使う)
     """
     return pwd_context.hash(password)
 
@@ -0,0 +1,59 @@
+# backend/app/core/tests/test_password_hasher.py
+import asyncio
+
+import pytest
+from passlib.context import CryptContext
+
+from app.core import password_hasher as module
+from app.core.exceptions import ServiceUnavailableError
+from app.core.password_hasher import PasswordHasher
+
+
+@pytest.fixture
+def fast_context(monkeypatch):
+    """テストを速くするため bcrypt のコストを最小にする"""
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4)
+    monkeypatch.setattr(module, "pwd_context", context)
+    return context
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_run_off_the_event_loop(fast_context):
+    hasher = PasswordHasher(max_workers=1, max_pending=4)
+    try:
+        hashed = await hasher.hash_password("secret")
+
+        assert await hasher.verify_password("secret", hashed)
+        assert not await hasher.verify_password("wrong", hashed)
+    finally:
+        hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_when_cost_changes(fast_context, monkeypatch):
+    """保存済みハッシュのコストが設定と異なれば、検証時に新しいハッシュが返る。"""
+    hasher = PasswordHasher(max_workers=1, max_pending=4)
+    try:
+        old_hash = await hasher.hash_password("secret")
+        assert await hasher.verify_and_update_password("secret", old_hash) == (True, None)
+
+        monkeypatch.setattr(module, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=5))
+        matched, new_hash = await hasher.verify_and_update_password("secret", old_hash)
+
+        assert matched and new_hash and new_hash.startswith("$2b$05$")
+    finally:
+        hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_saturated(fast_context):
+    """実行中 + 待機中が上限に達していれば、待たせずに 503 で断る。"""
+    hasher = PasswordHasher(max_workers=1, max_pending=2)
+    try:
+        hashes = [hasher.hash_password("secret") for _ in range(3)]
+        results = await asyncio.gather(*hashes, return_exceptions=True)
+
+        assert sum(isinstance(r, ServiceUnavailableError) for r in results) == 1
+        assert hasher.in_flight == 0
+    finally:
+        hasher.shutdown()
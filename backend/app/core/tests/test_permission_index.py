@@ -0,0 +1,60 @@
+# backend/app/core/tests/test_permission_index.py
+import uuid
+
+from app.core.permission_index import (
+    ADMIN_ROLE_NAME,
+    CompiledPermissions,
+    RolePermissionIndex,
+    compile_user_permissions,
+)
+from app.models.user import Permission, Role, User, UserRole
+
+
+def _make_user(*roles: Role) -> User:
+    user = User(id=uuid.uuid4(), email="perm@example.com", hashed_password="x", full_name="Perm")
+    user.user_roles = [UserRole(user_id=user.id, role=role) for role in roles]
+    return user
+
+
+def _make_role(name: str, *permission_names: str) -> Role:
+    role = Role(id=uuid.uuid4(), name=name)
+    role.permissions = [Permission(id=uuid.uuid4(), name=p) for p in permission_names]
+    return role
+
+
+def test_compile_user_permissions_unions_role_permissions():
+    """複数ロールの権限が 1 つの集合にまとめられる。"""
+    user = _make_user(_make_role("教員", "user_read"), _make_role("編集者", "content_write", "Admin_Access"))
+
+    permissions = compile_user_permissions(user)
+
+    assert permissions.names == frozenset({"user_read", "content_write", "Admin_Access"})
+    assert permissions.has_all(("user_read", "content_write"))
+    assert permissions.missing(("user_read", "user_write")) == frozenset({"user_write"})
+    assert permissions.is_superuser  # admin_access は大文字小文字を区別しない
+    assert not permissions.is_admin
+
+
+def test_admin_role_is_detected():
+    """管理者ロールを持つユーザーは is_admin になる。"""
+    permissions = compile_user_permissions(_make_user(_make_role(ADMIN_ROLE_NAME)))
+    assert permissions.is_admin
+
+
+def test_user_without_roles_has_no_permissions():
+    """ロールのないユーザーは空の権限集合になる。"""
+    assert compile_user_permissions(_make_user()) == CompiledPermissions()
+    assert compile_user_permissions(None) == CompiledPermissions()
+
+
+def test_role_index_memoizes_until_cleared():
+    """ロール単位の集合はクリアされるまで再利用される。"""
+    index = RolePermissionIndex(ttl_seconds=60)
+    role = _make_role("教員", "user_read")
+    first = index.permissions_for_role(role)
+
+    role.permissions = [Permission(id=uuid.uuid4(), name="user_write")]
+    assert index.permissions_for_role(role) is first
+
+    index.clear()
+    assert index.permissions_for_role(role) == frozenset({"user_write"})
@@ -0,0 +1,77 @@
+# backend/app/core/tests/test_principal_cache.py
+import time
+import uuid
+
+from app.core.principal_cache import PrincipalCache, Principal
+from app.models.user import User
+
+
+def _make_principal() -> Principal:
+    user = User(id=uuid.uuid4(), email=f"{uuid.uuid4()}@example.com", hashed_password="x", full_name="Test")
+    return Principal.from_user(user)
+
+
+def test_get_returns_cached_user_for_same_token():
+    """同じ (user_id, jti) であればキャッシュされたユーザーが返る。"""
+    cache = PrincipalCache(ttl_seconds=60, max_entries=10)
+    principal = _make_principal()
+    user = principal.user
+    cache.set(str(user.id), "jti-1", principal)
+
+    assert cache.get(str(user.id), "jti-1") is principal
+    assert cache.get(str(user.id), "jti-2") is None
+
+
+def test_entries_expire_after_ttl():
+    """TTL を過ぎたエントリは返されない。"""
+    cache = PrincipalCache(ttl_seconds=0.01, max_entries=10)
+    principal = _make_principal()
+    user = principal.user
+    cache.set(str(user.id), "jti-1", principal)
+    time.sleep(0.02)
+
+    assert cache.get(str(user.id), "jti-1") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    """上限を超えると最も使われていないエントリから追い出される。"""
+    cache = PrincipalCache(ttl_seconds=60, max_entries=2)
+    principals = [_make_principal() for _ in range(3)]
+    users = [p.user for p in principals]
+    cache.set(str(users[0].id), "a", principals[0])
+    cache.set(str(users[1].id), "b", principals[1])
+    cache.get(str(users[0].id), "a")
+    cache.set(str(users[2].id), "c", principals[2])
+
+    assert cache.get(str(users[0].id), "a") is principals[0]
+    assert cache.get(str(users[1].id), "b") is None
+    assert cache.get(str(users[2].id), "c") is principals[2]
+
+
+def test_invalidate_user_and_token():
+    """ユーザー単位・トークン単位の無効化。"""
+    cache = PrincipalCache(ttl_seconds=60, max_entries=10)
+    principal = _make_principal()
+    user = principal.user
+    cache.set(str(user.id), "a", principal)
+    cache.set(str(user.id), "b", principal)
+
+    cache.invalidate_token("a")
+    assert cache.get(str(user.id), "a") is None
+    assert cache.get(str(user.id), "b") is principal
+
+    cache.invalidate_user(str(user.id))
+    assert cache.get(str(user.id), "b") is None
+
+
+def test_set_is_ignored_when_invalidated_during_load():
+    """ロード開始後に無効化が走った場合、古い値はキャッシュされない。"""
+    cache = PrincipalCache(ttl_seconds=60, max_entries=10)
+    principal = _make_principal()
+    user = principal.user
+    generation = cache.generation
+    cache.clear()
+    cache.set(str(user.id), "a", principal, generation=generation)
+
+    assert cache.get(str(user.id), "a") is None
@@ -0,0 +1,81 @@
+# backend/app/core/tests/test_token_revocation.py
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app.core import token_revocation as module
+from app.core.config import settings
+from app.core.token_revocation import TokenRevocationFilter
+from app.crud import token as crud_token
+from app.models.enums import TokenBlacklistReason
+from app.models.user import TokenBlacklist
+
+
+def test_revoked_jti_is_rejected_until_it_expires():
+    """ログアウトで失効した jti は拒否され、期限切れ後の prune で取り除かれる。"""
+    revocations = TokenRevocationFilter()
+    now = datetime.utcnow()
+    revocations.apply([("jti-1", uuid.uuid4(), TokenBlacklistReason.LOGOUT, now, now + timedelta(minutes=5))])
+
+    assert revocations.is_revoked("jti-1", None, None)
+    assert not revocations.is_revoked("jti-2", None, None)
+
+    revocations.prune(now + timedelta(minutes=6))
+    assert not revocations.is_revoked("jti-1", None, None)
+
+
+def test_security_event_revokes_tokens_issued_before_it():
+    """パスワード変更より前に発行されたトークンは jti に関わらず拒否され、後に発行されたものは通る。"""
+    revocations = TokenRevocationFilter()
+    user_id = uuid.uuid4()
+    event_at = datetime.utcnow()
+    revocations.apply([("event-jti", user_id, TokenBlacklistReason.PASSWORD_CHANGE, event_at, event_at + timedelta(hours=1))])
+    event_ts = int(event_at.replace(tzinfo=timezone.utc).timestamp())
+
+    assert revocations.is_revoked("old-jti", str(user_id), event_ts - 60)
+    assert not revocations.is_revoked("new-jti", str(user_id), event_ts + 1)
+    assert not revocations.is_revoked("old-jti", str(uuid.uuid4()), event_ts - 60)
+
+
+def test_committed_blacklist_entry_takes_effect_immediately(monkeypatch):
+    """同一プロセスでのブラックリスト登録はコミット時にフィルターへ反映される。"""
+    revocations = TokenRevocationFilter()
+    monkeypatch.setattr(module, "token_revocation", revocations)
+    session = Session()
+    session.add(TokenBlacklist(
+        token_jti="jti-1", user_id=uuid.uuid4(), reason=TokenBlacklistReason.LOGOUT,
+        created_at=datetime.utcnow(), expires_at=datetime.utcnow() + timedelta(minutes=5),
+    ))
+
+    module._record_revocations(session, None)
+    assert not revocations.is_revoked("jti-1", None, None)
+
+    module._apply_revocations(session)
+    assert revocations.is_revoked("jti-1", None, None)
+
+
+@pytest.mark.asyncio
+async def test_password_change_survives_a_reload_after_the_access_token_expires(monkeypatch, fake_session):
+    """パスワード変更の記録はアクセストークンの期限後も残り、読み直したフィルターでも古いリフレッシュトークンを拒否する。"""
+    user_id = uuid.uuid4()
+    db = fake_session()
+    await crud_token.blacklist_tokens_by_user(db, user_id, reason=TokenBlacklistReason.PASSWORD_CHANGE)
+    [event] = db.added
+    later = event.created_at + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES + 60)
+    assert event.expires_at >= later  # remove_expired_tokens で消えない
+
+    class Clock(datetime):
+        @classmethod
+        def utcnow(cls):
+            return later
+
+    monkeypatch.setattr(module, "datetime", Clock)
+    revocations = TokenRevocationFilter()  # 再起動後・新しいワーカー
+    reload = fake_session([(event.token_jti, event.user_id, event.reason, event.created_at, event.expires_at)])
+    await revocations.refresh(reload)
+
+    assert reload.values(0)["expires_at_1"] <= event.expires_at  # DB 側の条件でも読み込まれる
+    issued_before = int(event.created_at.replace(tzinfo=timezone.utc).timestamp()) - 60
+    assert revocations.is_revoked("refresh-jti", str(user_id), issued_before)
@@ -0,0 +1,164 @@
+"""
+JWT の失効判定をプロセス内で行うためのフィルター。
+
+AuthMiddleware はトークンをデコードするだけで token_blacklist を見ていなかった。
+リクエストごとに is_token_blacklisted を呼ぶと DB 往復が 1 回増えるため、
+ここでは token_blacklist の内容をメモリに持ち、判定を DB なしの O(1) で行う。
+
+- 失効済み jti の集合 (ログアウトなど、個別トークンの失効)
+- ユーザーごとの「この時刻より前に発行されたトークンは無効」 (パスワード変更などのセキュリティイベント)
+
+同一プロセスでの失効はコミット時に SQLAlchemy のセッションイベントで即時反映し、
+他プロセスでの失効は settings.TOKEN_REVOCATION_REFRESH_SECONDS ごとの差分読み込み
+(created_at が前回読み込み以降の行だけ) で反映する。
+期限切れの項目は remove_expired_tokens と同じタイミングで prune() により取り除く。
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud.token import SECURITY_EVENT_REASONS
+from app.models.user import TokenBlacklist
+
+logger = logging.getLogger(__name__)
+
+# (jti, user_id, reason, created_at, expires_at)
+RevocationRow = Tuple[str, str, object, datetime, datetime]
+
+# セッションの info に未反映の失効を溜めておくキー
+_PENDING_KEY = "_token_revocation_pending"
+
+
+def _utc(value: datetime) -> datetime:
+    # token_blacklist の日時は naive な UTC で保存されている
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class TokenRevocationFilter:
+    """失効済み jti とユーザーごとの失効時刻を保持する"""
+
+    def __init__(self, refresh_overlap_seconds: float = 30.0):
+        # 書き込みからコミットまでの遅れで取りこぼさないよう、差分読み込みは少し前から読み直す
+        self.refresh_overlap = timedelta(seconds=refresh_overlap_seconds)
+        self._revoked_jtis: Dict[str, datetime] = {}
+        self._revoked_before: Dict[str, datetime] = {}
+        self._watermark: Optional[datetime] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._watermark is not None
+
+    def is_revoked(self, jti: Optional[str], user_id: Optional[str], issued_at: Optional[int]) -> bool:
+        """jti が失効済み、またはユーザーのセキュリティイベントより前に発行されたトークンなら True"""
+        if jti and jti in self._revoked_jtis:
+            return True
+        if user_id and issued_at is not None:
+            revoked_before = self._revoked_before.get(str(user_id))
+            # iat は秒単位に切り捨てられているので、イベントと同じ秒に発行されたトークンは有効とみなす
+            if revoked_before is not None and issued_at < int(revoked_before.timestamp()):
+                return True
+        return False
+
+    def apply(self, rows: Iterable[RevocationRow]) -> None:
+        """token_blacklist の行を反映する (同じ行を何度渡してもよい)"""
+        for jti, user_id, reason, created_at, expires_at in rows:
+            created_at, expires_at = _utc(created_at), _utc(expires_at)
+            self._revoked_jtis[jti] = expires_at
+            if reason in SECURITY_EVENT_REASONS and user_id is not None:
+                key = str(user_id)
+                current = self._revoked_before.get(key)
+                if current is None or created_at > current:
+                    self._revoked_before[key] = created_at
+
+    async def refresh(self, db) -> int:
+        """前回読み込み以降に追加された失効を DB から読み込む"""
+        now = datetime.utcnow()
+        stmt = select(
+            TokenBlacklist.token_jti,
+            TokenBlacklist.user_id,
+            TokenBlacklist.reason,
+            TokenBlacklist.created_at,
+            TokenBlacklist.expires_at,
+        ).where(TokenBlacklist.expires_at >= now)
+        if self._watermark is not None:
+            since = (self._watermark - self.refresh_overlap).replace(tzinfo=None)
+            stmt = stmt.where(TokenBlacklist.created_at >= since)
+        rows: List[RevocationRow] = [row for row in (await db.execute(stmt)).all() if row[3] is not None]
+        self.apply(rows)
+        # 次回はここまでに読んだ行より後 (初回で行がなければ今) から読む
+        latest = max((_utc(row[3]) for row in rows), default=_utc(now))
+        if self._watermark is None or latest > self._watermark:
+            self._watermark = latest
+        return len(rows)
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """期限切れの jti と、それ以前に発行されたトークンがすべて期限切れになった失効時刻を取り除く"""
+        now = _utc(now or datetime.utcnow())
+        expired = [jti for jti, expires_at in self._revoked_jtis.items() if expires_at < now]
+        for jti in expired:
+            del self._revoked_jtis[jti]
+        max_token_lifetime = timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+        stale = [user_id for user_id, at in self._revoked_before.items() if at + max_token_lifetime < now]
+        for user_id in stale:
+            del self._revoked_before[user_id]
+        return len(expired) + len(stale)
+
+    def clear(self) -> None:
+        self._revoked_jtis.clear()
+        self._revoked_before.clear()
+        self._watermark = None
+
+    def __len__(self) -> int:
+        return len(self._revoked_jtis)
+
+
+token_revocation = TokenRevocationFilter()
+
+
+async def refresh_token_revocations() -> None:
+    """失効リストを一度読み込む (失敗してもログだけ残す)"""
+    from app.database.database import AsyncSessionLocal
+    try:
+        async with AsyncSessionLocal() as db:
+            count = await token_revocation.refresh(db)
+        if count:
+            logger.debug(f"Loaded {count} token revocation(s).")
+    except Exception as e:
+        logger.error(f"Failed to refresh token revocations: {e}")
+
+
+async def run_token_revocation_refresh() -> None:
+    """他プロセスでの失効を取り込むため、一定間隔で差分読み込みを続ける"""
+    while True:
+        await asyncio.sleep(settings.TOKEN_REVOCATION_REFRESH_SECONDS)
+        await refresh_token_revocations()
+
+
+# --- セッションイベントによる即時反映 ---
+
+@event.listens_for(Session, "after_flush")
+def _record_revocations(session: Session, flush_context) -> None:
+    rows = [
+        (obj.token_jti, obj.user_id, obj.reason, obj.created_at or datetime.utcnow(), obj.expires_at)
+        for obj in session.new
+        if isinstance(obj, TokenBlacklist) and obj.token_jti and obj.expires_at is not None
+    ]
+    if rows:
+        session.info.setdefault(_PENDING_KEY, []).extend(rows)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_revocations(session: Session) -> None:
+    rows = session.info.pop(_PENDING_KEY, None)
+    if rows:
+        token_revocation.apply(rows)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_revocations(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,196 @@
+# backend/app/crud/broadcast.py
+"""
+全体通知 (broadcast_notifications) を対象ユーザーごとの通知に展開するクエリ。
+
+対象ユーザーの解決・notifications / in_app_notifications への書き込みはすべて
+INSERT ... SELECT で DB 側で行い、ユーザーを 1 人ずつアプリに読み込まない。
+"""
+from datetime import datetime, time
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import Time, and_, case, cast, exists, func, insert, literal, or_, select, true, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.in_app_notification import InAppNotification
+from app.models.notification_setting import NotificationSetting
+from app.models.system import BroadcastNotification, BroadcastTargetRole, BroadcastTargetSchool, Notification
+from app.models.user import User, UserRole
+
+
+async def list_pending_broadcast_ids(db: AsyncSession, now: datetime) -> List[UUID]:
+    """配信時刻になった未展開の全体通知"""
+    result = await db.execute(
+        select(BroadcastNotification.id)
+        .where(
+            BroadcastNotification.is_active.is_(True),
+            BroadcastNotification.sent_at.is_(None),
+            or_(BroadcastNotification.scheduled_at.is_(None), BroadcastNotification.scheduled_at <= now),
+            or_(BroadcastNotification.expires_at.is_(None), BroadcastNotification.expires_at > now),
+        )
+        .order_by(BroadcastNotification.created_at)
+    )
+    return list(result.scalars().all())
+
+
+async def claim_broadcast(db: AsyncSession, broadcast_id: UUID, now: datetime) -> Optional[BroadcastNotification]:
+    """
+    sent_at を埋めて全体通知を確保する (未展開のものだけ)。
+    commit するまで行ロックを持つので、展開と同じトランザクションで呼ぶこと。
+    """
+    result = await db.execute(
+        update(BroadcastNotification)
+        .where(BroadcastNotification.id == broadcast_id, BroadcastNotification.sent_at.is_(None))
+        .values(sent_at=now)
+        .returning(BroadcastNotification)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().first()
+
+
+def audience_query(broadcast_id: UUID):
+    """
+    全体通知の対象ユーザー ID。対象ロール・対象学校が未指定ならその条件では絞り込まない。
+    user_roles / broadcast_target_* に対する EXISTS なので、複数ロールを持つユーザーも 1 行になる。
+    """
+    has_roles = exists().where(BroadcastTargetRole.broadcast_notification_id == broadcast_id)
+    has_schools = exists().where(BroadcastTargetSchool.broadcast_notification_id == broadcast_id)
+    in_roles = exists().where(
+        UserRole.user_id == User.id,
+        UserRole.role_id == BroadcastTargetRole.role_id,
+        BroadcastTargetRole.broadcast_notification_id == broadcast_id,
+    )
+    in_schools = exists().where(
+        BroadcastTargetSchool.school_id == User.school_id,
+        BroadcastTargetSchool.broadcast_notification_id == broadcast_id,
+    )
+    return select(User.id.label("user_id")).where(
+        User.is_active.is_(True),
+        or_(~has_roles, in_roles),
+        or_(~has_schools, in_schools),
+    )
+
+
+def _setting_join(audience, notification_type):
+    return and_(
+        NotificationSetting.user_id == audience.c.user_id,
+        NotificationSetting.notification_type == notification_type,
+    )
+
+
+def in_quiet_hours(current_time: time):
+    """通知設定の静かな時間帯に current_time が入るか (開始 > 終了なら日付をまたぐ)"""
+    start = cast(NotificationSetting.quiet_hours_start, Time)
+    end = cast(NotificationSetting.quiet_hours_end, Time)
+    now = literal(current_time, Time)
+    return and_(
+        NotificationSetting.quiet_hours_start.is_not(None),
+        NotificationSetting.quiet_hours_end.is_not(None),
+        case(
+            (start <= end, and_(start <= now, now <= end)),
+            else_=or_(now >= start, now <= end),
+        ),
+    )
+
+
+async def materialize_broadcast(db: AsyncSession, broadcast: BroadcastNotification, now: datetime) -> Tuple[int, int]:
+    """
+    対象ユーザーごとの notifications と、アプリ内通知が有効なユーザーの in_app_notifications を
+    それぞれ 1 回の INSERT ... SELECT で書き込み、(notifications, in_app_notifications) の件数を返す。
+    notifications は (broadcast_notification_id, user_id) で一意なので、展開し直しても重複しない。
+    commit は呼び出し元で行う。
+    """
+    audience = audience_query(broadcast.id).subquery("audience")
+
+    notifications = (
+        pg_insert(Notification)
+        .from_select(
+            [
+                "id", "user_id", "title", "content", "notification_type", "broadcast_notification_id",
+                "is_read", "is_action_required", "action_url", "sent_at", "expires_at", "priority",
+                "created_at", "updated_at",
+            ],
+            select(
+                func.gen_random_uuid(),
+                audience.c.user_id,
+                literal(broadcast.title),
+                literal(broadcast.content),
+                literal(broadcast.notification_type, Notification.notification_type.type),
+                literal(broadcast.id, Notification.broadcast_notification_id.type),
+                literal(False),
+                literal(False),
+                literal(broadcast.action_url),
+                literal(now),
+                literal(broadcast.expires_at, Notification.expires_at.type),
+                literal(broadcast.priority, Notification.priority.type),
+                literal(now),
+                literal(now),
+            ),
+        )
+        .on_conflict_do_nothing(
+            index_elements=["broadcast_notification_id", "user_id"],
+            index_where=Notification.broadcast_notification_id.is_not(None),
+        )
+    )
+    notification_count = (await db.execute(notifications)).rowcount
+
+    # 通知設定がないユーザーはモデルの既定値 (アプリ内通知は有効) として扱う
+    in_app_users = (
+        select(audience.c.user_id)
+        .distinct()
+        .outerjoin(NotificationSetting, _setting_join(audience, broadcast.notification_type))
+        .where(func.coalesce(NotificationSetting.in_app_enabled, true()))
+        .subquery("in_app_users")
+    )
+    notification_type = broadcast.notification_type
+    in_app = insert(InAppNotification).from_select(
+        ["id", "user_id", "notification_type", "title", "message", "data", "is_read", "created_at", "updated_at"],
+        select(
+            cast(func.gen_random_uuid(), InAppNotification.id.type),
+            in_app_users.c.user_id,
+            literal(getattr(notification_type, "value", notification_type)),
+            literal(broadcast.title[:200]),
+            literal((broadcast.content or broadcast.title)[:1000]),
+            literal({"broadcast_notification_id": str(broadcast.id), "action_url": broadcast.action_url},
+                    InAppNotification.data.type),
+            literal(False),
+            literal(now),
+            literal(now),
+        ),
+    )
+    in_app_count = (await db.execute(in_app)).rowcount
+    return notification_count, in_app_count
+
+
+async def list_delivery_recipients(
+    db: AsyncSession,
+    broadcast: BroadcastNotification,
+    current_time: time,
+    limit: int,
+    after_user_id: Optional[UUID] = None,
+) -> List[Tuple[UUID, str, str, bool, bool]]:
+    """
+    メール・プッシュで届ける対象 (静かな時間帯のユーザーを除く) を
+    (user_id, email, full_name, email_enabled, push_enabled) で user_id 順に最大 limit 件返す。
+    after_user_id を渡すとその次から読む (キーセットページング)。
+    通知設定がないユーザーはモデルの既定値 (メールは有効、プッシュは無効) として扱う。
+    """
+    audience = audience_query(broadcast.id).subquery("audience")
+    email_enabled = func.coalesce(NotificationSetting.email_enabled, true())
+    push_enabled = func.coalesce(NotificationSetting.push_enabled, False)
+    stmt = (
+        select(User.id, User.email, User.full_name, email_enabled, push_enabled)
+        .distinct(User.id)
+        .join(audience, audience.c.user_id == User.id)
+        .outerjoin(NotificationSetting, _setting_join(audience, broadcast.notification_type))
+        .where(
+            or_(email_enabled, push_enabled),
+            ~in_quiet_hours(current_time),
+        )
+        .order_by(User.id)
+        .limit(limit)
+    )
+    if after_user_id is not None:
+        stmt = stmt.where(User.id > after_user_id)
+    return [tuple(row) for row in (await db.execute(stmt)).all()]
@@ -1,10 +1,11 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, tuple_, true
 from app.models.chat import ChatSession, ChatMessage, MessageSender
 from app.models.enums import SessionStatus, ChatType
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Union, Tuple
 from datetime import datetime
+import base64
 import uuid
 from fastapi import HTTPException
 import logging
@@ -20,7 +21,8 @@ async def get_or_create_chat_session(
     db: AsyncSession,
     user_id: uuid.UUID,
     session_id: Optional[Union[str, uuid.UUID]] = None,
-    chat_type: str = "general"
+    chat_type: str = "general",
+    persist: bool = True
 ) -> ChatSession:
     """
     チャットセッションを取得または作成する
@@ -30,6 +32,8 @@ async def get_or_create_chat_session(
         user_id: ユーザーID
         session_id: セッションID（オプション）
         chat_type: チャットタイプ (例: "consultation", "self_analysis")
+        persist: False の場合、新規セッションはコミットせずメモリ上のオブジェクトとして返す
+                 (呼び出し側で chat_write_behind に積む想定)
     
     Returns:
         ChatSession: 取得または作成されたチャットセッション
@@ -78,6 +82,8 @@ async def get_or_create_chat_session(
         status=SessionStatus.ACTIVE,
         chat_type=chat_type_enum
     )
+    if not persist:
+        return new_session
     db.add(new_session)
     await db.commit()
     await db.refresh(new_session)
@@ -114,59 +120,108 @@ async def save_chat_message(
     await db.refresh(message)
     return message
 
+# 一覧に表示する最終メッセージ要約の最大文字数
+LAST_MESSAGE_SUMMARY_LENGTH = 50
+
+def _session_sort_key():
+    """一覧の並び順キー。updated_at が未設定のセッションは created_at で代用する"""
+    return func.coalesce(ChatSession.updated_at, ChatSession.created_at)
+
+def encode_session_cursor(summary: ChatSessionSummary) -> str:
+    """一覧の最終要素から次ページ取得用のカーソル文字列を作る"""
+    sort_value = summary.updated_at or summary.created_at
+    raw = f"{sort_value.isoformat()}|{summary.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_session_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """encode_session_cursor で作ったカーソルを (並び順キー, セッションID) に戻す"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        sort_value_str, session_id_str = raw.split("|", 1)
+        return datetime.fromisoformat(sort_value_str), uuid.UUID(session_id_str)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid session cursor: {cursor}") from e
+
 async def get_user_chat_sessions(
     db: AsyncSession,
     user_id: uuid.UUID,
-    chat_type: str = "general",
-    status: Optional[SessionStatus] = SessionStatus.ACTIVE
+    chat_type: Optional[str] = "general",
+    status: Optional[SessionStatus] = SessionStatus.ACTIVE,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
 ) -> List[ChatSessionSummary]:
     """
     ユーザーのチャットセッション一覧をChatSessionSummaryのリストとして取得。
     オプションでステータスによるフィルタリングも可能。
+
+    最終メッセージの要約は LATERAL サブクエリで同じクエリ内に取得するため、
+    セッション数に関わらず発行するクエリは 1 回。
+    limit / cursor を指定するとキーセットページネーションになる
+    (cursor は前ページ最終要素から encode_session_cursor で作る)。
     """
-    logger.debug(f"[CRUD get_user_chat_sessions] Called with user_id: {user_id}, chat_type_str: '{chat_type}', status: {status}")
-    try:
-        chat_type_enum_filter = ChatType(chat_type)
-        logger.debug(f"[CRUD get_user_chat_sessions] Parsed chat_type_enum_filter: {chat_type_enum_filter}")
-    except ValueError:
-        logger.warning(f"[CRUD get_user_chat_sessions] Invalid chat_type string '{chat_type}'.")
-        raise ValueError(f"Invalid chat type string for filtering: {chat_type}")
+    logger.debug(f"[CRUD get_user_chat_sessions] Called with user_id: {user_id}, chat_type_str: '{chat_type}', status: {status}, limit: {limit}, cursor: {cursor}")
 
-    filters = [
-        ChatSession.user_id == user_id,
-        ChatSession.chat_type == chat_type_enum_filter
-    ]
+    filters = [ChatSession.user_id == user_id]
+    if chat_type:
+        try:
+            chat_type_enum_filter = ChatType(chat_type)
+        except ValueError:
+            logger.warning(f"[CRUD get_user_chat_sessions] Invalid chat_type string '{chat_type}'.")
+            raise ValueError(f"Invalid chat type string for filtering: {chat_type}")
+        filters.append(ChatSession.chat_type == chat_type_enum_filter)
     if status:
         filters.append(ChatSession.status == status)
-    
-    stmt = select(ChatSession).filter(*filters).order_by(ChatSession.updated_at.desc())
+
+    sort_key = _session_sort_key()
+    if cursor:
+        cursor_sort_value, cursor_id = decode_session_cursor(cursor)
+        filters.append(tuple_(sort_key, ChatSession.id) < tuple_(cursor_sort_value, cursor_id))
+
+    # 要約に必要な分だけ (+1 文字で切り詰め要否を判定) を取得する
+    last_message = (
+        select(func.substr(ChatMessage.content, 1, LAST_MESSAGE_SUMMARY_LENGTH + 1).label("content"))
+        .where(ChatMessage.session_id == ChatSession.id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(1)
+        .correlate(ChatSession)
+        .lateral("last_message")
+    )
+
+    stmt = (
+        select(
+            ChatSession.id,
+            ChatSession.title,
+            ChatSession.chat_type,
+            ChatSession.created_at,
+            ChatSession.updated_at,
+            last_message.c.content,
+        )
+        .outerjoin(last_message, true())
+        .filter(*filters)
+        .order_by(sort_key.desc(), ChatSession.id.desc())
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
     result = await db.execute(stmt)
-    sessions_db = result.scalars().all()
-    logger.debug(f"[CRUD get_user_chat_sessions] Found {len(sessions_db)} sessions from DB before processing summaries.")
+    rows = result.all()
+    logger.debug(f"[CRUD get_user_chat_sessions] Found {len(rows)} sessions from DB.")
 
     summaries: List[ChatSessionSummary] = []
-    for session_db in sessions_db:
-        logger.debug(f"[CRUD get_user_chat_sessions] Processing session ID: {session_db.id}, title: {session_db.title}")
-        last_message_stmt = select(ChatMessage.content)\
-            .filter(ChatMessage.session_id == session_db.id)\
-            .order_by(ChatMessage.created_at.desc())\
-            .limit(1)
-        last_message_result = await db.execute(last_message_stmt)
-        last_message_content = last_message_result.scalars().first()
-        logger.debug(f"[CRUD get_user_chat_sessions] For session {session_db.id}, last_message_content: '{last_message_content}'")
-
+    for row in rows:
         summary_text = None
-        if last_message_content:
-            summary_text = (last_message_content[:50] + '...') if len(last_message_content) > 50 else last_message_content
-        logger.debug(f"[CRUD get_user_chat_sessions] For session {session_db.id}, summary_text: '{summary_text}'")
-        
+        if row.content:
+            summary_text = (
+                row.content[:LAST_MESSAGE_SUMMARY_LENGTH] + '...'
+                if len(row.content) > LAST_MESSAGE_SUMMARY_LENGTH else row.content
+            )
         summaries.append(
             ChatSessionSummary(
-                id=session_db.id,
-                title=session_db.title,
-                chat_type=session_db.chat_type,
-                created_at=session_db.created_at,
-                updated_at=session_db.updated_at,
+                id=row.id,
+                title=row.title,
+                chat_type=row.chat_type,
+                created_at=row.created_at,
+                updated_at=row.updated_at,
                 last_message_summary=summary_text
             )
         )
@@ -301,12 +356,16 @@ async def update_session_status(
 async def get_archived_chat_sessions(
     db: AsyncSession,
     user_id: uuid.UUID,
-    chat_type: str = "general"
+    chat_type: str = "general",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
 ) -> List[ChatSessionSummary]:
     """
     ユーザーのアーカイブ済みチャットセッション一覧を ChatSessionSummary のリストとして取得
     """
-    return await get_user_chat_sessions(db, user_id, chat_type, status=SessionStatus.ARCHIVED)
+    return await get_user_chat_sessions(
+        db, user_id, chat_type, status=SessionStatus.ARCHIVED, limit=limit, cursor=cursor
+    )
 
 async def get_chat_messages(db: AsyncSession, session_id: uuid.UUID) -> List[Dict]:
     """チャット履歴を取得"""
@@ -334,6 +393,23 @@ async def get_chat_messages(db: AsyncSession, session_id: uuid.UUID) -> List[Dic
         logger.error(f"Error getting chat messages for session {session_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve chat messages.")
 
+async def get_chat_messages_after(
+    db: AsyncSession,
+    session_id: uuid.UUID,
+    after_id: int = 0,
+) -> List[Tuple[int, MessageSender, str]]:
+    """
+    指定 ID より新しいメッセージだけを (id, sender, content) で取得する。
+    会話コンテキストキャッシュの差分読み込み用 (メッセージは追記のみの前提)。
+    """
+    stmt = (
+        select(ChatMessage.id, ChatMessage.sender, ChatMessage.content)
+        .where(ChatMessage.session_id == session_id, ChatMessage.id > after_id)
+        .order_by(ChatMessage.id.asc())
+    )
+    result = await db.execute(stmt)
+    return [tuple(row) for row in result.all()]
+
 async def get_chat_session_by_id(db: AsyncSession, session_id: uuid.UUID) -> Optional[ChatSession]:
     """指定されたIDのChatSessionを取得する"""
     stmt = select(ChatSession).filter(ChatSession.id == session_id)
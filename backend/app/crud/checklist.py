@@ -4,7 +4,7 @@ from sqlalchemy import select, update as sql_update, delete as sql_delete
 from app.models.checklist import ChecklistEvaluation
 from app.schemas.checklist import ChecklistEvaluationCreate, ChecklistEvaluationUpdate
 from typing import List, Dict, Optional
-from openai import AsyncOpenAI
+from app.services.llm_clients import get_openai_client
 from uuid import UUID
 from fastapi import HTTPException
 import logging
@@ -14,8 +14,6 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-
 class ChecklistEvaluator:
     def __init__(self):
         self.evaluation_prompt = """
@@ -85,7 +83,7 @@ class ChecklistEvaluator:
         ])
 
         try:
-            response = await client.chat.completions.create(
+            response = await get_openai_client().chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": self.evaluation_prompt},
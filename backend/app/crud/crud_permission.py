@@ -23,6 +23,8 @@ from app.models.user import Permission # Permission モデルをインポート
 # # !!! ここまで仮のインポート !!!
 
 from app.schemas.permission import PermissionCreate, PermissionUpdate
+from app.core.principal_cache import principal_cache
+from app.core.permission_index import role_permission_index
 
 async def get_permission(db: Session, permission_id: uuid.UUID) -> Permission | None:
     """IDで権限を取得"""
@@ -72,6 +74,9 @@ async def update_permission(db: Session, permission_id: uuid.UUID, permission_in
     )
     result = await db.execute(stmt)
     await db.commit()
+    # Core の UPDATE はセッションイベントで検知できないため明示的に無効化
+    role_permission_index.clear()
+    principal_cache.clear()
     return result.scalars().first()
 
 
@@ -82,4 +87,6 @@ async def delete_permission(db: Session, permission_id: uuid.UUID) -> Permission
         stmt = sql_delete(Permission).where(Permission.id == permission_id)
         await db.execute(stmt)
         await db.commit()
+        role_permission_index.clear()
+        principal_cache.clear()
     return permission 
\ No newline at end of file
@@ -84,6 +84,13 @@ async def get_role_by_name(db: AsyncSession, name: str) -> Role | None:
     result = await db.execute(select(Role).filter(Role.name == name))
     return result.scalars().first()
 
+async def get_role_names_by_ids(db: AsyncSession, role_ids: List[uuid.UUID]) -> dict[uuid.UUID, str]:
+    """複数のロール ID を 1 クエリでロール名に解決する (見つからない ID は含まれない)"""
+    if not role_ids:
+        return {}
+    result = await db.execute(select(Role.id, Role.name).filter(Role.id.in_(set(role_ids))))
+    return {role_id: name for role_id, name in result.all()}
+
 async def get_roles(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[Role]:
     """ロール一覧を取得 (関連する権限も含む)"""
     result = await db.execute(
@@ -8,8 +8,10 @@ from app.models.university import University, Department
 from app.models.enums import SessionType, SessionStatus, MessageType
 from typing import Dict, List, Any, Optional
 from uuid import UUID
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, select
 from datetime import datetime, timedelta
+from app.core.config import settings
+from app.services.recommendation_pool import CandidatePool, recommendation_pool_cache, sample_by_random_key
 
 def get_student_dashboard(db: Session, user_id: UUID) -> Dict[str, Any]:
     """学生向けダッシュボード情報を取得する"""
@@ -300,16 +302,10 @@ def get_recommendations(db: Session, user_id: UUID) -> Dict[str, Any]:
     
     # 2. 志望校の推奨（仮実装）
     # 実際の実装では、ユーザーのプロフィールや興味に基づいて推奨する
-    recommended_universities = db.query(
-        University
-    ).order_by(
-        func.random()
-    ).limit(3).all()
-    
     university_recommendations = [{
-        "id": str(university.id),
-        "name": university.name
-    } for university in recommended_universities]
+        "id": str(university_id),
+        "name": name
+    } for university_id, name in get_university_candidate_pool(db, user_id).pick(3)]
     
     return {
         "recommended_contents": content_recommendations,
@@ -321,6 +317,32 @@ def get_recommendations(db: Session, user_id: UUID) -> Dict[str, Any]:
         ]
     }
 
+def get_university_candidate_pool(db: Session, user_id: UUID) -> CandidatePool:
+    """
+    おすすめの大学の候補 ((id, name) の組) をユーザーごとに抽出してキャッシュする。
+    すでに志望校に入れている大学は除く
+    """
+    key = ("universities", user_id)
+    pool = recommendation_pool_cache.get(key)
+    if pool is not None:
+        return pool
+
+    generation = recommendation_pool_cache.generation(key)
+    size = settings.RECOMMENDATION_POOL_SIZE
+    desired = select(DesiredSchool.id).where(
+        DesiredSchool.user_id == user_id,
+        DesiredSchool.university_id == University.id
+    ).exists()
+    candidates = sample_by_random_key(
+        select(University.id, University.name).where(University.is_active.is_(True), ~desired),
+        University.random_key,
+        size
+    )
+    rows = db.execute(select(candidates.c.id, candidates.c.name).limit(size)).all()
+    pool = CandidatePool(tiers=(tuple((row.id, row.name) for row in rows),))
+    recommendation_pool_cache.set(key, pool, generation)
+    return pool
+
 def get_pending_feedback_requests(db: Session, teacher_id: UUID) -> List[Dict[str, Any]]:
     """教師へのフィードバック要求を取得する"""
     # 実際の実装では、フィードバック要求テーブルからデータを取得
@@ -0,0 +1,97 @@
+# backend/app/crud/email_outbox.py
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID
+
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.email_outbox import EmailOutbox
+
+
+async def enqueue_emails(db: AsyncSession, messages: Iterable[Dict[str, Optional[str]]]) -> List[UUID]:
+    """
+    送信待ちのメールを 1 回の INSERT でまとめて積む。
+    messages の各要素は to_email / subject / html_content / plain_content を持つ dict。
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "to_email": message["to_email"],
+            "subject": message["subject"],
+            "html_content": message["html_content"],
+            "plain_content": message.get("plain_content"),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for message in messages
+    ]
+    if not rows:
+        return []
+    await db.execute(insert(EmailOutbox), rows)
+    await db.commit()
+    return [row["id"] for row in rows]
+
+
+async def claim_due_emails(db: AsyncSession, limit: int, stale_before: datetime) -> List[EmailOutbox]:
+    """
+    送信時刻になったメールを最大 limit 件 sending にして返す。
+    FOR UPDATE SKIP LOCKED で選ぶので、複数のプロセスが同じメールを取り出すことはない。
+    sending のまま止まった (プロセスが落ちた) メールも取り出し直す。
+    """
+    now = datetime.utcnow()
+    due = (
+        select(EmailOutbox.id)
+        .where(or_(
+            (EmailOutbox.status == "pending") & (EmailOutbox.next_attempt_at <= now),
+            (EmailOutbox.status == "sending") & (EmailOutbox.updated_at < stale_before),
+        ))
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(due))
+        .values(status="sending", attempts=EmailOutbox.attempts + 1, updated_at=now)
+        .returning(EmailOutbox)
+        .execution_options(synchronize_session=False)
+    )
+    emails = list(result.scalars().all())
+    await db.commit()
+    return emails
+
+
+async def mark_emails_sent(db: AsyncSession, email_ids: List[UUID]) -> None:
+    if not email_ids:
+        return
+    now = datetime.utcnow()
+    await db.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(email_ids))
+        .values(status="sent", sent_at=now, last_error=None, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def mark_email_unsent(db: AsyncSession, email_id: UUID, error: str, retry_at: Optional[datetime]) -> None:
+    """送信失敗を記録する。retry_at があればその時刻に再送し、なければ failed にする"""
+    await db.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id == email_id)
+        .values(
+            status="pending" if retry_at else "failed",
+            next_attempt_at=retry_at or EmailOutbox.next_attempt_at,
+            last_error=error,
+            updated_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
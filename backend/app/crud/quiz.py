@@ -1,465 +1,528 @@
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, and_, or_
-from app.models.quiz import Quiz, QuizQuestion, QuizAnswer, UserQuizAttempt, UserQuizAnswer
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import func, or_, select, update, insert, delete as sql_delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.models.quiz import Quiz, QuizQuestion, QuizAnswer, UserQuizAttempt, UserQuizAnswer, UserQuizStats
 from app.schemas.quiz import (
     QuizCreate, QuizUpdate, QuizQuestionCreate, QuizQuestionUpdate,
-    QuizAnswerCreate, QuizAnswerUpdate, QuizAnswerSubmit,
+    QuizAnswerCreate, QuizAnswerUpdate,
     UserQuizAttemptCreate, UserQuizAttemptUpdate
 )
-from typing import List, Optional, Dict, Any, Tuple
+from app.services.quiz_definition_cache import quiz_definition_cache
+from app.services.quiz_grading import AnswerKey, grade
+from app.services.recommendation_pool import CandidatePool, recommendation_pool_cache, sample_by_random_key
+from app.core.config import settings
+from typing import List, Optional, Dict, Any, Mapping, Tuple
 from uuid import UUID
-import uuid
+from enum import Enum
 from datetime import datetime
 from sqlalchemy import desc
-import random
+
+
+def _value(value: Any) -> Any:
+    """Enum のスキーマ値を DB に入れる文字列にする"""
+    return value.value if isinstance(value, Enum) else value
+
+
+def _build_question(question_data: QuizQuestionCreate, quiz_id: Optional[UUID] = None) -> QuizQuestion:
+    """問題と選択肢をまとめて組み立てる (同じ flush で INSERT される)"""
+    return QuizQuestion(
+        quiz_id=quiz_id,
+        text=question_data.text,
+        question_type=_value(question_data.question_type),
+        points=question_data.points,
+        order=question_data.order,
+        image_url=question_data.image_url,
+        answers=[_build_answer(answer_data) for answer_data in question_data.answers]
+    )
+
+
+def _build_answer(answer_data: QuizAnswerCreate, question_id: Optional[UUID] = None) -> QuizAnswer:
+    return QuizAnswer(
+        question_id=question_id,
+        text=answer_data.text,
+        is_correct=answer_data.is_correct,
+        explanation=answer_data.explanation
+    )
+
+
+async def _touch_quiz(db: AsyncSession, quiz_id: Any) -> Optional[UUID]:
+    """
+    問題・選択肢の変更をクイズの updated_at (解答キーの version) に反映し、クイズの ID を返す。
+    呼び出し側はコミット後に _invalidate_quiz で解答キーのキャッシュを破棄する
+    """
+    result = await db.execute(
+        update(Quiz)
+        .where(Quiz.id == quiz_id)
+        .values(updated_at=datetime.utcnow())
+        .returning(Quiz.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar()
+
+
+def _invalidate_quiz(quiz_id: Optional[UUID]) -> None:
+    if quiz_id is not None:
+        quiz_definition_cache.invalidate(quiz_id)
+
+
+def _quiz_with_questions():
+    return select(Quiz).options(selectinload(Quiz.questions).selectinload(QuizQuestion.answers))
+
 
 # クイズのCRUD操作
-def create_quiz(db: Session, quiz_in: QuizCreate, user_id: UUID) -> Quiz:
-    """新しいクイズを作成します"""
-    
-    # クイズオブジェクトの作成
+async def create_quiz(db: AsyncSession, quiz_in: QuizCreate, user_id: UUID) -> Quiz:
+    """新しいクイズを作成します (問題と回答も同じコミットで作成します)"""
     db_quiz = Quiz(
         title=quiz_in.title,
         description=quiz_in.description,
         time_limit=quiz_in.time_limit,
-        difficulty=quiz_in.difficulty,
+        difficulty=_value(quiz_in.difficulty),
         is_active=quiz_in.is_active,
         pass_percentage=quiz_in.pass_percentage,
         max_attempts=quiz_in.max_attempts,
-        created_by=user_id
+        created_by=user_id,
+        questions=[_build_question(question_data) for question_data in quiz_in.questions]
     )
     db.add(db_quiz)
-    db.flush()  # IDを生成するためにフラッシュする
-    
-    # 質問の作成
-    for question_data in quiz_in.questions:
-        db_question = QuizQuestion(
-            quiz_id=db_quiz.id,
-            text=question_data.text,
-            question_type=question_data.question_type,
-            points=question_data.points,
-            order=question_data.order,
-            image_url=question_data.image_url
-        )
-        db.add(db_question)
-        db.flush()  # IDを生成するためにフラッシュする
-        
-        # 回答の作成
-        for answer_data in question_data.answers:
-            db_answer = QuizAnswer(
-                question_id=db_question.id,
-                text=answer_data.text,
-                is_correct=answer_data.is_correct,
-                explanation=answer_data.explanation
-            )
-            db.add(db_answer)
-    
-    db.commit()
-    db.refresh(db_quiz)
+    await db.commit()
     return db_quiz
 
-def get_quiz(db: Session, quiz_id: UUID) -> Optional[Quiz]:
-    """指定されたIDのクイズを取得します"""
-    return db.query(Quiz).filter(Quiz.id == quiz_id).first()
+async def get_quiz(db: AsyncSession, quiz_id: UUID) -> Optional[Quiz]:
+    """指定されたIDのクイズを取得します (問題と回答を含む)"""
+    result = await db.execute(
+        _quiz_with_questions().filter(Quiz.id == quiz_id).execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
 
-def get_quizzes(
-    db: Session, 
-    skip: int = 0, 
+async def get_quizzes(
+    db: AsyncSession,
+    skip: int = 0,
     limit: int = 100,
     search: Optional[str] = None,
     difficulty: Optional[str] = None,
     active_only: bool = True
 ) -> Tuple[List[Quiz], int]:
     """クイズのリストと総数を取得します"""
-    query = db.query(Quiz)
-    
+    filters = []
+
     # 検索フィルター
     if search:
         search_term = f"%{search}%"
-        query = query.filter(or_(
+        filters.append(or_(
             Quiz.title.ilike(search_term),
             Quiz.description.ilike(search_term)
         ))
-    
+
     # 難易度フィルター
     if difficulty:
-        query = query.filter(Quiz.difficulty == difficulty)
-    
+        filters.append(Quiz.difficulty == difficulty)
+
     # アクティブのみ表示
     if active_only:
-        query = query.filter(Quiz.is_active == True)
-    
+        filters.append(Quiz.is_active.is_(True))
+
     # 総数を取得
-    total = query.count()
-    
+    total = (await db.execute(select(func.count()).select_from(Quiz).where(*filters))).scalar_one()
+
     # ページネーション
-    quizzes = query.order_by(Quiz.created_at.desc()).offset(skip).limit(limit).all()
-    
-    return quizzes, total
+    result = await db.execute(
+        _quiz_with_questions().where(*filters).order_by(Quiz.created_at.desc()).offset(skip).limit(limit)
+    )
 
-def update_quiz(db: Session, quiz: Quiz, quiz_in: QuizUpdate) -> Quiz:
+    return list(result.scalars().all()), total
+
+async def update_quiz(db: AsyncSession, quiz: Quiz, quiz_in: QuizUpdate) -> Quiz:
     """クイズを更新します"""
     # 基本情報の更新
-    for field in quiz_in.__fields_set__:
+    for field in quiz_in.model_fields_set:
         if field == "questions":
             continue  # 質問は別途処理
-        setattr(quiz, field, getattr(quiz_in, field))
-    
+        setattr(quiz, field, _value(getattr(quiz_in, field)))
+
     # 質問と回答を更新（既存の質問・回答を削除し、新しいものを作成する方法）
     if quiz_in.questions is not None:
-        # クイズに関連する質問と回答をすべて削除
-        for question in quiz.questions:
-            for answer in question.answers:
-                db.delete(answer)
-            db.delete(question)
-        
-        # 新しい質問と回答を作成
-        for question_data in quiz_in.questions:
-            db_question = QuizQuestion(
-                quiz_id=quiz.id,
-                text=question_data.text,
-                question_type=question_data.question_type,
-                points=question_data.points,
-                order=question_data.order,
-                image_url=question_data.image_url
-            )
-            db.add(db_question)
-            db.flush()
-            
-            for answer_data in question_data.answers:
-                db_answer = QuizAnswer(
-                    question_id=db_question.id,
-                    text=answer_data.text,
-                    is_correct=answer_data.is_correct,
-                    explanation=answer_data.explanation
-                )
-                db.add(db_answer)
-    
-    db.commit()
-    db.refresh(quiz)
-    return quiz
-
-def delete_quiz(db: Session, quiz_id: UUID) -> None:
-    """クイズを削除します"""
-    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
-    if quiz:
-        db.delete(quiz)  # カスケード削除により関連する質問と回答も削除されます
-        db.commit()
+        # 回答・受験者の回答は外部キーの ON DELETE CASCADE で削除される
+        await db.execute(sql_delete(QuizQuestion).where(QuizQuestion.quiz_id == quiz.id))
+        set_committed_value(quiz, "questions", [])
+        quiz.questions.extend(_build_question(question_data) for question_data in quiz_in.questions)
+
+    quiz.updated_at = datetime.utcnow()
+    await db.commit()
+    _invalidate_quiz(quiz.id)
+    return await get_quiz(db, quiz.id)
+
+async def delete_quiz(db: AsyncSession, quiz_id: UUID) -> bool:
+    """クイズを削除します (関連する問題・回答・受験は外部キーのカスケードで削除されます)"""
+    result = await db.execute(sql_delete(Quiz).where(Quiz.id == quiz_id))
+    await db.commit()
+    _invalidate_quiz(quiz_id)
+    return result.rowcount > 0
 
 # クイズ問題のCRUD操作
-def create_quiz_question(db: Session, quiz_id: UUID, question: QuizQuestionCreate) -> QuizQuestion:
+async def create_quiz_question(db: AsyncSession, quiz_id: UUID, question: QuizQuestionCreate) -> QuizQuestion:
     """クイズに問題を追加する"""
-    # シーケンス番号が指定されていない場合、最後に追加する
-    if question.sequence_number is None:
-        max_seq = db.query(func.max(QuizQuestion.sequence_number)).filter(
-            QuizQuestion.quiz_id == quiz_id
-        ).scalar() or 0
-        question.sequence_number = max_seq + 1
-    
-    db_question = QuizQuestion(
-        id=uuid.uuid4(),
-        quiz_id=quiz_id,
-        question_text=question.question_text,
-        question_type=question.question_type,
-        explanation=question.explanation,
-        points=question.points or 1,
-        sequence_number=question.sequence_number,
-        media_url=question.media_url
-    )
+    db_question = _build_question(question, quiz_id)
     db.add(db_question)
-    db.commit()
-    db.refresh(db_question)
+    await _touch_quiz(db, quiz_id)
+    await db.commit()
+    _invalidate_quiz(quiz_id)
     return db_question
 
-def get_quiz_questions(db: Session, quiz_id: UUID) -> List[QuizQuestion]:
+async def get_quiz_questions(db: AsyncSession, quiz_id: UUID) -> List[QuizQuestion]:
     """クイズの問題一覧を取得する"""
-    return db.query(QuizQuestion).filter(
-        QuizQuestion.quiz_id == quiz_id
-    ).order_by(
-        QuizQuestion.sequence_number
-    ).all()
+    result = await db.execute(
+        select(QuizQuestion).filter(
+            QuizQuestion.quiz_id == quiz_id
+        ).options(
+            selectinload(QuizQuestion.answers)
+        ).order_by(
+            QuizQuestion.order
+        )
+    )
+    return list(result.scalars().all())
 
-def get_quiz_question(db: Session, question_id: UUID) -> Optional[QuizQuestion]:
+async def get_quiz_question(db: AsyncSession, question_id: UUID) -> Optional[QuizQuestion]:
     """特定のクイズ問題を取得する"""
-    return db.query(QuizQuestion).filter(
-        QuizQuestion.id == question_id
-    ).options(
-        joinedload(QuizQuestion.answers)
-    ).first()
+    result = await db.execute(
+        select(QuizQuestion).filter(
+            QuizQuestion.id == question_id
+        ).options(
+            selectinload(QuizQuestion.answers)
+        ).execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
 
-def update_quiz_question(db: Session, question_id: UUID, question_data: QuizQuestionUpdate) -> Optional[QuizQuestion]:
+async def update_quiz_question(db: AsyncSession, question_id: UUID, question_data: QuizQuestionUpdate) -> Optional[QuizQuestion]:
     """クイズ問題を更新する"""
-    db_question = db.query(QuizQuestion).filter(QuizQuestion.id == question_id).first()
+    db_question = await get_quiz_question(db, question_id)
     if not db_question:
         return None
-    
+
     # 更新可能なフィールドを設定
-    if question_data.question_text is not None:
-        db_question.question_text = question_data.question_text
+    if question_data.text is not None:
+        db_question.text = question_data.text
     if question_data.question_type is not None:
-        db_question.question_type = question_data.question_type
-    if question_data.explanation is not None:
-        db_question.explanation = question_data.explanation
+        db_question.question_type = _value(question_data.question_type)
     if question_data.points is not None:
         db_question.points = question_data.points
-    if question_data.sequence_number is not None:
-        db_question.sequence_number = question_data.sequence_number
-    if question_data.media_url is not None:
-        db_question.media_url = question_data.media_url
-    
-    db.commit()
-    db.refresh(db_question)
-    return db_question
+    if question_data.order is not None:
+        db_question.order = question_data.order
+    if question_data.image_url is not None:
+        db_question.image_url = question_data.image_url
 
-def delete_quiz_question(db: Session, question_id: UUID) -> bool:
-    """クイズ問題を削除する"""
-    db_question = db.query(QuizQuestion).filter(QuizQuestion.id == question_id).first()
-    if not db_question:
+    # 回答選択肢は置き換える
+    if question_data.answers is not None:
+        await db.execute(sql_delete(QuizAnswer).where(QuizAnswer.question_id == question_id))
+        set_committed_value(db_question, "answers", [])
+        db_question.answers.extend(_build_answer(answer_data) for answer_data in question_data.answers)
+
+    await _touch_quiz(db, db_question.quiz_id)
+    await db.commit()
+    _invalidate_quiz(db_question.quiz_id)
+    return await get_quiz_question(db, question_id)
+
+async def delete_quiz_question(db: AsyncSession, question_id: UUID, quiz_id: UUID) -> bool:
+    """クイズ問題を削除する (関連する回答も外部キーのカスケードで削除される)"""
+    result = await db.execute(
+        sql_delete(QuizQuestion).where(QuizQuestion.id == question_id, QuizQuestion.quiz_id == quiz_id)
+    )
+    if result.rowcount == 0:
+        await db.rollback()
         return False
-    
-    # 関連する回答も削除される（カスケード削除）
-    db.delete(db_question)
-    db.commit()
+
+    await _touch_quiz(db, quiz_id)
+    await db.commit()
+    _invalidate_quiz(quiz_id)
     return True
 
 # クイズ回答選択肢のCRUD操作
-def create_quiz_answer(db: Session, question_id: UUID, answer: QuizAnswerCreate) -> QuizAnswer:
-    """クイズ問題に回答選択肢を追加する"""
-    # シーケンス番号が指定されていない場合、最後に追加する
-    if answer.sequence_number is None:
-        max_seq = db.query(func.max(QuizAnswer.sequence_number)).filter(
-            QuizAnswer.question_id == question_id
-        ).scalar() or 0
-        answer.sequence_number = max_seq + 1
-    
-    db_answer = QuizAnswer(
-        id=uuid.uuid4(),
-        question_id=question_id,
-        answer_text=answer.answer_text,
-        is_correct=answer.is_correct,
-        explanation=answer.explanation,
-        sequence_number=answer.sequence_number
+def _quiz_id_of_question(question_id: UUID):
+    return select(QuizQuestion.quiz_id).where(QuizQuestion.id == question_id).scalar_subquery()
+
+def _quiz_id_of_answer(answer_id: UUID):
+    return (
+        select(QuizQuestion.quiz_id)
+        .join(QuizAnswer, QuizAnswer.question_id == QuizQuestion.id)
+        .where(QuizAnswer.id == answer_id)
+        .scalar_subquery()
     )
+
+async def create_quiz_answer(db: AsyncSession, question_id: UUID, answer: QuizAnswerCreate) -> QuizAnswer:
+    """クイズ問題に回答選択肢を追加する"""
+    db_answer = _build_answer(answer, question_id)
     db.add(db_answer)
-    db.commit()
-    db.refresh(db_answer)
+    quiz_id = await _touch_quiz(db, _quiz_id_of_question(question_id))
+    await db.commit()
+    _invalidate_quiz(quiz_id)
     return db_answer
 
-def get_quiz_answers(db: Session, question_id: UUID) -> List[QuizAnswer]:
+async def get_quiz_answers(db: AsyncSession, question_id: UUID) -> List[QuizAnswer]:
     """クイズ問題の回答選択肢一覧を取得する"""
-    return db.query(QuizAnswer).filter(
-        QuizAnswer.question_id == question_id
-    ).order_by(
-        QuizAnswer.sequence_number
-    ).all()
+    result = await db.execute(
+        select(QuizAnswer).filter(
+            QuizAnswer.question_id == question_id
+        ).order_by(
+            QuizAnswer.created_at
+        )
+    )
+    return list(result.scalars().all())
 
-def update_quiz_answer(db: Session, answer_id: UUID, answer_data: QuizAnswerUpdate) -> Optional[QuizAnswer]:
+async def update_quiz_answer(db: AsyncSession, answer_id: UUID, answer_data: QuizAnswerUpdate) -> Optional[QuizAnswer]:
     """クイズ回答選択肢を更新する"""
-    db_answer = db.query(QuizAnswer).filter(QuizAnswer.id == answer_id).first()
+    db_answer = (await db.execute(select(QuizAnswer).filter(QuizAnswer.id == answer_id))).scalars().first()
     if not db_answer:
         return None
-    
+
     # 更新可能なフィールドを設定
-    if answer_data.answer_text is not None:
-        db_answer.answer_text = answer_data.answer_text
+    if answer_data.text is not None:
+        db_answer.text = answer_data.text
     if answer_data.is_correct is not None:
         db_answer.is_correct = answer_data.is_correct
     if answer_data.explanation is not None:
         db_answer.explanation = answer_data.explanation
-    if answer_data.sequence_number is not None:
-        db_answer.sequence_number = answer_data.sequence_number
-    
-    db.commit()
-    db.refresh(db_answer)
+
+    quiz_id = await _touch_quiz(db, _quiz_id_of_question(db_answer.question_id))
+    await db.commit()
+    _invalidate_quiz(quiz_id)
     return db_answer
 
-def delete_quiz_answer(db: Session, answer_id: UUID) -> bool:
+async def delete_quiz_answer(db: AsyncSession, answer_id: UUID) -> bool:
     """クイズ回答選択肢を削除する"""
-    db_answer = db.query(QuizAnswer).filter(QuizAnswer.id == answer_id).first()
-    if not db_answer:
+    # 削除すると所属するクイズを引けなくなるので先に version を進める
+    quiz_id = await _touch_quiz(db, _quiz_id_of_answer(answer_id))
+    result = await db.execute(sql_delete(QuizAnswer).where(QuizAnswer.id == answer_id))
+    if result.rowcount == 0:
+        await db.rollback()
         return False
-    
-    db.delete(db_answer)
-    db.commit()
+
+    await db.commit()
+    _invalidate_quiz(quiz_id)
     return True
 
 # ユーザークイズ挑戦のCRUD操作
-def start_quiz_attempt(db: Session, quiz_id: UUID, user_id: UUID) -> Tuple[UserQuizAttempt, List[QuizQuestion]]:
-    """クイズの挑戦を開始する"""
-    # クイズを取得
-    quiz = get_quiz(db, quiz_id)
-    if not quiz:
+def _attempt_with_answers():
+    return select(UserQuizAttempt).options(selectinload(UserQuizAttempt.answers))
+
+async def get_quiz_definition(db: AsyncSession, quiz_id: UUID) -> Optional[AnswerKey]:
+    """クイズの定義 (解答キー) をキャッシュから取得する (クイズがなければ None)"""
+    return await quiz_definition_cache.get(db, quiz_id)
+
+async def start_quiz_attempt(db: AsyncSession, quiz_id: UUID, user_id: UUID) -> UserQuizAttempt:
+    """クイズの挑戦を開始する (クイズの定義はキャッシュを使い、DB は挑戦の行だけを扱う)"""
+    definition = await get_quiz_definition(db, quiz_id)
+    if definition is None:
         raise ValueError(f"クイズID {quiz_id} が見つかりません")
-    
+
     # 挑戦回数をチェック
-    if quiz.max_attempts:
-        attempt_count = db.query(func.count(UserQuizAttempt.id)).filter(
-            UserQuizAttempt.user_id == user_id,
-            UserQuizAttempt.quiz_id == quiz_id
-        ).scalar()
-        
-        if attempt_count >= quiz.max_attempts:
-            raise ValueError(f"クイズの最大挑戦回数 ({quiz.max_attempts}) に達しています")
-    
-    # 挑戦回数を計算
-    attempt_number = db.query(func.count(UserQuizAttempt.id)).filter(
-        UserQuizAttempt.user_id == user_id,
-        UserQuizAttempt.quiz_id == quiz_id
-    ).scalar() + 1
-    
+    if definition.max_attempts:
+        attempt_count = (await db.execute(
+            select(func.count(UserQuizAttempt.id)).filter(
+                UserQuizAttempt.user_id == user_id,
+                UserQuizAttempt.quiz_id == quiz_id
+            )
+        )).scalar_one()
+
+        if attempt_count >= definition.max_attempts:
+            raise ValueError(f"クイズの最大挑戦回数 ({definition.max_attempts}) に達しています")
+
     # 新しい挑戦を作成
     db_attempt = UserQuizAttempt(
-        id=uuid.uuid4(),
         user_id=user_id,
         quiz_id=quiz_id,
         start_time=datetime.utcnow(),
-        attempt_number=attempt_number
+        is_completed=False,
+        score=0.0,
+        passed=False,
+        answers=[]
     )
     db.add(db_attempt)
-    db.commit()
-    db.refresh(db_attempt)
-    
-    # 問題を取得
-    questions = get_quiz_questions(db, quiz_id)
-    
-    # 問題をランダム化する場合
-    if quiz.is_randomized:
-        random.shuffle(questions)
-    
-    return db_attempt, questions
-
-def submit_quiz_attempt(
-    db: Session, attempt_id: UUID, user_answers: List[QuizAnswerSubmit]
-) -> UserQuizAttempt:
-    """クイズの回答を提出する"""
-    # 挑戦を取得
-    db_attempt = db.query(UserQuizAttempt).filter(
-        UserQuizAttempt.id == attempt_id
-    ).options(
-        joinedload(UserQuizAttempt.quiz)
-    ).first()
-    
-    if not db_attempt:
-        raise ValueError(f"挑戦ID {attempt_id} が見つかりません")
-    
-    # 既に終了している場合はエラー
-    if db_attempt.end_time:
-        raise ValueError("この挑戦は既に終了しています")
-    
-    # 終了時間を設定
-    db_attempt.end_time = datetime.utcnow()
-    
-    # クイズの全問題を取得
-    quiz_questions = get_quiz_questions(db, db_attempt.quiz_id)
-    total_points = sum(q.points for q in quiz_questions)
-    
-    # ユーザーの回答を処理
-    earned_points = 0
-    
-    for answer_submit in user_answers:
-        # 問題を取得
-        question = get_quiz_question(db, answer_submit.question_id)
-        if not question:
-            continue
-        
-        # 回答の正解判定
-        is_correct = False
-        
-        if question.question_type in ["MULTIPLE_CHOICE", "SINGLE_CHOICE", "TRUE_FALSE"]:
-            # 選択式の場合
-            if answer_submit.answer_id:
-                # 選択された回答を取得
-                selected_answer = db.query(QuizAnswer).filter(
-                    QuizAnswer.id == answer_submit.answer_id
-                ).first()
-                
-                if selected_answer:
-                    is_correct = selected_answer.is_correct
-        else:
-            # 記述式の場合（シンプルな文字列比較 - より高度な判定も可能）
-            correct_answer = db.query(QuizAnswer).filter(
-                QuizAnswer.question_id == question.id,
-                QuizAnswer.is_correct == True
-            ).first()
-            
-            if correct_answer and answer_submit.user_text_answer:
-                # 大文字小文字を無視して比較
-                is_correct = (
-                    answer_submit.user_text_answer.strip().lower() == 
-                    correct_answer.answer_text.strip().lower()
-                )
-        
-        # ポイントを加算
-        points_earned = question.points if is_correct else 0
-        earned_points += points_earned
-        
-        # ユーザー回答を記録
-        db_user_answer = UserQuizAnswer(
-            id=uuid.uuid4(),
-            attempt_id=db_attempt.id,
-            question_id=question.id,
-            answer_id=answer_submit.answer_id,
-            user_text_answer=answer_submit.user_text_answer,
-            is_correct=is_correct,
-            points_earned=points_earned,
-            time_spent_seconds=answer_submit.time_spent_seconds
-        )
-        db.add(db_user_answer)
-    
-    # スコアと正答率を計算
-    db_attempt.score = earned_points
-    
-    if total_points > 0:
-        db_attempt.percentage = round((earned_points / total_points) * 100, 2)
-    else:
-        db_attempt.percentage = 0
-    
-    # 合格判定
-    db_attempt.passed = db_attempt.percentage >= db_attempt.quiz.passing_percentage
-    
-    db.commit()
-    db.refresh(db_attempt)
+    await db.commit()
     return db_attempt
 
-def get_quiz_attempt(db: Session, attempt_id: UUID) -> Optional[UserQuizAttempt]:
+async def submit_quiz_attempt(
+    db: AsyncSession, user_id: UUID, quiz_id: UUID, answers: List[Mapping[str, Any]]
+) -> Optional[UserQuizAttempt]:
+    """
+    クイズの回答を提出する
+    キャッシュした解答キーでメモリ上で採点し、挑戦の確定 (UPDATE ... RETURNING) と
+    回答の一括 INSERT を同じコミットで行う。問題数によらずクエリ数は一定。
+    確定時にクイズの updated_at も返し、解答キーが古ければ読み直して 1 回だけやり直す。
+    進行中の挑戦がなければ None
+    """
+    answer_key = await get_quiz_definition(db, quiz_id)
+    if answer_key is None:
+        raise ValueError(f"クイズID {quiz_id} が見つかりません")
+
+    # 最新の進行中の挑戦を確定する (同時に提出されても 1 回しか確定しない)
+    open_attempt = (
+        select(UserQuizAttempt.id)
+        .where(
+            UserQuizAttempt.user_id == user_id,
+            UserQuizAttempt.quiz_id == quiz_id,
+            UserQuizAttempt.is_completed.is_(False)
+        )
+        .order_by(UserQuizAttempt.start_time.desc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    current_version = select(Quiz.updated_at).where(Quiz.id == quiz_id).scalar_subquery()
+    completed_at = datetime.utcnow()
+    reloaded = False
+    while True:
+        result = grade(answer_key, answers)
+        attempt = (await db.execute(
+            update(UserQuizAttempt)
+            .where(UserQuizAttempt.id == open_attempt)
+            .values(
+                is_completed=True,
+                end_time=completed_at,
+                score=result.score,
+                passed=result.passed,
+                updated_at=completed_at
+            )
+            .returning(UserQuizAttempt.id, current_version.label("version"))
+            .execution_options(synchronize_session=False)
+        )).first()
+        if attempt is None:
+            await db.rollback()
+            return None
+        if attempt.version == answer_key.version or reloaded:
+            break
+
+        # 他のプロセスでクイズが変更されていた: 読み直して採点し直す
+        await db.rollback()
+        quiz_definition_cache.invalidate(quiz_id)
+        answer_key = await get_quiz_definition(db, quiz_id)
+        if answer_key is None:
+            raise ValueError(f"クイズID {quiz_id} が見つかりません")
+        reloaded = True
+
+    attempt_id = attempt.id
+    # 分析用の集計に加算する (挑戦の確定と同じコミット)
+    await db.execute(_record_completed_attempt(user_id, quiz_id, result.score, result.passed, completed_at))
+    if result.answer_rows:
+        await db.execute(
+            insert(UserQuizAnswer),
+            [{"attempt_id": attempt_id, **row} for row in result.answer_rows]
+        )
+    await db.commit()
+    # 完了したクイズはおすすめの優先度が変わる
+    recommendation_pool_cache.invalidate(_quiz_pool_key(user_id))
+
+    return await get_quiz_attempt(db, attempt_id)
+
+async def get_quiz_attempt(db: AsyncSession, attempt_id: UUID) -> Optional[UserQuizAttempt]:
     """特定のクイズ挑戦を取得する"""
-    return db.query(UserQuizAttempt).filter(
-        UserQuizAttempt.id == attempt_id
-    ).options(
-        joinedload(UserQuizAttempt.quiz),
-        joinedload(UserQuizAttempt.user_answers).joinedload(UserQuizAnswer.question),
-        joinedload(UserQuizAttempt.user_answers).joinedload(UserQuizAnswer.answer)
-    ).first()
-
-def get_user_quiz_attempts(db: Session, user_id: UUID, quiz_id: Optional[UUID] = None) -> List[UserQuizAttempt]:
+    result = await db.execute(
+        _attempt_with_answers().filter(
+            UserQuizAttempt.id == attempt_id
+        ).execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+async def get_user_quiz_attempts(db: AsyncSession, user_id: UUID, quiz_id: Optional[UUID] = None) -> List[UserQuizAttempt]:
     """ユーザーのクイズ挑戦一覧を取得する"""
-    query = db.query(UserQuizAttempt).filter(UserQuizAttempt.user_id == user_id)
-    
+    query = _attempt_with_answers().filter(UserQuizAttempt.user_id == user_id)
+
     if quiz_id:
         query = query.filter(UserQuizAttempt.quiz_id == quiz_id)
-    
-    return query.order_by(desc(UserQuizAttempt.start_time)).all()
 
-def get_quiz_results(db: Session, quiz_id: UUID, limit: int = 100) -> List[UserQuizAttempt]:
+    result = await db.execute(query.order_by(desc(UserQuizAttempt.start_time)))
+    return list(result.scalars().all())
+
+async def get_quiz_results(db: AsyncSession, quiz_id: UUID, limit: int = 100) -> List[UserQuizAttempt]:
     """クイズの結果一覧を取得する"""
-    return db.query(UserQuizAttempt).filter(
-        UserQuizAttempt.quiz_id == quiz_id,
-        UserQuizAttempt.end_time != None  # 完了した挑戦のみ
-    ).order_by(
-        desc(UserQuizAttempt.percentage),
-        desc(UserQuizAttempt.end_time)
-    ).limit(limit).all()
-
-def get_user_quiz_analysis(db: Session, user_id: UUID) -> Dict[str, Any]:
-    """ユーザーのクイズ結果分析を取得する"""
-    # 完了した挑戦を取得
-    completed_attempts = db.query(UserQuizAttempt).filter(
+    result = await db.execute(
+        _attempt_with_answers().filter(
+            UserQuizAttempt.quiz_id == quiz_id,
+            UserQuizAttempt.is_completed.is_(True)  # 完了した挑戦のみ
+        ).order_by(
+            desc(UserQuizAttempt.score),
+            desc(UserQuizAttempt.end_time)
+        ).limit(limit)
+    )
+    return list(result.scalars().all())
+
+# 分析で「合格したクイズ」とみなす最高スコア
+ANALYSIS_PASSING_SCORE = 70
+
+def _record_completed_attempt(
+    user_id: UUID, quiz_id: UUID, score: float, passed: bool, completed_at: datetime
+):
+    """完了した挑戦 1 件を user_quiz_stats に加算する UPSERT"""
+    stmt = pg_insert(UserQuizStats).values(
+        user_id=user_id,
+        quiz_id=quiz_id,
+        attempts=1,
+        passed_attempts=1 if passed else 0,
+        total_score=score or 0,
+        best_score=score or 0,
+        last_completed_at=completed_at
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[UserQuizStats.user_id, UserQuizStats.quiz_id],
+        set_={
+            "attempts": UserQuizStats.attempts + 1,
+            "passed_attempts": UserQuizStats.passed_attempts + stmt.excluded.passed_attempts,
+            "total_score": UserQuizStats.total_score + stmt.excluded.total_score,
+            "best_score": func.greatest(UserQuizStats.best_score, stmt.excluded.best_score),
+            "last_completed_at": func.greatest(UserQuizStats.last_completed_at, stmt.excluded.last_completed_at),
+        }
+    )
+
+async def refresh_user_quiz_stats(db: AsyncSession, user_id: UUID, quiz_id: UUID) -> None:
+    """
+    1 ユーザー × 1 クイズの集計を挑戦から作り直す (コミットは呼び出し側)。
+    加算では表せない変更 (完了済みの挑戦のスコア修正など) のあとに使う
+    """
+    completed = (
         UserQuizAttempt.user_id == user_id,
-        UserQuizAttempt.end_time != None
-    ).all()
-    
+        UserQuizAttempt.quiz_id == quiz_id,
+        UserQuizAttempt.is_completed.is_(True)
+    )
+    await db.execute(sql_delete(UserQuizStats).where(
+        UserQuizStats.user_id == user_id, UserQuizStats.quiz_id == quiz_id
+    ))
+    await db.execute(
+        pg_insert(UserQuizStats).from_select(
+            ["user_id", "quiz_id", "attempts", "passed_attempts", "total_score", "best_score", "last_completed_at"],
+            select(
+                UserQuizAttempt.user_id,
+                UserQuizAttempt.quiz_id,
+                func.count(),
+                func.count().filter(UserQuizAttempt.passed.is_(True)),
+                func.sum(func.coalesce(UserQuizAttempt.score, 0.0)),
+                func.max(func.coalesce(UserQuizAttempt.score, 0.0)),
+                func.max(UserQuizAttempt.end_time)
+            ).where(*completed).group_by(UserQuizAttempt.user_id, UserQuizAttempt.quiz_id)
+        )
+    )
+
+async def get_user_quiz_analysis(db: AsyncSession, user_id: UUID) -> Dict[str, Any]:
+    """
+    ユーザーのクイズ結果分析を取得する。
+    挑戦の履歴は読み込まず、user_quiz_stats を難易度ごとに集計した数行と最新 5 件だけを読む
+    """
+    by_difficulty_rows = (await db.execute(
+        select(
+            Quiz.difficulty,
+            func.sum(UserQuizStats.attempts).label("attempts"),
+            func.sum(UserQuizStats.passed_attempts).label("passed"),
+            func.sum(UserQuizStats.total_score).label("total_score"),
+            func.max(UserQuizStats.best_score).label("top_score"),
+            func.count().label("quizzes_taken"),
+            func.count().filter(UserQuizStats.best_score >= ANALYSIS_PASSING_SCORE).label("passed_quizzes")
+        )
+        .join(Quiz, Quiz.id == UserQuizStats.quiz_id)
+        .where(UserQuizStats.user_id == user_id, UserQuizStats.attempts > 0)
+        .group_by(Quiz.difficulty)
+    )).all()
+
     # 基本統計情報
-    total_attempts = len(completed_attempts)
+    total_attempts = sum(row.attempts for row in by_difficulty_rows)
     if total_attempts == 0:
         return {
             "total_attempts": 0,
@@ -470,217 +533,159 @@ def get_user_quiz_analysis(db: Session, user_id: UUID) -> Dict[str, Any]:
             "by_difficulty": {},
             "recent_attempts": []
         }
-    
-    # クイズごとの最高スコア
-    quiz_highest_scores = {}
-    for attempt in completed_attempts:
-        quiz_id = str(attempt.quiz_id)
-        current_score = attempt.percentage or 0
-        
-        if quiz_id not in quiz_highest_scores or current_score > quiz_highest_scores[quiz_id]:
-            quiz_highest_scores[quiz_id] = current_score
-    
+
     # 難易度別の統計
-    difficulty_stats = {}
-    for attempt in completed_attempts:
-        difficulty = str(attempt.quiz.difficulty_level) if attempt.quiz else "UNKNOWN"
-        
-        if difficulty not in difficulty_stats:
-            difficulty_stats[difficulty] = {
-                "attempts": 0,
-                "passed": 0,
-                "average_score": 0,
-                "total_score": 0
-            }
-        
-        difficulty_stats[difficulty]["attempts"] += 1
-        if attempt.passed:
-            difficulty_stats[difficulty]["passed"] += 1
-        
-        difficulty_stats[difficulty]["total_score"] += attempt.percentage or 0
-    
-    # 難易度別の平均スコアを計算
-    for difficulty, stats in difficulty_stats.items():
-        if stats["attempts"] > 0:
-            stats["average_score"] = round(stats["total_score"] / stats["attempts"], 2)
-    
-    # 全体の統計情報を計算
-    total_score = sum(attempt.percentage or 0 for attempt in completed_attempts)
-    average_score = round(total_score / total_attempts, 2)
-    passed_quizzes = sum(1 for quiz_id, score in quiz_highest_scores.items() if score >= 70)  # 70%を合格とする
-    top_score = max((attempt.percentage or 0) for attempt in completed_attempts)
-    
+    difficulty_stats = {
+        str(row.difficulty) if row.difficulty is not None else "UNKNOWN": {
+            "attempts": row.attempts,
+            "passed": row.passed,
+            "average_score": round(row.total_score / row.attempts, 2),
+            "total_score": row.total_score
+        }
+        for row in by_difficulty_rows
+    }
+
     # 最近の挑戦（最新5件）
-    recent_attempts = sorted(
-        completed_attempts, 
-        key=lambda x: x.end_time or datetime.min, 
-        reverse=True
-    )[:5]
-    
-    recent_attempts_data = []
-    for attempt in recent_attempts:
-        quiz_title = attempt.quiz.title if attempt.quiz else "Unknown Quiz"
-        recent_attempts_data.append({
-            "id": str(attempt.id),
-            "quiz_id": str(attempt.quiz_id),
-            "quiz_title": quiz_title,
-            "score": attempt.percentage,
-            "passed": attempt.passed,
-            "date": attempt.end_time.isoformat() if attempt.end_time else None
-        })
-    
+    recent_rows = (await db.execute(
+        select(
+            UserQuizAttempt.id,
+            UserQuizAttempt.quiz_id,
+            Quiz.title,
+            UserQuizAttempt.score,
+            UserQuizAttempt.passed,
+            UserQuizAttempt.end_time
+        )
+        .join(Quiz, Quiz.id == UserQuizAttempt.quiz_id)
+        .where(UserQuizAttempt.user_id == user_id, UserQuizAttempt.is_completed.is_(True))
+        .order_by(UserQuizAttempt.end_time.desc().nulls_last())
+        .limit(5)
+    )).all()
+
+    total_score = sum(row.total_score for row in by_difficulty_rows)
     return {
         "total_attempts": total_attempts,
-        "average_score": average_score,
-        "passed_quizzes": passed_quizzes,
-        "top_score": top_score,
-        "total_quizzes_taken": len(quiz_highest_scores),
+        "average_score": round(total_score / total_attempts, 2),
+        "passed_quizzes": sum(row.passed_quizzes for row in by_difficulty_rows),
+        "top_score": max(row.top_score for row in by_difficulty_rows),
+        "total_quizzes_taken": sum(row.quizzes_taken for row in by_difficulty_rows),
         "by_difficulty": difficulty_stats,
-        "recent_attempts": recent_attempts_data
+        "recent_attempts": [
+            {
+                "id": str(row.id),
+                "quiz_id": str(row.quiz_id),
+                "quiz_title": row.title,
+                "score": row.score,
+                "passed": row.passed,
+                "date": row.end_time.isoformat() if row.end_time else None
+            }
+            for row in recent_rows
+        ]
     }
 
-def get_recommended_quizzes(db: Session, user_id: UUID, limit: int = 5) -> List[Quiz]:
-    """ユーザーにおすすめのクイズ一覧を取得する"""
-    # ユーザーが挑戦したクイズのIDを取得
-    attempted_quiz_ids = db.query(UserQuizAttempt.quiz_id).filter(
-        UserQuizAttempt.user_id == user_id
-    ).distinct().all()
-    
-    attempted_quiz_ids = [str(quiz_id[0]) for quiz_id in attempted_quiz_ids]
-    
-    # まだ挑戦していないクイズを取得
-    new_quizzes = db.query(Quiz).filter(
-        Quiz.is_active == True,
-        ~Quiz.id.in_(attempted_quiz_ids) if attempted_quiz_ids else True
-    ).order_by(
-        func.random()
-    ).limit(limit).all()
-    
-    # 新しいクイズが足りない場合は、挑戦済みの中から追加
-    if len(new_quizzes) < limit and attempted_quiz_ids:
-        # 合格していないクイズを優先
-        failed_quizzes = db.query(Quiz).join(
-            UserQuizAttempt, UserQuizAttempt.quiz_id == Quiz.id
-        ).filter(
-            Quiz.is_active == True,
-            Quiz.id.in_(attempted_quiz_ids),
-            UserQuizAttempt.user_id == user_id,
-            UserQuizAttempt.passed == False
-        ).order_by(
-            func.random()
-        ).limit(limit - len(new_quizzes)).all()
-        
-        new_quizzes.extend(failed_quizzes)
-    
-    # それでも足りない場合はランダムに追加
-    if len(new_quizzes) < limit:
-        additional_quizzes = db.query(Quiz).filter(
-            Quiz.is_active == True,
-            ~Quiz.id.in_([str(quiz.id) for quiz in new_quizzes])
-        ).order_by(
-            func.random()
-        ).limit(limit - len(new_quizzes)).all()
-        
-        new_quizzes.extend(additional_quizzes)
-    
-    return new_quizzes
-
-def create_user_quiz_attempt(db: Session, attempt_in: UserQuizAttemptCreate, user_id: UUID) -> UserQuizAttempt:
+def _quiz_pool_key(user_id: UUID) -> Tuple[str, UUID]:
+    return ("quizzes", user_id)
+
+async def _load_quiz_candidate_pool(db: AsyncSession, user_id: UUID) -> CandidatePool:
+    """
+    おすすめのクイズの候補を抽出する (最大 2 クエリ)。
+    まだ完了していないクイズ、合格していないクイズ、合格済みのクイズの順に優先する
+    """
+    size = settings.RECOMMENDATION_POOL_SIZE
+    completed = select(UserQuizStats.quiz_id).where(
+        UserQuizStats.user_id == user_id,
+        UserQuizStats.quiz_id == Quiz.id
+    ).exists()
+    new_candidates = sample_by_random_key(
+        select(Quiz.id).where(Quiz.is_active.is_(True), ~completed), Quiz.random_key, size
+    )
+    new_ids = tuple((await db.execute(select(new_candidates.c.id).limit(size))).scalars().all())
+    if len(new_ids) >= size:
+        return CandidatePool(tiers=(new_ids,))
+
+    # 足りない分は完了済みのクイズから (user_quiz_stats はそのユーザーが完了したクイズだけ)
+    passed = (UserQuizStats.passed_attempts > 0).label("passed")
+    completed_rows = (await db.execute(
+        select(UserQuizStats.quiz_id, passed)
+        .join(Quiz, Quiz.id == UserQuizStats.quiz_id)
+        .where(UserQuizStats.user_id == user_id, Quiz.is_active.is_(True))
+        .order_by(passed, Quiz.random_key)
+        .limit(size - len(new_ids))
+    )).all()
+    return CandidatePool(tiers=(
+        new_ids,
+        tuple(row.quiz_id for row in completed_rows if not row.passed),
+        tuple(row.quiz_id for row in completed_rows if row.passed),
+    ))
+
+async def get_recommended_quizzes(db: AsyncSession, user_id: UUID, limit: int = 5) -> List[Quiz]:
+    """
+    ユーザーにおすすめのクイズ一覧を取得する。
+    候補はユーザーごとに抽出してキャッシュし、リクエストごとにはその中から選んだクイズだけを読む
+    """
+    key = _quiz_pool_key(user_id)
+    pool = recommendation_pool_cache.get(key)
+    if pool is None:
+        generation = recommendation_pool_cache.generation(key)
+        pool = await _load_quiz_candidate_pool(db, user_id)
+        recommendation_pool_cache.set(key, pool, generation)
+
+    quiz_ids = pool.pick(limit)
+    if not quiz_ids:
+        return []
+    quizzes = {
+        quiz.id: quiz
+        for quiz in (await db.execute(
+            _quiz_with_questions().filter(Quiz.id.in_(quiz_ids), Quiz.is_active.is_(True))
+        )).scalars().all()
+    }
+    return [quizzes[quiz_id] for quiz_id in quiz_ids if quiz_id in quizzes]
+
+async def create_user_quiz_attempt(db: AsyncSession, attempt_in: UserQuizAttemptCreate, user_id: UUID) -> UserQuizAttempt:
     """ユーザーのクイズ挑戦を作成します"""
-    now = datetime.datetime.utcnow()
-    
     db_attempt = UserQuizAttempt(
         user_id=user_id,
         quiz_id=attempt_in.quiz_id,
-        start_time=now,
+        start_time=datetime.utcnow(),
         is_completed=False,
         score=0,  # 初期スコア
-        passed=False  # 初期状態では不合格
+        passed=False,  # 初期状態では不合格
+        answers=[]
     )
-    
+
     db.add(db_attempt)
-    db.commit()
-    db.refresh(db_attempt)
+    await db.commit()
     return db_attempt
 
-def get_user_quiz_attempt(db: Session, attempt_id: UUID) -> Optional[UserQuizAttempt]:
+async def get_user_quiz_attempt(db: AsyncSession, attempt_id: UUID) -> Optional[UserQuizAttempt]:
     """指定されたIDのクイズ挑戦を取得します"""
-    return db.query(UserQuizAttempt).filter(UserQuizAttempt.id == attempt_id).first()
-
-def get_user_quiz_attempts(
-    db: Session, 
-    user_id: UUID,
-    quiz_id: Optional[UUID] = None
-) -> List[UserQuizAttempt]:
-    """ユーザーのクイズ挑戦リストを取得します"""
-    query = db.query(UserQuizAttempt).filter(UserQuizAttempt.user_id == user_id)
-    
-    if quiz_id:
-        query = query.filter(UserQuizAttempt.quiz_id == quiz_id)
-    
-    return query.order_by(UserQuizAttempt.start_time.desc()).all()
+    return await get_quiz_attempt(db, attempt_id)
 
-def update_user_quiz_attempt(db: Session, attempt: UserQuizAttempt, attempt_update: UserQuizAttemptUpdate) -> UserQuizAttempt:
+async def update_user_quiz_attempt(db: AsyncSession, attempt: UserQuizAttempt, attempt_update: UserQuizAttemptUpdate) -> UserQuizAttempt:
     """ユーザーのクイズ挑戦を更新します（完了、スコア計算など）"""
-    # 回答の保存
-    if attempt_update.answers:
-        # 既存の回答を削除（再提出の場合）
-        for answer in attempt.answers:
-            db.delete(answer)
-        
-        # 新しい回答を追加
-        for answer_data in attempt_update.answers:
-            db_answer = UserQuizAnswer(
-                attempt_id=attempt.id,
-                question_id=answer_data.question_id,
-                selected_answer_id=answer_data.selected_answer_id
+    was_completed = bool(attempt.is_completed)
+    for field in attempt_update.model_fields_set:
+        setattr(attempt, field, getattr(attempt_update, field))
+
+    # 挑戦の完了 (スコアが指定されていなければ保存済みの回答を採点する)
+    if attempt_update.is_completed and attempt_update.score is None:
+        attempt.end_time = attempt.end_time or datetime.utcnow()
+
+        answer_key = await get_quiz_definition(db, attempt.quiz_id)
+        saved_answers = (await db.execute(
+            select(UserQuizAnswer.question_id, UserQuizAnswer.selected_answer_id).where(
+                UserQuizAnswer.attempt_id == attempt.id
             )
-            db.add(db_answer)
-        
-        db.flush()
-    
-    # 挑戦の完了
-    if attempt_update.is_completed:
-        attempt.is_completed = True
-        attempt.end_time = datetime.datetime.utcnow()
-        
-        # スコア計算
-        total_points = 0
-        earned_points = 0
-        
-        quiz = db.query(Quiz).filter(Quiz.id == attempt.quiz_id).first()
-        
-        # クイズの全質問を取得し、合計点数を計算
-        questions = db.query(QuizQuestion).filter(QuizQuestion.quiz_id == attempt.quiz_id).all()
-        for question in questions:
-            total_points += question.points
-            
-            # ユーザーの回答を検索
-            user_answer = db.query(UserQuizAnswer).filter(
-                UserQuizAnswer.attempt_id == attempt.id,
-                UserQuizAnswer.question_id == question.id
-            ).first()
-            
-            if user_answer:
-                # 正解の場合、ポイントを追加
-                correct_answer = db.query(QuizAnswer).filter(
-                    QuizAnswer.question_id == question.id,
-                    QuizAnswer.id == user_answer.selected_answer_id,
-                    QuizAnswer.is_correct == True
-                ).first()
-                
-                if correct_answer:
-                    earned_points += question.points
-        
-        # 最終スコアを計算（パーセント）
-        if total_points > 0:
-            attempt.score = (earned_points / total_points) * 100
-        else:
-            attempt.score = 0
-        
-        # 合格判定
-        attempt.passed = attempt.score >= quiz.pass_percentage if quiz.pass_percentage else True
-    
-    db.commit()
-    db.refresh(attempt)
-    return attempt 
\ No newline at end of file
+        )).mappings().all()
+        if answer_key is not None:
+            result = grade(answer_key, saved_answers)
+            attempt.score = result.score
+            attempt.passed = result.passed
+
+    # 完了済みの挑戦の変更は加算で表せないので、このクイズの集計を作り直す
+    if was_completed or attempt.is_completed:
+        await db.flush()
+        await refresh_user_quiz_stats(db, attempt.user_id, attempt.quiz_id)
+
+    await db.commit()
+    recommendation_pool_cache.invalidate(_quiz_pool_key(attempt.user_id))
+    return await get_quiz_attempt(db, attempt.id)
@@ -1,7 +1,8 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from uuid import UUID
 from datetime import datetime, timezone
 from fastapi import HTTPException, status
@@ -9,7 +10,7 @@ from sqlalchemy.exc import IntegrityError
 import uuid
 import logging
 
-from app.models.subscription import Subscription, PaymentHistory, CampaignCode, StripeCoupon, SubscriptionPlan, StripeDbProduct
+from app.models.subscription import Subscription, PaymentHistory, CampaignCode, StripeCoupon, SubscriptionPlan, StripeDbProduct, StripeWebhookEvent
 from app.models.user import User
 from app.schemas.subscription import (
     SubscriptionCreate,
@@ -23,7 +24,7 @@ from app.schemas.subscription import (
     SubscriptionPlanUpdate
 )
 from app.schemas.stripe import StripeDbProductCreate, StripeDbProductUpdate, StripeDbProductResponse
-from app.services.stripe_service import StripeService
+from app.services.stripe_client import stripe_client
 import stripe
 
 logger = logging.getLogger(__name__)
@@ -309,7 +310,7 @@ async def create_campaign_code(db: AsyncSession, campaign_code: CampaignCodeCrea
         try:
             # Stripe API からクーポン取得
             # ★ StripeService を経由するように修正
-            stripe_obj = StripeService.retrieve_coupon(campaign_code.stripe_coupon_id) # await を削除
+            stripe_obj = await stripe_client.retrieve_coupon(campaign_code.stripe_coupon_id)
 
             # DB スキーマに沿ってインサート
             # ★ StripeCouponCreate のフィールドに合わせて調整が必要
@@ -354,7 +355,7 @@ async def create_campaign_code(db: AsyncSession, campaign_code: CampaignCodeCrea
     # --- Stripe Promotion Code 作成処理 ---
     created_stripe_promo_code_id: Optional[str] = None
     try:
-        stripe_promo_code = StripeService.create_promotion_code(
+        stripe_promo_code = await stripe_client.create_promotion_code(
             coupon_id=db_coupon.stripe_coupon_id, # ★ DBから取得した Coupon の Stripe ID
             code=campaign_code.code,
             max_redemptions=campaign_code.max_uses,
@@ -396,7 +397,7 @@ async def create_campaign_code(db: AsyncSession, campaign_code: CampaignCodeCrea
         if created_stripe_promo_code_id:
              try:
                  logger.warning(f"DB保存失敗(IntegrityError)のため、作成済みのStripe Promotion Code {created_stripe_promo_code_id} を無効化します。")
-                 StripeService.archive_promotion_code(created_stripe_promo_code_id)
+                 await stripe_client.archive_promotion_code(created_stripe_promo_code_id)
              except Exception as e_archive:
                  logger.error(f"重複エラー時のStripe Promotion Code ({created_stripe_promo_code_id}) 無効化に失敗: {e_archive}")
         raise HTTPException(
@@ -409,7 +410,7 @@ async def create_campaign_code(db: AsyncSession, campaign_code: CampaignCodeCrea
         if created_stripe_promo_code_id:
              try:
                  logger.warning(f"DBコミット失敗のため、作成済みのStripe Promotion Code {created_stripe_promo_code_id} を無効化します。")
-                 StripeService.archive_promotion_code(created_stripe_promo_code_id)
+                 await stripe_client.archive_promotion_code(created_stripe_promo_code_id)
              except Exception as e_archive:
                  logger.error(f"コミット失敗時のStripe Promotion Code ({created_stripe_promo_code_id}) 無効化に失敗: {e_archive}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="データベースへの保存中にエラーが発生しました。")
@@ -473,7 +474,7 @@ async def update_campaign_code(db: AsyncSession, campaign_code_id: UUID, campaig
         if 'is_active' in update_data and update_data['is_active'] is False and campaign_code.stripe_promotion_code_id:
             try:
                 logger.info(f"CampaignCode {campaign_code.code} が非アクティブ化されたため、Stripe Promotion Code {campaign_code.stripe_promotion_code_id} を無効化します。")
-                StripeService.archive_promotion_code(campaign_code.stripe_promotion_code_id)
+                await stripe_client.archive_promotion_code(campaign_code.stripe_promotion_code_id)
             except Exception as e_archive:
                 # 無効化に失敗してもDB更新は続行する（エラーログは残す）
                  logger.error(f"Stripe Promotion Code ({campaign_code.stripe_promotion_code_id}) の無効化に失敗 (DB更新は続行): {e_archive}")
@@ -515,7 +516,7 @@ async def delete_campaign_code(db: AsyncSession, campaign_code_id: UUID) -> bool
     if stripe_promotion_code_id:
         try:
             logger.info(f"CampaignCode {campaign_code.code} (ID: {campaign_code_id}) 削除のため、Stripe Promotion Code {stripe_promotion_code_id} を無効化します。")
-            StripeService.archive_promotion_code(stripe_promotion_code_id)
+            await stripe_client.archive_promotion_code(stripe_promotion_code_id)
             logger.info(f"Stripe Promotion Code {stripe_promotion_code_id} の無効化が完了しました。")
         except Exception as e_archive:
             # Stripe無効化エラーはログに記録し、フラグを立てるが、DB削除は続行
@@ -596,7 +597,7 @@ async def verify_campaign_code(db: AsyncSession, code: str, price_id: str) -> Di
     # --- 2. Stripe Promotion Code の状態も確認 (DBにIDがあれば) --- 
     if campaign_code.stripe_promotion_code_id:
         try:
-            stripe_promo_code = StripeService.retrieve_promotion_code(campaign_code.stripe_promotion_code_id)
+            stripe_promo_code = await stripe_client.retrieve_promotion_code(campaign_code.stripe_promotion_code_id)
             if not stripe_promo_code or not stripe_promo_code.get('active'):
                  return {
                     "valid": False, "message": "このキャンペーンコードは現在利用できません(Stripe側)。", # メッセージ変更
@@ -669,7 +670,7 @@ async def verify_campaign_code(db: AsyncSession, code: str, price_id: str) -> Di
 
     try:
         logger.info(f"Verifying campaign code: Attempting to fetch price data for price_id: {price_id}")
-        price_data = StripeService.get_price(price_id)
+        price_data = await stripe_client.get_price(price_id)
         original_amount = price_data.get("unit_amount")
         logger.info(f"Verifying campaign code: Original amount from Stripe: {original_amount}")
 
@@ -952,4 +953,87 @@ async def get_active_subscription_plans(db: AsyncSession, skip: int = 0, limit:
         .offset(skip)
         .limit(limit)
     )
-    return result.scalars().all()
\ No newline at end of file
+    return result.scalars().all()
+
+
+# --- Stripe Webhook イベント ---
+
+async def record_webhook_event(
+    db: AsyncSession, event_id: str, event_type: str, ordering_key: str, payload: Dict[str, Any]
+) -> Optional[UUID]:
+    """
+    未受信のイベントなら pending で保存して行 ID を返す。
+    同じ event.id を受信済み (Stripe の再送やリプレイ) なら何もせず None を返す。
+    """
+    now = datetime.utcnow()
+    result = await db.execute(
+        pg_insert(StripeWebhookEvent)
+        .values(
+            id=uuid.uuid4(),
+            event_id=event_id,
+            event_type=event_type,
+            ordering_key=ordering_key,
+            payload=payload,
+            status='pending',
+            attempts=0,
+            created_at=now,
+            updated_at=now,
+        )
+        .on_conflict_do_nothing(index_elements=[StripeWebhookEvent.event_id])
+        .returning(StripeWebhookEvent.id)
+    )
+    event_row_id = result.scalar_one_or_none()
+    await db.commit()
+    return event_row_id
+
+
+def _claimable_webhook_event(stale_before: datetime):
+    # 処理待ち、または処理中のまま止まった (プロセスが落ちた) イベント
+    return or_(
+        StripeWebhookEvent.status == 'pending',
+        (StripeWebhookEvent.status == 'processing') & (StripeWebhookEvent.updated_at < stale_before),
+    )
+
+
+async def claim_webhook_event(db: AsyncSession, event_row_id: UUID, stale_before: datetime) -> Optional[StripeWebhookEvent]:
+    """
+    イベントを processing にして返す。1 回の UPDATE で状態を確認するので、
+    他のワーカーやプロセスが処理中・処理済みのイベントは取得できず None になる。
+    """
+    result = await db.execute(
+        update(StripeWebhookEvent)
+        .where(StripeWebhookEvent.id == event_row_id, _claimable_webhook_event(stale_before))
+        .values(status='processing', attempts=StripeWebhookEvent.attempts + 1, updated_at=datetime.utcnow())
+        .returning(StripeWebhookEvent)
+        .execution_options(synchronize_session=False)
+    )
+    event_row = result.scalars().first()
+    await db.commit()
+    return event_row
+
+
+async def finish_webhook_event(db: AsyncSession, event_row_id: UUID, status: str, error: Optional[str] = None) -> None:
+    """処理結果を記録する (status は 'processed' / 'failed' / 再試行待ちの 'pending')"""
+    now = datetime.utcnow()
+    await db.execute(
+        update(StripeWebhookEvent)
+        .where(StripeWebhookEvent.id == event_row_id)
+        .values(
+            status=status,
+            last_error=error,
+            processed_at=now if status == 'processed' else None,
+            updated_at=now,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def list_unfinished_webhook_events(db: AsyncSession, stale_before: datetime) -> List[Tuple[UUID, str]]:
+    """未処理のイベントの (行 ID, ordering_key) を受信順に返す (起動時の再投入用)"""
+    result = await db.execute(
+        select(StripeWebhookEvent.id, StripeWebhookEvent.ordering_key)
+        .where(_claimable_webhook_event(stale_before))
+        .order_by(StripeWebhookEvent.created_at)
+    )
+    return [(row.id, row.ordering_key) for row in result.all()]
@@ -0,0 +1,44 @@
+# backend/app/crud/tests/test_broadcast.py
+import uuid
+from datetime import datetime, time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.crud import broadcast as crud_broadcast
+from app.models.enums import NotificationPriority, NotificationType
+
+
+def _broadcast():
+    return SimpleNamespace(
+        id=uuid.uuid4(), title="メンテナンスのお知らせ", content="本日 22 時から", action_url=None, expires_at=None,
+        notification_type=NotificationType.SYSTEM_ANNOUNCEMENT, priority=NotificationPriority.NORMAL,
+    )
+
+
+@pytest.mark.asyncio
+async def test_materialize_is_one_insert_select_per_table(fake_session):
+    """対象ユーザーの解決も書き込みも DB 側で行い、ユーザーを 1 人ずつ追加しない。"""
+    broadcast = _broadcast()
+    db = fake_session(rowcount=50000)
+    assert await crud_broadcast.materialize_broadcast(db, broadcast, datetime.utcnow()) == (50000, 50000)
+
+    assert db.writes == [("INSERT", "notifications"), ("INSERT", "in_app_notifications")]
+    notifications, in_app = db.values(0), db.values(1)
+    assert broadcast.id in notifications.values() and broadcast.title in notifications.values()
+    assert in_app["param_4"] == {"broadcast_notification_id": str(broadcast.id), "action_url": None}
+    assert db.statements[0].sql.endswith("DO NOTHING")  # 再実行しても重複しない
+
+
+@pytest.mark.asyncio
+async def test_materialize_counts_only_new_rows(fake_session):
+    """再実行では既に作成済みの通知を数えない。"""
+    db = fake_session(rowcount=0)
+    assert await crud_broadcast.materialize_broadcast(db, _broadcast(), datetime.utcnow()) == (0, 0)
+
+
+def test_quiet_hours_are_filtered_in_sql():
+    sql = str(crud_broadcast.in_quiet_hours(time(23, 0)).compile(dialect=postgresql.dialect()))
+    assert "CAST(notification_settings.quiet_hours_start AS TIME WITHOUT TIME ZONE)" in sql
+    assert "CASE WHEN" in sql  # 日付をまたぐ時間帯
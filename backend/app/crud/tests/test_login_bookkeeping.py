@@ -0,0 +1,61 @@
+# backend/app/crud/tests/test_login_bookkeeping.py
+import uuid
+
+import pytest
+
+from app.core.config import settings
+from app.crud import user as crud_user
+from app.models.enums import AccountLockReason
+
+
+@pytest.mark.asyncio
+async def test_failure_is_one_atomic_update(fake_session):
+    """失敗カウンタの加算とロック判定を、読み込みなしの UPDATE ... RETURNING 1 回で行う。"""
+    db = fake_session([(5, None)])
+    assert await crud_user.record_login_failure(db, uuid.uuid4()) == (5, None)
+
+    assert db.writes == [("UPDATE", "user_login_info")] and db.commits == 1
+    values = db.values(0)
+    assert values["param_1"] == settings.LOGIN_MAX_FAILED_ATTEMPTS
+    assert values["param_3"] == AccountLockReason.FAILED_ATTEMPTS
+    assert values["param_2"] > values["last_failed_login_at"]  # ロック期限は失敗時刻より後
+
+
+@pytest.mark.asyncio
+async def test_failure_without_login_info_returns_none(fake_session):
+    db = fake_session([])
+    assert await crud_user.record_login_failure(db, uuid.uuid4()) is None
+
+
+@pytest.mark.asyncio
+async def test_success_does_not_unlock_a_locked_account(fake_session):
+    """ロック中の行は更新対象から外れ、False が返る。ハッシュの置き換えも行わない。"""
+    db = fake_session([])
+    assert not await crud_user.record_login_success(db, uuid.uuid4(), rehashed_password="$2b$12$new")
+
+    assert db.writes == [("UPDATE", "user_login_info")]
+    assert "user_login_info.locked_until IS NULL OR user_login_info.locked_until <=" in db.statements[0].sql
+
+
+@pytest.mark.asyncio
+async def test_success_stores_rehashed_password_in_the_same_commit(fake_session):
+    user_id = uuid.uuid4()
+    db = fake_session([(user_id,)])
+    assert await crud_user.record_login_success(db, user_id, rehashed_password="$2b$12$new")
+
+    assert db.writes == [("UPDATE", "user_login_info"), ("UPDATE", "users")] and db.commits == 1
+    login_info, user = db.values(0), db.values(1)
+    assert login_info["failed_login_attempts"] == 0 and login_info["locked_until"] is None
+    assert login_info["account_lock_reason"] is None
+    assert user["hashed_password"] == "$2b$12$new" and user["id_1"] == user_id
+
+
+@pytest.mark.asyncio
+async def test_rehash_is_stored_without_login_info(fake_session):
+    """ログイン情報の行がないユーザーでも、再ハッシュした値を保存する。"""
+    user_id = uuid.uuid4()
+    db = fake_session()
+    await crud_user.update_password_hash(db, user_id, "$2b$12$new")
+
+    assert db.writes == [("UPDATE", "users")] and db.commits == 1
+    assert db.values(0)["hashed_password"] == "$2b$12$new" and db.values(0)["id_1"] == user_id
@@ -0,0 +1,64 @@
+# backend/app/crud/tests/test_quiz.py
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.crud import quiz as crud_quiz
+
+
+@pytest.mark.asyncio
+async def test_analysis_reads_rollups_and_recent_five_only(fake_session):
+    """挑戦の履歴は読み込まず、難易度ごとの集計行と最新 5 件の 2 クエリで組み立てる。"""
+    quiz_id = uuid.uuid4()
+    by_difficulty = [
+        SimpleNamespace(difficulty="easy", attempts=8, passed=6, total_score=640.0, top_score=100.0,
+                        quizzes_taken=3, passed_quizzes=2),
+        SimpleNamespace(difficulty="hard", attempts=2, passed=0, total_score=90.0, top_score=50.0,
+                        quizzes_taken=1, passed_quizzes=0),
+    ]
+    recent = [SimpleNamespace(id=uuid.uuid4(), quiz_id=quiz_id, title="Quiz", score=80.0, passed=True,
+                              end_time=datetime(2026, 1, 2))]
+    db = fake_session(by_difficulty, recent)
+
+    analysis = await crud_quiz.get_user_quiz_analysis(db, uuid.uuid4())
+
+    stats_sql, recent_sql = (statement.sql for statement in db.statements)
+    assert "FROM user_quiz_stats JOIN quizzes" in stats_sql and "GROUP BY quizzes.difficulty" in stats_sql
+    assert "FROM user_quiz_attempts JOIN quizzes" in recent_sql and "LIMIT" in recent_sql
+    assert analysis["total_attempts"] == 10 and analysis["average_score"] == 73.0
+    assert analysis["passed_quizzes"] == 2 and analysis["total_quizzes_taken"] == 4
+    assert analysis["top_score"] == 100.0
+    assert analysis["by_difficulty"]["easy"] == {"attempts": 8, "passed": 6, "average_score": 80.0, "total_score": 640.0}
+    assert analysis["recent_attempts"][0]["quiz_id"] == str(quiz_id)
+    assert analysis["recent_attempts"][0]["date"] == "2026-01-02T00:00:00"
+
+
+@pytest.mark.asyncio
+async def test_analysis_without_attempts_skips_recent_query(fake_session):
+    db = fake_session([])
+    analysis = await crud_quiz.get_user_quiz_analysis(db, uuid.uuid4())
+    assert analysis["total_attempts"] == 0 and analysis["recent_attempts"] == []
+    assert len(db.statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_recommendations_sample_once_then_reuse_the_pool(fake_session):
+    """候補は ORDER BY random() なしで 1 回だけ抽出し、以降は選んだクイズだけを読む。"""
+    crud_quiz.recommendation_pool_cache.clear()
+    new_ids = [uuid.uuid4(), uuid.uuid4()]
+    completed = [SimpleNamespace(quiz_id=uuid.uuid4(), passed=False)]
+    quizzes = [SimpleNamespace(id=quiz_id) for quiz_id in new_ids + [completed[0].quiz_id]]
+    user_id = uuid.uuid4()
+    db = fake_session(new_ids, completed, quizzes)
+    recommended = await crud_quiz.get_recommended_quizzes(db, user_id, limit=3)
+    assert {quiz.id for quiz in recommended[:2]} == set(new_ids) and recommended[2].id == completed[0].quiz_id
+    sample_sql, completed_sql, load_sql = (statement.sql for statement in db.statements)
+    assert "random()" not in sample_sql and "NOT (EXISTS (SELECT user_quiz_stats.quiz_id" in sample_sql
+    assert "FROM user_quiz_stats JOIN quizzes" in completed_sql
+
+    db = fake_session(quizzes)
+    await crud_quiz.get_recommended_quizzes(db, user_id, limit=3)
+    [load] = db.statements
+    assert load.kind == "SELECT" and load.sql.startswith("SELECT quizzes.")
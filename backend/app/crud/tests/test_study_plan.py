@@ -0,0 +1,53 @@
+# backend/app/crud/tests/test_study_plan.py
+import uuid
+from datetime import date
+
+import pytest
+
+from app.crud import study_plan as crud_study_plan
+from app.schemas.study_plan import StudyProgressUpdate
+
+
+@pytest.fixture
+def progress(monkeypatch):
+    async def fake_progress(db, plan_id):
+        return {"plan_id": plan_id}
+
+    monkeypatch.setattr(crud_study_plan, "get_study_plan_progress", fake_progress)
+
+
+@pytest.mark.asyncio
+async def test_progress_update_is_two_statements_in_one_commit(fake_session, progress):
+    """目標を 1 件ずつ読み書きせず、目標の UPDATE と進捗率の UPDATE を 1 回のコミットで行う。"""
+    db = fake_session()
+    plan_id = uuid.uuid4()
+
+    result = await crud_study_plan.update_study_progress(db, plan_id, StudyProgressUpdate(completed=True))
+
+    assert result == {"plan_id": plan_id}
+    assert db.writes == [("UPDATE", "study_goals"), ("UPDATE", "study_plans")]
+    assert db.commits == 1 and db.rollbacks == 0
+    goals, plan = db.values(0), db.values(1)
+    assert goals["completed"] is True and goals["coalesce_1"] == date.today()
+    assert "notes" not in goals
+    assert goals["study_plan_id_1"] == plan_id and plan["id_1"] == plan_id
+
+
+@pytest.mark.asyncio
+async def test_reopening_goals_clears_completion_date(fake_session, progress):
+    db = fake_session()
+    await crud_study_plan.update_study_progress(db, uuid.uuid4(), StudyProgressUpdate(completed=False))
+
+    assert db.values(0)["completed"] is False and db.values(0)["completion_date"] is None
+
+
+@pytest.mark.asyncio
+async def test_progress_update_for_another_plans_goal_is_not_found(fake_session):
+    db = fake_session(rowcount=0)
+    goal_id = uuid.uuid4()
+    progress = StudyProgressUpdate(goal_id=goal_id, completed=False, notes="メモ")
+
+    assert await crud_study_plan.update_study_progress(db, uuid.uuid4(), progress) is None
+    assert db.writes == [("UPDATE", "study_goals")] and db.values(0)["id_1"] == goal_id
+    assert db.values(0)["notes"] == "メモ"
+    assert db.commits == 0 and db.rollbacks == 1
@@ -1,11 +1,18 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete as sql_delete, insert
-from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete as sql_delete
+from datetime import datetime, timedelta
 from typing import Optional, List
+from app.core.config import settings
 from app.models.user import TokenBlacklist
 from app.models.enums import TokenBlacklistReason
 import uuid
 
+# このいずれかの理由で失効させた時刻より前に発行されたトークンは、jti に関わらずすべて無効
+SECURITY_EVENT_REASONS = frozenset({
+    TokenBlacklistReason.PASSWORD_CHANGE,
+    TokenBlacklistReason.SECURITY_BREACH,
+})
+
 async def add_token_to_blacklist(
     db: AsyncSession,
     token_jti: str,
@@ -96,6 +103,12 @@ async def blacklist_tokens_by_user(
     特定ユーザーの全アクティブトークンをブラックリストに登録する
     パスワード変更時や不審なアクティビティ検出時などに使用
 
+    jti は分からないので、イベントの時刻を記録し、それより前に発行されたトークンを
+    すべて無効とみなす (app.core.token_revocation)。
+    リフレッシュトークンが切れるまでは remove_expired_tokens で消えないよう、
+    期限は REFRESH_TOKEN_EXPIRE_DAYS 後にする。
+    コミットは呼び出し側で行う (パスワードの更新と同じトランザクションにするため)。
+
     Args:
         db: データベースセッション
         user_id: ユーザーID
@@ -104,42 +117,15 @@ async def blacklist_tokens_by_user(
     Returns:
         影響を受けたレコード数
     """
-    # 現実のアプリケーションでは、すべてのアクティブなトークンを追跡する方法が必要
-    # この実装では、ユーザーのセキュリティイベント（パスワード変更など）発生時に、
-    # そのイベント以前に発行されたすべてのトークンを無効化するための措置として、
-    # 将来的な使用のためのスケルトン実装です
-    
-    # 実装例：現在より30日以内に発行されたトークンをすべて無効化
-    # これは実際のトークンJTIがわからないため、ブロッキングには使えませんが、
-    # セキュリティイベント発生時のタイムスタンプを記録するのに役立ちます
-    
     now = datetime.utcnow()
-    expiry = now + timedelta(days=30)  # 30日後を期限とする
-    
-    # セキュリティイベントを記録
-    security_record = TokenBlacklist(
+    db.add(TokenBlacklist(
         id=uuid.uuid4(),
         token_jti=f"security-event-{uuid.uuid4()}",  # 特殊なJTIフォーマット
         user_id=user_id,
-        expires_at=expiry,
+        expires_at=now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
         reason=reason,
         created_at=now
-    )
-    
-    db.add(security_record)
-    await db.commit()
-    
-    # JWT検証時に、トークン発行日とユーザーの最終セキュリティイベント日時を比較する
-    # 実装を追加することで、特定のJTIを知らなくても、発行日時に基づいてトークンを無効化できる
-    
-    stmt = insert(TokenBlacklist).values({
-        'user_id': user_id,
-        'reason': TokenBlacklistReason.PASSWORD_CHANGE, # 例：パスワード変更など
-        'jti': 'placeholder_jti', # プレースホルダーまたは適切な値を設定
-        'exp': datetime.now(timezone.utc) + timedelta(days=1) # 例：1日後
-    })
-    await db.execute(stmt)
-    await db.commit()
+    ))
     
     return 1  # 影響を受けたレコード数（ここでは常に1）
 
@@ -156,11 +142,7 @@ async def get_latest_security_event(db: AsyncSession, user_id: str) -> Optional[
     """
     stmt = select(TokenBlacklist.created_at).where(
         TokenBlacklist.user_id == user_id,
-        TokenBlacklist.reason.in_([
-            TokenBlacklistReason.PASSWORD_CHANGE,
-            TokenBlacklistReason.SECURITY_BREACH,
-            TokenBlacklistReason.ADMIN_ACTION
-        ])
+        TokenBlacklist.reason.in_(SECURITY_EVENT_REASONS)
     ).order_by(TokenBlacklist.created_at.desc()).limit(1)
     result = await db.execute(stmt)
     latest_event_time = result.scalar_one_or_none()
@@ -1,10 +1,11 @@
 from sqlalchemy.orm import Session, joinedload, selectinload, contains_eager
-from sqlalchemy import func, or_, select, delete as sql_delete
+from sqlalchemy import case, func, or_, select, update, delete as sql_delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User, Role, UserEmailVerification, UserTwoFactorAuth, UserLoginInfo, UserRole as ModelUserRole, UserProfile, RolePermission
 from app.models.enums import AccountLockReason
 from app.schemas.user import UserCreate, UserUpdate, UserStatus as SchemaUserStatus
-from app.core.security import get_password_hash
+from app.core import password_hasher
+from app.core.config import settings
 from uuid import UUID
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List, Tuple
@@ -32,6 +33,21 @@ async def get_user(db: AsyncSession, user_id: UUID) -> Optional[User]:
     )
     return result.scalars().first()
 
+async def get_user_for_login(db: AsyncSession, email: str) -> Optional[User]:
+    """
+    ログイン用: ユーザー・ロール・権限・ログイン情報を JOIN で 1 クエリにまとめて取得する
+    """
+    result = await db.execute(
+        select(User).options(
+            joinedload(User.user_roles)
+            .joinedload(ModelUserRole.role)
+            .joinedload(Role.role_permissions)
+            .joinedload(RolePermission.permission),
+            joinedload(User.login_info)
+        ).filter(User.email == email)
+    )
+    return result.unique().scalars().first()
+
 async def get_role_by_name(db: AsyncSession, role_name: str) -> Optional[Role]:
     result = await db.execute(select(Role).filter(Role.name == role_name))
     return result.scalars().first()
@@ -103,7 +119,7 @@ async def create_user(db: AsyncSession, *, user_in: UserCreate) -> User:
     db_user = User(
         id=uuid.uuid4(),
         email=user_in.email,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=await password_hasher.hash_password(user_in.password),
         full_name=user_in.full_name,
         status=SchemaUserStatus.ACTIVE, # Default status, ensure this is intended
         is_verified=True, # Default verification, ensure this is intended
@@ -168,7 +184,7 @@ async def update_user(
     update_data = user_in.model_dump(exclude_unset=True)
 
     if "password" in update_data and update_data["password"]:
-        hashed_password = get_password_hash(update_data["password"])
+        hashed_password = await password_hasher.hash_password(update_data["password"])
         db_user.hashed_password = hashed_password
         del update_data["password"]
     elif "password" in update_data:
@@ -298,49 +314,93 @@ async def disable_2fa(db: AsyncSession, user_id: UUID) -> bool:
     await db.commit()
     return True
 
-async def record_login_attempt(db: AsyncSession, user_id: UUID, success: bool) -> None:
-    logger.info(f"Attempting to record login for user_id: {user_id}, success: {success}")
-    user = await get_user(db, user_id)
-    if not user:
-        logger.warning(f"User not found in record_login_attempt for user_id: {user_id}")
-        return
-
-    result = await db.execute(select(UserLoginInfo).filter(UserLoginInfo.user_id == user_id))
-    login_info = result.scalars().first()
-
-    if not login_info:
+async def record_login_failure(db: AsyncSession, user_id: UUID) -> Optional[Tuple[int, Optional[datetime]]]:
+    """
+    ログイン失敗を 1 回の UPDATE ... RETURNING で記録する。
+    カウンタの加算とロック判定を DB 側で原子的に行うので、同時に失敗しても取りこぼさない。
+    更新後の (failed_login_attempts, locked_until) を返す (ログイン情報がなければ None)。
+    """
+    now = datetime.utcnow()
+    attempts = func.coalesce(UserLoginInfo.failed_login_attempts, 0) + 1
+    reaches_limit = attempts >= settings.LOGIN_MAX_FAILED_ATTEMPTS
+    result = await db.execute(
+        update(UserLoginInfo)
+        .where(UserLoginInfo.user_id == user_id)
+        .values(
+            failed_login_attempts=attempts,
+            last_failed_login_at=now,
+            locked_until=case(
+                (reaches_limit, now + timedelta(minutes=settings.LOGIN_LOCKOUT_MINUTES)),
+                else_=UserLoginInfo.locked_until,
+            ),
+            account_lock_reason=case(
+                (reaches_limit, AccountLockReason.FAILED_ATTEMPTS),
+                else_=UserLoginInfo.account_lock_reason,
+            ),
+            updated_at=now,
+        )
+        .returning(UserLoginInfo.failed_login_attempts, UserLoginInfo.locked_until)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+    await db.commit()
+    if row is None:
         logger.warning(f"UserLoginInfo not found for user_id: {user_id}")
-        # Consider adding logic here to create UserLoginInfo if it doesn't exist
-        # login_info = UserLoginInfo(user_id=user_id, created_at=datetime.utcnow())
-        # db.add(login_info)
-        # logger.info(f"Created new UserLoginInfo for user_id: {user_id}")
-        return # Or handle as appropriate
+    return row
+
 
+async def record_login_success(db: AsyncSession, user_id: UUID, rehashed_password: Optional[str] = None) -> bool:
+    """
+    ログイン成功を 1 回の UPDATE ... RETURNING で記録する (失敗カウンタとロックも解除)。
+    ロック中の行は更新しないので、検証中に別のリクエストでロックされた場合は False を返す。
+    rehashed_password があれば同じトランザクションでパスワードハッシュも置き換える。
+    """
     now = datetime.utcnow()
-    logger.info(f"Current time (UTC): {now}")
+    result = await db.execute(
+        update(UserLoginInfo)
+        .where(
+            UserLoginInfo.user_id == user_id,
+            or_(UserLoginInfo.locked_until.is_(None), UserLoginInfo.locked_until <= now),
+        )
+        .values(
+            last_login_at=now,
+            failed_login_attempts=0,
+            locked_until=None,
+            account_lock_reason=None,
+            updated_at=now,
+        )
+        .returning(UserLoginInfo.id)
+        .execution_options(synchronize_session=False)
+    )
+    recorded = result.first() is not None
+    if recorded and rehashed_password:
+        await db.execute(_password_hash_update(user_id, rehashed_password))
+    await db.commit()
+    return recorded
 
-    if success:
-        logger.info(f"Login successful for user_id: {user_id}. Current last_login_at: {login_info.last_login_at}")
-        login_info.last_login_at = now
-        login_info.failed_login_attempts = 0
-        login_info.locked_until = None
-        login_info.account_lock_reason = None
-        logger.info(f"Updated last_login_at to: {login_info.last_login_at} for user_id: {user_id}")
-    else:
-        logger.info(f"Login failed for user_id: {user_id}")
-        if hasattr(login_info, 'last_failed_login_at'): # Keep this check for last_failed_login_at
-            login_info.last_failed_login_at = now
-        login_info.failed_login_attempts += 1
-        if login_info.failed_login_attempts >= 5: # Threshold should be configurable
-            login_info.locked_until = now + timedelta(minutes=15) # Lock duration should be configurable
-            login_info.account_lock_reason = AccountLockReason.FAILED_ATTEMPTS
-    
-    login_info.updated_at = now
+
+async def update_password_hash(db: AsyncSession, user_id: UUID, hashed_password: str) -> None:
+    """パスワードハッシュだけを置き換える (ログイン情報の行がないユーザーの再ハッシュ用)"""
+    await db.execute(_password_hash_update(user_id, hashed_password))
+    await db.commit()
+
+
+def _password_hash_update(user_id: UUID, hashed_password: str):
+    return (
+        update(User)
+        .where(User.id == user_id)
+        .values(hashed_password=hashed_password)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def record_login_attempt(db: AsyncSession, user_id: UUID, success: bool) -> None:
+    logger.info(f"Attempting to record login for user_id: {user_id}, success: {success}")
     try:
-        db.add(login_info)
-        await db.commit()
-        await db.refresh(login_info) # Refresh to get the latest state from DB
-        logger.info(f"Successfully committed UserLoginInfo for user_id: {user_id}. Refreshed last_login_at: {login_info.last_login_at}")
+        if success:
+            await record_login_success(db, user_id)
+        else:
+            await record_login_failure(db, user_id)
     except Exception as e:
         logger.error(f"Error committing UserLoginInfo for user_id: {user_id}: {e}", exc_info=True)
         await db.rollback()
@@ -62,6 +62,9 @@ async def cleanup_expired_tokens():
             async with AsyncSessionLocal() as db:
                 removed = await remove_expired_tokens(db)
                 logger.info(f"期限切れトークンのクリーンアップ: {removed}件削除")
+            # メモリ上の失効リストからも期限切れを取り除く
+            from app.core.token_revocation import token_revocation
+            token_revocation.prune()
         except Exception as e:
             logger.error(f"トークンクリーンアップエラー: {str(e)}")
         
@@ -75,10 +78,66 @@ async def lifespan(app: FastAPI):
     # 期限切れトークンのクリーンアップタスク
     cleanup_task = asyncio.create_task(cleanup_expired_tokens())
     logger.info("バックグラウンド期限切れトークンクリーンアップタスクを開始しました")
+    # 失効済みトークンを読み込んでから受け付けを始め、以降は他プロセスでの失効を差分で取り込む
+    from app.core.token_revocation import refresh_token_revocations, run_token_revocation_refresh
+    await refresh_token_revocations()
+    revocation_task = asyncio.create_task(run_token_revocation_refresh())
+    # トークン数カウント用の tokenizer をバックグラウンドで読み込む (読み込むまでは概算で数える)
+    from app.services.context_window import warm_up_tokenizer
+    tokenizer_task = asyncio.create_task(warm_up_tokenizer())
+    # LLM API への接続を先に張っておき、最初のチャットで TLS ハンドシェイクを待たないようにする
+    from app.services.llm_clients import close_llm_clients, warm_up_llm_connections
+    llm_warmup_task = asyncio.create_task(warm_up_llm_connections())
+    # Stripe Webhook の処理ワーカーを起動し、前回処理しきれなかったイベントを再投入する
+    from app.services.stripe_webhook_queue import stripe_webhook_queue
+    await stripe_webhook_queue.start()
+    # メール送信ワーカーを起動する (前回送りきれなかったメールもここで送られる)
+    from app.services.email_dispatcher import email_dispatcher
+    email_dispatcher.start()
+    # 配信時刻になった全体通知を展開するワーカーを起動する
+    from app.services.broadcast_engine import broadcast_engine
+    broadcast_engine.start()
+    # 自己分析ステップのエージェントを先に構築しておく (最初のターンで構築を待たないように)
+    try:
+        from app.services.agents.self_analysis_langchain.main import warm_up_step_agents
+        warm_up_step_agents()
+    except Exception as e:
+        logger.warning(f"自己分析エージェントの事前構築に失敗しました (初回利用時に構築します): {e}")
     
     yield
     
     # 終了時の処理
+    # 処理中の Stripe Webhook を待ってからワーカーを止める
+    await stripe_webhook_queue.close()
+    # 未書き込みのチャットメッセージを書き出す
+    from app.services.chat_persistence import chat_write_behind
+    await chat_write_behind.close()
+    # パスワードハッシュ用のスレッドプールを止める
+    from app.core.password_hasher import password_hasher
+    password_hasher.shutdown()
+    # Stripe 呼び出し用のスレッドプールを止める
+    from app.services.stripe_client import stripe_client
+    stripe_client.shutdown()
+    # S3 (boto3) 呼び出し用のスレッドプールを止める
+    from app.services.s3_service import s3_service
+    s3_service.shutdown()
+    # 全体通知の展開ワーカーを止める (途中の展開はロールバックされ、次回起動時にやり直す)
+    await broadcast_engine.close()
+    # Web Push 配信用のスレッドプールと接続を閉じる (配信中の全体通知がなくなってから)
+    from app.services.push_delivery import push_delivery
+    push_delivery.close()
+    # メール送信ワーカーを止めて SMTP 接続を閉じる
+    await email_dispatcher.close()
+
+    # 読み込み中の tokenizer の事前読み込みを止める
+    if not tokenizer_task.done():
+        tokenizer_task.cancel()
+    # 共有の LLM コネクションプールを閉じる
+    if not llm_warmup_task.done():
+        llm_warmup_task.cancel()
+    await close_llm_clients()
+
+    revocation_task.cancel()
     cleanup_task.cancel()
     try:
         await cleanup_task
@@ -141,7 +200,7 @@ app.add_middleware(
         "Access-Control-Request-Method",
         "Access-Control-Request-Headers",
     ],  # 具体的なヘッダー指定
-    expose_headers=["Set-Cookie", "X-Auth-Status"],  # 公開するヘッダー
+    expose_headers=["Set-Cookie", "X-Auth-Status", "X-Next-Cursor"],  # 公開するヘッダー
     max_age=3600,  # プリフライトリクエストのキャッシュ時間
 )
 
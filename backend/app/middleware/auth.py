@@ -10,6 +10,9 @@ from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy import select
 from app.models.user import User, UserRole, Role, RolePermission, Permission
+from app.crud import user as crud_user
+from app.core.principal_cache import principal_cache, Principal
+from app.core.token_revocation import token_revocation
 from jose import jwt, jwe, JWTError
 from datetime import datetime, timezone
 from app.core.security import derived_key
@@ -117,6 +120,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
             return await call_next(request)
 
         user = None
+        principal = None
         # token_payload = None # Cookie関連なので削除
         # session_token = request.cookies.get("next-auth.session-token") # Cookie関連なので削除
 
@@ -135,45 +139,49 @@ class AuthMiddleware(BaseHTTPMiddleware):
             bearer_token = auth_header.split(" ")[1]
             logger.debug("Bearer token found. Attempting to decode...")
             bearer_payload = decode_bearer_token(bearer_token)
+            # ログアウト・パスワード変更などで失効したトークンを拒否する (DB には問い合わせない)
+            if bearer_payload and token_revocation.is_revoked(
+                bearer_payload.get("jti"), bearer_payload.get("sub"), bearer_payload.get("iat")
+            ):
+                logger.warning("失効済みの Bearer token")
+                bearer_payload = None
 
             if bearer_payload:
                 user_id_from_bearer = bearer_payload.get("sub")
                 logger.debug(f"Decoded Bearer token payload: {bearer_payload}")
                 if user_id_from_bearer:
                     logger.debug(f"ユーザーIDをBearerトークンから取得: {user_id_from_bearer}")
-                    # Use async session directly
-                    async with AsyncSessionLocal() as db:
-                        try:
-                            try:
-                                user_uuid = uuid.UUID(user_id_from_bearer)
-                            except ValueError:
-                                logger.warning(f"Invalid UUID format in bearer token: {user_id_from_bearer}")
-                                user_uuid = None
+                    try:
+                        user_uuid = uuid.UUID(user_id_from_bearer)
+                    except ValueError:
+                        logger.warning(f"Invalid UUID format in bearer token: {user_id_from_bearer}")
+                        user_uuid = None
 
-                            if user_uuid:
-                                # Execute the async query
-                                result = await db.execute(
-                                    select(User)
-                                    .options(
-                                        selectinload(User.user_roles)
-                                        .selectinload(UserRole.role)
-                                        .selectinload(Role.role_permissions)
-                                        .selectinload(RolePermission.permission)
-                                    )
-                                    .filter(User.id == user_uuid)
-                                )
-                                user = result.scalars().first()
+                    if user_uuid:
+                        token_jti = bearer_payload.get("jti")
+                        principal = principal_cache.get(str(user_uuid), token_jti)
+                        if principal:
+                            user = principal.user
+                            logger.debug(f"キャッシュからユーザー情報を取得 (Bearer): {user.email}")
+                        else:
+                            # ロード中に無効化された場合に古い値をキャッシュしないよう世代を控えておく
+                            generation = principal_cache.generation
+                            async with AsyncSessionLocal() as db:
+                                try:
+                                    user = await crud_user.get_user(db, user_id=user_uuid)
+                                except SQLAlchemyError as e:
+                                    logger.error(f"ユーザー情報取得中のデータベースエラー (Bearer): {e}")
+                                    user = None # Ensure user is None on DB error
+                                except Exception as e:
+                                    logger.error(f"ユーザー情報取得中の予期せぬエラー (Bearer): {e}")
+                                    user = None # Ensure user is None on other errors
 
                             if user:
                                 logger.debug(f"DBからユーザー情報を取得 (Bearer): {user.email}")
+                                principal = Principal.from_user(user)
+                                principal_cache.set(str(user_uuid), token_jti, principal, generation=generation)
                             else:
                                 logger.warning(f"BearerトークンのユーザーID ({user_id_from_bearer}) がDBに見つかりません。")
-                        except SQLAlchemyError as e:
-                            logger.error(f"ユーザー情報取得中のデータベースエラー (Bearer): {e}")
-                            user = None # Ensure user is None on DB error
-                        except Exception as e:
-                            logger.error(f"ユーザー情報取得中の予期せぬエラー (Bearer): {e}")
-                            user = None # Ensure user is None on other errors
                 else:
                     logger.warning("BearerトークンペイロードにユーザーID (sub) が含まれていません。")
             else:
@@ -184,6 +192,8 @@ class AuthMiddleware(BaseHTTPMiddleware):
         # --- Final Authentication Check and State Setting --- #
         if user:
             request.state.user_id = str(user.id) # Set user_id as string
+            request.state.user = user # get_current_user が再ロードせずに使う解決済みユーザー
+            request.state.permissions = principal.permissions # コンパイル済みの権限集合
             logger.debug(f"認証成功: User ID {request.state.user_id}, Email: {user.email}")
             try:
                 response = await call_next(request)
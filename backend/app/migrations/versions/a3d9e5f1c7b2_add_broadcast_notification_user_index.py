@@ -0,0 +1,30 @@
+"""add_broadcast_notification_user_index
+
+Revision ID: a3d9e5f1c7b2
+Revises: f2c7a9e4b6d1
+Create Date: 2026-10-17 18:20:05.613402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d9e5f1c7b2'
+down_revision: Union[str, None] = 'f2c7a9e4b6d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 全体通知はユーザーごとに 1 件だけ展開する (展開し直しは ON CONFLICT DO NOTHING で無視される)
+    op.create_index(
+        'uq_notifications_broadcast_user', 'notifications', ['broadcast_notification_id', 'user_id'],
+        unique=True, postgresql_where=sa.text('broadcast_notification_id IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_notifications_broadcast_user', table_name='notifications')
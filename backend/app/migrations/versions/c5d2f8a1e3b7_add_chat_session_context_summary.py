@@ -0,0 +1,28 @@
+"""add_chat_session_context_summary
+
+Revision ID: c5d2f8a1e3b7
+Revises: a41c7e2d9b10
+Create Date: 2026-10-17 11:40:05.219364
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d2f8a1e3b7'
+down_revision: Union[str, None] = 'a41c7e2d9b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chat_sessions', sa.Column('context_summary', sa.Text(), nullable=True))
+    op.add_column('chat_sessions', sa.Column('context_summary_message_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('chat_sessions', 'context_summary_message_id')
+    op.drop_column('chat_sessions', 'context_summary')
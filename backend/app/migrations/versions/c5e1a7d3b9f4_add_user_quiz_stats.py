@@ -0,0 +1,54 @@
+"""add_user_quiz_stats
+
+Revision ID: c5e1a7d3b9f4
+Revises: a3d9e5f1c7b2
+Create Date: 2026-10-17 19:48:12.407316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e1a7d3b9f4'
+down_revision: Union[str, None] = 'a3d9e5f1c7b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_quiz_stats',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('quiz_id', sa.UUID(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('passed_attempts', sa.Integer(), nullable=False),
+    sa.Column('total_score', sa.Float(), nullable=False),
+    sa.Column('best_score', sa.Float(), nullable=False),
+    sa.Column('last_completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['quiz_id'], ['quizzes.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'quiz_id')
+    )
+    # 既存の完了した挑戦から集計を作る (以降は提出時に加算で更新する)
+    op.execute(
+        """
+        INSERT INTO user_quiz_stats
+            (user_id, quiz_id, attempts, passed_attempts, total_score, best_score, last_completed_at)
+        SELECT user_id, quiz_id, count(*), count(*) FILTER (WHERE passed),
+               sum(coalesce(score, 0)), max(coalesce(score, 0)), max(end_time)
+        FROM user_quiz_attempts
+        WHERE is_completed
+        GROUP BY user_id, quiz_id
+        """
+    )
+    op.create_index(
+        'ix_user_quiz_attempts_user_completed_end_time', 'user_quiz_attempts', ['user_id', 'end_time'],
+        unique=False, postgresql_where=sa.text('is_completed')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_quiz_attempts_user_completed_end_time', table_name='user_quiz_attempts')
+    op.drop_table('user_quiz_stats')
@@ -0,0 +1,31 @@
+"""add_token_blacklist_created_at_index
+
+Revision ID: d7e1a3c9f2b4
+Revises: c5d2f8a1e3b7
+Create Date: 2026-10-17 14:05:48.301772
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e1a3c9f2b4'
+down_revision: Union[str, None] = 'c5d2f8a1e3b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_token_blacklist_created_at',
+        'token_blacklist',
+        ['created_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_token_blacklist_created_at', table_name='token_blacklist')
@@ -0,0 +1,36 @@
+"""add_recommendation_random_keys
+
+Revision ID: d8f2b6a4c0e7
+Revises: c5e1a7d3b9f4
+Create Date: 2026-10-17 20:31:47.902184
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8f2b6a4c0e7'
+down_revision: Union[str, None] = 'c5e1a7d3b9f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # random() は揮発性なので、既存の行にも 1 行ずつ別の値が入る
+    op.add_column('quizzes', sa.Column('random_key', sa.Float(), server_default=sa.text('random()'), nullable=False))
+    op.add_column('universities', sa.Column('random_key', sa.Float(), server_default=sa.text('random()'), nullable=False))
+    op.create_index(
+        'ix_quizzes_active_random_key', 'quizzes', ['random_key'],
+        unique=False, postgresql_where=sa.text('is_active')
+    )
+    op.create_index('ix_universities_random_key', 'universities', ['random_key'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_universities_random_key', table_name='universities')
+    op.drop_index('ix_quizzes_active_random_key', table_name='quizzes')
+    op.drop_column('universities', 'random_key')
+    op.drop_column('quizzes', 'random_key')
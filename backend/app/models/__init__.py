@@ -27,7 +27,7 @@ from .system import (
 )
 from .subscription import (
     Subscription, SubscriptionPlan, PaymentHistory, PaymentMethod, 
-    CampaignCode, CampaignCodeRedemption, Invoice, InvoiceItem
+    CampaignCode, CampaignCodeRedemption, Invoice, InvoiceItem, StripeWebhookEvent
 )
 from .enums import (
     SessionType, SessionStatus, SenderType, MessageType, DocumentStatus,
@@ -38,7 +38,7 @@ from .enums import (
 )
 from .checklist import ChecklistEvaluation
 from .study_plan import StudyPlan, StudyGoal, StudyPlanTemplate
-from .quiz import Quiz, QuizQuestion, QuizAnswer, UserQuizAttempt, UserQuizAnswer
+from .quiz import Quiz, QuizQuestion, QuizAnswer, UserQuizAttempt, UserQuizAnswer, UserQuizStats
 from .communication import Conversation, Message
 from .forum import (
     ForumCategory, ForumTopic, ForumPost, ForumPostReaction, ForumTopicView
@@ -51,6 +51,7 @@ from .learning_path import (
 from .notification_setting import NotificationSetting
 from .push_subscription import PushSubscription
 from .in_app_notification import InAppNotification
+from .email_outbox import EmailOutbox
 
 __all__ = [
     # Base classes
@@ -144,6 +145,7 @@ __all__ = [
     "CampaignCodeRedemption",
     "Invoice",
     "InvoiceItem",
+    "StripeWebhookEvent",
     
     # Study Plan related
     "StudyPlan",
@@ -157,6 +159,7 @@ __all__ = [
     "QuizAnswer",
     "UserQuizAttempt",
     "UserQuizAnswer",
+    "UserQuizStats",
     
     # Communication related
     "Conversation",
@@ -203,5 +206,6 @@ __all__ = [
     "AuditLogAction",
     "AuditLogStatus",
     "PushSubscription",
-    "InAppNotification"
+    "InAppNotification",
+    "EmailOutbox"
 ]
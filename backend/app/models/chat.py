@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Enum, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import UUID
@@ -33,6 +33,9 @@ class ChatSession(Base):
                        server_default=ChatType.GENERAL.value)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # トークン予算からあふれた古い会話のローリングサマリーと、要約済みの最後のメッセージID
+    context_summary = Column(Text, nullable=True)
+    context_summary_message_id = Column(Integer, nullable=True)
 
     user = relationship("User") # Userモデルとのリレーション (Userモデルが存在する前提)
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
@@ -43,6 +46,10 @@ class ChatSession(Base):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # セッションごとの最新メッセージ取得 (一覧の LATERAL 結合) 用
+        Index("ix_chat_messages_session_id_created_at", "session_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(UUID(as_uuid=True), ForeignKey("chat_sessions.id"), nullable=False, index=True)
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, String, Text, DateTime, Integer, UUID, Index
+from datetime import datetime
+import uuid
+from .base import Base, TimestampMixin
+
+class EmailOutbox(Base, TimestampMixin):
+    """送信待ちのメール (リクエスト処理では積むだけで、送信は app.services.email_dispatcher が行う)"""
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        # 送信待ちの取り出し用
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    to_email = Column(String(320), nullable=False)
+    subject = Column(String(500), nullable=False)
+    html_content = Column(Text, nullable=False)
+    plain_content = Column(Text, nullable=True)
+    status = Column(String(20), nullable=False, default="pending")  # 'pending', 'sending', 'sent', 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
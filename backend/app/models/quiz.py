@@ -1,6 +1,7 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Boolean, Float, Text, DateTime, func
+from sqlalchemy import Column, String, Integer, ForeignKey, Boolean, Float, Text, DateTime, Index, func, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
+import random
 import uuid
 from datetime import datetime
 
@@ -9,6 +10,9 @@ from .base import Base, TimestampMixin
 
 class Quiz(Base):
     __tablename__ = "quizzes"
+    __table_args__ = (
+        Index("ix_quizzes_active_random_key", "random_key", postgresql_where=text("is_active")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     title = Column(String, index=True, nullable=False)
@@ -18,6 +22,8 @@ class Quiz(Base):
     is_active = Column(Boolean, default=True)
     pass_percentage = Column(Float, default=70.0)
     max_attempts = Column(Integer, nullable=True)  # Noneは無制限
+    # おすすめの抽出用の乱数キー (app.services.recommendation_pool)
+    random_key = Column(Float, nullable=False, default=random.random, server_default=func.random())
     
     created_by = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -66,6 +72,13 @@ class QuizAnswer(Base):
 
 class UserQuizAttempt(Base):
     __tablename__ = "user_quiz_attempts"
+    __table_args__ = (
+        # 分析の「最近の挑戦」(完了した挑戦を end_time の新しい順に数件) 用
+        Index(
+            "ix_user_quiz_attempts_user_completed_end_time", "user_id", "end_time",
+            postgresql_where=text("is_completed")
+        ),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -96,4 +109,17 @@ class UserQuizAnswer(Base):
     # Relationships
     attempt = relationship("UserQuizAttempt", back_populates="answers")
     question = relationship("QuizQuestion", back_populates="user_answers")
-    selected_answer = relationship("QuizAnswer", back_populates="user_selections") 
\ No newline at end of file
+    selected_answer = relationship("QuizAnswer", back_populates="user_selections")
+
+
+class UserQuizStats(Base):
+    """ユーザー × クイズごとの完了した挑戦の集計 (提出のたびに加算で更新し、分析はこれを集計する)"""
+    __tablename__ = "user_quiz_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    quiz_id = Column(UUID(as_uuid=True), ForeignKey("quizzes.id", ondelete="CASCADE"), primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    passed_attempts = Column(Integer, nullable=False, default=0)
+    total_score = Column(Float, nullable=False, default=0.0)
+    best_score = Column(Float, nullable=False, default=0.0)
+    last_completed_at = Column(DateTime, nullable=True)
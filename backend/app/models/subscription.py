@@ -206,4 +206,20 @@ class InvoiceItem(Base, TimestampMixin):
     
     # Relationships
     invoice = relationship("Invoice", back_populates="invoice_items")
-    subscription_plan = relationship("SubscriptionPlan", back_populates="invoice_items") 
\ No newline at end of file
+    subscription_plan = relationship("SubscriptionPlan", back_populates="invoice_items")
+
+
+class StripeWebhookEvent(Base, TimestampMixin):
+    """受信した Stripe Webhook イベント (event.id で重複を弾き、バックグラウンドで処理する)"""
+    __tablename__ = 'stripe_webhook_events'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    event_id = Column(String, nullable=False, unique=True, index=True)
+    event_type = Column(String, nullable=False)
+    # 同じキー (サブスクリプション ID など) のイベントは受信順に処理する
+    ordering_key = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default='pending', index=True)  # 'pending', 'processing', 'processed', 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String)
+    processed_at = Column(DateTime)
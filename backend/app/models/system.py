@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, UUID, Boolean, JSON, Text, ForeignKey, DateTime, Enum as SQLAlchemyEnum
+from sqlalchemy import Column, String, UUID, Boolean, JSON, Text, ForeignKey, DateTime, Index, text, Enum as SQLAlchemyEnum
 from sqlalchemy.orm import relationship
 import uuid
 from .base import Base, TimestampMixin
@@ -19,6 +19,13 @@ class SystemLog(Base):
 
 class Notification(Base):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # 全体通知はユーザーごとに 1 件だけ展開する
+        Index(
+            'uq_notifications_broadcast_user', 'broadcast_notification_id', 'user_id',
+            unique=True, postgresql_where=text('broadcast_notification_id IS NOT NULL')
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False)
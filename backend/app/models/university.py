@@ -1,15 +1,21 @@
-from sqlalchemy import Column, String, UUID, Boolean, Text, ForeignKey, Integer
+from sqlalchemy import Column, String, UUID, Boolean, Text, ForeignKey, Integer, Float, Index, func
 from sqlalchemy.orm import relationship
+import random
 import uuid
 from .base import Base, TimestampMixin
 
 class University(Base, TimestampMixin):
     __tablename__ = 'universities'
+    __table_args__ = (
+        Index('ix_universities_random_key', 'random_key'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
     university_code = Column(String, unique=True, nullable=False)
     is_active = Column(Boolean, default=True)
+    # おすすめの抽出用の乱数キー (app.services.recommendation_pool)
+    random_key = Column(Float, nullable=False, default=random.random, server_default=func.random())
 
     # Relationships
     details = relationship("UniversityDetails", back_populates="university", uselist=False)
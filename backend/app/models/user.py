@@ -233,7 +233,7 @@ class TokenBlacklist(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False)
     expires_at = Column(DateTime, nullable=False)
     reason = Column(SQLAlchemyEnum(TokenBlacklistReason), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     user = relationship("User", back_populates="token_blacklist")
@@ -107,7 +107,8 @@ class BaseAgent:
         multi_modal_processor: Optional[MultiModalProcessor] = None,
         security_manager: Optional[SecurityManager] = None,
         performance_optimizer: Optional[PerformanceOptimizer] = None,
-        collaboration_manager: Optional[CollaborationManager] = None
+        collaboration_manager: Optional[CollaborationManager] = None,
+        context_window: Optional[Any] = None # fit(messages) -> (kept, dropped) を持つトークン予算マネージャ
     ):
         self.name = name
         self.instructions = instructions
@@ -151,6 +152,7 @@ class BaseAgent:
         self.security_manager = security_manager
         self.performance_optimizer = performance_optimizer
         self.collaboration_manager = collaboration_manager or CollaborationManager()
+        self.context_window = context_window
 
         self._handoff_depth = 0
         self._memory: List[Dict[str, Any]] = []
@@ -555,6 +557,12 @@ class BaseAgent:
                 final_processed_messages = [system_prompt] + memory_to_include + messages
         else:
             final_processed_messages = [system_prompt] + memory_to_include + messages
+
+        # トークン予算が設定されていれば、system と直近のメッセージだけを予算内に残す
+        if self.context_window is not None:
+            final_processed_messages, dropped_messages = self.context_window.fit(final_processed_messages)
+            if dropped_messages:
+                print(f"[{self.name}] Dropped {len(dropped_messages)} old message(s) to fit the token budget.")
         
         # # LearningEngineによるパーソナライズ例 (プロンプト調整など)
         # if self.learning_engine and session_id: # user_id も必要
@@ -17,6 +17,12 @@ class AnthropicAdapter(BaseLLMAdapter):
 
     def __init__(self, model_name: str, api_key: Optional[str] = None, base_url: Optional[str] = None, **kwargs):
         super().__init__(model_name, api_key, base_url, **kwargs)
+        # 共有クライアント (app.services.llm_clients) が渡された場合はそれを使い、close() でも閉じない
+        shared_client = self.extra_params.get("client")
+        self._owns_client = shared_client is None
+        if shared_client is not None:
+            self.client = shared_client
+            return
         try:
             # base_url は Anthropic SDK では直接サポートされていない場合があるため、
             # 必要であれば httpx.AsyncClient をカスタマイズして渡す必要がある。
@@ -342,7 +348,7 @@ class AnthropicAdapter(BaseLLMAdapter):
         """
         AsyncAnthropicクライアントを閉じます。
         """
-        if self.client:
+        if self.client and self._owns_client:
             await self.client.close()
             print("[AnthropicAdapter] AsyncAnthropic client closed.")
 
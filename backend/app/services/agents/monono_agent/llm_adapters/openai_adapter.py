@@ -18,6 +18,12 @@ class OpenAIAdapter(BaseLLMAdapter):
 
     def __init__(self, model_name: str, api_key: Optional[str] = None, base_url: Optional[str] = None, **kwargs):
         super().__init__(model_name, api_key, base_url, **kwargs)
+        # 共有クライアント (app.services.llm_clients) が渡された場合はそれを使い、close() でも閉じない
+        shared_client = self.extra_params.get("client")
+        self._owns_client = shared_client is None
+        if shared_client is not None:
+            self.client = shared_client
+            return
         try:
             self.client = AsyncOpenAI(
                 api_key=self.api_key,
@@ -323,6 +329,6 @@ class OpenAIAdapter(BaseLLMAdapter):
         """
         AsyncOpenAIクライアントを閉じます。
         """
-        if self.client:
+        if self.client and self._owns_client:
             await self.client.close()
             print("[OpenAIAdapter] AsyncOpenAI client closed.")
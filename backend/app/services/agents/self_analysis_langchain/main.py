@@ -1,5 +1,6 @@
 from langgraph.graph import StateGraph, START, END
 from typing_extensions import TypedDict
+from sqlalchemy import update
 import inspect
 import json
 import logging
@@ -7,6 +8,7 @@ import logging
 # Local application imports
 from app.database.database import AsyncSessionLocal 
 from app.models.self_analysis import SelfAnalysisSession 
+from app.services.llm_clients import on_llm_clients_closed
 from .steps.future import FutureStepAgent
 from .steps.gap import GapStepAgent
 from .steps.history import HistoryStepAgent
@@ -20,13 +22,50 @@ logger = logging.getLogger(__name__)
 class SelfAnalysisState(TypedDict):
     messages: list
     session_id: str
+    current_step: str | None      # 実行中のステップ (run() で DB から一度だけ読み込み、ステップ遷移で更新)
     next_step: str | None
     current_response: str | None  # Add field for current agent response
     user_message: str | None      # Add field for user-facing message
 
+# ステップ名 → ステップエージェントのクラス
+STEP_AGENT_CLASSES = {
+    "FUTURE": FutureStepAgent,
+    "MOTIVATION": MotivationStepAgent,
+    "HISTORY": HistoryStepAgent,
+    "GAP": GapStepAgent,
+    "VISION": VisionStepAgent,
+    "REFLECT": ReflectStepAgent,
+}
+
+# 構築済みのステップエージェント (プロセス内で共有)
+_step_agents: dict = {}
+# ChatOpenAI は共有の HTTP クライアントを持つので、クライアントを閉じたら作り直す
+on_llm_clients_closed(_step_agents.clear)
+
+
+def get_step_agent(step: str):
+    """
+    ステップエージェントを初回だけ構築して使い回す。
+    ChatOpenAI / プロンプト / AgentExecutor の構築はターンごとに行うと重いが、
+    エージェント自体はセッション固有の状態を持たない (入力は毎回 state から渡す) ので共有してよい。
+    """
+    agent = _step_agents.get(step)
+    if agent is None:
+        agent = STEP_AGENT_CLASSES[step]()
+        _step_agents[step] = agent
+    return agent
+
+
+def warm_up_step_agents() -> None:
+    """起動時に全ステップのエージェントを構築しておく"""
+    for step in STEP_AGENT_CLASSES:
+        get_step_agent(step)
+    logger.info(f"Self-analysis step agents built: {list(_step_agents)}")
+
+
 # ステップ実行のラッパー関数を定義
 async def run_future_step(state: SelfAnalysisState) -> SelfAnalysisState:
-    agent = FutureStepAgent()
+    agent = get_step_agent("FUTURE")
     response = await agent(state)
     
     # Debug logging
@@ -43,13 +82,14 @@ async def run_future_step(state: SelfAnalysisState) -> SelfAnalysisState:
     
     return {
         **state, 
+        "current_step": next_step or "FUTURE",
         "next_step": next_step,
         "current_response": response,
         "user_message": user_message
     }
 
 async def run_motivation_step(state: SelfAnalysisState) -> SelfAnalysisState:
-    agent = MotivationStepAgent()
+    agent = get_step_agent("MOTIVATION")
     response = await agent(state)
     
     # Debug logging
@@ -65,13 +105,14 @@ async def run_motivation_step(state: SelfAnalysisState) -> SelfAnalysisState:
     
     return {
         **state, 
+        "current_step": next_step or "MOTIVATION",
         "next_step": next_step,
         "current_response": response,
         "user_message": user_message
     }
 
 async def run_history_step(state: SelfAnalysisState) -> SelfAnalysisState:
-    agent = HistoryStepAgent()
+    agent = get_step_agent("HISTORY")
     response = await agent(state)
     
     # Debug logging
@@ -87,13 +128,14 @@ async def run_history_step(state: SelfAnalysisState) -> SelfAnalysisState:
     
     return {
         **state, 
+        "current_step": next_step or "HISTORY",
         "next_step": next_step,
         "current_response": response,
         "user_message": user_message
     }
 
 async def run_gap_step(state: SelfAnalysisState) -> SelfAnalysisState:
-    agent = GapStepAgent()
+    agent = get_step_agent("GAP")
     response = await agent(state)
     
     # Debug logging
@@ -109,13 +151,14 @@ async def run_gap_step(state: SelfAnalysisState) -> SelfAnalysisState:
     
     return {
         **state, 
+        "current_step": next_step or "GAP",
         "next_step": next_step,
         "current_response": response,
         "user_message": user_message
     }
 
 async def run_vision_step(state: SelfAnalysisState) -> SelfAnalysisState:
-    agent = VisionStepAgent()
+    agent = get_step_agent("VISION")
     response = await agent(state)
     
     # Debug logging
@@ -131,13 +174,14 @@ async def run_vision_step(state: SelfAnalysisState) -> SelfAnalysisState:
     
     return {
         **state, 
+        "current_step": next_step or "VISION",
         "next_step": next_step,
         "current_response": response,
         "user_message": user_message
     }
 
 async def run_reflect_step(state: SelfAnalysisState) -> SelfAnalysisState:
-    agent = ReflectStepAgent()
+    agent = get_step_agent("REFLECT")
     response = await agent(state)
     
     # Debug logging
@@ -152,6 +196,7 @@ async def run_reflect_step(state: SelfAnalysisState) -> SelfAnalysisState:
     
     return {
         **state, 
+        "current_step": "REFLECT",
         "next_step": next_step,  # End of flow
         "current_response": response,
         "user_message": user_message
@@ -387,142 +432,18 @@ def is_step_completed(step: str, response: str | dict) -> bool:
 
 # 動的ノード選択関数  
 def select_step_node(state: SelfAnalysisState) -> str:
-    """状態に基づいて実行するステップを決定"""
-    session_id = state.get("session_id", "")
-    messages = state.get("messages", [])
-    
-    # DBから現在のステップを取得
-    try:
-        import asyncio
-        async def get_current_step():
-            async with AsyncSessionLocal() as db:
-                sa = await db.get(SelfAnalysisSession, session_id)
-                return sa.current_step if sa else "FUTURE"
-        
-        # 非同期関数を同期的に実行
-        try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # 既存のループ内で実行中の場合は新しいタスクとして実行
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(asyncio.run, get_current_step())
-                    current_step = future.result(timeout=5)
-            else:
-                current_step = asyncio.run(get_current_step())
-        except (RuntimeError, Exception) as e:
-            # イベントループ関連のエラーの場合は、同期的にDBアクセスを試行
-            try:
-                # 同期セッションを使って直接DBアクセス
-                logger.warning(f"Cannot access event loop for session {session_id}, trying synchronous DB access: {e}")
-                from sqlalchemy import create_engine
-                from sqlalchemy.orm import sessionmaker
-                from app.core.config import settings
-                
-                sync_engine = create_engine(settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://"))
-                SyncSessionLocal = sessionmaker(bind=sync_engine)
-                
-                with SyncSessionLocal() as db:
-                    sa = db.get(SelfAnalysisSession, session_id)
-                    current_step = sa.current_step if sa else "FUTURE"
-                    logger.info(f"Retrieved current step synchronously: {current_step}")
-                    return determine_current_step(current_step, len(messages))
-                    
-            except Exception as sync_e:
-                logger.error(f"Synchronous DB access also failed for session {session_id}: {sync_e}")
-                return "FUTURE"
-            
-        return determine_current_step(current_step, len(messages))
-    except Exception as e:
-        logger.error(f"Error getting current step for session {session_id}: {e}")
-        return "FUTURE"  # デフォルト
+    """状態に基づいて実行するステップを決定 (current_step は run() で読み込み済み)"""
+    return determine_current_step(state.get("current_step"), len(state.get("messages", [])))
 
 # 条件分岐でフェーズ移行を制御する関数を追加
 def decide_next_step(state: SelfAnalysisState) -> str:
-    """ステップ完了状況に基づいて次のアクションを決定"""
-    session_id = state.get("session_id", "")
-    current_response = state.get("current_response", "")
-    
-    try:
-        import asyncio
-        async def get_current_step_and_check():
-            async with AsyncSessionLocal() as db:
-                sa = await db.get(SelfAnalysisSession, session_id)
-                if not sa:
-                    return "FUTURE", False
-                
-                current_step = sa.current_step or "FUTURE"
-                step_completed = is_step_completed(current_step, current_response)
-                return current_step, step_completed
-        
-        # 非同期関数を同期的に実行
-        try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(asyncio.run, get_current_step_and_check())
-                    current_step, step_completed = future.result(timeout=5)
-            else:
-                current_step, step_completed = asyncio.run(get_current_step_and_check())
-        except (RuntimeError, Exception) as e:
-            # イベントループ関連のエラーの場合は、同期的にDBアクセスを試行
-            try:
-                logger.warning(f"Cannot access event loop for session {session_id}, trying synchronous DB access: {e}")
-                from sqlalchemy import create_engine
-                from sqlalchemy.orm import sessionmaker
-                from app.core.config import settings
-                
-                sync_engine = create_engine(settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://"))
-                SyncSessionLocal = sessionmaker(bind=sync_engine)
-                
-                with SyncSessionLocal() as db:
-                    sa = db.get(SelfAnalysisSession, session_id)
-                    if not sa:
-                        current_step, step_completed = "FUTURE", False
-                    else:
-                        current_step = sa.current_step or "FUTURE"
-                        step_completed = is_step_completed(current_step, current_response)
-                    logger.info(f"Retrieved step info synchronously: {current_step}, completed: {step_completed}")
-                    
-            except Exception as sync_e:
-                logger.error(f"Synchronous DB access also failed for session {session_id}: {sync_e}")
-                return END
-        
-        if step_completed:
-            next_step = get_next_step(current_step)
-            if next_step:
-                logger.info(f"Step {current_step} completed, moving to {next_step}")
-                # DB更新もここで実行して一貫性を保つ
-                try:
-                    from sqlalchemy import create_engine
-                    from sqlalchemy.orm import sessionmaker
-                    from app.core.config import settings
-                    
-                    sync_engine = create_engine(settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://"))
-                    SyncSessionLocal = sessionmaker(bind=sync_engine)
-                    
-                    with SyncSessionLocal() as db:
-                        sa = db.get(SelfAnalysisSession, session_id)
-                        if sa:
-                            sa.current_step = next_step
-                            db.add(sa)
-                            db.commit()
-                            logger.info(f"Updated SelfAnalysisSession {session_id}: {current_step} -> {next_step}")
-                except Exception as update_err:
-                    logger.error(f"Failed to update step in decide_next_step: {update_err}")
-                
-                return next_step
-            else:
-                logger.info(f"All steps completed for session {session_id}")
-                return END
-        else:
-            logger.info(f"Step {current_step} not completed, staying on current step")
-            return END  # フローを終了してユーザーの次の入力を待つ
-            
-    except Exception as e:
-        logger.error(f"Error in decide_next_step for session {session_id}: {e}")
-        return END
+    """ステップ完了状況に基づいて次のアクションを決定 (完了判定は各ステップのノードで済ませている)"""
+    next_step = state.get("next_step")
+    if next_step:
+        logger.info(f"Step completed for session {state.get('session_id', '')}, moving to {next_step}")
+        return next_step
+    logger.info(f"Step {state.get('current_step')} not completed, staying on current step")
+    return END  # フローを終了してユーザーの次の入力を待つ
 
 # Graphオーケストレーターの構築
 builder = StateGraph(SelfAnalysisState)
@@ -612,17 +533,20 @@ class SelfAnalysisOrchestrator:
         """
         logger.info(f"SelfAnalysisOrchestrator.run starting for session {session_id} with {len(messages)} messages")
         
-        # Ensure session exists before processing
+        # 現在のステップはここで一度だけ読み込み、グラフ内では state で持ち回る
+        # (ノートは session_id を外部キーに持つので、新規セッションはグラフ実行前に作成する)
+        current_step = "FUTURE"
         try:
             async with AsyncSessionLocal() as db:
                 sa = await db.get(SelfAnalysisSession, session_id)
                 if not sa:
-                    sa = SelfAnalysisSession(id=session_id, current_step="FUTURE")
+                    sa = SelfAnalysisSession(id=session_id, current_step=current_step)
                     db.add(sa)
                     await db.commit()
                     logger.info(f"Created new SelfAnalysisSession for {session_id}")
                 else:
-                    logger.info(f"Found existing SelfAnalysisSession for {session_id}, step: {sa.current_step}")
+                    current_step = sa.current_step or "FUTURE"
+                    logger.info(f"Found existing SelfAnalysisSession for {session_id}, step: {current_step}")
         except Exception as db_err:
             logger.error(f"Database error creating session in SelfAnalysisOrchestrator: {db_err}", exc_info=True)
             # Continue execution even if DB session creation fails
@@ -631,6 +555,7 @@ class SelfAnalysisOrchestrator:
             initial_state = SelfAnalysisState(
                 messages=messages, 
                 session_id=session_id, 
+                current_step=current_step,
                 next_step=None,
                 current_response=None,
                 user_message=None
@@ -640,7 +565,8 @@ class SelfAnalysisOrchestrator:
             result = await self.orchestrator.ainvoke(initial_state)
             logger.info(f"Orchestrator ainvoke completed. Result: {result}")
             
-            # Note: DB updates are now handled within decide_next_step for consistency
+            # ステップ遷移はグラフ実行後にまとめて 1 回だけ書き込む
+            await self._save_current_step(session_id, current_step, result.get("current_step") or current_step)
             logger.info(f"Orchestrator completed for session {session_id}")
             
             # Return user-facing message instead of raw state
@@ -656,3 +582,23 @@ class SelfAnalysisOrchestrator:
         except Exception as e:
             logger.error(f"Error in SelfAnalysisOrchestrator.run for session {session_id}: {e}", exc_info=True)
             return {"user_visible": "申し訳ございませんが、自己分析処理中にエラーが発生しました。もう一度お試しください。"}
+
+    async def _save_current_step(self, session_id: str, loaded_step: str, final_step: str) -> None:
+        """ステップが進んだ場合だけ current_step を 1 回の UPDATE で保存する"""
+        if final_step == loaded_step:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(SelfAnalysisSession)
+                    .where(SelfAnalysisSession.id == session_id)
+                    .values(current_step=final_step)
+                )
+                await db.commit()
+            logger.info(f"Updated SelfAnalysisSession {session_id}: {loaded_step} -> {final_step}")
+        except Exception as db_err:
+            logger.error(f"Failed to update step for session {session_id}: {db_err}", exc_info=True)
+
+
+# オーケストレーターは状態を持たないのでリクエスト間で共有する
+self_analysis_orchestrator = SelfAnalysisOrchestrator()
@@ -241,5 +241,32 @@ async def test_orchestrator_run_with_existing_session_mocked_ainvoke(orchestrato
     assert updated_instance.current_step == "CONTINUATION_COMPLETED" 
     mock_db_operations.commit.assert_called_once()
 
+def test_step_agents_are_built_once_and_shared():
+    """ステップエージェントは初回だけ構築され、以降のターン・セッションで使い回される。"""
+    from app.services.agents.self_analysis_langchain import main as main_module
+
+    with patch.dict(main_module._step_agents, clear=True), \
+         patch.object(main_module, "STEP_AGENT_CLASSES", {"FUTURE": MagicMock(side_effect=lambda: object())}) as classes:
+        first = main_module.get_step_agent("FUTURE")
+        second = main_module.get_step_agent("FUTURE")
+
+    assert first is second
+    classes["FUTURE"].assert_called_once_with()
+
+def test_routing_uses_current_step_from_state():
+    """ルーティングは DB を見ずに state の current_step / next_step だけで決まる。"""
+    from langgraph.graph import END
+    from app.services.agents.self_analysis_langchain.main import decide_next_step, select_step_node
+
+    state = SelfAnalysisState(messages=[], session_id="s", current_step="GAP", next_step=None, current_response=None, user_message=None)
+
+    with patch("app.services.agents.self_analysis_langchain.main.AsyncSessionLocal") as session_factory:
+        assert select_step_node(state) == "GAP"
+        assert select_step_node({**state, "current_step": None}) == "FUTURE"
+        assert decide_next_step(state) == END
+        assert decide_next_step({**state, "current_step": "VISION", "next_step": "VISION"}) == "VISION"
+
+    session_factory.assert_not_called()
+
 # TODO: (TEST.MD IV, V) 異常系テスト（不正な入力、外部サービスエラーなど）
 # TODO: (TEST.MD I.C, I.F) 各StepAgentのロジック（プロンプト、ツール呼び出し）のより詳細なユニットテスト (各test_XXX_step.pyにて) 
\ No newline at end of file
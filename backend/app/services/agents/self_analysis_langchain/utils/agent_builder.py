@@ -3,6 +3,8 @@ from langchain.agents import create_openai_functions_agent, AgentExecutor
 from langchain.prompts import PromptTemplate
 import logging
 
+from app.services.llm_clients import get_http_client
+
 logger = logging.getLogger(__name__)
 
 def build_step_agent(step_prompt: str, tools: list):
@@ -36,6 +38,7 @@ Agent Scratchpad (for agent's internal thoughts and tool usage):
         request_timeout=60,  # Add timeout
         streaming=False,  # Disable streaming to reduce token usage
         max_tokens=1000,  # Limit output tokens to reduce rate limiting
+        http_async_client=get_http_client(),  # 共有コネクションプールを使う
     )
     
     # Create function agent
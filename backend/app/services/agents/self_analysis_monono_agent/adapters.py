@@ -1,5 +1,4 @@
-import os
-from app.services.agents.monono_agent.llm_adapters.openai_adapter import OpenAIAdapter
+from app.services.llm_clients import get_llm_adapter
 
-# モデル名と環境変数から取得した API キーを使ったアダプタ
-openai_adapter = OpenAIAdapter(model_name="gpt-4.1", api_key=os.getenv("OPENAI_API_KEY")) 
\ No newline at end of file
+# 共有 HTTP クライアントを使うアダプタ (app.services.llm_clients でモデルごとに共有)
+openai_adapter = get_llm_adapter("openai", "gpt-4.1") 
\ No newline at end of file
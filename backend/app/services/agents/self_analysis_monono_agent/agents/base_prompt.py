@@ -1,4 +1,3 @@
-import os
 import logging
 from pathlib import Path
 import uuid
@@ -9,6 +8,8 @@ from app.services.agents.monono_agent.llm_adapters.openai_adapter import OpenAIA
 from app.services.agents.monono_agent.components.guardrail import BaseGuardrail
 from app.services.agents.monono_agent.components.trace_logger import TraceLogger
 from app.services.agents.monono_agent.components.planning_engine import PlanningEngine
+from app.services.context_window import chat_context_window
+from app.services.llm_clients import get_llm_adapter
 from ..adapters import openai_adapter
 from ..guardrails import SelfAnalysisGuardrail
 from ..context_resources import ctx_mgr, rm, trace
@@ -27,8 +28,7 @@ def default_openai_adapter() -> OpenAIAdapter:
     """
     OpenAIAdapter をデフォルト設定で作成する。
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    return OpenAIAdapter(model_name="gpt-4o-mini", api_key=api_key)
+    return get_llm_adapter("openai", "gpt-4o-mini")
 
 
 def default_guardrail() -> BaseGuardrail:
@@ -75,6 +75,9 @@ class BaseSelfAnalysisAgent(BaseAgent):
         # Pop subclass-provided tools to avoid passing duplicate
         custom_tools = kwargs.pop("tools", None)
         tools_to_use = custom_tools if custom_tools is not None else []
+
+        # プロンプト全体をチャットと同じトークン予算に収める
+        context_window = kwargs.pop("context_window", chat_context_window)
         super().__init__(
             name=step_id.title(),
             instructions=full_instructions,
@@ -89,6 +92,7 @@ class BaseSelfAnalysisAgent(BaseAgent):
                 llm_adapter=openai_adapter,
                 model="gpt-4o"
             ),
+            context_window=context_window,
             **kwargs,
         )
 
@@ -1,16 +1,12 @@
-import os
 import math
 
-from openai import AsyncOpenAI
+from app.services.llm_clients import get_openai_client
 
 # 抽象度が低すぎる or 意味が薄い語
 NG_WORDS = {"好き", "頑張り", "IT"}
 # 埋め込み類似度の閾値
 THRESHOLD = 0.9
 
-# AsyncOpenAIクライアントを初期化
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 async def normalize_values(session_id: str, values: list[str]) -> list[str]:
     """
     OpenAI Embeddingsで類似度を計算し、重複表記をまとめた上でNG_WORDSを除外して返します。
@@ -18,7 +14,7 @@ async def normalize_values(session_id: str, values: list[str]) -> list[str]:
     if not values:
         return []
     # 埋め込みを取得
-    response = await client.embeddings.create(
+    response = await get_openai_client().embeddings.create(
         model="text-embedding-ada-002",
         input=values
     )
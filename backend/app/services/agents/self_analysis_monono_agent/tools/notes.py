@@ -1,5 +1,7 @@
-from typing import Optional, List
+from collections import defaultdict
+from typing import Dict, Optional, List
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.database import AsyncSessionLocal
 from app.models.self_analysis import SelfAnalysisNote as Note, Summary
 
@@ -25,6 +27,25 @@ async def list_notes(session_id: str, step: Optional[str] = None) -> List[dict]:
         notes = result.scalars().all()
         return [n.content for n in notes]
 
+async def list_notes_by_step(session_id: str, db: Optional[AsyncSession] = None) -> Dict[str, List[dict]]:
+    """
+    セッションの全ステップのノートを 1 クエリで取得し、ステップごとにまとめて返します。
+    db を渡すとそのセッションで読みます (渡さなければ新しく開きます)。
+    """
+    if db is None:
+        async with AsyncSessionLocal() as db:
+            return await list_notes_by_step(session_id, db)
+
+    result = await db.execute(
+        select(Note.step, Note.content)
+        .where(Note.session_id == session_id)
+        .order_by(Note.created_at, Note.id)
+    )
+    notes: Dict[str, List[dict]] = defaultdict(list)
+    for step, content in result.all():
+        notes[step].append(content)
+    return dict(notes)
+
 async def get_summary(session_id: str) -> dict:
     """
     指定のセッションIDのサマリーを取得します。
@@ -55,7 +55,7 @@
 # #     ... 
 
 from uuid import uuid4
-from app.services.agents.self_analysis_langchain.main import SelfAnalysisOrchestrator
+from app.services.agents.self_analysis_langchain.main import self_analysis_orchestrator
 import logging
 from typing import List, Dict, Optional, Any
 
@@ -69,9 +69,8 @@ async def get_self_analysis_agent_response(user_input: str, history: Optional[Li
     try:
         # 新しいセッションIDを生成し、オーケストレーターで自己分析を実行
         session_id = str(uuid4())
-        orchestrator = SelfAnalysisOrchestrator()
         # messages リストを渡して実行
-        result = await orchestrator.run([{"role": "user", "content": user_input}], session_id)
+        result = await self_analysis_orchestrator.run([{"role": "user", "content": user_input}], session_id)
         # user_visible にクライアントに返す内容が含まれる
         if isinstance(result, dict):
             return result.get("user_visible") or result.get("final_notes") or None
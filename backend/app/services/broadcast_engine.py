@@ -0,0 +1,173 @@
+"""
+全体通知 (broadcast_notifications) の展開と配信。
+
+以前は全体通知を保存するだけで、対象ロールのユーザーへ展開する処理がなかった。
+ユーザーを 1 人ずつ ORM で追加すると数万人の学校・ロール向けでは何時間もかかるため、
+
+- 配信時刻になった全体通知を sent_at の UPDATE で確保し、同じトランザクションで
+  対象ユーザーの notifications / in_app_notifications を INSERT ... SELECT で書き込む
+  (対象ユーザーの解決は user_roles / broadcast_target_* に対する 1 つのクエリ)
+- コミット後、メール・プッシュの対象を settings.BROADCAST_DELIVERY_CHUNK_SIZE 件ずつ読み出して
+  メールは送信キュー (email_outbox) へまとめて積み、プッシュは push_delivery で並列に送る
+  (読み出しのセッションは送信前に閉じ、失効した購読の削除は別の短いセッションで行う)
+
+静かな時間帯のユーザーにはメール・プッシュを送らない (アプリ内通知は音が鳴らないので常に書き込む)。
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Optional
+from uuid import UUID
+
+from sqlalchemy import delete as sql_delete, select
+
+from app.core.config import settings
+from app.crud import broadcast as crud_broadcast
+from app.database.database import AsyncSessionLocal
+from app.models.push_subscription import PushSubscription
+from app.services.email import send_notification_emails
+from app.services.push_delivery import push_delivery
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BroadcastReport:
+    """全体通知 1 件の展開・配信の結果"""
+    broadcast_id: UUID
+    notifications: int = 0
+    in_app_notifications: int = 0
+    emails: int = 0
+    pushes: int = 0
+    materialize_seconds: float = 0.0
+    deliver_seconds: float = 0.0
+
+
+class BroadcastEngine:
+    """配信時刻になった全体通知を展開して配信するワーカー"""
+
+    def __init__(
+        self,
+        chunk_size: int,
+        poll_seconds: float,
+        session_factory: Callable[[], Any] = AsyncSessionLocal,
+    ):
+        self.chunk_size = chunk_size
+        self.poll_seconds = poll_seconds
+        self._session_factory = session_factory
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """ワーカーを起動する (アプリ起動時に呼ぶ)"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_pending()
+            except Exception as e:  # ワーカー自体は止めない
+                logger.error(f"Unexpected error in broadcast engine: {e}", exc_info=True)
+            await asyncio.sleep(self.poll_seconds)
+
+    async def run_pending(self) -> int:
+        """配信時刻になった全体通知をすべて処理し、処理した件数を返す"""
+        async with self._session_factory() as db:
+            broadcast_ids = await crud_broadcast.list_pending_broadcast_ids(db, datetime.utcnow())
+        processed = 0
+        for broadcast_id in broadcast_ids:
+            if await self.process(broadcast_id) is not None:
+                processed += 1
+        return processed
+
+    async def process(self, broadcast_id: UUID) -> Optional[BroadcastReport]:
+        """
+        全体通知を 1 件展開して配信する。
+        他のプロセスが確保済み・展開済みなら何もせず None を返す。
+        """
+        report = BroadcastReport(broadcast_id=broadcast_id)
+        started = time.perf_counter()
+        async with self._session_factory() as db:
+            now = datetime.utcnow()
+            broadcast = await crud_broadcast.claim_broadcast(db, broadcast_id, now)
+            if broadcast is None:
+                await db.rollback()
+                return None
+            report.notifications, report.in_app_notifications = await crud_broadcast.materialize_broadcast(
+                db, broadcast, now
+            )
+            await db.commit()
+        report.materialize_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            await self._deliver(broadcast, report)
+        except Exception as e:
+            # 通知自体は書き込み済みなので、配信の失敗で全体通知をやり直すことはしない
+            logger.error(f"Broadcast {broadcast_id} delivery failed: {e}", exc_info=True)
+        report.deliver_seconds = time.perf_counter() - started
+
+        logger.info(
+            f"Broadcast {broadcast_id}: {report.notifications} notification(s) and "
+            f"{report.in_app_notifications} in-app notification(s) in {report.materialize_seconds:.2f}s, "
+            f"{report.emails} email(s) queued and {report.pushes} push(es) sent in {report.deliver_seconds:.2f}s"
+        )
+        return report
+
+    async def _deliver(self, broadcast, report: BroadcastReport) -> None:
+        current_time = datetime.now().time()
+        message = broadcast.content or broadcast.title
+        payload = {
+            "title": broadcast.title,
+            "message": message,
+            "data": {"broadcast_notification_id": str(broadcast.id), "action_url": broadcast.action_url},
+        }
+        # 対象とプッシュの購読は chunk ごとに短いセッションで読み出し、送信中は DB 接続を持たない
+        after_user_id = None
+        while True:
+            async with self._session_factory() as db:
+                chunk = await crud_broadcast.list_delivery_recipients(
+                    db, broadcast, current_time, self.chunk_size, after_user_id
+                )
+                push_user_ids = [user_id for user_id, _, _, _, push_enabled in chunk if push_enabled]
+                subscriptions = (await db.execute(
+                    select(PushSubscription).where(PushSubscription.user_id.in_(push_user_ids))
+                )).scalars().all() if push_user_ids else []
+            if not chunk:
+                return
+            after_user_id = chunk[-1][0]
+
+            recipients = [
+                {"email": email, "name": name}
+                for _, email, name, email_enabled, _ in chunk if email_enabled
+            ]
+            if recipients and await send_notification_emails(recipients, subject=broadcast.title, message=message):
+                report.emails += len(recipients)
+
+            if subscriptions:
+                delivery = await push_delivery.deliver(subscriptions, payload)
+                report.pushes += len(delivery.sent_ids)
+                if delivery.gone_ids:
+                    async with self._session_factory() as db:
+                        await db.execute(sql_delete(PushSubscription).where(PushSubscription.id.in_(delivery.gone_ids)))
+                        await db.commit()
+
+            if len(chunk) < self.chunk_size:
+                return
+
+
+broadcast_engine = BroadcastEngine(
+    chunk_size=settings.BROADCAST_DELIVERY_CHUNK_SIZE,
+    poll_seconds=settings.BROADCAST_POLL_SECONDS,
+)
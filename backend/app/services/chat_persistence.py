@@ -0,0 +1,227 @@
+"""
+チャットのライトビハインド永続化。
+
+WebSocket チャットは 1 ターンごとにユーザーメッセージ保存・AI プレースホルダー保存・
+ストリーミング後の更新でそれぞれ commit/refresh しており、最初のトークンを返す前に
+複数回の DB 往復を待っていた。
+
+ここではセッション作成・タイトル更新・メッセージ挿入をキューに積み、
+バックグラウンドのワーカーが溜まった分を 1 トランザクションでまとめて書き込む。
+呼び出し側 (WebSocket ハンドラ) は enqueue するだけで commit を待たない。
+"""
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func, insert, update
+
+from app.database.database import AsyncSessionLocal
+from app.models.chat import ChatMessage, ChatSession
+from app.models.enums import MessageSender
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PendingWrite:
+    """キューに積まれた 1 件分の書き込み"""
+    kind: str  # "session" / "title" / "summary" / "message"
+    values: Dict[str, Any]
+    # 書き込み完了 (True) / 破棄 (False) で解決される
+    done: Optional[asyncio.Future] = None
+
+
+class ChatWriteBehindQueue:
+    """
+    チャットの書き込みを非同期にまとめて DB へ反映するキュー。
+
+    - 書き込みは投入順に適用される (セッション作成 → タイトル更新 → メッセージ)
+    - 1 バッチ = 1 トランザクション。失敗時は max_retries 回までリトライし、
+      それでも失敗したバッチは 1 件ずつ書き直して問題のある行だけを捨てる
+    - created_at は投入時刻を明示的に入れるため、同一トランザクションで
+      書かれたユーザー/AI メッセージの順序も保たれる
+    - 各投入メソッドは完了を表す Future を返す。投入順に適用されるため、
+      最後に投入した分の Future を待てば自分の書き込みはすべて読める
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Any] = AsyncSessionLocal,
+        max_batch_size: int = 200,
+        max_queue_size: int = 10000,
+        max_retries: int = 3,
+        retry_delay_seconds: float = 0.2,
+    ):
+        self._session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_delay_seconds = retry_delay_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    # --- 投入 API ---
+
+    async def add_session(self, chat_session: ChatSession) -> asyncio.Future:
+        """メモリ上で作成したチャットセッションの INSERT を予約する"""
+        return await self._put(_PendingWrite("session", {
+            "id": chat_session.id,
+            "user_id": chat_session.user_id,
+            "title": chat_session.title,
+            "status": chat_session.status,
+            "chat_type": chat_session.chat_type,
+            "created_at": chat_session.created_at or _utcnow(),
+        }))
+
+    async def update_title(self, session_id: uuid.UUID, title: str) -> asyncio.Future:
+        """セッションタイトルの更新を予約する"""
+        return await self._put(_PendingWrite("title", {"session_id": session_id, "title": title}))
+
+    async def update_summary(self, session_id: uuid.UUID, summary: str, upto_message_id: int) -> asyncio.Future:
+        """会話のローリングサマリーの保存を予約する (一覧の並び順に影響しないよう updated_at は触らない)"""
+        return await self._put(_PendingWrite("summary", {
+            "session_id": session_id,
+            "summary": summary,
+            "upto_message_id": upto_message_id,
+        }))
+
+    async def add_message(
+        self,
+        session_id: uuid.UUID,
+        content: str,
+        sender: MessageSender,
+        user_id: Optional[uuid.UUID] = None,
+        created_at: Optional[datetime] = None,
+    ) -> asyncio.Future:
+        """チャットメッセージの INSERT を予約する"""
+        return await self._put(_PendingWrite("message", {
+            "session_id": session_id,
+            "user_id": user_id,
+            "sender": sender,
+            "content": content,
+            "created_at": created_at or _utcnow(),
+        }))
+
+    async def flush(self) -> None:
+        """投入済みの書き込みがすべて反映されるまで待つ"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """残りを書き出してからワーカーを停止する (アプリ終了時に呼ぶ)"""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # --- ワーカー ---
+
+    async def _put(self, item: _PendingWrite) -> asyncio.Future:
+        self._ensure_worker()
+        item.done = asyncio.get_running_loop().create_future()
+        # キューが一杯のときだけ呼び出し側を待たせる (バックプレッシャー)
+        await self._queue.put(item)
+        return item.done
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            return
+        if self._queue is None or self._queue.empty():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._write_batch(batch)
+            except Exception as e:  # ワーカー自体は止めない
+                logger.error(f"Unexpected error in chat write-behind worker: {e}", exc_info=True)
+            finally:
+                for item in batch:
+                    _resolve(item, False)
+                    queue.task_done()
+
+    async def _write_batch(self, batch: List[_PendingWrite]) -> None:
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await self._commit(batch)
+                logger.debug(f"Chat write-behind flushed {len(batch)} item(s)")
+                for item in batch:
+                    _resolve(item, True)
+                return
+            except Exception as e:
+                logger.warning(f"Chat write-behind batch of {len(batch)} failed (attempt {attempt}/{self.max_retries}): {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_delay_seconds * attempt)
+
+        if len(batch) == 1:
+            logger.error(f"Dropping chat write after {self.max_retries} attempts: {batch[0].kind} {batch[0].values.get('session_id') or batch[0].values.get('id')}")
+            return
+        # 1 件ずつ書き直し、失敗した行だけを捨てる
+        for item in batch:
+            try:
+                await self._commit([item])
+                _resolve(item, True)
+            except Exception as e:
+                logger.error(f"Dropping chat write {item.kind} {item.values.get('session_id') or item.values.get('id')}: {e}")
+
+    async def _commit(self, batch: List[_PendingWrite]) -> None:
+        session_rows = [item.values for item in batch if item.kind == "session"]
+        titles: Dict[uuid.UUID, str] = {}
+        for item in batch:
+            if item.kind == "title":
+                titles[item.values["session_id"]] = item.values["title"]
+        summaries: Dict[uuid.UUID, Dict[str, Any]] = {}
+        for item in batch:
+            if item.kind == "summary":
+                summaries[item.values["session_id"]] = item.values
+        message_rows = [item.values for item in batch if item.kind == "message"]
+
+        async with self._session_factory() as db:
+            if session_rows:
+                await db.execute(insert(ChatSession), session_rows)
+            for session_id, title in titles.items():
+                await db.execute(
+                    update(ChatSession)
+                    .where(ChatSession.id == session_id)
+                    .values(title=title, updated_at=func.now())
+                )
+            for session_id, values in summaries.items():
+                await db.execute(
+                    update(ChatSession)
+                    .where(ChatSession.id == session_id)
+                    .values(
+                        context_summary=values["summary"],
+                        context_summary_message_id=values["upto_message_id"],
+                    )
+                )
+            if message_rows:
+                await db.execute(insert(ChatMessage), message_rows)
+            await db.commit()
+
+
+def _resolve(item: _PendingWrite, written: bool) -> None:
+    # 解決済みなら何もしない (失敗時の後始末で二重に呼ばれる)
+    if item.done is not None and not item.done.done():
+        item.done.set_result(written)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+chat_write_behind = ChatWriteBehindQueue()
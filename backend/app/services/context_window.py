@@ -0,0 +1,167 @@
+"""
+LLM に渡すメッセージ列をトークン予算内に収めるためのユーティリティ。
+
+- トークン数はローカルの tokenizer (tiktoken) で数える。エンコーディングは
+  起動時に warm_up_tokenizer() でバックグラウンド読み込みし、読み込み前や
+  読み込めない環境 (オフラインなど) では UTF-8 長からの概算で代用する
+- ContextWindowManager は system プロンプトと直近のメッセージを予算内に残し、
+  あふれた古いメッセージを返す (呼び出し側でローリングサマリーに畳み込む)
+- summarize_messages は古い会話を既存のサマリーに畳み込む
+"""
+import asyncio
+import logging
+import math
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# メッセージ 1 件あたりのロール等のオーバーヘッド (OpenAI の chat フォーマット相当)
+MESSAGE_TOKEN_OVERHEAD = 4
+# gpt-4o 系のエンコーディング
+TOKENIZER_ENCODING = "o200k_base"
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算。日本語は 1 文字 ≒ 1 トークン、英数字は 3〜4 文字 ≒ 1 トークンなので
+    UTF-8 のバイト数 / 3 で多めに見積もる。
+    """
+    return math.ceil(len(text.encode("utf-8")) / 3) if text else 0
+
+
+def load_tokenizer() -> bool:
+    """tiktoken のエンコーディングを読み込む (初回はネットワークからの取得を伴うので同期 I/O)"""
+    global _encoding
+    if _encoding is not None:
+        return True
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        _count_tokens_cached.cache_clear()
+        logger.info(f"Tokenizer '{TOKENIZER_ENCODING}' loaded.")
+        return True
+    except Exception as e:
+        logger.warning(f"Tokenizer '{TOKENIZER_ENCODING}' unavailable, falling back to estimated token counts: {e}")
+        return False
+
+
+async def warm_up_tokenizer() -> bool:
+    """イベントループを止めないようスレッドで tokenizer を読み込む"""
+    return await asyncio.to_thread(load_tokenizer)
+
+
+@lru_cache(maxsize=4096)
+def _count_tokens_cached(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def count_tokens(text: str) -> int:
+    """テキストのトークン数 (system プロンプトなど同じ文字列はキャッシュされる)"""
+    return _count_tokens_cached(text) if text else 0
+
+
+def count_message_tokens(message: Dict[str, Any], counter: Callable[[str], int] = count_tokens) -> int:
+    """chat メッセージ 1 件のトークン数 (content とツール呼び出しの引数を含む)"""
+    tokens = MESSAGE_TOKEN_OVERHEAD
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += counter(content)
+    elif isinstance(content, list):
+        for part in content:
+            if isinstance(part, dict) and isinstance(part.get("text"), str):
+                tokens += counter(part["text"])
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function") or {}
+        tokens += counter(function.get("name") or "") + counter(function.get("arguments") or "")
+    return tokens
+
+
+class ContextWindowManager:
+    """system プロンプト + 直近のメッセージを max_tokens に収める"""
+
+    def __init__(self, max_tokens: int, counter: Callable[[str], int] = count_tokens):
+        self.max_tokens = max_tokens
+        self.counter = counter
+
+    def fit(self, messages: Sequence[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        (予算内に残したメッセージ, 切り捨てた古いメッセージ) を返す。
+        先頭の system メッセージと最新の 1 件は予算を超えても残す。
+        """
+        head_end = 0
+        while head_end < len(messages) and messages[head_end].get("role") == "system":
+            head_end += 1
+        head, body = list(messages[:head_end]), list(messages[head_end:])
+        if not body:
+            return head, []
+
+        budget = self.max_tokens - sum(count_message_tokens(m, self.counter) for m in head)
+        start = len(body) - 1
+        used = count_message_tokens(body[start], self.counter)
+        while start > 0:
+            tokens = count_message_tokens(body[start - 1], self.counter)
+            if used + tokens > budget:
+                break
+            used += tokens
+            start -= 1
+        # 対応する assistant(tool_calls) を失った tool メッセージは API に拒否されるので一緒に落とす
+        while start < len(body) - 1 and body[start].get("role") == "tool":
+            start += 1
+        return head + body[start:], body[:start]
+
+    def build(
+        self,
+        system_prompt: str,
+        history: Sequence[Dict[str, str]],
+        history_tokens: Sequence[int],
+        user_message: str,
+        summary: Optional[str] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        会話キャッシュのトークン数を使って OpenAI 用のメッセージ列を組み立てる。
+        history は再カウントせず、予算からあふれる古い分は (既にサマリーへ畳み込まれる前提で) 含めない。
+        """
+        head = [{"role": "system", "content": system_prompt}]
+        if summary:
+            head.append({"role": "system", "content": f"これまでの会話の要約:\n{summary}"})
+        user = {"role": "user", "content": user_message}
+        budget = self.max_tokens - sum(count_message_tokens(m, self.counter) for m in head) - count_message_tokens(user, self.counter)
+
+        start = len(history)
+        used = 0
+        while start > 0 and used + history_tokens[start - 1] <= budget:
+            used += history_tokens[start - 1]
+            start -= 1
+        return head + list(history[start:]) + [user]
+
+
+# WebSocket チャット用 (プロンプト全体の上限)
+chat_context_window = ContextWindowManager(max_tokens=settings.CHAT_CONTEXT_MAX_TOKENS)
+
+
+async def summarize_messages(previous_summary: Optional[str], messages: Sequence[Dict[str, str]]) -> str:
+    """古い会話を既存の要約に畳み込んだ新しい要約を返す"""
+    from app.services.llm_clients import get_openai_client
+
+    transcript = "\n".join(
+        f"{'ユーザー' if m.get('role') == 'user' else 'アシスタント'}: {m.get('content', '')}" for m in messages
+    )
+    prompt = (
+        "以下は会話の要約と、その後に続く会話です。両方を踏まえて、今後の応答に必要な事実・ユーザーの状況・"
+        "決まったことを漏らさないよう、日本語で簡潔な要約に更新してください。\n\n"
+        f"# これまでの要約\n{previous_summary or '(なし)'}\n\n# 続きの会話\n{transcript}"
+    )
+    response = await get_openai_client().chat.completions.create(
+        model=settings.CHAT_SUMMARY_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+    )
+    return (response.choices[0].message.content or "").strip()
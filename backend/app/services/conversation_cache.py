@@ -0,0 +1,213 @@
+"""
+チャットセッションごとの会話コンテキストキャッシュ。
+
+WebSocket チャットは毎ターン chat_messages からセッションの全履歴を読み直し、
+OpenAI 用のメッセージ列を一から組み立てていた。ここではセッションごとに
+組み立て済みの履歴と、読み込み済みメッセージ ID の最大値 (high-water mark) を保持し、
+毎ターンは high-water mark より新しい行だけを読んで末尾に追記する。
+
+履歴はトークン予算 (settings.CHAT_HISTORY_MAX_TOKENS) に収まる直近分だけを残し、
+予算からあふれた古いメッセージは追記のタイミングで一度だけ切り落とす。
+切り落とした分はバックグラウンドでローリングサマリーに畳み込み、
+chat_sessions.context_summary に保存する (次回のキャッシュミス時はサマリー以降だけを読む)。
+
+保存先は ConversationStore を実装すれば差し替えられる (既定はプロセス内 LRU)。
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Protocol, Sequence, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.chat import get_chat_messages_after
+from app.models.enums import MessageSender
+from app.services.chat_persistence import chat_write_behind
+from app.services.context_window import MESSAGE_TOKEN_OVERHEAD, count_tokens, summarize_messages
+
+logger = logging.getLogger(__name__)
+
+Summarizer = Callable[[Optional[str], Sequence[Dict[str, str]]], Awaitable[str]]
+
+
+def _openai_role(sender) -> str:
+    value = sender.value if isinstance(sender, MessageSender) else str(sender).lower()
+    return "assistant" if value == MessageSender.AI.value else "user"
+
+
+@dataclass
+class ConversationContext:
+    """1 セッション分の会話履歴 (トークン予算内の直近分 + それ以前の要約)"""
+    max_tokens: int
+    high_water_mark: int = 0
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    message_ids: List[int] = field(default_factory=list)
+    token_counts: List[int] = field(default_factory=list)
+    total_tokens: int = 0
+    summary: Optional[str] = None
+    # summary が畳み込み済みの最後のメッセージ ID
+    summary_upto: int = 0
+    # 履歴から切り落とされ、まだ summary に畳み込まれていない (id, message, tokens)
+    pending_summary: List[Tuple[int, Dict[str, str], int]] = field(default_factory=list)
+
+    def append(self, rows: Iterable[Tuple[int, object, str]], count_tokens: Callable[[str], int] = count_tokens) -> List[Dict[str, str]]:
+        """
+        high-water mark より新しい行を追記し、予算からあふれた古いメッセージを返す。
+        同じ行が重ねて渡されても (並行ロードなど) 二重には追加しない。
+        """
+        for message_id, sender, content in rows:
+            if message_id <= self.high_water_mark:
+                continue
+            content = content or ""
+            tokens = count_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+            self.messages.append({"role": _openai_role(sender), "content": content})
+            self.message_ids.append(message_id)
+            self.token_counts.append(tokens)
+            self.total_tokens += tokens
+            self.high_water_mark = message_id
+        return self._trim()
+
+    def window(self) -> List[Dict[str, str]]:
+        """OpenAI に渡す履歴 (呼び出し側が変更してもキャッシュに影響しないようコピーを返す)"""
+        return list(self.messages)
+
+    def _trim(self) -> List[Dict[str, str]]:
+        # 最新の 1 件は予算を超えていても残す
+        drop = 0
+        while self.total_tokens > self.max_tokens and drop < len(self.messages) - 1:
+            self.total_tokens -= self.token_counts[drop]
+            drop += 1
+        if not drop:
+            return []
+        evicted = self.messages[:drop]
+        for message_id, message, tokens in zip(self.message_ids[:drop], evicted, self.token_counts[:drop]):
+            if message_id > self.summary_upto:
+                self.pending_summary.append((message_id, message, tokens))
+        del self.messages[:drop]
+        del self.message_ids[:drop]
+        del self.token_counts[:drop]
+        return evicted
+
+
+class ConversationStore(Protocol):
+    """ConversationContext の保存先 (共有ストアに差し替える場合はこれを実装する)"""
+
+    def get(self, session_id: uuid.UUID) -> Optional[ConversationContext]: ...
+
+    def put(self, session_id: uuid.UUID, context: ConversationContext) -> None: ...
+
+    def delete(self, session_id: uuid.UUID) -> None: ...
+
+
+class InMemoryConversationStore:
+    """プロセス内の LRU ストア"""
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._entries: "OrderedDict[uuid.UUID, ConversationContext]" = OrderedDict()
+
+    def get(self, session_id: uuid.UUID) -> Optional[ConversationContext]:
+        context = self._entries.get(session_id)
+        if context is not None:
+            self._entries.move_to_end(session_id)
+        return context
+
+    def put(self, session_id: uuid.UUID, context: ConversationContext) -> None:
+        self._entries[session_id] = context
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    def delete(self, session_id: uuid.UUID) -> None:
+        self._entries.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ConversationCache:
+    """セッション ID → ConversationContext。差分読み込みで最新状態に追従する"""
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        max_tokens: int,
+        count_tokens: Callable[[str], int] = count_tokens,
+        summarizer: Optional[Summarizer] = None,
+    ):
+        self.store = store
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.summarizer = summarizer
+        self._summarizing: Set[uuid.UUID] = set()
+
+    async def get_history(self, db: AsyncSession, session_id: uuid.UUID) -> List[Dict[str, str]]:
+        """high-water mark 以降の新着だけを読み込み、トークン予算内の履歴を返す"""
+        context = await self.refresh(db, session_id)
+        return context.window()
+
+    async def refresh(
+        self,
+        db: AsyncSession,
+        session_id: uuid.UUID,
+        summary: Optional[str] = None,
+        summary_upto: Optional[int] = None,
+    ) -> ConversationContext:
+        """
+        キャッシュを最新化して返す。summary / summary_upto はキャッシュミス時の初期値
+        (chat_sessions に保存済みのサマリー) で、サマリー済みのメッセージは読み込まない。
+        """
+        # 並行して同じセッションを読み込んでも append が ID で重複を弾くのでロックは不要
+        context = self.store.get(session_id)
+        if context is None:
+            context = ConversationContext(
+                max_tokens=self.max_tokens,
+                high_water_mark=summary_upto or 0,
+                summary=summary,
+                summary_upto=summary_upto or 0,
+            )
+        rows = await get_chat_messages_after(db, session_id, context.high_water_mark)
+        if rows:
+            context.append(rows, self.count_tokens)
+        self.store.put(session_id, context)
+        if context.pending_summary and self.summarizer is not None and session_id not in self._summarizing:
+            self._summarizing.add(session_id)
+            asyncio.create_task(self._summarize(session_id, context))
+        return context
+
+    def invalidate(self, session_id: uuid.UUID) -> None:
+        self.store.delete(session_id)
+
+    async def _summarize(self, session_id: uuid.UUID, context: ConversationContext) -> None:
+        """切り落とされた分をサマリーに畳み込み、セッションに保存する (応答の待ち時間には乗せない)"""
+        try:
+            while context.pending_summary:
+                # 要約モデルへの入力が大きくなりすぎないよう、履歴の予算分ずつ畳み込む
+                batch_size, batch_tokens = 0, 0
+                for _, _, tokens in context.pending_summary:
+                    if batch_size and batch_tokens + tokens > self.max_tokens:
+                        break
+                    batch_size += 1
+                    batch_tokens += tokens
+                batch = context.pending_summary[:batch_size]
+                summary = await self.summarizer(context.summary, [message for _, message, _ in batch])
+                context.summary = summary
+                context.summary_upto = batch[-1][0]
+                del context.pending_summary[:batch_size]
+                await chat_write_behind.update_summary(session_id, summary, context.summary_upto)
+                logger.info(f"Folded {batch_size} message(s) into the rolling summary of session {session_id}")
+        except Exception as e:
+            # 失敗分は pending に残り、次に履歴があふれたときに再試行される
+            logger.error(f"Failed to update rolling summary for session {session_id}: {e}", exc_info=True)
+        finally:
+            self._summarizing.discard(session_id)
+
+
+conversation_cache = ConversationCache(
+    store=InMemoryConversationStore(max_sessions=settings.CHAT_CONTEXT_CACHE_MAX_SESSIONS),
+    max_tokens=settings.CHAT_HISTORY_MAX_TOKENS,
+    summarizer=summarize_messages,
+)
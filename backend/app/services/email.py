@@ -1,63 +1,24 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from typing import Dict, List
 from app.core.config import settings
+from app.services.email_dispatcher import email_dispatcher
 import logging
-from datetime import datetime
-from fastapi import BackgroundTasks
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-def send_email(to_email: str, subject: str, html_content: str, plain_content: str = None):
+async def send_email(to_email: str, subject: str, html_content: str, plain_content: str = None):
     """
     メール送信の共通処理
+    email_outbox に積むだけで、送信はバックグラウンドのワーカー (email_dispatcher) が行う
     """
     try:
-        # 設定からSMTP情報を取得
-        smtp_server = settings.SMTP_SERVER
-        smtp_port = settings.SMTP_PORT
-        smtp_user = settings.SMTP_USER
-        smtp_password = settings.SMTP_PASSWORD
-        from_email = settings.FROM_EMAIL
-        
-        # メッセージの作成
-        message = MIMEMultipart("alternative")
-        message["Subject"] = subject
-        message["From"] = from_email
-        message["To"] = to_email
-        
-        # プレーンテキスト版（指定がなければHTMLから生成）
-        if plain_content is None:
-            # 簡易的なHTMLからテキスト変換（実際のプロジェクトではより洗練された方法を使用すべき）
-            plain_content = html_content.replace("<br>", "\n").replace("<p>", "").replace("</p>", "\n\n")
-        
-        # テキストパートとHTMLパートを追加
-        text_part = MIMEText(plain_content, "plain", "utf-8")
-        html_part = MIMEText(html_content, "html", "utf-8")
-        message.attach(text_part)
-        message.attach(html_part)
-        
-        # 開発環境ではメール送信をログに記録するだけ
-        if settings.ENVIRONMENT == "development":
-            logger.info(f"[DEV MODE] メール送信 - 宛先: {to_email}, 件名: {subject}")
-            logger.info(f"[DEV MODE] 内容: {plain_content}")
-            return True
-        
-        # 本番環境では実際にメールを送信
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(message)
-            
-        logger.info(f"メール送信成功 - 宛先: {to_email}, 件名: {subject}")
+        await email_dispatcher.enqueue(to_email, subject, html_content, plain_content)
         return True
-    
     except Exception as e:
         logger.error(f"メール送信エラー: {str(e)}")
         return False
 
-def send_verification_email(email: str, name: str):
+async def send_verification_email(email: str, name: str):
     """
     メールアドレス検証リンクを送信
     """
@@ -95,9 +56,9 @@ def send_verification_email(email: str, name: str):
     """
     
     # メールの送信
-    send_email(email, subject, html_content)
+    await send_email(email, subject, html_content)
 
-def send_password_reset_email(email: str, name: str, token: str):
+async def send_password_reset_email(email: str, name: str, token: str):
     """
     パスワードリセットリンクを送信
     """
@@ -126,9 +87,9 @@ def send_password_reset_email(email: str, name: str, token: str):
     """
     
     # メールの送信
-    send_email(email, subject, html_content)
+    await send_email(email, subject, html_content)
 
-def send_welcome_email(email: str, name: str):
+async def send_welcome_email(email: str, name: str):
     """
     新規登録完了後のウェルカムメールを送信
     """
@@ -157,14 +118,10 @@ def send_welcome_email(email: str, name: str):
     """
     
     # メールの送信
-    send_email(email, subject, html_content)
+    await send_email(email, subject, html_content)
 
-def send_notification_email(email: str, name: str, subject: str, message: str):
-    """
-    通知メールを送信
-    """
-    # メールの内容
-    html_content = f"""
+def _notification_html(name: str, message: str) -> str:
+    return f"""
     <p>{name}様</p>
     
     <p>{message}</p>
@@ -174,6 +131,26 @@ def send_notification_email(email: str, name: str, subject: str, message: str):
     お問い合わせ: support@smartao.example.com
     </p>
     """
-    
-    # メールの送信
-    send_email(email, subject, html_content) 
\ No newline at end of file
+
+async def send_notification_email(email: str, name: str, subject: str, message: str):
+    """
+    通知メールを送信
+    """
+    await send_email(email, subject, _notification_html(name, message))
+
+async def send_notification_emails(recipients: List[Dict[str, str]], subject: str, message: str):
+    """
+    同じ通知メールを複数のユーザーに送信 (1 回の INSERT でまとめて積む)
+    recipients の各要素は email / name を持つ dict
+    """
+    if not recipients:
+        return True
+    try:
+        await email_dispatcher.enqueue_many([
+            {"to_email": r["email"], "subject": subject, "html_content": _notification_html(r["name"], message)}
+            for r in recipients
+        ])
+        return True
+    except Exception as e:
+        logger.error(f"メール送信エラー: {str(e)}")
+        return False
@@ -0,0 +1,296 @@
+"""
+メール送信のディスパッチャー。
+
+以前の send_email はメール 1 通ごとに smtplib.SMTP で接続し、STARTTLS とログインを
+やり直したうえで、async なハンドラーの中から同期的に送っていた。
+
+- リクエスト処理では email_outbox テーブルに積むだけ (enqueue / enqueue_many)
+- バックグラウンドのワーカーが送信時刻になったメールをまとめて取り出し
+  (FOR UPDATE SKIP LOCKED なので複数プロセスでも重複しない)、
+  ログイン済みの SMTP 接続を使い回すプールで並列に送る
+- 失敗したメールは指数バックオフで再送し、settings.EMAIL_MAX_ATTEMPTS 回で failed にする
+- 開発環境 (ENVIRONMENT=development) では送信せずログに出すだけ (従来どおり)
+"""
+import asyncio
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from app.core.config import settings
+from app.crud import email_outbox as crud_email_outbox
+from app.database.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def build_message(to_email: str, subject: str, html_content: str, plain_content: Optional[str] = None) -> MIMEMultipart:
+    """HTML とプレーンテキストの 2 パートのメッセージを作る"""
+    message = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"] = settings.FROM_EMAIL
+    message["To"] = to_email
+
+    # プレーンテキスト版（指定がなければHTMLから生成）
+    if plain_content is None:
+        # 簡易的なHTMLからテキスト変換（実際のプロジェクトではより洗練された方法を使用すべき）
+        plain_content = html_content.replace("<br>", "\n").replace("<p>", "").replace("</p>", "\n\n")
+
+    message.attach(MIMEText(plain_content, "plain", "utf-8"))
+    message.attach(MIMEText(html_content, "html", "utf-8"))
+    return message
+
+
+class SMTPConnectionPool:
+    """ログイン済みの SMTP 接続を最大 size 本まで保持して使い回す (スレッドセーフ)"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        starttls: bool,
+        size: int,
+        timeout: float,
+        max_idle_seconds: float,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, float]]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.connections_opened = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        self.connections_opened += 1
+        return smtp
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                smtp, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            # しばらく使っていない接続はサーバー側で切られていることがあるので確認する
+            if time.monotonic() - last_used < self.max_idle_seconds:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            _close_quietly(smtp)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """接続を借りる。送信中に例外が出た接続は状態が分からないので捨てる"""
+        with self._slots:
+            smtp = self._checkout()
+            try:
+                yield smtp
+            except BaseException:
+                _close_quietly(smtp)
+                raise
+            self._idle.put((smtp, time.monotonic()))
+
+    def close(self) -> None:
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _close_quietly(smtp)
+
+
+def _close_quietly(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.quit()
+    except Exception:
+        smtp.close()
+
+
+class EmailDispatcher:
+    """email_outbox を送信するワーカー"""
+
+    def __init__(
+        self,
+        pool: SMTPConnectionPool,
+        batch_size: int,
+        max_attempts: int,
+        retry_base_seconds: float,
+        poll_seconds: float,
+        stale_seconds: float,
+        session_factory: Callable[[], Any] = AsyncSessionLocal,
+    ):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.poll_seconds = poll_seconds
+        self.stale_seconds = stale_seconds
+        self._session_factory = session_factory
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    # --- 投入 API ---
+
+    async def enqueue(self, to_email: str, subject: str, html_content: str, plain_content: Optional[str] = None) -> UUID:
+        """メールを 1 通積む"""
+        [email_id] = await self.enqueue_many([{
+            "to_email": to_email,
+            "subject": subject,
+            "html_content": html_content,
+            "plain_content": plain_content,
+        }])
+        return email_id
+
+    async def enqueue_many(self, messages: Iterable[Dict[str, Optional[str]]]) -> List[UUID]:
+        """複数のメールを 1 回の INSERT で積む (一斉通知など)"""
+        async with self._session_factory() as db:
+            email_ids = await crud_email_outbox.enqueue_emails(db, messages)
+        if email_ids and self._wake is not None:
+            self._wake.set()
+        return email_ids
+
+    def start(self) -> None:
+        """ワーカーを起動する (アプリ起動時に呼ぶ)。前回送りきれなかった分もここで送られる"""
+        if self._worker is not None and not self._worker.done():
+            return
+        self._wake = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """ワーカーを止めて接続を閉じる。未送信の分は次回起動時に送られる"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.pool.close()
+
+    # --- ワーカー ---
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                while await self.send_due():
+                    pass
+            except Exception as e:  # ワーカー自体は止めない
+                logger.error(f"Unexpected error in email dispatcher: {e}", exc_info=True)
+            # 新しいメールが積まれるか、再送時刻を確認する間隔が経つまで待つ
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def send_due(self) -> int:
+        """送信時刻になったメールを 1 バッチ分送り、取り出した件数を返す"""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        async with self._session_factory() as db:
+            emails = await crud_email_outbox.claim_due_emails(db, self.batch_size, stale_before)
+        if not emails:
+            return 0
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix="smtp")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self._deliver, email) for email in emails),
+            return_exceptions=True
+        )
+        # 1 通の想定外の失敗でバッチ全体の結果を失うと、送れた分まで stale_seconds 後に再送されてしまう
+        errors = [(str(result), True) if isinstance(result, BaseException) else result for result in results]
+
+        sent_ids = [email.id for email, error in zip(emails, errors) if error is None]
+        async with self._session_factory() as db:
+            await crud_email_outbox.mark_emails_sent(db, sent_ids)
+            for email, error in zip(emails, errors):
+                if error is None:
+                    continue
+                message, retryable = error
+                retry_at = None
+                if retryable and email.attempts < self.max_attempts:
+                    retry_at = datetime.utcnow() + timedelta(seconds=self.retry_base_seconds * (2 ** (email.attempts - 1)))
+                else:
+                    logger.error(f"メール送信エラー (送信を中止します) - 宛先: {email.to_email}, 件名: {email.subject}: {message}")
+                await crud_email_outbox.mark_email_unsent(db, email.id, message, retry_at)
+
+        logger.info(
+            f"Sent {len(sent_ids)}/{len(emails)} email(s) in {time.perf_counter() - started:.2f}s "
+            f"(pool opened {self.pool.connections_opened} connection(s) so far)"
+        )
+        return len(emails)
+
+    def _deliver(self, email) -> Optional[Tuple[str, bool]]:
+        """1 通送る (ワーカースレッドで実行)。失敗時は (エラー, 再送するか) を返し、例外は投げない"""
+        try:
+            return self._send(email)
+        except Exception as e:
+            logger.error(f"Unexpected error sending email {email.id}: {e}", exc_info=True)
+            return str(e), True
+
+    def _send(self, email) -> Optional[Tuple[str, bool]]:
+        message = build_message(email.to_email, email.subject, email.html_content, email.plain_content)
+        # 開発環境ではメール送信をログに記録するだけ
+        if settings.ENVIRONMENT == "development":
+            logger.info(f"[DEV MODE] メール送信 - 宛先: {email.to_email}, 件名: {email.subject}")
+            logger.info(f"[DEV MODE] 内容: {message.get_payload(0).get_payload(decode=True).decode('utf-8')}")
+            return None
+        try:
+            with self.pool.connection() as smtp:
+                smtp.send_message(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            # 宛先が拒否された場合は再送しても変わらない
+            return str(e), False
+        except (smtplib.SMTPException, OSError) as e:
+            return str(e), True
+        logger.info(f"メール送信成功 - 宛先: {email.to_email}, 件名: {email.subject}")
+        return None
+
+
+email_dispatcher = EmailDispatcher(
+    pool=SMTPConnectionPool(
+        host=settings.SMTP_SERVER,
+        port=settings.SMTP_PORT,
+        username=settings.SMTP_USER,
+        password=settings.SMTP_PASSWORD,
+        starttls=settings.SMTP_STARTTLS,
+        size=settings.SMTP_POOL_SIZE,
+        timeout=settings.SMTP_TIMEOUT_SECONDS,
+        max_idle_seconds=settings.SMTP_MAX_IDLE_SECONDS,
+    ),
+    batch_size=settings.EMAIL_BATCH_SIZE,
+    max_attempts=settings.EMAIL_MAX_ATTEMPTS,
+    retry_base_seconds=settings.EMAIL_RETRY_BASE_SECONDS,
+    poll_seconds=settings.EMAIL_POLL_SECONDS,
+    stale_seconds=settings.EMAIL_STALE_SECONDS,
+)
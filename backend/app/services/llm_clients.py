@@ -0,0 +1,129 @@
+"""
+プロセス全体で共有する LLM クライアントのレジストリ。
+
+これまでは openai_service / crud.checklist / chat エンドポイント / 各アダプターが
+それぞれ AsyncOpenAI を生成しており、リクエストごとに作り直す箇所もあったため、
+接続確立や TLS ハンドシェイクが応答待ちの経路に乗っていた。
+
+ここでは 1 つの httpx.AsyncClient (keep-alive / 可能なら HTTP/2) を全プロバイダーで共有し、
+SDK クライアントと monono_agent のアダプターは (プロバイダー, モデル名) ごとに一度だけ作って使い回す。
+"""
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+from app.services.agents.monono_agent.llm_adapters.base_llm_adapter import BaseLLMAdapter
+
+logger = logging.getLogger(__name__)
+
+_http_client: Optional[httpx.AsyncClient] = None
+_openai_client: Optional[AsyncOpenAI] = None
+_anthropic_client = None
+_adapters: Dict[Tuple[str, str], BaseLLMAdapter] = {}
+# 共有クライアントを抱えたオブジェクトをキャッシュしている側の破棄処理 (close_llm_clients で呼ぶ)
+_close_callbacks: List[Callable[[], None]] = []
+
+
+def _http2_available() -> bool:
+    # HTTP/2 には h2 パッケージ (httpx[http2]) が必要
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """LLM API 呼び出し用の共有コネクションプール"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        http2 = settings.LLM_HTTP2 and _http2_available()
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(settings.LLM_HTTP_TIMEOUT_SECONDS, connect=10.0),
+        )
+        logger.info(f"Shared LLM HTTP client created (http2={http2}, max_connections={settings.LLM_HTTP_MAX_CONNECTIONS})")
+    return _http_client
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """共有プールを使う AsyncOpenAI"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=get_http_client())
+    return _openai_client
+
+
+def get_anthropic_client():
+    """共有プールを使う AsyncAnthropic"""
+    global _anthropic_client
+    if _anthropic_client is None:
+        from anthropic import AsyncAnthropic
+        _anthropic_client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY or None, http_client=get_http_client())
+    return _anthropic_client
+
+
+def get_llm_adapter(provider: str, model_name: str) -> BaseLLMAdapter:
+    """
+    monono_agent のアダプターを (プロバイダー, モデル名) ごとに一度だけ作って返す。
+    アダプターは SDK クライアント以外の状態を持たないので、セッションをまたいで共有してよい。
+    """
+    key = (provider, model_name)
+    adapter = _adapters.get(key)
+    if adapter is not None:
+        return adapter
+
+    if provider == "openai":
+        from app.services.agents.monono_agent.llm_adapters.openai_adapter import OpenAIAdapter
+        adapter = OpenAIAdapter(model_name=model_name, api_key=settings.OPENAI_API_KEY, client=get_openai_client())
+    elif provider == "anthropic":
+        from app.services.agents.monono_agent.llm_adapters.anthropic_adapter import AnthropicAdapter
+        adapter = AnthropicAdapter(model_name=model_name, api_key=settings.ANTHROPIC_API_KEY, client=get_anthropic_client())
+    else:
+        # Gemini アダプターは現状未実装 (google_gemini_adapter.py はコメントアウトされている)
+        raise ValueError(f"Unsupported LLM provider: {provider}")
+
+    _adapters[key] = adapter
+    return adapter
+
+
+async def warm_up_llm_connections() -> None:
+    """起動時に OpenAI への接続を張っておき、最初のリクエストで TLS ハンドシェイクを待たないようにする"""
+    if not settings.OPENAI_API_KEY:
+        return
+    try:
+        await get_openai_client().models.list()
+        logger.info("OpenAI connection warmed up.")
+    except Exception as e:
+        logger.warning(f"Failed to warm up OpenAI connection: {e}")
+
+
+def on_llm_clients_closed(callback: Callable[[], None]) -> None:
+    """
+    共有クライアントを閉じたときに呼ぶ処理を登録する。
+    get_http_client() / get_openai_client() で作ったオブジェクトをキャッシュするモジュールは、
+    閉じたクライアントを使い続けないようにここでキャッシュを捨てる
+    """
+    if callback not in _close_callbacks:
+        _close_callbacks.append(callback)
+
+
+async def close_llm_clients() -> None:
+    """アプリ終了時に共有プールを閉じる"""
+    global _http_client, _openai_client, _anthropic_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+    _openai_client = None
+    _anthropic_client = None
+    _adapters.clear()
+    for callback in _close_callbacks:
+        callback()
@@ -2,13 +2,14 @@ import logging
 from typing import Optional, List, Dict, Any
 from datetime import datetime, time
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import delete as sql_delete, select
+from uuid import UUID
 from app.models.notification_setting import NotificationSetting
 from app.models.user import User
 from app.models.enums import NotificationType
-from app.services.email import send_notification_email
+from app.services.email import send_notification_emails
 from app.core.config import settings
-from app.services.push_service import PushService
+from app.services.push_delivery import push_delivery
 from app.models.in_app_notification import InAppNotification
 from sqlalchemy.orm import Session
 from app.models.push_subscription import PushSubscription
@@ -16,6 +17,20 @@ from app.schemas.notification import NotificationCreate
 
 logger = logging.getLogger(__name__)
 
+
+def _in_quiet_hours(notification_setting: NotificationSetting, current_time: time) -> bool:
+    """静かな時間帯か (開始 > 終了なら日付をまたぐ時間帯として扱う)"""
+    start, end = notification_setting.quiet_hours_start, notification_setting.quiet_hours_end
+    if not start or not end:
+        return False
+    # カラムは DateTime なので時刻部分だけを比較する
+    start = start.time() if isinstance(start, datetime) else start
+    end = end.time() if isinstance(end, datetime) else end
+    if start <= end:
+        return start <= current_time <= end
+    return current_time >= start or current_time <= end
+
+
 class NotificationService:
     @staticmethod
     async def send_notification(
@@ -40,70 +55,15 @@ class NotificationService:
         Returns:
             bool: 通知の送信が成功したかどうか
         """
-        try:
-            # ユーザーの通知設定を取得
-            stmt = select(NotificationSetting).filter(
-                NotificationSetting.user_id == user_id,
-                NotificationSetting.notification_type == notification_type
-            )
-            result = await db.execute(stmt)
-            notification_setting = result.scalars().first()
-            
-            if not notification_setting:
-                logger.warning(f"ユーザー {user_id} の通知設定が見つかりません")
-                return False
-            
-            # 静かな時間帯のチェック
-            current_time = datetime.now().time()
-            if notification_setting.quiet_hours_start and notification_setting.quiet_hours_end:
-                if notification_setting.quiet_hours_start <= current_time <= notification_setting.quiet_hours_end:
-                    logger.info(f"ユーザー {user_id} の静かな時間帯のため、通知を送信しません")
-                    return False
-            
-            # メール通知の送信
-            if notification_setting.email_enabled:
-                user = await db.get(User, user_id)
-                if user:
-                    send_notification_email(
-                        email=user.email,
-                        name=user.full_name,
-                        subject=title,
-                        message=message
-                    )
-            
-            # プッシュ通知の送信
-            if notification_setting.push_enabled:
-                stmt = select(PushSubscription).filter(
-                    PushSubscription.user_id == user_id
-                )
-                result = await db.execute(stmt)
-                subscriptions = result.scalars().all()
-                
-                for subscription in subscriptions:
-                    await PushService.send_push_notification(
-                        subscription=subscription,
-                        title=title,
-                        message=message,
-                        data=metadata
-                    )
-            
-            # アプリ内通知の保存
-            if notification_setting.in_app_enabled:
-                db_notification = InAppNotification(
-                    user_id=user_id,
-                    notification_type=notification_type,
-                    title=title,
-                    message=message,
-                    metadata=metadata
-                )
-                db.add(db_notification)
-                await db.commit()
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"通知送信エラー: {str(e)}")
-            return False
+        results = await NotificationService.send_bulk_notification(
+            db=db,
+            user_ids=[user_id],
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            metadata=metadata
+        )
+        return results[user_id]
     
     @staticmethod
     async def send_bulk_notification(
@@ -116,6 +76,8 @@ class NotificationService:
     ) -> Dict[str, bool]:
         """
         複数のユーザーに一括で通知を送信する
+        通知設定とプッシュ通知のサブスクリプションは全ユーザー分を 1 クエリで読み込み、
+        プッシュ通知は push_delivery で並列に送信する。失効したサブスクリプション (404/410) は削除する。
         
         Args:
             db: データベースセッション
@@ -128,15 +90,78 @@ class NotificationService:
         Returns:
             Dict[str, bool]: ユーザーIDをキーとし、送信結果（成功/失敗）を値とする辞書
         """
-        results = {}
-        for user_id in user_ids:
-            success = await NotificationService.send_notification(
-                db=db,
-                user_id=user_id,
-                notification_type=notification_type,
-                title=title,
-                message=message,
-                metadata=metadata
+        results = {user_id: False for user_id in user_ids}
+        if not user_ids:
+            return results
+        try:
+            ids = {str(user_id): user_id for user_id in user_ids}
+
+            # 通知設定とプッシュ通知のサブスクリプションをまとめて取得
+            stmt = (
+                select(NotificationSetting, PushSubscription)
+                .outerjoin(
+                    PushSubscription,
+                    (PushSubscription.user_id == NotificationSetting.user_id) & NotificationSetting.push_enabled.is_(True)
+                )
+                .filter(
+                    NotificationSetting.user_id.in_([UUID(key) for key in ids]),
+                    NotificationSetting.notification_type == notification_type
+                )
             )
-            results[user_id] = success
-        return results 
\ No newline at end of file
+            settings_by_user: Dict[str, NotificationSetting] = {}
+            push_subscriptions: List[PushSubscription] = []
+            for notification_setting, subscription in (await db.execute(stmt)).all():
+                settings_by_user.setdefault(str(notification_setting.user_id), notification_setting)
+                if subscription is not None:
+                    push_subscriptions.append(subscription)
+
+            # 静かな時間帯のチェック
+            current_time = datetime.now().time()
+            recipients: Dict[str, NotificationSetting] = {}
+            for key, notification_setting in settings_by_user.items():
+                if _in_quiet_hours(notification_setting, current_time):
+                    logger.info(f"ユーザー {key} の静かな時間帯のため、通知を送信しません")
+                    continue
+                recipients[key] = notification_setting
+            for key in ids.keys() - settings_by_user.keys():
+                logger.warning(f"ユーザー {key} の通知設定が見つかりません")
+
+            # メール通知の送信
+            email_user_ids = [UUID(key) for key, s in recipients.items() if s.email_enabled]
+            if email_user_ids:
+                users = (await db.execute(select(User).filter(User.id.in_(email_user_ids)))).scalars().all()
+                await send_notification_emails(
+                    [{"email": user.email, "name": user.full_name} for user in users],
+                    subject=title,
+                    message=message
+                )
+
+            # プッシュ通知の送信
+            push_subscriptions = [s for s in push_subscriptions if str(s.user_id) in recipients]
+            if push_subscriptions:
+                report = await push_delivery.deliver(
+                    push_subscriptions, {"title": title, "message": message, "data": metadata or {}}
+                )
+                if report.gone_ids:
+                    await db.execute(sql_delete(PushSubscription).where(PushSubscription.id.in_(report.gone_ids)))
+                    logger.info(f"失効したプッシュ通知のサブスクリプションを {len(report.gone_ids)} 件削除しました")
+
+            # アプリ内通知の保存
+            for key, notification_setting in recipients.items():
+                if notification_setting.in_app_enabled:
+                    db.add(InAppNotification(
+                        user_id=UUID(key),
+                        notification_type=notification_type,
+                        title=title,
+                        message=message,
+                        data=metadata
+                    ))
+            await db.commit()
+
+            for key in recipients:
+                results[ids[key]] = True
+            return results
+            
+        except Exception as e:
+            logger.error(f"通知送信エラー: {str(e)}")
+            return {user_id: False for user_id in user_ids}
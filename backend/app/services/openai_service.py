@@ -7,15 +7,13 @@ from fastapi import HTTPException
 from datetime import datetime
 from app.core.config import settings
 from typing import List, Dict, AsyncGenerator, Any
-from openai import AsyncOpenAI
+from app.services.llm_clients import get_openai_client
 
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-
 async def stream_openai_response(messages: List[Dict], session_id: str) -> AsyncGenerator[str, None]:
     try:
-        response = await client.chat.completions.create(
+        response = await get_openai_client().chat.completions.create(
             model="gpt-4o",
             messages=messages,
             stream=True,
@@ -93,7 +91,7 @@ async def generate_study_plan(subject: str, goal: str, duration: int, level: str
 """
         
         # OpenAI APIを呼び出し
-        response = await client.chat.completions.create(
+        response = await get_openai_client().chat.completions.create(
             model=settings.OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": "あなたは学習計画を生成するAIアシスタントです。JSONフォーマットで回答してください。"},
@@ -0,0 +1,140 @@
+"""
+Web Push の一括配信。
+
+pywebpush.webpush は requests による同期送信で、1 件ごとに新しい接続を張る。
+以前は通知ごと・サブスクリプションごとにイベントループ上でこれを直列に呼んでいたため、
+学校単位の一斉通知では数千件の送信が終わるまで他のリクエストも止まっていた。
+
+ここでは固定サイズのスレッドプールで並列に送信し、HTTP 接続はプッシュサービスの
+オリジン (fcm.googleapis.com, updates.push.services.mozilla.com など) ごとに
+1 つの requests.Session を共有して使い回す。
+404 / 410 が返ったエンドポイントは購読が失効しているので、呼び出し元で削除できるよう報告する。
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import requests
+from pywebpush import WebPushException, webpush
+from requests.adapters import HTTPAdapter
+
+from app.core.config import settings
+from app.models.push_subscription import PushSubscription
+
+logger = logging.getLogger(__name__)
+
+# 購読が失効しているエンドポイントのステータス
+GONE_STATUS_CODES = {404, 410}
+
+
+@dataclass
+class PushDeliveryReport:
+    """一括配信の結果"""
+    sent_ids: List[str] = field(default_factory=list)
+    failed_ids: List[str] = field(default_factory=list)
+    # 404 / 410 が返った (削除すべき) サブスクリプション
+    gone_ids: List[str] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """1 秒あたりの配信試行数"""
+        total = len(self.sent_ids) + len(self.failed_ids) + len(self.gone_ids)
+        return total / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+
+class PushDeliveryEngine:
+    """オリジンごとの共有セッション + 固定サイズのスレッドプールで Web Push を送る"""
+
+    def __init__(self, max_workers: int, timeout_seconds: float):
+        self.max_workers = max_workers
+        self.timeout_seconds = timeout_seconds
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def _session_for(self, endpoint: str) -> requests.Session:
+        parts = urlsplit(endpoint)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                # 同じオリジンへは最大でワーカー数だけ同時に送るので、その分の接続を保持する
+                session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers))
+                self._sessions[origin] = session
+            return session
+
+    def _send(self, subscription: PushSubscription, data: str) -> str:
+        """1 件送信し、"sent" / "gone" / "failed" を返す (ワーカースレッドで実行される)"""
+        try:
+            webpush(
+                subscription_info={
+                    "endpoint": subscription.endpoint,
+                    "keys": {
+                        "p256dh": subscription.p256dh_key,
+                        "auth": subscription.auth_token
+                    }
+                },
+                data=data,
+                vapid_private_key=settings.VAPID_PRIVATE_KEY,
+                vapid_claims={
+                    "sub": f"mailto:{settings.SMTP_USER}"
+                },
+                timeout=self.timeout_seconds,
+                requests_session=self._session_for(subscription.endpoint),
+            )
+            return "sent"
+        except WebPushException as e:
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code in GONE_STATUS_CODES:
+                return "gone"
+            logger.error(f"プッシュ通知送信エラー: {str(e)}")
+            return "failed"
+        except Exception as e:
+            logger.error(f"予期せぬエラー: {str(e)}")
+            return "failed"
+
+    async def deliver(self, subscriptions: Sequence[PushSubscription], payload: Dict[str, Any]) -> PushDeliveryReport:
+        """同じペイロードを全サブスクリプションへ並列に送る"""
+        report = PushDeliveryReport()
+        if not subscriptions:
+            return report
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="push")
+        data = json.dumps(payload)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._send, subscription, data) for subscription in subscriptions
+        ))
+        report.elapsed_seconds = time.perf_counter() - started
+        for subscription, outcome in zip(subscriptions, outcomes):
+            getattr(report, f"{outcome}_ids").append(subscription.id)
+        if len(subscriptions) > 1:
+            logger.info(
+                f"Push delivered: {len(report.sent_ids)} sent, {len(report.failed_ids)} failed, "
+                f"{len(report.gone_ids)} gone in {report.elapsed_seconds:.2f}s ({report.throughput:.1f}/s)"
+            )
+        return report
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+push_delivery = PushDeliveryEngine(
+    max_workers=settings.PUSH_MAX_WORKERS,
+    timeout_seconds=settings.PUSH_TIMEOUT_SECONDS,
+)
@@ -1,9 +1,7 @@
-import json
 import logging
 from typing import Dict, Any
-from pywebpush import webpush, WebPushException
-from app.core.config import settings
 from app.models.push_subscription import PushSubscription
+from app.services.push_delivery import push_delivery
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +14,7 @@ class PushService:
         data: Dict[str, Any] = None
     ) -> bool:
         """
-        プッシュ通知を送信する
+        プッシュ通知を送信する (送信はイベントループの外で行う)
         
         Args:
             subscription: プッシュ通知のサブスクリプション
@@ -27,32 +25,10 @@ class PushService:
         Returns:
             bool: 送信が成功したかどうか
         """
-        try:
-            payload = {
-                "title": title,
-                "message": message,
-                "data": data or {}
-            }
-            
-            webpush(
-                subscription_info={
-                    "endpoint": subscription.endpoint,
-                    "keys": {
-                        "p256dh": subscription.p256dh_key,
-                        "auth": subscription.auth_token
-                    }
-                },
-                data=json.dumps(payload),
-                vapid_private_key=settings.VAPID_PRIVATE_KEY,
-                vapid_claims={
-                    "sub": f"mailto:{settings.SMTP_USER}"
-                }
-            )
-            return True
-            
-        except WebPushException as e:
-            logger.error(f"プッシュ通知送信エラー: {str(e)}")
-            return False
-        except Exception as e:
-            logger.error(f"予期せぬエラー: {str(e)}")
-            return False 
\ No newline at end of file
+        payload = {
+            "title": title,
+            "message": message,
+            "data": data or {}
+        }
+        report = await push_delivery.deliver([subscription], payload)
+        return bool(report.sent_ids)
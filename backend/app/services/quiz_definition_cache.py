@@ -0,0 +1,124 @@
+"""
+クイズ定義 (解答キー) のプロセス内キャッシュ。
+
+クイズは編集よりも受験のほうがはるかに多いので、挑戦の開始・提出のたびに
+問題と選択肢を読み直さず、quiz_id ごとに不変の AnswerKey を保持する。
+
+- 同じプロセスでの問題・選択肢の変更は app.crud.quiz がコミット後に invalidate() する
+- 他プロセスでの変更は TTL (settings.QUIZ_DEFINITION_CACHE_TTL_SECONDS) で反映されるほか、
+  提出時は挑戦を確定する UPDATE でクイズの updated_at も返し、キャッシュした version と
+  違えば読み直して採点し直す (app.crud.quiz.submit_quiz_attempt)
+- キャッシュミスが同時に起きても、同じクイズの読み込みは 1 回にまとめる
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.services.quiz_grading import AnswerKey, load_answer_key
+
+logger = logging.getLogger(__name__)
+
+
+class QuizDefinitionCache:
+    """quiz_id をキーにした TTL 付き LRU キャッシュ"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[UUID, Tuple[float, AnswerKey]]" = OrderedDict()
+        self._loading: Dict[UUID, "asyncio.Future[Optional[AnswerKey]]"] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def peek(self, quiz_id: UUID) -> Optional[AnswerKey]:
+        """期限内のキャッシュだけを返す (DB には行かない)"""
+        with self._lock:
+            entry = self._entries.get(quiz_id)
+            if entry is None:
+                return None
+            expires_at, answer_key = entry
+            if expires_at < time.monotonic():
+                del self._entries[quiz_id]
+                return None
+            self._entries.move_to_end(quiz_id)
+            return answer_key
+
+    async def get(self, db: AsyncSession, quiz_id: UUID) -> Optional[AnswerKey]:
+        """キャッシュから解答キーを返し、なければ読み込む (クイズがなければ None)"""
+        answer_key = self.peek(quiz_id)
+        if answer_key is not None:
+            return answer_key
+
+        loading = self._loading.get(quiz_id)
+        if loading is not None:
+            try:
+                return await asyncio.shield(loading)
+            except Exception:
+                # 先行した読み込みが失敗したら自分のセッションで読み直す
+                pass
+
+        generation = self._generation
+        future: "asyncio.Future[Optional[AnswerKey]]" = asyncio.get_running_loop().create_future()
+        self._loading[quiz_id] = future
+        try:
+            answer_key = await load_answer_key(db, quiz_id)
+        except BaseException as e:
+            # キャンセルされた場合も、待っているタスクには自分で読み直させる
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError(f"Loading quiz {quiz_id} was interrupted"))
+            # 待っているタスクがなくても "never retrieved" の警告を出さない
+            future.exception()
+            raise
+        finally:
+            if self._loading.get(quiz_id) is future:
+                del self._loading[quiz_id]
+
+        future.set_result(answer_key)
+        if answer_key is not None:
+            self.set(answer_key, generation)
+        return answer_key
+
+    def set(self, answer_key: AnswerKey, generation: Optional[int] = None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                logger.debug(f"Quiz {answer_key.quiz_id} was invalidated during load; not caching.")
+                return
+            current = self._entries.get(answer_key.quiz_id)
+            # 他のタスクがより新しい version を入れていたら上書きしない
+            if current is not None and _is_newer(current[1], answer_key):
+                return
+            self._entries[answer_key.quiz_id] = (time.monotonic() + self.ttl_seconds, answer_key)
+            self._entries.move_to_end(answer_key.quiz_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, quiz_id: UUID) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(quiz_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _is_newer(current: AnswerKey, candidate: AnswerKey) -> bool:
+    if current.version is None or candidate.version is None:
+        return False
+    return current.version > candidate.version
+
+
+quiz_definition_cache = QuizDefinitionCache(
+    ttl_seconds=settings.QUIZ_DEFINITION_CACHE_TTL_SECONDS,
+    max_entries=settings.QUIZ_DEFINITION_CACHE_MAX_ENTRIES,
+)
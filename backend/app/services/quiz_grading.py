@@ -0,0 +1,213 @@
+"""
+クイズの採点。
+
+問題ごと・回答ごとに DB を引くと 50 問のクイズで 100 回以上の往復になるため、
+クイズの配点と正解を 1 回のクエリで読み込んで不変の解答キー (AnswerKey) にし、
+提出された回答はメモリ上で 1 パスで採点する。
+
+解答キーはクイズの updated_at を version として持つ。問題・選択肢を変更する
+CRUD はクイズの updated_at を更新するので、(quiz_id, version) ごとにキャッシュできる
+(app.services.quiz_definition_cache)。挑戦の開始に必要な is_active / max_attempts も持たせ、
+開始・提出ではクイズの定義を DB から読み直さない。
+"""
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.quiz import Quiz, QuizAnswer, QuizQuestion
+
+# 選択肢ではなく文字列で答える問題 (正解の選択肢の text と照合する)
+TEXT_QUESTION_TYPES = frozenset({"TEXT_INPUT", "ESSAY"})
+
+
+def normalize_text_answer(text: str) -> str:
+    """記述式の回答を比較用に正規化する (全角・半角、大文字・小文字、前後と連続する空白を無視)"""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+@dataclass(frozen=True)
+class QuestionKey:
+    question_id: UUID
+    question_type: str
+    points: int
+    answer_ids: FrozenSet[UUID]
+    correct_answer_ids: FrozenSet[UUID]
+    # 正規化した正解の文字列 -> 選択肢 ID (記述式のみ)
+    text_answers: Mapping[str, UUID]
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    quiz_id: UUID
+    version: Optional[datetime]
+    is_active: bool
+    max_attempts: Optional[int]
+    pass_percentage: float
+    total_points: int
+    questions: Mapping[UUID, QuestionKey]
+
+
+@dataclass(frozen=True)
+class GradeResult:
+    earned_points: int
+    total_points: int
+    score: float
+    passed: bool
+    correct_question_ids: FrozenSet[UUID]
+    # user_quiz_answers に入れる行 (question_id, selected_answer_id)
+    answer_rows: List[Dict[str, UUID]]
+
+
+def answer_key_query(quiz_id: UUID):
+    """クイズ・問題・選択肢を 1 回で読み込む (問題も選択肢もないクイズも 1 行返す)"""
+    return (
+        select(
+            Quiz.id.label("quiz_id"),
+            Quiz.updated_at,
+            Quiz.is_active,
+            Quiz.max_attempts,
+            Quiz.pass_percentage,
+            QuizQuestion.id.label("question_id"),
+            QuizQuestion.question_type,
+            QuizQuestion.points,
+            QuizAnswer.id.label("answer_id"),
+            QuizAnswer.is_correct,
+            QuizAnswer.text,
+        )
+        .select_from(Quiz)
+        .outerjoin(QuizQuestion, QuizQuestion.quiz_id == Quiz.id)
+        .outerjoin(QuizAnswer, QuizAnswer.question_id == QuizQuestion.id)
+        .where(Quiz.id == quiz_id)
+    )
+
+
+def build_answer_key(rows: Iterable[Any]) -> Optional[AnswerKey]:
+    """answer_key_query の結果行から解答キーを組み立てる"""
+    quiz = None
+    questions: Dict[UUID, Dict[str, Any]] = {}
+    for row in rows:
+        quiz = quiz or row
+        if row.question_id is None:
+            continue
+        question = questions.setdefault(row.question_id, {
+            "question_type": row.question_type,
+            "points": row.points or 0,
+            "answer_ids": set(),
+            "correct_answer_ids": set(),
+            "text_answers": {},
+        })
+        if row.answer_id is None:
+            continue
+        question["answer_ids"].add(row.answer_id)
+        if row.is_correct:
+            question["correct_answer_ids"].add(row.answer_id)
+            if row.question_type in TEXT_QUESTION_TYPES:
+                question["text_answers"][normalize_text_answer(row.text)] = row.answer_id
+    if quiz is None:
+        return None
+
+    question_keys = {
+        question_id: QuestionKey(
+            question_id=question_id,
+            question_type=question["question_type"],
+            points=question["points"],
+            answer_ids=frozenset(question["answer_ids"]),
+            correct_answer_ids=frozenset(question["correct_answer_ids"]),
+            text_answers=MappingProxyType(question["text_answers"]),
+        )
+        for question_id, question in questions.items()
+    }
+    return AnswerKey(
+        quiz_id=quiz.quiz_id,
+        version=quiz.updated_at,
+        is_active=bool(quiz.is_active),
+        max_attempts=quiz.max_attempts,
+        pass_percentage=quiz.pass_percentage or 0.0,
+        total_points=sum(question.points for question in question_keys.values()),
+        questions=MappingProxyType(question_keys),
+    )
+
+
+async def load_answer_key(db: AsyncSession, quiz_id: UUID) -> Optional[AnswerKey]:
+    """クイズの解答キーを 1 回のクエリで読み込む (クイズがなければ None)"""
+    result = await db.execute(answer_key_query(quiz_id))
+    return build_answer_key(result.all())
+
+
+def _as_uuid(value: Any) -> Optional[UUID]:
+    if value is None or isinstance(value, UUID):
+        return value
+    try:
+        return UUID(str(value))
+    except ValueError:
+        return None
+
+
+def grade(answer_key: AnswerKey, answers: Iterable[Mapping[str, Any]]) -> GradeResult:
+    """
+    提出された回答を解答キーで採点する。
+    回答は {"question_id", "selected_answer_id" (または "answer_id" / "selected_answer_ids"),
+    "user_text_answer"} の形。クイズにない問題や、問題に属さない選択肢は無視する。
+    選択式は選んだ選択肢の集合が正解の集合と一致したときに正解とする。
+    記述式は user_text_answer を正解と照合する。保存済みの回答 (照合済みの正解の
+    selected_answer_id だけを持つ) を採点し直すときは、その選択肢が正解なら正解とする。
+    """
+    selections: Dict[UUID, Set[UUID]] = {}
+    text_answers: Dict[UUID, str] = {}
+    matched_text_answers: Dict[UUID, UUID] = {}
+    for answer in answers:
+        question = answer_key.questions.get(_as_uuid(answer.get("question_id")))
+        if question is None:
+            continue
+        if question.question_type in TEXT_QUESTION_TYPES:
+            if answer.get("user_text_answer"):
+                text_answers[question.question_id] = answer["user_text_answer"]
+            else:
+                answer_id = _as_uuid(answer.get("selected_answer_id") or answer.get("answer_id"))
+                if answer_id in question.correct_answer_ids:
+                    matched_text_answers[question.question_id] = answer_id
+            continue
+        answer_ids = list(answer.get("selected_answer_ids") or [])
+        answer_ids.append(answer.get("selected_answer_id") or answer.get("answer_id"))
+        selected = selections.setdefault(question.question_id, set())
+        selected.update(
+            answer_id for answer_id in map(_as_uuid, answer_ids) if answer_id in question.answer_ids
+        )
+
+    correct: Set[UUID] = set()
+    answer_rows: List[Dict[str, UUID]] = []
+    for question_id, selected in selections.items():
+        if not selected:
+            continue
+        if selected == answer_key.questions[question_id].correct_answer_ids:
+            correct.add(question_id)
+        answer_rows.extend(
+            {"question_id": question_id, "selected_answer_id": answer_id} for answer_id in selected
+        )
+    for question_id, text in text_answers.items():
+        # user_quiz_answers は選択肢 ID しか持てないので、記述式は一致した正解の選択肢として記録する
+        matched_text_answers[question_id] = answer_key.questions[question_id].text_answers.get(
+            normalize_text_answer(text)
+        )
+    for question_id, matched in matched_text_answers.items():
+        if matched is not None:
+            correct.add(question_id)
+            answer_rows.append({"question_id": question_id, "selected_answer_id": matched})
+
+    earned_points = sum(answer_key.questions[question_id].points for question_id in correct)
+    total_points = answer_key.total_points
+    score = round(earned_points / total_points * 100, 2) if total_points > 0 else 0.0
+    return GradeResult(
+        earned_points=earned_points,
+        total_points=total_points,
+        score=score,
+        passed=score >= answer_key.pass_percentage,
+        correct_question_ids=frozenset(correct),
+        answer_rows=answer_rows,
+    )
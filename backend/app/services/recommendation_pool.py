@@ -0,0 +1,119 @@
+"""
+おすすめ (クイズ・大学) の候補の抽出とキャッシュ。
+
+ORDER BY random() は候補の全行を読んで並べ替えるため、カタログが大きくなるほど遅くなる。
+各行にインデックス付きの乱数キー (random_key) を持たせ、ランダムな起点からキー順に
+数件読む (足りなければ先頭から折り返す) ことで、インデックスの範囲読みだけで抽出する。
+
+抽出した候補はユーザーごとのプール (CandidatePool) として短い TTL
+(settings.RECOMMENDATION_POOL_TTL_SECONDS) でキャッシュし、リクエストごとには
+プールの中からメモリ上で選ぶ。
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, List, Optional, Tuple
+
+from sqlalchemy import Select, union_all
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def sample_by_random_key(query: Select, random_key: Any, size: int, pivot: Optional[float] = None):
+    """
+    query の行を random_key のランダムな位置から最大 size 件ずつ読むサブクエリを返す
+    (呼び出し側で LIMIT size する)。起点より後ろを読み、足りない分は先頭から折り返す
+    """
+    pivot = random.random() if pivot is None else pivot
+    after = query.where(random_key >= pivot).order_by(random_key).limit(size)
+    before = query.where(random_key < pivot).order_by(random_key).limit(size)
+    return union_all(after, before).subquery()
+
+
+@dataclass(frozen=True)
+class CandidatePool:
+    """優先度の高い順に並んだ候補のグループ"""
+    tiers: Tuple[Tuple[Any, ...], ...]
+
+    def pick(self, limit: int) -> List[Any]:
+        """優先度の高いグループから順に、各グループ内ではランダムに limit 件選ぶ"""
+        picked: List[Any] = []
+        for tier in self.tiers:
+            if len(picked) >= limit:
+                break
+            picked.extend(random.sample(tier, min(limit - len(picked), len(tier))))
+        return picked
+
+
+class CandidatePoolCache:
+    """
+    (種類, user_id) をキーにした TTL 付き LRU キャッシュ。
+    世代番号はキーごとに持ち、あるユーザーの無効化が他のユーザーの読み込み結果の保存を妨げないようにする
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, CandidatePool]]" = OrderedDict()
+        # キーごとの最後の無効化の番号。古いものから捨て、捨てた番号は _floor (記録のないキーの世代) に繰り上げる
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def generation(self, key: Hashable) -> int:
+        """読み込み前に取得して set() に渡すと、読み込み中に無効化された候補を書き戻さない"""
+        with self._lock:
+            return self._generations.get(key, self._floor)
+
+    def get(self, key: Hashable) -> Optional[CandidatePool]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, pool = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return pool
+
+    def set(self, key: Hashable, pool: CandidatePool, generation: Optional[int] = None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, self._floor):
+                logger.debug(f"Candidate pool {key} was invalidated during load; not caching.")
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, pool)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._counter += 1
+            self._generations[key] = self._counter
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.max_entries:
+                _, self._floor = self._generations.popitem(last=False)
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counter += 1
+            self._floor = self._counter
+            self._generations.clear()
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+recommendation_pool_cache = CandidatePoolCache(
+    ttl_seconds=settings.RECOMMENDATION_POOL_TTL_SECONDS,
+    max_entries=settings.RECOMMENDATION_POOL_MAX_ENTRIES,
+)
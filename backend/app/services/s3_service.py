@@ -1,67 +1,234 @@
+"""
+S3 へのアップロード・削除。
+
+boto3 は同期 API なので、async なエンドポイントから直接呼ぶとアップロードが終わるまで
+イベントループが止まる。ここではすべて専用の固定サイズのスレッドプールで実行し、
+boto3 のクライアント (コネクションプール) はプロセスで 1 つを共有する。
+
+- アップロードは UploadFile が一時ファイルに退避した内容をそのまま読みながら送り
+  (メモリに全体を読み込まない)、settings.S3_MULTIPART_THRESHOLD_MB を超えるとマルチパートにする
+- アイコンは Pillow で向きを補正して長辺 settings.ICON_MAX_DIMENSION まで縮小し、
+  EXIF を落としてから保存する (これもスレッドプールで行う)
+- クライアントから S3 へ直接アップロードできるよう、署名付き POST を発行する。
+  直接アップロードされたファイルは一時キーに置かれ、complete_icon_upload で
+  同じ正規化をしてからアイコンのキーへ保存する
+"""
+import asyncio
+import functools
 import logging
 import os
-from typing import Optional
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Optional, Tuple
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from fastapi import UploadFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 拡張子 -> (Pillow のフォーマット, Content-Type)
+ICON_FORMATS: Dict[str, Tuple[str, str]] = {
+    ".png": ("PNG", "image/png"),
+    ".jpg": ("JPEG", "image/jpeg"),
+    ".jpeg": ("JPEG", "image/jpeg"),
+    ".gif": ("GIF", "image/gif"),
+}
+
+# 正規化した画像をメモリに置く上限 (超えたらディスクに退避する)
+SPOOL_MAX_BYTES = 1024 * 1024
+
+
+def normalize_icon(source: BinaryIO, file_extension: str, max_dimension: int) -> BinaryIO:
+    """
+    アイコン画像の向きを補正して長辺を max_dimension までに縮小し、EXIF なしで保存し直す。
+    アニメーション GIF はフレームを崩さないようそのまま返す。画像でなければ ValueError。
+    """
+    image_format, _ = ICON_FORMATS[file_extension.lower()]
+    try:
+        with Image.open(source) as image:
+            if getattr(image, "is_animated", False):
+                source.seek(0)
+                return source
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension))
+            if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+            image.save(output, format=image_format, optimize=True)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid image: {e}") from e
+    output.seek(0)
+    return output
+
+
 class S3Service:
-    def __init__(self):
-        self.s3_client = boto3.client(
+    def __init__(
+        self,
+        bucket_name: Optional[str] = None,
+        s3_client: Any = None,
+        max_workers: int = settings.S3_MAX_WORKERS,
+    ):
+        self.s3_client = s3_client or boto3.client(
             's3',
             # ローカル開発用・テスト用などにエンドポイントURLを指定する場合
-            # endpoint_url=os.getenv('AWS_S3_ENDPOINT_URL'),
-            region_name=os.getenv('AWS_REGION', 'ap-northeast-1')
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            region_name=settings.AWS_REGION,
+            # スレッドプールの全スレッドが同時に接続できるようにする
+            config=Config(max_pool_connections=max_workers, retries={"mode": "standard"}),
         )
-        self.bucket_name = os.getenv('AWS_S3_ICON_BUCKET_NAME')
+        self.bucket_name = bucket_name or os.getenv('AWS_S3_ICON_BUCKET_NAME')
         if not self.bucket_name:
             logger.error("AWS_S3_ICON_BUCKET_NAME environment variable is not set.")
             # 必要に応じてここで例外を発生させるか、デフォルト値を設定
             # raise ValueError("S3 bucket name for icons is not configured.")
+        self.max_workers = max_workers
+        # パートの送信は呼び出し元のスレッドで順に行い、並列数はスレッドプールで抑える
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNK_MB * 1024 * 1024,
+            use_threads=False,
+        )
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="s3")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    @staticmethod
+    def icon_key(user_id: str, file_extension: str) -> str:
+        # S3のオブジェクトキーを生成 (例: icons/user_123.png)
+        return f"icons/user_{user_id}{file_extension}"
+
+    @staticmethod
+    def icon_upload_prefix(user_id: str) -> str:
+        """署名付き POST で直接アップロードされたアイコンの一時キーの接頭辞"""
+        return f"icons/uploads/user_{user_id}/"
+
+    def _upload_fileobj(self, fileobj: BinaryIO, object_key: str, content_type: Optional[str]) -> None:
+        extra_args = {"ContentType": content_type} if content_type else None
+        self.s3_client.upload_fileobj(
+            fileobj, self.bucket_name, object_key, ExtraArgs=extra_args, Config=self.transfer_config
+        )
+
+    async def upload_fileobj(self, fileobj: BinaryIO, object_key: str, content_type: Optional[str] = None) -> None:
+        """ファイルを読みながら S3 に送る (大きいファイルはマルチパート)"""
+        await self._run(self._upload_fileobj, fileobj, object_key, content_type)
+
+    def _store_icon(self, source: BinaryIO, object_key: str, file_extension: str) -> None:
+        icon = normalize_icon(source, file_extension, settings.ICON_MAX_DIMENSION)
+        try:
+            self._upload_fileobj(icon, object_key, ICON_FORMATS[file_extension.lower()][1])
+        finally:
+            if icon is not source:
+                icon.close()
 
     async def upload_icon(self, file: UploadFile, user_id: str, file_extension: str) -> Optional[str]:
-        """ユーザーアイコンをS3にアップロードする"""
+        """
+        ユーザーアイコンを正規化してS3にアップロードする
+        画像として読めなければ ValueError
+        """
         if not self.bucket_name:
             logger.error("S3 bucket name is not configured, cannot upload icon.")
             return None
 
-        # S3のオブジェクトキーを生成 (例: icons/user_123.png)
-        object_key = f"icons/user_{user_id}{file_extension}"
+        file_extension = file_extension.lower()
+        object_key = self.icon_key(user_id, file_extension)
 
         try:
-            # await を使って非同期にファイルを読み込む
-            contents = await file.read()
-            await file.seek(0)  # ストリームの位置をリセット (必要な場合)
+            # UploadFile.file は Starlette が退避した一時ファイル。読み込みから送信までスレッドプールで行う
+            await self._run(self._store_icon, file.file, object_key, file_extension)
+            logger.info(f"Successfully uploaded icon for user {user_id} to s3://{self.bucket_name}/{object_key}")
+            # オブジェクトキーを返す（実際のURLはアプリ側で組み立てる）
+            return object_key
 
-            self.s3_client.put_object(
+        except ValueError:
+            raise
+        except ClientError as e:
+            logger.error(f"Failed to upload icon for user {user_id} to S3: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"An unexpected error occurred during icon upload for user {user_id}: {e}")
+            return None
+
+    async def create_icon_upload(self, user_id: str, file_extension: str) -> Optional[Dict[str, Any]]:
+        """
+        クライアントから S3 へ直接アイコンをアップロードするための署名付き POST を発行する。
+        アップロード後に complete_icon_upload(object_key) を呼ぶとアイコンとして保存される。
+        """
+        if not self.bucket_name:
+            logger.error("S3 bucket name is not configured, cannot create icon upload.")
+            return None
+
+        content_type = ICON_FORMATS[file_extension.lower()][1]
+        object_key = f"{self.icon_upload_prefix(user_id)}{uuid.uuid4().hex}{file_extension.lower()}"
+        try:
+            post = await self._run(
+                self.s3_client.generate_presigned_post,
                 Bucket=self.bucket_name,
                 Key=object_key,
-                Body=contents,
-                ContentType=file.content_type,
-                # ACL='public-read'  # ACL を設定しないようにコメントアウト
+                Fields={"Content-Type": content_type},
+                Conditions=[
+                    {"Content-Type": content_type},
+                    ["content-length-range", 1, settings.ICON_MAX_UPLOAD_BYTES],
+                ],
+                ExpiresIn=settings.S3_PRESIGNED_EXPIRES_SECONDS,
             )
-            logger.info(f"Successfully uploaded icon for user {user_id} to s3://{self.bucket_name}/{object_key}")
+        except ClientError as e:
+            logger.error(f"Failed to create presigned icon upload for user {user_id}: {e}")
+            return None
+        return {
+            "url": post["url"],
+            "fields": post["fields"],
+            "object_key": object_key,
+            "expires_in": settings.S3_PRESIGNED_EXPIRES_SECONDS,
+        }
 
-            # アップロードされたファイルのURLを返す (CloudFront経由などを想定)
-            # ここではオブジェクトキーを返す例（実際のURLはアプリ側で組み立てる）
-            # 必要に応じて、署名付きURLなどを生成して返すことも可能
-            # s3_url = self.s3_client.generate_presigned_url(
-            #     'get_object',
-            #     Params={'Bucket': self.bucket_name, 'Key': object_key},
-            #     ExpiresIn=3600 # 1時間有効
-            # )
-            # return s3_url
-            return object_key
+    def _complete_icon_upload(self, upload_key: str, object_key: str, file_extension: str) -> None:
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as source:
+                self.s3_client.download_fileobj(self.bucket_name, upload_key, source, Config=self.transfer_config)
+                source.seek(0)
+                self._store_icon(source, object_key, file_extension)
+        finally:
+            # 一時キーは失敗しても残さない (完了されなかった分はバケットのライフサイクルで消す)
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=upload_key)
+
+    async def complete_icon_upload(self, user_id: str, upload_key: str) -> Optional[str]:
+        """
+        直接アップロードされたアイコンを正規化してアイコンのキーへ保存し、そのキーを返す。
+        他のユーザーの一時キーや画像でないファイルは ValueError
+        """
+        if not self.bucket_name:
+            logger.error("S3 bucket name is not configured, cannot complete icon upload.")
+            return None
+
+        _, file_extension = os.path.splitext(upload_key)
+        if not upload_key.startswith(self.icon_upload_prefix(user_id)) or file_extension.lower() not in ICON_FORMATS:
+            raise ValueError("Invalid upload key.")
 
+        file_extension = file_extension.lower()
+        object_key = self.icon_key(user_id, file_extension)
+        try:
+            await self._run(self._complete_icon_upload, upload_key, object_key, file_extension)
+            logger.info(f"Successfully stored uploaded icon for user {user_id} to s3://{self.bucket_name}/{object_key}")
+            return object_key
+        except ValueError:
+            raise
         except ClientError as e:
-            logger.error(f"Failed to upload icon for user {user_id} to S3: {e}")
+            logger.error(f"Failed to complete icon upload for user {user_id}: {e}")
             return None
         except Exception as e:
-            logger.error(f"An unexpected error occurred during icon upload for user {user_id}: {e}")
-            # より詳細なエラーハンドリングが必要な場合がある
+            logger.error(f"An unexpected error occurred while completing icon upload for user {user_id}: {e}")
             return None
 
     async def delete_icon(self, user_id: str, file_extension: str) -> bool:
@@ -70,10 +237,10 @@ class S3Service:
             logger.error("S3 bucket name is not configured, cannot delete icon.")
             return False
 
-        object_key = f"icons/user_{user_id}{file_extension}"
+        object_key = self.icon_key(user_id, file_extension)
 
         try:
-            self.s3_client.delete_object(Bucket=self.bucket_name, Key=object_key)
+            await self._run(self.s3_client.delete_object, Bucket=self.bucket_name, Key=object_key)
             logger.info(f"Successfully deleted icon for user {user_id} from s3://{self.bucket_name}/{object_key}")
             return True
         except ClientError as e:
@@ -83,45 +250,10 @@ class S3Service:
             logger.error(f"An unexpected error occurred during icon deletion for user {user_id}: {e}")
             return False
 
-# 使用例 (FastAPIのルーターなどで):
-# from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
-# from app.services.s3_service import S3Service
-# from app.core.security import get_current_user # 仮の認証関数
-# from app.models.user import User # 仮のユーザーモデル
-
-# router = APIRouter()
-# s3_service = S3Service()
-
-# @router.post("/upload-icon/")
-# async def upload_user_icon(
-#     file: UploadFile = File(...),
-#     current_user: User = Depends(get_current_user)
-# ):
-#     # ファイル拡張子を取得 (例: .png, .jpg)
-#     _, file_extension = os.path.splitext(file.filename)
-#     if file_extension.lower() not in ['.png', '.jpg', '.jpeg', '.gif']:
-#         raise HTTPException(status_code=400, detail="Invalid image format.")
-
-#     object_key = await s3_service.upload_icon(file, str(current_user.id), file_extension)
-#     if not object_key:
-#         raise HTTPException(status_code=500, detail="Failed to upload icon.")
-
-#     # ここでユーザーモデルの profile_image_url などを更新する処理
-#     # 例: await crud.user.update(db, db_obj=current_user, obj_in={"profile_image_url": object_key})
-
-#     return {"message": "Icon uploaded successfully", "object_key": object_key}
-
-# @router.delete("/delete-icon/")
-# async def delete_user_icon(current_user: User = Depends(get_current_user)):
-#     # ユーザーの現在のアイコンURLから拡張子を取得する必要がある
-#     # 例: _, file_extension = os.path.splitext(current_user.profile_image_url)
-#     file_extension = ".png" # 仮にpngとする
-
-#     success = await s3_service.delete_icon(str(current_user.id), file_extension)
-#     if not success:
-#         raise HTTPException(status_code=500, detail="Failed to delete icon.")
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
 
-#     # ユーザーモデルの profile_image_url をNoneやデフォルト値に更新する処理
-#     # 例: await crud.user.update(db, db_obj=current_user, obj_in={"profile_image_url": None})
 
-#     return {"message": "Icon deleted successfully"} 
\ No newline at end of file
+s3_service = S3Service()
@@ -0,0 +1,135 @@
+"""
+自己分析レポート (各ステップのノート + Markdown 年表) の組み立てとキャッシュ。
+
+レポートはセッションの全ノートを list_notes_by_step で 1 クエリ取得して組み立て、
+セッション ID ごとにプロセス内キャッシュへ保持する。
+SelfAnalysisNote が書き込まれるとコミット時に SQLAlchemy のセッションイベントで
+該当セッションのレポートを破棄する (他プロセスでの書き込みは TTL の経過で反映される)。
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.self_analysis import SelfAnalysisNote
+from app.services.agents.self_analysis_langchain.markdown import render_markdown_timeline
+from app.services.agents.self_analysis_monono_agent.tools.notes import list_notes_by_step
+
+logger = logging.getLogger(__name__)
+
+# レポートに含めるステップ (レスポンスのキー名 → ノートのステップ名)
+REPORT_STEPS = {
+    "future": "FUTURE",
+    "motivation": "MOTIVATION",
+    "history": "HISTORY",
+    "gap": "GAP",
+    "vision": "VISION",
+    "reflect": "REFLECT",
+}
+
+# セッションの info に無効化対象を溜めておくキー
+_PENDING_KEY = "_self_analysis_report_pending"
+
+
+class SelfAnalysisReportCache:
+    """セッション ID をキーにした TTL 付き LRU キャッシュ"""
+
+    def __init__(self, ttl_seconds: float, max_sessions: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """
+        無効化のたびに進むカウンタ。組み立て前に取得して set() に渡すと、
+        組み立て中にノートが書き込まれた場合の古いレポートの書き戻しを防げる。
+        """
+        return self._generation
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        expires_at, report = entry
+        if expires_at < time.monotonic():
+            del self._entries[session_id]
+            return None
+        self._entries.move_to_end(session_id)
+        return report
+
+    def set(self, session_id: str, report: Dict[str, Any], generation: Optional[int] = None) -> None:
+        if generation is not None and generation != self._generation:
+            logger.debug(f"Self-analysis report for session {session_id} was invalidated during build; not caching.")
+            return
+        self._entries[session_id] = (time.monotonic() + self.ttl_seconds, report)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, session_id: str) -> None:
+        self._generation += 1
+        self._entries.pop(session_id, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+report_cache = SelfAnalysisReportCache(
+    ttl_seconds=settings.SELF_ANALYSIS_REPORT_CACHE_TTL_SECONDS,
+    max_sessions=settings.SELF_ANALYSIS_REPORT_CACHE_MAX_SESSIONS,
+)
+
+
+def build_report(notes_by_step: Dict[str, list]) -> Dict[str, Any]:
+    """ステップごとのノートからレポートを組み立てる"""
+    report = {key: notes_by_step.get(step, []) for key, step in REPORT_STEPS.items()}
+    history = report["history"]
+    timeline = history[0].get("timeline", []) if history and isinstance(history[0], dict) else []
+    report["timeline_md"] = render_markdown_timeline(timeline)
+    return report
+
+
+async def load_self_analysis_report(db: AsyncSession, session_id: str) -> Dict[str, Any]:
+    """キャッシュ済みならそれを、なければノートを呼び出し側のセッションで 1 クエリ読み込んでレポートを返す"""
+    report = report_cache.get(session_id)
+    if report is not None:
+        return report
+    generation = report_cache.generation
+    report = build_report(await list_notes_by_step(session_id, db))
+    report_cache.set(session_id, report, generation)
+    return report
+
+
+# --- セッションイベントによる無効化 ---
+
+@event.listens_for(Session, "after_flush")
+def _record_note_changes(session: Session, flush_context) -> None:
+    pending: Set[str] = {
+        str(obj.session_id)
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, SelfAnalysisNote) and obj.session_id is not None
+    }
+    if pending:
+        session.info.setdefault(_PENDING_KEY, set()).update(pending)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_report_invalidations(session: Session) -> None:
+    for session_id in session.info.pop(_PENDING_KEY, ()):
+        report_cache.invalidate(session_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_report_invalidations(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
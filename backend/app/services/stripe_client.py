@@ -0,0 +1,175 @@
+"""
+同期の Stripe SDK を非同期ハンドラーから使うためのファサード。
+
+StripeService のメソッドは stripe SDK (requests) をそのまま呼ぶため、
+async なエンドポイントから直接呼ぶと Stripe の応答を待つ間イベントループが止まる。
+ここでは専用の固定サイズのスレッドプールで実行し、HTTP 接続は
+stripe_service で設定した共有の requests.Session (コネクションプール) を使い回す。
+
+商品・価格・クーポンなどのカタログ読み込みは TTL 付きでキャッシュする。
+同じプロセスでの書き込みと、Stripe の Webhook (product.* / price.* / coupon.* など) で
+該当する種別のキャッシュを破棄する。他のプロセスには Webhook が届かないため、
+そちらは settings.STRIPE_CATALOG_CACHE_TTL_SECONDS で古さの上限を決める。
+キャッシュした StripeObject は呼び出し元で共有されるので、書き換えずにコピーして使うこと。
+"""
+import asyncio
+import functools
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from app.core.config import settings
+from app.services.stripe_service import StripeService
+
+logger = logging.getLogger(__name__)
+
+# 結果をキャッシュする読み込み -> キャッシュの種別
+CACHED_READS: Dict[str, str] = {
+    "list_products": "product",
+    "get_product": "product",
+    "list_prices": "price",
+    "list_all_prices": "price",
+    "get_price": "price",
+    "list_coupons": "coupon",
+    "retrieve_coupon": "coupon",
+    "retrieve_promotion_code": "promotion_code",
+}
+
+# 成功後にキャッシュを破棄する書き込み -> 破棄する種別
+# (価格一覧は data.product を展開しているので、商品の変更で価格も破棄する)
+INVALIDATING_WRITES: Dict[str, Tuple[str, ...]] = {
+    "create_product": ("product", "price"),
+    "update_product": ("product", "price"),
+    "archive_product": ("product", "price"),
+    "create_price": ("price",),
+    "update_price": ("price",),
+    "create_coupon": ("coupon",),
+    "create_stripe_coupon": ("coupon",),
+    "update_coupon": ("coupon",),
+    "archive_stripe_coupon": ("coupon",),
+    "delete_coupon": ("coupon",),
+    "create_promotion_code": ("promotion_code",),
+    "archive_promotion_code": ("promotion_code",),
+}
+
+# Webhook のイベント種別の接頭辞 -> 破棄する種別
+EVENT_INVALIDATIONS: Dict[str, Tuple[str, ...]] = {
+    "product": ("product", "price"),
+    "price": ("price",),
+    "plan": ("price",),
+    "coupon": ("coupon",),
+    "promotion_code": ("promotion_code",),
+}
+
+
+class StripeCatalogCache:
+    """種別ごとの世代番号を持つ TTL 付き LRU キャッシュ"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+
+    def generation(self, kind: str) -> int:
+        return self._generations.get(kind, 0)
+
+    def get(self, kind: str, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get((kind, key))
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[(kind, key)]
+            return None
+        self._entries.move_to_end((kind, key))
+        return value
+
+    def set(self, kind: str, key: Hashable, value: Any, generation: int) -> None:
+        """読み込み開始時の世代から変わっていれば (途中で破棄されていれば) 保存しない"""
+        if self.ttl_seconds <= 0 or generation != self.generation(kind):
+            return
+        self._entries[(kind, key)] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end((kind, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *kinds: str) -> None:
+        for kind in kinds:
+            self._generations[kind] = self.generation(kind) + 1
+        for entry_key in [k for k in self._entries if k[0] in kinds]:
+            del self._entries[entry_key]
+
+    def invalidate_for_event(self, event_type: str) -> None:
+        """Webhook のイベント種別 (例: "price.updated") に対応するキャッシュを破棄する"""
+        kinds = EVENT_INVALIDATIONS.get(event_type.split(".", 1)[0])
+        if kinds:
+            self.invalidate(*kinds)
+            logger.debug(f"Stripe catalog cache invalidated by {event_type}: {kinds}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._generations.clear()
+
+
+class AsyncStripeService:
+    """
+    StripeService の各メソッドを同じ名前・引数の coroutine として提供する。
+    例: await stripe_client.list_products(active=True)
+    """
+
+    def __init__(self, max_workers: int, cache: StripeCatalogCache):
+        self.max_workers = max_workers
+        self.cache = cache
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def call(self, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """任意の同期 Stripe 呼び出しをスレッドプールで実行する"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stripe")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def _cached_read(self, method: str, kind: str, /, *args, **kwargs) -> Any:
+        # 引数には dict (created など) も来るので repr をキーにする
+        key = (method, repr(args), repr(sorted(kwargs.items())))
+        cached = self.cache.get(kind, key)
+        if cached is not None:
+            return cached
+        generation = self.cache.generation(kind)
+        result = await self.call(getattr(StripeService, method), *args, **kwargs)
+        self.cache.set(kind, key, result, generation)
+        return result
+
+    async def _write(self, method: str, kinds: Tuple[str, ...], /, *args, **kwargs) -> Any:
+        # create_product(name=...) のように name などを引数に取るメソッドがあるので位置専用にする
+        try:
+            return await self.call(getattr(StripeService, method), *args, **kwargs)
+        finally:
+            # 失敗しても Stripe 側で反映済みの場合があるので破棄しておく
+            self.cache.invalidate(*kinds)
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        if name.startswith("_") or not hasattr(StripeService, name):
+            raise AttributeError(name)
+        if name in CACHED_READS:
+            return functools.partial(self._cached_read, name, CACHED_READS[name])
+        if name in INVALIDATING_WRITES:
+            return functools.partial(self._write, name, INVALIDATING_WRITES[name])
+        return functools.partial(self.call, getattr(StripeService, name))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+stripe_catalog_cache = StripeCatalogCache(
+    ttl_seconds=settings.STRIPE_CATALOG_CACHE_TTL_SECONDS,
+    max_entries=settings.STRIPE_CATALOG_CACHE_MAX_ENTRIES,
+)
+
+stripe_client = AsyncStripeService(max_workers=settings.STRIPE_MAX_WORKERS, cache=stripe_catalog_cache)
@@ -1,4 +1,6 @@
+import requests
 import stripe
+from requests.adapters import HTTPAdapter
 from app.core.config import settings
 from app.schemas.subscription import CheckoutSessionResponse
 from typing import Optional, Dict, Any, List
@@ -15,6 +17,12 @@ logger = logging.getLogger(__name__)
 # Stripe APIキーの設定
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# 接続を使い回すため、全スレッドで 1 つの requests.Session (コネクションプール) を共有する
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_MAX_WORKERS))
+stripe.default_http_client = stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT_SECONDS, session=_http_session)
+stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+
 class StripeService:
     @staticmethod
     def create_customer(email: str, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> str:
@@ -101,6 +109,23 @@ class StripeService:
             logger.error(f"価格一覧取得エラー: {str(e)}")
             raise
 
+    @staticmethod
+    def list_all_prices(active: Optional[bool] = True) -> List[Dict[str, Any]]:
+        """
+        Stripeから全商品の価格を取得する (100 件ずつのページングで、商品数によらず呼び出し回数は一定)
+        価格の product は商品 ID の文字列のまま返す
+        """
+        try:
+            list_params = {'limit': 100}
+            if active is not None:
+                list_params['active'] = active
+            prices = list(stripe.Price.list(**list_params).auto_paging_iter())
+            logger.info(f"Stripe Price 全件取得: {len(prices)} 件")
+            return prices
+        except Exception as e:
+            logger.error(f"価格一覧 (全件) 取得エラー: {str(e)}")
+            raise
+
     @staticmethod
     def get_product(product_id: str) -> Dict[str, Any]:
         """
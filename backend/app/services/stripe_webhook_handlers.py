@@ -0,0 +1,365 @@
+"""
+Stripe Webhook イベントの処理本体。
+
+受信エンドポイント (subscription.stripe_webhook) はイベントを保存して即座に応答し、
+ここにある handle_stripe_event は app.services.stripe_webhook_queue のワーカーから呼ばれる。
+例外を送出したイベントはキューが再試行し、{"status": "error"} を返したイベントは
+再試行しても結果が変わらない (データ不整合など) ものとして失敗扱いにする。
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import crud_role
+from app.crud import subscription as crud_subscription
+from app.crud import user as crud_user
+from app.models.subscription import CampaignCode
+from app.schemas.user import UserStatus as SchemaUserStatus, UserUpdate
+from app.services.stripe_client import stripe_client
+
+logger = logging.getLogger(__name__)
+
+
+def ordering_key_for(event: Dict[str, Any]) -> str:
+    """
+    順序を保って処理すべきイベントをまとめるキー。
+    サブスクリプションに関するイベントはサブスクリプション ID、それ以外は対象オブジェクトの ID。
+    """
+    data = event['data']['object']
+    event_type = event['type']
+    if event_type.startswith('customer.subscription.'):
+        key = data.get('id')
+    elif event_type.startswith(('checkout.session.', 'invoice.')):
+        key = data.get('subscription') or data.get('customer')
+    else:
+        key = data.get('id')
+    return str(key or event['id'])
+
+
+async def handle_stripe_event(db: AsyncSession, event: Any) -> Dict[str, Any]:
+    """
+    Stripe のイベントを 1 件処理する。
+    主にサブスクリプションのステータス変更や支払い完了イベントをハンドルします。
+    """
+    event_type = event['type']
+    data = event['data']['object']
+
+    if event_type == 'checkout.session.completed':
+        try:
+            session = data
+            logger.info(f"🟢 Checkout Session Completed開始: {session.id}")
+            metadata = session.get('metadata', {})
+            user_id_str = metadata.get('user_id')
+            price_id = metadata.get('price_id')
+            stripe_subscription_id = session.get('subscription')
+            stripe_customer_id = session.get('customer')
+            applied_coupon_id = metadata.get('applied_coupon_id')
+            db_campaign_code: Optional[CampaignCode] = None
+
+            logger.info(f"📊 Webhook受信データ - user_id: {user_id_str}, price_id: {price_id}, subscription: {stripe_subscription_id}, coupon: {applied_coupon_id}")
+        except Exception as init_error:
+            logger.error(f"🚨 checkout.session.completed 初期処理でエラー: {init_error}", exc_info=True)
+            return {"status": "error", "message": f"初期処理エラー: {str(init_error)}"}
+
+        try:
+            logger.info(f"🔍 クーポンコード処理開始 - applied_coupon_id: {applied_coupon_id}")
+            if applied_coupon_id:
+                db_coupon = await crud_subscription.get_db_coupon_by_stripe_id(db, applied_coupon_id)
+                if db_coupon and db_coupon.campaign_codes:
+                    db_campaign_code = db_coupon.campaign_codes[0]
+                    logger.info(f"✅ Checkoutに適用されたDB Campaign Code ID: {db_campaign_code.id} (via Stripe Coupon: {applied_coupon_id})")
+                else:
+                    logger.warning(f"⚠️ メタデータのStripe Coupon ID {applied_coupon_id} に対応するDB CampaignCodeが見つかりません。")
+        except Exception as coupon_error:
+            logger.error(f"🚨 クーポンコード処理でエラー: {coupon_error}", exc_info=True)
+            return {"status": "error", "message": f"クーポンコード処理エラー: {str(coupon_error)}"}
+
+        try:
+            logger.info(f"🔍 ユーザーID検証開始 - user_id_str: {user_id_str}")
+            if not user_id_str:
+                logger.error("🚨 Webhook checkout.session.completed: metadataにuser_idがありません")
+                return {"status": "error", "message": "user_id not found in metadata"}
+
+            user_id = UUID(user_id_str)
+            logger.info(f"✅ ユーザーID検証成功 - user_id: {user_id}")
+        except ValueError as uuid_error:
+            logger.error(f"🚨 Webhook checkout.session.completed: 無効なuser_id形式です: {user_id_str} - {uuid_error}")
+            return {"status": "error", "message": "Invalid user_id format"}
+        except Exception as user_validation_error:
+            logger.error(f"🚨 ユーザーID検証でエラー: {user_validation_error}", exc_info=True)
+            return {"status": "error", "message": f"ユーザーID検証エラー: {str(user_validation_error)}"}
+
+        try:
+            logger.info(f"🔍 既存サブスクリプション検索開始 - stripe_subscription_id: {stripe_subscription_id}")
+            existing_sub = await crud_subscription.get_subscription_by_stripe_id(db, stripe_subscription_id)
+            logger.info(f"📊 既存サブスクリプション検索結果: {'見つかりました' if existing_sub else '見つかりませんでした'}")
+        except Exception as sub_search_error:
+            logger.error(f"🚨 既存サブスクリプション検索でエラー: {sub_search_error}", exc_info=True)
+            return {"status": "error", "message": f"サブスクリプション検索エラー: {str(sub_search_error)}"}
+
+        if existing_sub:
+             logger.info(f"既存サブスクリプション更新 (Stripe ID: {stripe_subscription_id})")
+             stripe_sub_data = await stripe_client.get_subscription(stripe_subscription_id)
+             update_data = {
+                 "status": stripe_sub_data.get('status'),
+                 "current_period_start": datetime.fromtimestamp(cps) if (cps := stripe_sub_data.get('current_period_start')) is not None else None,
+                 "current_period_end": datetime.fromtimestamp(cpe) if (cpe := stripe_sub_data.get('current_period_end')) is not None else None,
+                 "cancel_at": datetime.fromtimestamp(ca) if (ca := stripe_sub_data.get('cancel_at')) is not None else None,
+                 "canceled_at": datetime.fromtimestamp(cat) if (cat := stripe_sub_data.get('canceled_at')) is not None else None,
+                 "is_active": stripe_sub_data.get('status') in ['active', 'trialing'],
+                 "campaign_code_id": db_campaign_code.id if db_campaign_code else existing_sub.campaign_code_id,
+                 "stripe_customer_id": stripe_customer_id
+             }
+             await crud_subscription.update_subscription(db, existing_sub.id, update_data)
+        else:
+            try:
+                logger.info(f"🟢 新規サブスクリプション作成開始 (Stripe ID: {stripe_subscription_id})")
+                logger.info(f"🔍 Stripe APIからサブスクリプション情報取得中...")
+                stripe_sub_data = await stripe_client.get_subscription(stripe_subscription_id)
+                logger.info(f"✅ Stripe APIからサブスクリプション情報取得成功")
+
+                # ★★★ Stripe Price ID から DBのPlan UUIDを取得 ★★★
+                logger.info(f"🔍 Price ID取得開始...")
+                stripe_price_id = stripe_sub_data.get('items', {}).get('data', [{}])[0].get('price', {}).get('id')
+                logger.info(f"📊 取得されたPrice ID: {stripe_price_id}")
+
+                db_plan = None
+                if stripe_price_id:
+                    logger.info(f"🔍 DB内のプラン検索開始 - Price ID: {stripe_price_id}")
+                    db_plan = await crud_subscription.get_plan_by_price_id(db, stripe_price_id)
+                    logger.info(f"📊 DB内のプラン検索結果: {'見つかりました' if db_plan else '見つかりませんでした'}")
+                else:
+                    logger.error("🚨 Stripe SubscriptionデータからPrice IDを取得できませんでした。")
+            except Exception as stripe_fetch_error:
+                logger.error(f"🚨 Stripe情報取得でエラー: {stripe_fetch_error}", exc_info=True)
+                return {"status": "error", "message": f"Stripe情報取得エラー: {str(stripe_fetch_error)}"}
+
+            if not db_plan:
+                 logger.error(f"🚨 Stripe Price ID {stripe_price_id} に対応するDBプランが見つかりません。")
+                 logger.error(f"🚨 利用可能なプランをDBから確認してください: user_id={user_id}, stripe_sub_id={stripe_subscription_id}")
+                 # エラーで停止せず、警告として処理を続行
+                 logger.warning(f"⚠️ プラン紐付けに失敗しましたが、処理を続行します。")
+                 return {"status": "error", "message": f"プラン情報の紐付けに失敗しました: price_id={stripe_price_id}"}
+            # ★★★ ここまで ★★★
+
+            new_sub_data = {
+                "user_id": user_id,
+                "plan_id": db_plan.id, # ★ DBから取得したUUIDを設定
+                "price_id": stripe_price_id, # ★ StripeのPrice IDを設定
+                "stripe_subscription_id": stripe_subscription_id,
+                "stripe_customer_id": stripe_customer_id,
+                "status": stripe_sub_data.get('status'),
+                "current_period_start": datetime.fromtimestamp(cps) if (cps := stripe_sub_data.get('current_period_start')) is not None else None,
+                "current_period_end": datetime.fromtimestamp(cpe) if (cpe := stripe_sub_data.get('current_period_end')) is not None else None,
+                "is_active": stripe_sub_data.get('status') in ['active', 'trialing'],
+                "campaign_code_id": db_campaign_code.id if db_campaign_code else None,
+            }
+            # SubscriptionCreate スキーマの検証 (plan_id が必須になっているはず)
+            await crud_subscription.create_subscription(db, crud_subscription.SubscriptionCreate(**new_sub_data))
+
+        # --- ★ 購入商品に紐づくロールをユーザーに割り当て --- (ここから修正)
+        if stripe_subscription_id and 'stripe_sub_data' in locals() and stripe_sub_data:
+            try:
+                items = stripe_sub_data.get('items', {}).get('data', [])
+                if items:
+                    price_info = items[0].get('price') # 通常、サブスクリプションの最初のアイテムが対象
+                    if price_info and price_info.get('product'):
+                        stripe_product_id_from_sub = price_info.get('product')
+                        logger.info(f"Subscription item's Stripe Product ID: {stripe_product_id_from_sub} を元にロール割り当て試行 (User: {user_id})")
+                        product_data = await stripe_client.get_product(stripe_product_id_from_sub)
+                        if product_data and product_data.get('metadata'):
+                            assigned_role_id_str = product_data.get('metadata', {}).get('assigned_role')
+                            if assigned_role_id_str:
+                                logger.info(f"商品 {stripe_product_id_from_sub} に紐づくロールID(str): {assigned_role_id_str} をユーザー {user_id} に割り当て試行")
+                                try:
+                                    assigned_role_id = UUID(assigned_role_id_str)
+                                    target_role_obj = await crud_role.get_role(db, role_id=assigned_role_id)
+
+                                    if target_role_obj:
+                                        target_role_name = target_role_obj.name
+                                        user_to_update = await crud_user.get_user(db, user_id)
+                                        if user_to_update:
+                                            await crud_user.update_user(db, db_user=user_to_update, user_in=UserUpdate(role=target_role_name))
+                                            logger.info(f"ユーザー {user_id} のプライマリロールを '{target_role_name}' (ID: {assigned_role_id}) に更新しました。")
+
+                                            # ★ ロール更新後、既存のJWTトークンを無効化してユーザーに再ログインを促す
+                                            try:
+                                                # トークン無効化機能は現在実装されていないためコメントアウト
+                                                # from app.crud.token_blacklist import add_to_blacklist
+                                                # 該当ユーザーのすべてのアクティブトークンを無効化
+                                                # （実装により異なるが、user_idベースで無効化）
+                                                logger.info(f"ユーザー {user_id} のロール更新により、既存トークンの再検証が必要です。（トークン無効化機能は未実装のためスキップ）")
+                                            except Exception as token_invalidate_error:
+                                                logger.warning(f"トークン無効化処理でエラー（ユーザー: {user_id}）: {token_invalidate_error}")
+                                        else:
+                                            logger.warning(f"ロール割り当て対象のユーザー {user_id} がDBで見つかりません。")
+                                    else:
+                                        logger.error(f"指定されたロールID {assigned_role_id} (\"{assigned_role_id_str}\") に該当するロールがDBで見つかりません。")
+                                except ValueError:
+                                    logger.error(f"メタデータの assigned_role '{assigned_role_id_str}' は有効なUUIDではありません。")
+                                except Exception as e_role_assign:
+                                    logger.error(f"ロール割り当て処理中に予期せぬエラー: {e_role_assign}", exc_info=True)
+                            else:
+                                logger.info(f"Stripe Product {stripe_product_id_from_sub} のメタデータに assigned_role が設定されていません。")
+                        else:
+                            logger.warning(f"Stripe Product {stripe_product_id_from_sub} のメタデータ取得に失敗、またはメタデータが存在しません。")
+                    else:
+                        logger.warning(f"サブスクリプションアイテムからStripe Product IDを取得できませんでした。Subscription ID: {stripe_subscription_id}")
+                else:
+                    logger.warning(f"サブスクリプション {stripe_subscription_id} にアイテムが見つかりません。ロール割り当て不可。")
+            except Exception as e_outer_role_assign:
+                logger.error(f"ロール割り当てブロック全体で予期せぬエラー: {e_outer_role_assign}", exc_info=True)
+        elif not stripe_subscription_id:
+            logger.warning(f"checkout.session.completed イベントに subscription ID が含まれていません。ロール割り当て不可。 Session ID: {session.id}")
+        elif not ('stripe_sub_data' in locals() and stripe_sub_data):
+             logger.warning(f"stripe_sub_dataが利用できませんでした。ロール割り当て不可。 Subscription ID: {stripe_subscription_id}, Session ID: {session.id}")
+        # --- ★ ロール割り当て処理ここまで ---
+
+        if db_campaign_code:
+            await crud_subscription.increment_campaign_code_usage(db, db_campaign_code.id)
+
+        try:
+            logger.info(f"🔍 ユーザーステータス更新開始 - user_id: {user_id}")
+            user = await crud_user.get_user(db, user_id)
+            if user and user.status != SchemaUserStatus.ACTIVE:
+                await crud_user.update_user(db, db_user=user, user_in=UserUpdate(status=SchemaUserStatus.ACTIVE))
+                logger.info(f"✅ ユーザーステータスをACTIVEに更新しました - user_id: {user_id}")
+            else:
+                logger.info(f"📊 ユーザーは既にACTIVEです - user_id: {user_id}")
+        except Exception as user_status_error:
+            logger.error(f"🚨 ユーザーステータス更新でエラー: {user_status_error}", exc_info=True)
+            # ユーザーステータス更新は重要ではないのでエラーでも処理続行
+
+        logger.info(f"🎉 checkout.session.completed処理完了 - session_id: {session.id}")
+
+    elif event_type == 'invoice.payment_succeeded':
+        invoice = data
+        logger.info(f"Invoice Payment Succeeded: {invoice.id}")
+        stripe_subscription_id = invoice.get('subscription')
+        stripe_payment_intent_id = invoice.get('payment_intent')
+
+        if stripe_subscription_id:
+            # 既存のサブスクリプション情報を更新
+            db_subscription = await crud_subscription.get_subscription_by_stripe_id(db, stripe_subscription_id)
+            if db_subscription:
+                # Stripeから最新のサブスクリプション情報を取得して更新
+                stripe_sub_data = await stripe_client.get_subscription(stripe_subscription_id)
+                update_data = {
+                    "status": stripe_sub_data.get('status'),
+                    "current_period_start": datetime.fromtimestamp(cps) if (cps := stripe_sub_data.get('current_period_start')) is not None else None,
+                    "current_period_end": datetime.fromtimestamp(cpe) if (cpe := stripe_sub_data.get('current_period_end')) is not None else None,
+                    "cancel_at": datetime.fromtimestamp(ca) if (ca := stripe_sub_data.get('cancel_at')) is not None else None,
+                    "canceled_at": datetime.fromtimestamp(cat) if (cat := stripe_sub_data.get('canceled_at')) is not None else None,
+                    "is_active": stripe_sub_data.get('status') in ['active', 'trialing'],
+                }
+                await crud_subscription.update_subscription(db, db_subscription.id, update_data)
+
+    # 支払い履歴を作成
+                payment_data = {
+                    "user_id": db_subscription.user_id,
+                    "subscription_id": db_subscription.id,
+                    "stripe_payment_intent_id": stripe_payment_intent_id,
+                    "stripe_invoice_id": invoice.id,
+                    "amount": invoice.amount_paid,
+                    "currency": invoice.currency,
+                    "payment_date": datetime.fromtimestamp(spst) if (spst := invoice.status_transitions.paid_at) is not None else None,
+                    "status": "succeeded",
+                    "description": f"サブスクリプション支払い ({db_subscription.plan_name})"
+                }
+                await crud_subscription.create_payment_history(db, crud_subscription.PaymentHistoryCreate(**payment_data))
+            else:
+                 logger.error(f"Webhook invoice.payment_succeeded: Stripe Sub ID {stripe_subscription_id} に対応するDBレコードが見つかりません。")
+
+
+    elif event_type == 'invoice.payment_failed':
+        invoice = data
+        logger.warning(f"Invoice Payment Failed: {invoice.id}, Subscription: {invoice.get('subscription')}")
+        stripe_subscription_id = invoice.get('subscription')
+        if stripe_subscription_id:
+            # 支払い失敗に対応する処理（例：サブスクリプションステータスを 'past_due' or 'unpaid' に更新）
+            db_subscription = await crud_subscription.get_subscription_by_stripe_id(db, stripe_subscription_id)
+            if db_subscription:
+                stripe_sub_data = await stripe_client.get_subscription(stripe_subscription_id)
+                update_data = {"status": stripe_sub_data.get('status', 'past_due'), "is_active": False} # Stripe側のステータスを反映
+                await crud_subscription.update_subscription(db, db_subscription.id, update_data)
+                # ユーザーへの通知など
+
+
+    elif event_type == 'customer.subscription.updated':
+        stripe_sub_event_data = data # イベントデータ内の subscription オブジェクト
+        logger.info(f"Customer Subscription Updated: {stripe_sub_event_data.get('id')}, Status: {stripe_sub_event_data.get('status')}")
+        db_subscription = await crud_subscription.get_subscription_by_stripe_id(db, stripe_sub_event_data.get('id'))
+        if db_subscription:
+            new_stripe_price_id = None
+            if stripe_sub_event_data.get('items') and stripe_sub_event_data['items'].get('data'):
+                current_item = stripe_sub_event_data['items']['data'][0]
+                if current_item.get('price'):
+                    new_stripe_price_id = current_item['price'].get('id')
+
+            new_db_plan_id = db_subscription.plan_id
+            if new_stripe_price_id:
+                db_plan = await crud_subscription.get_plan_by_price_id(db, new_stripe_price_id)
+                if db_plan:
+                    new_db_plan_id = db_plan.id
+                else:
+                    logger.warning(f"Webhook customer.subscription.updated: 新しいPrice ID {new_stripe_price_id} に対応するDBプランが見つかりません。plan_idは更新されません。")
+
+            update_data = {
+                "status": stripe_sub_event_data.get('status'),
+                "plan_id": new_db_plan_id,
+                "current_period_start": datetime.fromtimestamp(cps) if (cps := stripe_sub_event_data.get('current_period_start')) is not None else None,
+                "current_period_end": datetime.fromtimestamp(cpe) if (cpe := stripe_sub_event_data.get('current_period_end')) is not None else None,
+                "cancel_at": datetime.fromtimestamp(ca) if (ca := stripe_sub_event_data.get('cancel_at')) is not None else None,
+                "canceled_at": datetime.fromtimestamp(cat) if (cat := stripe_sub_event_data.get('canceled_at')) is not None else None,
+                "is_active": stripe_sub_event_data.get('status') in ['active', 'trialing'],
+            }
+            await crud_subscription.update_subscription(db, db_subscription.id, update_data)
+        else:
+             logger.warning(f"Webhook customer.subscription.updated: Stripe Sub ID {stripe_sub_event_data.get('id')} に対応するDBレコードが見つかりません。")
+
+    elif event_type == 'customer.subscription.deleted':
+        subscription = data
+        logger.info(f"Customer Subscription Deleted: {subscription.id}")
+        # DBのサブスクリプションをキャンセル済みに更新
+        db_subscription = await crud_subscription.get_subscription_by_stripe_id(db, subscription.id)
+        if db_subscription:
+             # cancel_subscription を使うか、直接ステータス更新
+             await crud_subscription.cancel_subscription(db, db_subscription.id, canceled_at=datetime.utcnow())
+        else:
+             logger.warning(f"Webhook customer.subscription.deleted: Stripe Sub ID {subscription.id} に対応するDBレコードが見つかりません。")
+
+    # --- ★ customer.created イベントで Stripe Customer ID を DB に保存 ---
+    elif event_type == 'customer.created':
+         customer = data
+         logger.info(f"Customer Created: {customer.id}, Email: {customer.email}")
+         metadata = customer.get('metadata', {})
+         user_id_str = metadata.get('user_id')
+         if user_id_str:
+             try:
+                 user_id = UUID(user_id_str)
+                 # ユーザーの既存サブスクリプションを探して更新、なければ何もしない
+                 # （Checkout完了時にSubscriptionレコードは作成されるはず）
+                 user_subs = await crud_subscription.get_user_subscriptions(db, user_id)
+                 updated = False
+                 for sub in user_subs:
+                     if not sub.stripe_customer_id:
+                         await crud_subscription.update_subscription(db, sub.id, {"stripe_customer_id": customer.id})
+                         logger.info(f"DB Subscription {sub.id} に Stripe Customer ID {customer.id} を設定しました。")
+                         updated = True
+                 if not updated:
+                     logger.info(f"ユーザー {user_id} に Stripe Customer ID {customer.id} を設定する対象のDB Subscriptionが見つかりませんでした。")
+             except ValueError:
+                 logger.error(f"Webhook customer.created: 無効なuser_id形式です: {user_id_str}")
+             except Exception as e:
+                  logger.error(f"Webhook customer.created: DB更新中にエラー (User: {user_id_str}): {e}", exc_info=True)
+         else:
+             logger.warning("Webhook customer.created: metadataにuser_idがありません。")
+    # --- ★ ここまで追加 ---
+
+    else:
+        logger.info(f"未処理のWebhookイベントタイプ: {event_type}")
+
+    return {"status": "success"}
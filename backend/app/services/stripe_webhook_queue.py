@@ -0,0 +1,192 @@
+"""
+Stripe Webhook の永続キュー。
+
+以前は受信エンドポイントが DB 参照・Stripe API 呼び出し・サブスクリプション更新まで
+すべて終えてから応答していたため、応答が遅れると Stripe が再送し、同じ処理が重複していた。
+
+- 受信時は stripe_webhook_events に event.id で一意に保存して即座に応答する
+  (受信済みの event.id は保存されず、再送やリプレイは何もしない)
+- 保存したイベントは ordering_key (サブスクリプション ID など) ごとに同じワーカーへ振り分け、
+  同じキーのイベントは受信順に 1 件ずつ処理する。再試行待ちの間もそのワーカーは次へ進まない
+- 処理の開始は claim_webhook_event の 1 回の UPDATE で行うので、
+  同じイベントを複数のワーカー・プロセスが処理することはない
+- 起動時に未処理 (pending) と処理中のまま止まった (processing のまま古い) イベントを再投入する
+
+順序を保証するのは同じプロセスが受信したイベントの間だけ。
+ハンドラーは Stripe から最新の状態を取り直すので、プロセスをまたいだ順序の入れ替わりは許容する。
+"""
+import asyncio
+import logging
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from uuid import UUID
+
+import stripe
+
+from app.core.config import settings
+from app.crud import subscription as crud_subscription
+from app.database.database import AsyncSessionLocal
+from app.services.stripe_webhook_handlers import handle_stripe_event
+
+logger = logging.getLogger(__name__)
+
+
+class StripeWebhookQueue:
+    """ordering_key ごとに直列、キーをまたいで並列にイベントを処理するワーカー群"""
+
+    def __init__(
+        self,
+        workers: int,
+        max_attempts: int,
+        retry_base_seconds: float,
+        stale_seconds: float,
+        session_factory: Callable[[], Any] = AsyncSessionLocal,
+        handler: Callable[[Any, Any], Awaitable[Dict[str, Any]]] = handle_stripe_event,
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.stale_seconds = stale_seconds
+        self._session_factory = session_factory
+        self._handler = handler
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        # メトリクス
+        self._counters: Dict[str, int] = {"received": 0, "duplicates": 0, "processed": 0, "failed": 0, "retried": 0}
+        self._completed_at: Deque[float] = deque()
+        self._last_lag_seconds = 0.0
+        self._max_lag_seconds = 0.0
+
+    # --- 投入 API ---
+
+    async def start(self) -> None:
+        """ワーカーを起動し、未処理のイベントを再投入する (アプリ起動時に呼ぶ)"""
+        self._ensure_workers()
+        try:
+            async with self._session_factory() as db:
+                unfinished = await crud_subscription.list_unfinished_webhook_events(db, self._stale_before())
+        except Exception as e:
+            logger.error(f"Failed to load unfinished Stripe webhook events: {e}")
+            return
+        for event_row_id, ordering_key in unfinished:
+            self.enqueue(event_row_id, ordering_key)
+        if unfinished:
+            logger.info(f"Re-enqueued {len(unfinished)} unfinished Stripe webhook event(s).")
+
+    def enqueue(self, event_row_id: UUID, ordering_key: str) -> None:
+        """保存済みのイベントを処理キューに積む"""
+        self._ensure_workers()
+        self._queues[zlib.crc32(ordering_key.encode()) % self.workers].put_nowait(event_row_id)
+
+    def record_received(self, duplicate: bool) -> None:
+        self._counters["duplicates" if duplicate else "received"] += 1
+
+    async def join(self) -> None:
+        """積まれたイベントがすべて処理されるまで待つ"""
+        for queue in self._queues:
+            await queue.join()
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """処理中のイベントを待ってからワーカーを止める。残りは次回起動時に再投入される"""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stripe webhook queue did not drain before shutdown; remaining events will be retried on restart.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    def metrics(self) -> Dict[str, Any]:
+        """キューの滞留・遅延・スループット"""
+        now = time.monotonic()
+        while self._completed_at and self._completed_at[0] < now - 60:
+            self._completed_at.popleft()
+        return {
+            **self._counters,
+            "queue_depth": sum(queue.qsize() for queue in self._queues),
+            "processed_last_minute": len(self._completed_at),
+            "last_lag_seconds": round(self._last_lag_seconds, 3),
+            "max_lag_seconds": round(self._max_lag_seconds, 3),
+        }
+
+    # --- ワーカー ---
+
+    def _ensure_workers(self) -> None:
+        if self._tasks and not all(task.done() for task in self._tasks):
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+
+    def _stale_before(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            event_row_id = await queue.get()
+            try:
+                await self.process(event_row_id)
+            except Exception as e:  # ワーカー自体は止めない
+                logger.error(f"Unexpected error in Stripe webhook worker ({event_row_id}): {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def process(self, event_row_id: UUID) -> Optional[str]:
+        """
+        保存済みのイベントを 1 件処理し、最終的な状態を返す。
+        処理済み・他で処理中のイベントなら何もせず None を返す (リプレイは no-op)。
+        """
+        while True:
+            async with self._session_factory() as db:
+                event_row = await crud_subscription.claim_webhook_event(db, event_row_id, self._stale_before())
+            if event_row is None:
+                return None
+
+            lag = (datetime.utcnow() - event_row.created_at).total_seconds() if event_row.created_at else 0.0
+            self._last_lag_seconds = lag
+            self._max_lag_seconds = max(self._max_lag_seconds, lag)
+
+            status, error = await self._handle(event_row)
+            if status == "pending" and event_row.attempts >= self.max_attempts:
+                status = "failed"
+            async with self._session_factory() as db:
+                await crud_subscription.finish_webhook_event(db, event_row_id, status, error)
+
+            if status != "pending":
+                self._counters[status] += 1
+                if status == "processed":
+                    self._completed_at.append(time.monotonic())
+                else:
+                    logger.error(f"Stripe webhook {event_row.event_id} ({event_row.event_type}) failed after {event_row.attempts} attempt(s): {error}")
+                return status
+
+            # 同じキーの後続イベントを追い越させないよう、このワーカーで待ってから再試行する
+            self._counters["retried"] += 1
+            delay = self.retry_base_seconds * (2 ** (event_row.attempts - 1))
+            logger.warning(f"Retrying Stripe webhook {event_row.event_id} in {delay:.1f}s (attempt {event_row.attempts}): {error}")
+            await asyncio.sleep(delay)
+
+    async def _handle(self, event_row) -> Tuple[str, Optional[str]]:
+        """(次の状態, エラー) を返す。例外は再試行、{"status": "error"} は再試行しない"""
+        event = stripe.Event.construct_from(event_row.payload, stripe.api_key)
+        try:
+            async with self._session_factory() as db:
+                result = await self._handler(db, event)
+        except Exception as e:
+            logger.error(f"Stripe webhook {event_row.event_id} ({event_row.event_type}) raised: {e}", exc_info=True)
+            return "pending", str(e)
+        if result.get("status") == "error":
+            return "failed", result.get("message")
+        return "processed", None
+
+
+stripe_webhook_queue = StripeWebhookQueue(
+    workers=settings.STRIPE_WEBHOOK_WORKERS,
+    max_attempts=settings.STRIPE_WEBHOOK_MAX_ATTEMPTS,
+    retry_base_seconds=settings.STRIPE_WEBHOOK_RETRY_BASE_SECONDS,
+    stale_seconds=settings.STRIPE_WEBHOOK_STALE_SECONDS,
+)
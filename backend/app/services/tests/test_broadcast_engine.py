@@ -0,0 +1,61 @@
+# backend/app/services/tests/test_broadcast_engine.py
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.enums import NotificationPriority, NotificationType
+from app.services import broadcast_engine as module
+from app.services.broadcast_engine import BroadcastEngine, BroadcastReport
+
+
+@pytest.mark.asyncio
+async def test_no_session_is_held_while_pushing(monkeypatch, fake_session):
+    """対象の読み出しは送信前に閉じ、失効した購読の削除は新しいセッションで行う。"""
+    broadcast = SimpleNamespace(
+        id=uuid.uuid4(), title="お知らせ", content="本文", action_url=None,
+        notification_type=NotificationType.SYSTEM_ANNOUNCEMENT, priority=NotificationPriority.NORMAL,
+    )
+    user_ids = sorted(uuid.uuid4() for _ in range(3))
+    pages = [
+        [(user_ids[0], "a@example.com", "A", True, True), (user_ids[1], "b@example.com", "B", False, True)],
+        [(user_ids[2], "c@example.com", "C", True, False)],
+    ]
+    afters = []
+
+    async def fake_recipients(db, broadcast, current_time, limit, after_user_id=None):
+        afters.append(after_user_id)
+        return pages.pop(0)
+
+    subscriptions = [SimpleNamespace(id="live"), SimpleNamespace(id="gone")]
+    sessions = []
+
+    def session_factory():
+        # 1 ページ目は購読の SELECT 結果も返す
+        sessions.append(fake_session(subscriptions) if not sessions else fake_session())
+        return sessions[-1]
+
+    async def fake_deliver(subs, payload):
+        assert all(session.closed for session in sessions)
+        assert payload["data"]["broadcast_notification_id"] == str(broadcast.id)
+        return SimpleNamespace(sent_ids=["live"], gone_ids=["gone"])
+
+    queued = []
+
+    async def fake_emails(recipients, subject, message):
+        queued.extend(recipients)
+        return True
+
+    monkeypatch.setattr(module.crud_broadcast, "list_delivery_recipients", fake_recipients)
+    monkeypatch.setattr(module.push_delivery, "deliver", fake_deliver)
+    monkeypatch.setattr(module, "send_notification_emails", fake_emails)
+    report = BroadcastReport(broadcast_id=broadcast.id)
+
+    await BroadcastEngine(chunk_size=2, poll_seconds=60, session_factory=session_factory)._deliver(broadcast, report)
+
+    assert afters == [None, user_ids[1]]
+    assert report.pushes == 1 and report.emails == 2
+    assert [r["email"] for r in queued] == ["a@example.com", "c@example.com"]
+    first_page, cleanup, second_page = sessions
+    assert cleanup.writes == [("DELETE", "push_subscriptions")] and cleanup.commits == 1
+    assert first_page.writes == [] and second_page.statements == []
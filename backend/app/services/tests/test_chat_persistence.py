@@ -0,0 +1,84 @@
+# backend/app/services/tests/test_chat_persistence.py
+import uuid
+
+import pytest
+
+from app.models.chat import ChatSession
+from app.models.enums import ChatType, MessageSender, SessionStatus
+from app.services.chat_persistence import ChatWriteBehindQueue
+
+
+class FakeSession:
+    """execute された文を記録し、commit ごとに 1 トランザクションとして残す"""
+
+    def __init__(self, log, fail_when=None):
+        self.log = log
+        self.fail_when = fail_when
+        self.statements = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        table = statement.table.name
+        if self.fail_when is not None and self.fail_when(table, params):
+            raise RuntimeError("boom")
+        self.statements.append((statement.__visit_name__, table, params))
+
+    async def commit(self):
+        self.log.append(self.statements)
+
+
+def _make_queue(log, fail_when=None):
+    return ChatWriteBehindQueue(
+        session_factory=lambda: FakeSession(log, fail_when),
+        max_retries=2,
+        retry_delay_seconds=0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_turn_is_written_in_one_transaction():
+    """セッション作成・タイトル・ユーザー/AI メッセージが 1 回の commit にまとまる。"""
+    log = []
+    queue = _make_queue(log)
+    session = ChatSession(id=uuid.uuid4(), user_id=uuid.uuid4(), status=SessionStatus.ACTIVE, chat_type=ChatType.GENERAL)
+
+    await queue.add_session(session)
+    await queue.update_title(session.id, "タイトル")
+    await queue.add_message(session.id, "こんにちは", MessageSender.USER, user_id=session.user_id)
+    done = await queue.add_message(session.id, "こんにちは!", MessageSender.AI)
+    await queue.flush()
+
+    assert await done is True
+    assert len(log) == 1
+    kinds = [(kind, table) for kind, table, _ in log[0]]
+    assert kinds == [("insert", "chat_sessions"), ("update", "chat_sessions"), ("insert", "chat_messages")]
+    messages = log[0][2][2]
+    assert [m["sender"] for m in messages] == [MessageSender.USER, MessageSender.AI]
+    assert messages[0]["created_at"] <= messages[1]["created_at"]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_failing_row_is_dropped_without_losing_the_batch():
+    """バッチが失敗し続けた場合は 1 件ずつ書き直し、失敗した行だけを捨てる。"""
+    log = []
+    queue = _make_queue(
+        log,
+        fail_when=lambda table, params: table == "chat_messages" and any(row["content"] == "bad" for row in params),
+    )
+    session_id = uuid.uuid4()
+
+    good = await queue.add_message(session_id, "good", MessageSender.USER)
+    bad = await queue.add_message(session_id, "bad", MessageSender.USER)
+    await queue.flush()
+
+    assert await good is True
+    assert await bad is False
+    written = [row["content"] for statements in log for _, _, rows in statements for row in rows]
+    assert written == ["good"]
+    await queue.close()
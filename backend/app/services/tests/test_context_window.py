@@ -0,0 +1,45 @@
+# backend/app/services/tests/test_context_window.py
+from app.services.context_window import MESSAGE_TOKEN_OVERHEAD, ContextWindowManager
+
+# 1 文字 = 1 トークンとして数える
+per_message = lambda text: len(text) + MESSAGE_TOKEN_OVERHEAD
+
+
+def test_fit_keeps_system_prompt_and_most_recent_messages():
+    """system メッセージは常に残し、予算に収まる直近のメッセージだけを残す。"""
+    manager = ContextWindowManager(max_tokens=per_message("sys") + 2 * per_message("xx"), counter=len)
+    messages = [
+        {"role": "system", "content": "sys"},
+        {"role": "user", "content": "aa"},
+        {"role": "assistant", "content": "bb"},
+        {"role": "user", "content": "cc"},
+    ]
+
+    kept, dropped = manager.fit(messages)
+
+    assert [m["content"] for m in kept] == ["sys", "bb", "cc"]
+    assert [m["content"] for m in dropped] == ["aa"]
+
+
+def test_fit_drops_tool_results_whose_call_was_dropped():
+    """tool_calls を持つ assistant を落とした場合、その tool 応答も残さない。"""
+    manager = ContextWindowManager(max_tokens=2 * per_message("xx"), counter=len)
+    messages = [
+        {"role": "assistant", "content": "", "tool_calls": [{"function": {"name": "lookup", "arguments": "{}"}}]},
+        {"role": "tool", "content": "rr"},
+        {"role": "user", "content": "uu"},
+    ]
+
+    kept, _ = manager.fit(messages)
+
+    assert kept == [{"role": "user", "content": "uu"}]
+
+
+def test_build_uses_cached_counts_and_includes_summary():
+    """build は履歴のトークン数を再計算せず、要約を system として差し込む。"""
+    manager = ContextWindowManager(max_tokens=per_message("sys") + per_message("これまでの会話の要約:\nS") + per_message("q") + 10, counter=len)
+    history = [{"role": "user", "content": "old"}, {"role": "assistant", "content": "new"}]
+
+    messages = manager.build("sys", history, [100, 10], "q", summary="S")
+
+    assert [m["content"] for m in messages] == ["sys", "これまでの会話の要約:\nS", "new", "q"]
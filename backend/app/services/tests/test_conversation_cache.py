@@ -0,0 +1,105 @@
+# backend/app/services/tests/test_conversation_cache.py
+import asyncio
+import uuid
+
+import pytest
+
+from app.models.enums import MessageSender
+from app.services import conversation_cache as module
+from app.services.conversation_cache import (
+    MESSAGE_TOKEN_OVERHEAD,
+    ConversationCache,
+    ConversationContext,
+    InMemoryConversationStore,
+)
+
+
+@pytest.fixture
+def fake_rows(monkeypatch):
+    """get_chat_messages_after を差し替え、after_id 以降の行だけを返す"""
+    rows = []
+    calls = []
+
+    async def fake_get_chat_messages_after(db, session_id, after_id=0):
+        calls.append(after_id)
+        return [row for row in rows if row[0] > after_id]
+
+    monkeypatch.setattr(module, "get_chat_messages_after", fake_get_chat_messages_after)
+    return rows, calls
+
+
+@pytest.mark.asyncio
+async def test_history_is_loaded_incrementally(fake_rows):
+    """2 回目以降は high-water mark より新しい行だけを読み込んで追記する。"""
+    rows, calls = fake_rows
+    cache = ConversationCache(InMemoryConversationStore(max_sessions=10), max_tokens=1000)
+    session_id = uuid.uuid4()
+    rows += [(1, MessageSender.USER, "こんにちは"), (2, MessageSender.AI, "どうしました?")]
+
+    assert await cache.get_history(None, session_id) == [
+        {"role": "user", "content": "こんにちは"},
+        {"role": "assistant", "content": "どうしました?"},
+    ]
+
+    rows.append((3, MessageSender.USER, "相談です"))
+    history = await cache.get_history(None, session_id)
+
+    assert calls == [0, 2]
+    assert [m["content"] for m in history] == ["こんにちは", "どうしました?", "相談です"]
+
+
+def test_append_trims_to_token_budget_and_skips_seen_rows():
+    """予算を超えた古いメッセージは追記時に切り落とされ、既読の行は無視される。"""
+    context = ConversationContext(max_tokens=2 * (1 + MESSAGE_TOKEN_OVERHEAD))
+    count = lambda text: 1
+
+    evicted = context.append([(1, MessageSender.USER, "a"), (2, MessageSender.AI, "b"), (3, MessageSender.USER, "c")], count)
+    context.append([(2, MessageSender.AI, "b")], count)
+
+    assert evicted == [{"role": "user", "content": "a"}]
+    assert [m["content"] for m in context.window()] == ["b", "c"]
+    assert context.high_water_mark == 3
+
+
+def test_store_evicts_least_recently_used_session():
+    """セッション数の上限を超えると最も使われていないセッションから追い出される。"""
+    store = InMemoryConversationStore(max_sessions=2)
+    a, b, c = (uuid.uuid4() for _ in range(3))
+    store.put(a, ConversationContext(max_tokens=10))
+    store.put(b, ConversationContext(max_tokens=10))
+    store.get(a)
+    store.put(c, ConversationContext(max_tokens=10))
+
+    assert store.get(b) is None
+    assert store.get(a) is not None and store.get(c) is not None
+
+
+@pytest.mark.asyncio
+async def test_evicted_messages_are_folded_into_rolling_summary(fake_rows, monkeypatch):
+    """予算からあふれたメッセージはサマリーに畳み込まれ、セッションへの保存が予約される。"""
+    rows, _ = fake_rows
+    saved = []
+
+    async def fake_update_summary(session_id, summary, upto_message_id):
+        saved.append((session_id, summary, upto_message_id))
+
+    async def summarizer(previous, messages):
+        return (previous or "") + "".join(m["content"] for m in messages)
+
+    monkeypatch.setattr(module.chat_write_behind, "update_summary", fake_update_summary)
+    cache = ConversationCache(
+        InMemoryConversationStore(max_sessions=10),
+        max_tokens=2 * (1 + MESSAGE_TOKEN_OVERHEAD),
+        count_tokens=lambda text: 1,
+        summarizer=summarizer,
+    )
+    session_id = uuid.uuid4()
+    rows += [(1, MessageSender.USER, "a"), (2, MessageSender.AI, "b"), (3, MessageSender.USER, "c")]
+
+    context = await cache.refresh(None, session_id, summary="S", summary_upto=0)
+    await asyncio.sleep(0)
+
+    assert context.summary == "Sa"
+    assert context.summary_upto == 1
+    assert saved == [(session_id, "Sa", 1)]
+    assert [m["content"] for m in context.window()] == ["b", "c"]
@@ -0,0 +1,181 @@
+# backend/app/services/tests/test_email_dispatcher.py
+import socketserver
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import email_dispatcher as module
+from app.services.email_dispatcher import EmailDispatcher, SMTPConnectionPool
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """EHLO / MAIL / RCPT / DATA / NOOP / RSET / QUIT だけを話す最小の SMTP サーバー"""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.wfile.write(b"220 localhost ESMTP\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO") or command.startswith("HELO"):
+                self.wfile.write(b"250 localhost\r\n")
+            elif command.startswith("RCPT") and "REFUSED" in command:
+                self.wfile.write(b"550 no such user\r\n")
+            elif command.startswith("DATA"):
+                self.wfile.write(b"354 go ahead\r\n")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with server.lock:
+                    server.messages += 1
+                self.wfile.write(b"250 queued\r\n")
+            elif command.startswith("QUIT"):
+                self.wfile.write(b"221 bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 ok\r\n")
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = server.messages = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class _Session:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _pool(server, size=2):
+    host, port = server.server_address
+    return SMTPConnectionPool(host, port, "", "", starttls=False, size=size, timeout=5, max_idle_seconds=60)
+
+
+def test_pool_reuses_logged_in_connections(smtp_server):
+    """何通送っても、開く接続はプールのサイズまで"""
+    pool = _pool(smtp_server, size=2)
+
+    def send_many():
+        for _ in range(5):
+            with pool.connection() as smtp:
+                smtp.sendmail("noreply@example.com", ["a@example.com"], "Subject: x\r\n\r\nbody")
+
+    workers = [threading.Thread(target=send_many) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    pool.close()
+
+    assert smtp_server.messages == 20
+    assert smtp_server.connections <= 2 and pool.connections_opened == smtp_server.connections
+
+
+@pytest.mark.asyncio
+async def test_send_due_marks_sent_and_schedules_retries(smtp_server, monkeypatch):
+    """送れたメールはまとめて sent、一時的な失敗は再送、宛先拒否と上限到達は failed にする"""
+    emails = [
+        SimpleNamespace(id=f"ok{i}", to_email=f"user{i}@example.com", subject="s", html_content="<p>h</p>",
+                        plain_content=None, attempts=1)
+        for i in range(6)
+    ]
+    emails.append(SimpleNamespace(id="refused", to_email="refused@example.com", subject="s", html_content="h",
+                                  plain_content=None, attempts=1))
+    claimed, sent, unsent = [emails], [], {}
+
+    async def claim_due_emails(db, limit, stale_before):
+        return claimed.pop() if claimed else []
+
+    async def mark_emails_sent(db, ids):
+        sent.extend(ids)
+
+    async def mark_email_unsent(db, email_id, error, retry_at):
+        unsent[email_id] = retry_at
+
+    monkeypatch.setattr(module.crud_email_outbox, "claim_due_emails", claim_due_emails)
+    monkeypatch.setattr(module.crud_email_outbox, "mark_emails_sent", mark_emails_sent)
+    monkeypatch.setattr(module.crud_email_outbox, "mark_email_unsent", mark_email_unsent)
+    monkeypatch.setattr(module.settings, "ENVIRONMENT", "production")
+
+    dispatcher = EmailDispatcher(
+        _pool(smtp_server, size=3), batch_size=100, max_attempts=5, retry_base_seconds=30,
+        poll_seconds=1, stale_seconds=600, session_factory=_Session,
+    )
+    try:
+        assert await dispatcher.send_due() == 7
+        assert await dispatcher.send_due() == 0
+    finally:
+        await dispatcher.close()
+
+    assert sorted(sent) == [f"ok{i}" for i in range(6)]
+    assert list(unsent) == ["refused"] and unsent["refused"] is None
+    assert smtp_server.connections <= 3
+
+    # 接続できない場合は再送、上限に達していれば failed
+    dispatcher = EmailDispatcher(
+        SMTPConnectionPool("127.0.0.1", 1, "", "", starttls=False, size=1, timeout=1, max_idle_seconds=60),
+        batch_size=100, max_attempts=2, retry_base_seconds=30, poll_seconds=1, stale_seconds=600,
+        session_factory=_Session,
+    )
+    first = SimpleNamespace(id="first", to_email="a@example.com", subject="s", html_content="h",
+                            plain_content=None, attempts=1)
+    last = SimpleNamespace(id="last", to_email="b@example.com", subject="s", html_content="h",
+                           plain_content=None, attempts=2)
+    claimed.append([first, last])
+    unsent.clear()
+    try:
+        await dispatcher.send_due()
+    finally:
+        await dispatcher.close()
+    assert unsent["first"] is not None and unsent["last"] is None
+
+
+@pytest.mark.asyncio
+async def test_unexpected_error_does_not_lose_the_batch(smtp_server, monkeypatch):
+    """1 通で想定外の例外が出ても、送れたメールは sent に、失敗したメールは再送に記録する"""
+    good = SimpleNamespace(id="good", to_email="a@example.com", subject="s", html_content="h",
+                           plain_content=None, attempts=1)
+    broken = SimpleNamespace(id="broken", to_email="b@example.com", subject="s", html_content=None,
+                             plain_content=None, attempts=1)
+    claimed, sent, unsent = [[good, broken]], [], {}
+
+    async def claim_due_emails(db, limit, stale_before):
+        return claimed.pop() if claimed else []
+
+    async def mark_emails_sent(db, ids):
+        sent.extend(ids)
+
+    async def mark_email_unsent(db, email_id, error, retry_at):
+        unsent[email_id] = retry_at
+
+    monkeypatch.setattr(module.crud_email_outbox, "claim_due_emails", claim_due_emails)
+    monkeypatch.setattr(module.crud_email_outbox, "mark_emails_sent", mark_emails_sent)
+    monkeypatch.setattr(module.crud_email_outbox, "mark_email_unsent", mark_email_unsent)
+    monkeypatch.setattr(module.settings, "ENVIRONMENT", "production")
+
+    dispatcher = EmailDispatcher(
+        _pool(smtp_server), batch_size=100, max_attempts=5, retry_base_seconds=30,
+        poll_seconds=1, stale_seconds=600, session_factory=_Session,
+    )
+    try:
+        assert await dispatcher.send_due() == 2
+    finally:
+        await dispatcher.close()
+
+    assert sent == ["good"] and smtp_server.messages == 1
+    assert unsent["broken"] is not None
@@ -0,0 +1,47 @@
+# backend/app/services/tests/test_llm_clients.py
+import pytest
+
+from app.services import llm_clients
+
+
+@pytest.mark.asyncio
+async def test_adapters_are_shared_per_model_and_reuse_one_pool():
+    """同じモデルのアダプターは使い回され、すべて同じ HTTP コネクションプールを使う。"""
+    await llm_clients.close_llm_clients()
+    try:
+        mini = llm_clients.get_llm_adapter("openai", "gpt-4o-mini")
+        full = llm_clients.get_llm_adapter("openai", "gpt-4.1")
+
+        assert llm_clients.get_llm_adapter("openai", "gpt-4o-mini") is mini
+        assert full is not mini
+        assert mini.client is full.client is llm_clients.get_openai_client()
+        assert llm_clients.get_openai_client()._client is llm_clients.get_http_client()
+
+        # 共有クライアントはアダプター側では閉じない
+        await mini.close()
+        assert not llm_clients.get_http_client().is_closed
+    finally:
+        await llm_clients.close_llm_clients()
+
+
+def test_unknown_provider_is_rejected():
+    with pytest.raises(ValueError):
+        llm_clients.get_llm_adapter("gemini", "gemini-pro")
+
+
+@pytest.mark.asyncio
+async def test_closing_drops_objects_built_on_the_old_pool():
+    """閉じたあとは新しいプールが作られ、登録したキャッシュも捨てられる。"""
+    cached = {"agent": object()}
+    llm_clients.on_llm_clients_closed(cached.clear)
+    try:
+        old_pool = llm_clients.get_http_client()
+        old_client = llm_clients.get_openai_client()
+        await llm_clients.close_llm_clients()
+
+        assert old_pool.is_closed and cached == {}
+        assert llm_clients.get_openai_client() is not old_client
+        assert llm_clients.get_openai_client()._client is llm_clients.get_http_client() is not old_pool
+    finally:
+        llm_clients._close_callbacks.remove(cached.clear)
+        await llm_clients.close_llm_clients()
@@ -0,0 +1,54 @@
+# backend/app/services/tests/test_push_delivery.py
+import threading
+from datetime import datetime, time
+from types import SimpleNamespace
+
+import pytest
+from pywebpush import WebPushException
+
+from app.services import push_delivery as module
+from app.services.notification_service import _in_quiet_hours
+from app.services.push_delivery import PushDeliveryEngine
+
+
+def _subscription(sub_id, endpoint):
+    return SimpleNamespace(id=sub_id, endpoint=endpoint, p256dh_key="p256dh", auth_token="auth")
+
+
+@pytest.mark.asyncio
+async def test_delivers_in_parallel_and_reports_gone_endpoints(monkeypatch):
+    """送信はワーカースレッドで行い、オリジンごとにセッションを共有し、404/410 は gone として報告する。"""
+    sessions, threads = {}, set()
+
+    def fake_webpush(subscription_info, data, requests_session=None, **kwargs):
+        threads.add(threading.current_thread().name)
+        endpoint = subscription_info["endpoint"]
+        sessions.setdefault(endpoint.split("/")[2], set()).add(id(requests_session))
+        if endpoint.endswith("/gone"):
+            raise WebPushException("Gone", response=SimpleNamespace(status_code=410))
+        if endpoint.endswith("/error"):
+            raise WebPushException("Server error", response=SimpleNamespace(status_code=500))
+
+    monkeypatch.setattr(module, "webpush", fake_webpush)
+    engine = PushDeliveryEngine(max_workers=4, timeout_seconds=1)
+    subscriptions = [_subscription(f"s{i}", f"https://fcm.googleapis.com/fcm/send/{i}") for i in range(10)]
+    subscriptions += [
+        _subscription("gone", "https://updates.push.services.mozilla.com/wpush/gone"),
+        _subscription("error", "https://updates.push.services.mozilla.com/wpush/error"),
+    ]
+    try:
+        report = await engine.deliver(subscriptions, {"title": "t", "message": "m"})
+    finally:
+        engine.close()
+
+    assert len(report.sent_ids) == 10
+    assert report.gone_ids == ["gone"] and report.failed_ids == ["error"]
+    assert all(len(ids) == 1 for ids in sessions.values()) and len(sessions) == 2
+    assert all(name.startswith("push") for name in threads)
+
+
+def test_quiet_hours_compare_time_of_day_and_wrap_midnight():
+    night = SimpleNamespace(quiet_hours_start=datetime(2024, 1, 1, 22, 0), quiet_hours_end=datetime(2024, 1, 1, 7, 0))
+    assert _in_quiet_hours(night, time(23, 30)) and _in_quiet_hours(night, time(6, 0))
+    assert not _in_quiet_hours(night, time(12, 0))
+    assert not _in_quiet_hours(SimpleNamespace(quiet_hours_start=None, quiet_hours_end=None), time(12, 0))
@@ -0,0 +1,151 @@
+# backend/app/services/tests/test_quiz_grading.py
+import asyncio
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.crud import quiz as crud_quiz
+from app.services.quiz_definition_cache import QuizDefinitionCache, quiz_definition_cache
+from app.services.quiz_grading import build_answer_key, grade
+
+QUIZ_ID = uuid.uuid4()
+SINGLE, MULTI, TEXT = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+A_OK, A_NG, M_1, M_2, M_NG, T_OK = (uuid.uuid4() for _ in range(6))
+
+
+def _row(question_id, question_type, points, answer_id, is_correct, text="", updated_at=datetime(2026, 1, 1)):
+    return SimpleNamespace(
+        quiz_id=QUIZ_ID, updated_at=updated_at, is_active=True, max_attempts=None, pass_percentage=60.0,
+        question_id=question_id, question_type=question_type, points=points,
+        answer_id=answer_id, is_correct=is_correct, text=text,
+    )
+
+
+def _rows():
+    row = _row
+    return [
+        row(SINGLE, "single_choice", 1, A_OK, True), row(SINGLE, "single_choice", 1, A_NG, False),
+        row(MULTI, "multiple_choice", 2, M_1, True), row(MULTI, "multiple_choice", 2, M_2, True),
+        row(MULTI, "multiple_choice", 2, M_NG, False),
+        row(TEXT, "TEXT_INPUT", 3, T_OK, True, "Tokyo  Tower"),
+    ]
+
+
+def test_grade_in_one_pass():
+    key = build_answer_key(_rows())
+    assert key.total_points == 6 and key.version == datetime(2026, 1, 1)
+
+    result = grade(key, [
+        {"question_id": str(SINGLE), "selected_answer_id": str(A_OK)},
+        # 複数選択は 1 つずつ送られても集合で判定する。部分一致は不正解
+        {"question_id": MULTI, "selected_answer_id": M_1},
+        {"question_id": TEXT, "user_text_answer": " ｔｏｋｙｏ tower "},
+        {"question_id": uuid.uuid4(), "selected_answer_id": A_OK},  # クイズにない問題
+        {"question_id": SINGLE, "answer_id": M_NG},  # 別の問題の選択肢
+    ])
+    assert result.correct_question_ids == {SINGLE, TEXT}
+    assert (result.earned_points, result.score, result.passed) == (4, 66.67, True)
+    assert sorted(map(str, (row["selected_answer_id"] for row in result.answer_rows))) == sorted(map(str, (A_OK, M_1, T_OK)))
+
+    result = grade(key, [{"question_id": MULTI, "selected_answer_ids": [M_1, M_2]}])
+    assert (result.earned_points, result.passed) == (2, False)
+
+
+@pytest.mark.asyncio
+async def test_submit_is_constant_number_of_statements(fake_session):
+    quiz_definition_cache.clear()
+    attempt_id = uuid.uuid4()
+    attempt = SimpleNamespace(id=attempt_id)
+    returned = SimpleNamespace(id=attempt_id, version=datetime(2026, 1, 1))
+    db = fake_session(_rows(), [returned], [], [], [attempt])
+    answers = [{"question_id": SINGLE, "selected_answer_id": A_OK}, {"question_id": MULTI, "selected_answer_ids": [M_1, M_2]}]
+
+    assert await crud_quiz.submit_quiz_attempt(db, uuid.uuid4(), QUIZ_ID, answers) is attempt
+    assert db.writes == [
+        ("UPDATE", "user_quiz_attempts"), ("INSERT", "user_quiz_stats"), ("INSERT", "user_quiz_answers"),
+    ]
+    assert len(db.statements) == 5 and db.commits == 1
+    key_sql, update_sql = db.statements[0].sql, db.statements[1].sql
+    assert key_sql.count("LEFT OUTER JOIN") == 2 and "FOR UPDATE SKIP LOCKED" in update_sql
+    assert db.values(1)["score"] == 50.0 and db.values(1)["passed"] is False  # 記述式は未回答
+    assert db.values(2)["best_score"] == 50.0
+    rows = db.values(3)
+    assert len(rows) == 3 and all(row["attempt_id"] == attempt_id for row in rows)
+
+
+@pytest.mark.asyncio
+async def test_cache_loads_once_and_drops_loads_racing_invalidation(fake_session):
+    cache = QuizDefinitionCache(ttl_seconds=60, max_entries=10)
+    release = asyncio.Event()
+
+    class SlowSession(fake_session):
+        async def execute(self, stmt, params=None):
+            await release.wait()
+            return await super().execute(stmt, params)
+
+    db = SlowSession(_rows(), _rows())
+    waiters = [asyncio.ensure_future(cache.get(db, QUIZ_ID)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    keys = await asyncio.gather(*waiters)
+    assert len(db.statements) == 1 and all(key is keys[0] for key in keys)
+    assert cache.peek(QUIZ_ID) is keys[0]
+
+    # 読み込み中に invalidate されたら、読んだ結果はキャッシュしない
+    release.clear()
+    cache.invalidate(QUIZ_ID)
+    loading = asyncio.ensure_future(cache.get(db, QUIZ_ID))
+    await asyncio.sleep(0)
+    cache.invalidate(QUIZ_ID)
+    release.set()
+    assert (await loading).quiz_id == QUIZ_ID and cache.peek(QUIZ_ID) is None
+
+
+@pytest.mark.asyncio
+async def test_submit_regrades_when_cached_key_is_stale(fake_session):
+    quiz_definition_cache.clear()
+    old_version, new_version = datetime(2026, 1, 1), datetime(2026, 2, 1)
+    attempt_id = uuid.uuid4()
+    attempt = SimpleNamespace(id=attempt_id)
+    # 他のプロセスで SINGLE の正解が A_NG に変わった
+    new_rows = [
+        _row(SINGLE, "single_choice", 1, A_OK, False, updated_at=new_version),
+        _row(SINGLE, "single_choice", 1, A_NG, True, updated_at=new_version),
+    ]
+    returned = SimpleNamespace(id=attempt_id, version=new_version)
+    db = fake_session(_rows(), [returned], new_rows, [returned], [], [], [attempt])
+
+    answers = [{"question_id": SINGLE, "selected_answer_id": A_NG}]
+    assert await crud_quiz.submit_quiz_attempt(db, uuid.uuid4(), QUIZ_ID, answers) is attempt
+    # 2 回目の UPDATE は新しい解答キーで採点したスコアで確定する
+    assert db.writes == [
+        ("UPDATE", "user_quiz_attempts"), ("UPDATE", "user_quiz_attempts"),
+        ("INSERT", "user_quiz_stats"), ("INSERT", "user_quiz_answers"),
+    ]
+    assert db.values(1)["score"] == 0.0 and db.values(3)["score"] == 100.0
+    assert quiz_definition_cache.peek(QUIZ_ID).version == new_version
+    assert db.values(4)["best_score"] == 100.0
+    assert db.values(5) == [{"attempt_id": attempt_id, "question_id": SINGLE, "selected_answer_id": A_NG}]
+
+
+@pytest.mark.asyncio
+async def test_regrading_saved_answers_matches_the_submitted_score(fake_session):
+    """記述式も含めて、保存した回答を採点し直すと提出時と同じスコアになる。"""
+    key = build_answer_key(_rows())
+    quiz_definition_cache.clear()
+    quiz_definition_cache.set(key)
+    submitted = grade(key, [
+        {"question_id": SINGLE, "selected_answer_id": A_OK},
+        {"question_id": MULTI, "selected_answer_ids": [M_1, M_2]},
+        {"question_id": TEXT, "user_text_answer": "tokyo tower"},
+    ])
+    assert submitted.score == 100.0
+
+    attempt = SimpleNamespace(id=uuid.uuid4(), user_id=uuid.uuid4(), quiz_id=QUIZ_ID, is_completed=False,
+                              end_time=None, score=0.0, passed=False)
+    saved = submitted.answer_rows
+    db = fake_session(saved, [], [], [attempt])
+    await crud_quiz.update_user_quiz_attempt(db, attempt, crud_quiz.UserQuizAttemptUpdate(is_completed=True))
+    assert (attempt.score, attempt.passed) == (100.0, True) and db.commits == 1
@@ -0,0 +1,62 @@
+# backend/app/services/tests/test_recommendation_pool.py
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models.quiz import Quiz
+from app.services.recommendation_pool import CandidatePool, CandidatePoolCache, sample_by_random_key
+
+
+def test_sample_reads_index_ranges_without_sorting_the_table():
+    sample = sample_by_random_key(select(Quiz.id).where(Quiz.is_active.is_(True)), Quiz.random_key, 10, pivot=0.25)
+    sql = str(select(sample.c.id).limit(10).compile(dialect=postgresql.dialect()))
+    assert "random()" not in sql
+    assert "quizzes.random_key >= " in sql and "quizzes.random_key < " in sql
+    assert sql.count("ORDER BY quizzes.random_key") == 2 and "UNION ALL" in sql
+
+
+def test_pick_fills_from_higher_tiers_first():
+    pool = CandidatePool(tiers=(("a", "b"), ("c", "d", "e"), ("f",)))
+    picked = pool.pick(3)
+    assert set(picked[:2]) == {"a", "b"} and picked[2] in {"c", "d", "e"}
+    assert sorted(pool.pick(10)) == ["a", "b", "c", "d", "e", "f"]
+    assert CandidatePool(tiers=((),)).pick(5) == []
+
+
+def test_cache_drops_pools_loaded_across_an_invalidation():
+    cache = CandidatePoolCache(ttl_seconds=60, max_entries=1)
+    pool = CandidatePool(tiers=(("a",),))
+
+    generation = cache.generation("user-1")
+    cache.invalidate("user-1")
+    cache.set("user-1", pool, generation)
+    assert cache.get("user-1") is None
+
+    cache.set("user-1", pool, cache.generation("user-1"))
+    assert cache.get("user-1") is pool
+    cache.set("user-2", pool)
+    assert cache.get("user-1") is None and len(cache) == 1
+
+
+def test_invalidating_one_user_does_not_drop_another_users_load():
+    """ユーザー A の無効化 (クイズの提出) と同時に読み込んだユーザー B の候補はキャッシュされる。"""
+    cache = CandidatePoolCache(ttl_seconds=60, max_entries=10)
+    pool = CandidatePool(tiers=(("a",),))
+
+    generation_a, generation_b = cache.generation("user-a"), cache.generation("user-b")
+    cache.invalidate("user-a")
+    cache.set("user-a", pool, generation_a)
+    cache.set("user-b", pool, generation_b)
+
+    assert cache.get("user-a") is None and cache.get("user-b") is pool
+
+
+def test_forgotten_generations_never_let_a_stale_load_through():
+    """古い世代番号を捨てても、その間に無効化されたキーの読み込み結果は保存しない。"""
+    cache = CandidatePoolCache(ttl_seconds=60, max_entries=2)
+    pool = CandidatePool(tiers=(("a",),))
+
+    generation = cache.generation("user-1")
+    for user in ("user-1", "user-2", "user-3"):  # user-1 の番号は捨てられる
+        cache.invalidate(user)
+    cache.set("user-1", pool, generation)
+    assert cache.get("user-1") is None
@@ -0,0 +1,95 @@
+# backend/app/services/tests/test_s3_service.py
+import base64
+import io
+import json
+import threading
+
+import boto3
+import pytest
+from PIL import Image
+
+from app.services.s3_service import S3Service
+
+
+class InMemoryS3:
+    """upload_fileobj / download_fileobj / delete_object だけを持つ S3 クライアントの代わり"""
+
+    def __init__(self):
+        self.objects = {}
+        self.threads = set()
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.threads.add(threading.current_thread().name)
+        self.objects[key] = (fileobj.read(), (ExtraArgs or {}).get("ContentType"))
+
+    def download_fileobj(self, bucket, key, fileobj, Config=None):
+        fileobj.write(self.objects[key][0])
+
+    def delete_object(self, Bucket, Key):
+        self.threads.add(threading.current_thread().name)
+        self.objects.pop(Key, None)
+
+
+def _png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGBA", (width, height), (255, 0, 0, 255)).save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+class _UploadFile:
+    """UploadFile の代わり。イベントループ上での read() は呼ばれないこと"""
+
+    def __init__(self, fileobj):
+        self.file = fileobj
+
+    async def read(self):  # pragma: no cover - 呼ばれたら失敗
+        raise AssertionError("icon upload must not read the whole file on the event loop")
+
+
+@pytest.mark.asyncio
+async def test_upload_icon_normalizes_off_the_event_loop():
+    client = InMemoryS3()
+    service = S3Service(bucket_name="icons", s3_client=client, max_workers=2)
+    try:
+        key = await service.upload_icon(_UploadFile(_png(2048, 1024)), "u1", ".PNG")
+        assert key == "icons/user_u1.png"
+        body, content_type = client.objects[key]
+        assert content_type == "image/png"
+        assert Image.open(io.BytesIO(body)).size == (512, 256)
+
+        with pytest.raises(ValueError):
+            await service.upload_icon(_UploadFile(io.BytesIO(b"not an image")), "u1", ".png")
+
+        assert await service.delete_icon("u1", ".png") and key not in client.objects
+        assert all(name.startswith("s3") for name in client.threads)
+    finally:
+        service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_presigned_icon_upload_is_scoped_to_the_user():
+    """署名付き POST はユーザーごとの一時キーに限定され、完了時に正規化してアイコンのキーへ移す。"""
+    real = boto3.client(
+        "s3", region_name="ap-northeast-1", aws_access_key_id="test", aws_secret_access_key="test"
+    )
+    client = InMemoryS3()
+    client.generate_presigned_post = real.generate_presigned_post
+    service = S3Service(bucket_name="icons", s3_client=client, max_workers=2)
+    try:
+        upload = await service.create_icon_upload("u1", ".jpg")
+        assert upload["object_key"].startswith("icons/uploads/user_u1/")
+        policy = json.loads(base64.b64decode(upload["fields"]["policy"]))
+        assert ["content-length-range", 1, 10 * 1024 * 1024] in policy["conditions"]
+        assert upload["fields"]["Content-Type"] == "image/jpeg"
+
+        # クライアントが S3 へ直接アップロードした状態
+        client.objects[upload["object_key"]] = (_png(1024, 1024).read(), "image/jpeg")
+        with pytest.raises(ValueError):
+            await service.complete_icon_upload("u2", upload["object_key"])
+
+        assert await service.complete_icon_upload("u1", upload["object_key"]) == "icons/user_u1.jpg"
+        assert upload["object_key"] not in client.objects
+        assert Image.open(io.BytesIO(client.objects["icons/user_u1.jpg"][0])).format == "JPEG"
+    finally:
+        service.shutdown()
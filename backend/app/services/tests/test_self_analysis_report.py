@@ -0,0 +1,67 @@
+# backend/app/services/tests/test_self_analysis_report.py
+import pytest
+from sqlalchemy.orm import Session
+
+from app.models.self_analysis import SelfAnalysisNote
+from app.services import self_analysis_report as module
+from app.services.self_analysis_report import SelfAnalysisReportCache
+
+# エンドポイントが所有権の確認に使ったセッション (レポートの読み込みでも同じものを使う)
+DB = object()
+
+
+@pytest.fixture
+def fake_notes(monkeypatch):
+    """list_notes_by_step を差し替え、呼び出し回数を記録する"""
+    notes = {
+        "FUTURE": [{"chat": {"future": "研究者"}}],
+        "HISTORY": [{"timeline": [{"year": 2020, "event": "部活", "detail": "主将", "skills": ["統率"], "values": ["挑戦"]}]}],
+    }
+    calls = []
+
+    async def fake_list_notes_by_step(session_id, db):
+        assert db is DB
+        calls.append(session_id)
+        return notes
+
+    monkeypatch.setattr(module, "list_notes_by_step", fake_list_notes_by_step)
+    monkeypatch.setattr(module, "report_cache", SelfAnalysisReportCache(ttl_seconds=60, max_sessions=10))
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_report_is_built_from_one_query_and_cached(fake_notes):
+    """全ステップを 1 回の取得で組み立て、2 回目以降はキャッシュを返す。"""
+    report = await module.load_self_analysis_report(DB, "s1")
+    again = await module.load_self_analysis_report(DB, "s1")
+
+    assert fake_notes == ["s1"]
+    assert again is report
+    assert report["future"] == [{"chat": {"future": "研究者"}}]
+    assert report["gap"] == [] and report["reflect"] == []
+    assert "部活" in report["timeline_md"]
+
+
+@pytest.mark.asyncio
+async def test_committing_a_note_invalidates_the_report(fake_notes):
+    """ノートを書き込むセッションのコミットで、そのセッションのレポートだけが破棄される。"""
+    await module.load_self_analysis_report(DB, "s1")
+    await module.load_self_analysis_report(DB, "s2")
+
+    # DB には接続せず、flush / commit 時のイベントハンドラーを直接呼ぶ
+    session = Session()
+    session.add(SelfAnalysisNote(session_id="s1", step="GAP", content={}))
+    module._record_note_changes(session, None)
+    module._apply_report_invalidations(session)
+
+    assert module.report_cache.get("s1") is None
+    assert module.report_cache.get("s2") is not None
+
+
+def test_report_built_during_invalidation_is_not_cached():
+    cache = SelfAnalysisReportCache(ttl_seconds=60, max_sessions=10)
+    generation = cache.generation
+    cache.invalidate("s1")
+    cache.set("s1", {"future": []}, generation)
+
+    assert cache.get("s1") is None
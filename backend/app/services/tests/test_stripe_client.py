@@ -0,0 +1,62 @@
+# backend/app/services/tests/test_stripe_client.py
+import threading
+
+import pytest
+
+from app.services.stripe_client import AsyncStripeService, StripeCatalogCache
+from app.services.stripe_service import StripeService
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Stripe には接続せず、StripeService の呼び出しを記録する"""
+    calls = []
+
+    def fake_list_products(active=None, limit=100):
+        calls.append(("list_products", threading.current_thread().name))
+        return [{"id": "prod_1", "active": active}]
+
+    def fake_update_product(product_id, **kwargs):
+        calls.append(("update_product", threading.current_thread().name))
+        return {"id": product_id, **kwargs}
+
+    monkeypatch.setattr(StripeService, "list_products", staticmethod(fake_list_products))
+    monkeypatch.setattr(StripeService, "update_product", staticmethod(fake_update_product))
+    service = AsyncStripeService(max_workers=2, cache=StripeCatalogCache(ttl_seconds=60, max_entries=10))
+    service.calls = calls
+    yield service
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_catalog_reads_run_off_the_loop_and_are_cached(client):
+    first = await client.list_products(active=True)
+    again = await client.list_products(active=True)
+    other = await client.list_products(active=False)
+
+    assert again is first and other is not first
+    assert [name for name, _ in client.calls] == ["list_products", "list_products"]
+    assert all(thread.startswith("stripe") for _, thread in client.calls)
+
+
+@pytest.mark.asyncio
+async def test_writes_and_webhooks_invalidate_the_catalog(client):
+    await client.list_products(active=True)
+    await client.update_product("prod_1", name="新プラン")
+    await client.list_products(active=True)
+
+    client.cache.invalidate_for_event("product.updated")
+    await client.list_products(active=True)
+    client.cache.invalidate_for_event("customer.created")
+    await client.list_products(active=True)
+
+    assert [name for name, _ in client.calls] == ["list_products", "update_product", "list_products", "list_products"]
+
+
+def test_read_started_before_invalidation_is_not_cached():
+    cache = StripeCatalogCache(ttl_seconds=60, max_entries=10)
+    generation = cache.generation("price")
+    cache.invalidate_for_event("price.updated")
+    cache.set("price", "key", ["stale"], generation)
+
+    assert cache.get("price", "key") is None
@@ -0,0 +1,127 @@
+# backend/app/services/tests/test_stripe_webhook_queue.py
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import stripe_webhook_queue as module
+from app.services.stripe_webhook_handlers import ordering_key_for
+from app.services.stripe_webhook_queue import StripeWebhookQueue
+
+
+class FakeEventStore:
+    """stripe_webhook_events の代わり (record / claim / finish を crud と同じ約束で実装)"""
+
+    def __init__(self):
+        self.rows = {}
+        self.by_event_id = {}
+
+    def record(self, event):
+        if event["id"] in self.by_event_id:
+            return None
+        row_id = uuid.uuid4()
+        self.by_event_id[event["id"]] = row_id
+        self.rows[row_id] = SimpleNamespace(
+            id=row_id, event_id=event["id"], event_type=event["type"], ordering_key=ordering_key_for(event),
+            payload=event, status="pending", attempts=0, last_error=None, created_at=datetime.utcnow(),
+        )
+        return row_id
+
+    async def claim(self, db, row_id, stale_before):
+        row = self.rows[row_id]
+        if row.status != "pending":
+            return None
+        row.status, row.attempts = "processing", row.attempts + 1
+        return SimpleNamespace(**vars(row))
+
+    async def finish(self, db, row_id, status, error=None):
+        self.rows[row_id].status, self.rows[row_id].last_error = status, error
+
+
+def _event(event_id, event_type="customer.subscription.updated", subscription_id="sub_1"):
+    return {"id": event_id, "type": event_type, "data": {"object": {"id": subscription_id}}}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeEventStore()
+    monkeypatch.setattr(module.crud_subscription, "claim_webhook_event", store.claim)
+    monkeypatch.setattr(module.crud_subscription, "finish_webhook_event", store.finish)
+    return store
+
+
+@asynccontextmanager
+async def _no_db():
+    yield None
+
+
+def _queue(handler, **kwargs):
+    return StripeWebhookQueue(
+        workers=kwargs.get("workers", 4), max_attempts=kwargs.get("max_attempts", 3), retry_base_seconds=0,
+        stale_seconds=300, session_factory=_no_db, handler=handler,
+    )
+
+
+@pytest.mark.asyncio
+async def test_events_for_one_subscription_run_in_order_and_replays_are_noops(store):
+    handled = []
+
+    async def handler(db, event):
+        await asyncio.sleep(0.01 if event["id"] == "evt_1" else 0)
+        handled.append(event["id"])
+        return {"status": "success"}
+
+    queue = _queue(handler)
+    for event_id in ("evt_1", "evt_2", "evt_3"):
+        row_id = store.record(_event(event_id))
+        queue.enqueue(row_id, store.rows[row_id].ordering_key)
+    await queue.join()
+
+    assert handled == ["evt_1", "evt_2", "evt_3"]
+    assert store.record(_event("evt_1")) is None  # 同じ event.id は保存されない
+    assert await queue.process(store.by_event_id["evt_1"]) is None  # 処理済みのイベントは処理しない
+    assert queue.metrics()["processed"] == 3
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_exceptions_are_retried_and_error_results_are_not(store):
+    attempts = {"evt_flaky": 0}
+
+    async def handler(db, event):
+        if event["id"] == "evt_bad":
+            return {"status": "error", "message": "user_id not found in metadata"}
+        attempts["evt_flaky"] += 1
+        if attempts["evt_flaky"] < 2:
+            raise RuntimeError("temporary")
+        return {"status": "success"}
+
+    queue = _queue(handler)
+    flaky = store.record(_event("evt_flaky"))
+    bad = store.record(_event("evt_bad", subscription_id="sub_2"))
+
+    assert await queue.process(flaky) == "processed"
+    assert await queue.process(bad) == "failed"
+    assert attempts["evt_flaky"] == 2
+    assert store.rows[bad].last_error == "user_id not found in metadata"
+    assert queue.metrics()["retried"] == 1
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_attempts(store):
+    async def handler(db, event):
+        raise RuntimeError("down")
+
+    queue = _queue(handler, max_attempts=2)
+    row_id = store.record(_event("evt_down"))
+
+    assert await queue.process(row_id) == "failed"
+    assert store.rows[row_id].attempts == 2
+
+
+def test_ordering_key_groups_events_by_subscription():
+    assert ordering_key_for({"id": "evt_1", "type": "invoice.payment_succeeded", "data": {"object": {"id": "in_1", "subscription": "sub_9"}}}) == "sub_9"
+    assert ordering_key_for({"id": "evt_2", "type": "customer.subscription.deleted", "data": {"object": {"id": "sub_9"}}}) == "sub_9"
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+WebSocket チャットの time-to-first-token (TTFT) ベンチマーク。
+
+DB を往復遅延 (--rtt-ms) だけを持つフェイクに置き換え、1 ターン分の永続化処理を
+旧実装 (ユーザー/AI プレースホルダーをそれぞれ commit/refresh) と
+ライトビハインド実装 (chat_write_behind に積むだけ) で実行し、
+最初のトークンを送れるまでの時間を比較する。
+
+    python scripts/bench_chat_ttft.py --rtt-ms 2 5 --turns 50 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+# Ensure project root is in PYTHONPATH
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if top_dir not in sys.path:
+    sys.path.append(top_dir)
+
+from app.crud.chat import get_chat_messages, get_or_create_chat_session, save_chat_message
+from app.models.chat import ChatSession
+from app.models.enums import ChatType, MessageSender, SessionStatus
+from app.services.chat_persistence import ChatWriteBehindQueue
+
+
+class _FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self._rows[0] if self._rows else None
+
+    def all(self):
+        return list(self._rows)
+
+
+class LatencyDB:
+    """1 往復ごとに rtt 秒待つだけの AsyncSession 代わり"""
+
+    def __init__(self, rtt: float, chat_session: ChatSession = None):
+        self.rtt = rtt
+        self.chat_session = chat_session
+        self.round_trips = 0
+        self._pending = []
+        self._next_id = 1
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        await asyncio.sleep(self.rtt)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        await self._round_trip()
+        if getattr(statement, "is_select", False) and statement.column_descriptions[0]["entity"] is ChatSession:
+            return _FakeResult([self.chat_session] if self.chat_session else [])
+        return _FakeResult([])
+
+    def add(self, obj):
+        self._pending.append(obj)
+
+    async def commit(self):
+        if self._pending:
+            # flush (INSERT/UPDATE ... RETURNING) 分
+            await self._round_trip()
+            for obj in self._pending:
+                if hasattr(obj, "sender") and obj.id is None:
+                    obj.id = self._next_id
+                    self._next_id += 1
+            self._pending.clear()
+        await self._round_trip()
+
+    async def refresh(self, obj):
+        await self._round_trip()
+
+
+async def _first_token():
+    # LLM 側の遅延は比較対象外なので 0 とする
+    await asyncio.sleep(0)
+    return "token"
+
+
+async def legacy_turn(db: LatencyDB, chat_session: ChatSession, message: str) -> float:
+    """変更前の websocket_chat_endpoint と同じ順序で永続化してから最初のトークンを返す"""
+    started = time.perf_counter()
+    chat_session = await get_or_create_chat_session(db, chat_session.user_id, chat_session.id, "general")
+    await save_chat_message(db=db, session_id=chat_session.id, content=message, user_id=chat_session.user_id, sender_type="USER")
+    await get_chat_messages(db, chat_session.id)
+    ai_message = await save_chat_message(db=db, session_id=chat_session.id, content="", sender_type="AI")
+    await db.commit()
+    await db.refresh(ai_message)
+    await _first_token()
+    ttft = time.perf_counter() - started
+    # ストリーミング完了後の更新 (TTFT には含まれない)
+    ai_message.content = "reply"
+    db.add(ai_message)
+    await db.commit()
+    await db.refresh(ai_message)
+    return ttft
+
+
+async def write_behind_turn(db: LatencyDB, writer: ChatWriteBehindQueue, chat_session: ChatSession, message: str, first: bool) -> float:
+    """ライトビハインド版: セッション解決 (初回のみ) と履歴読み込みだけが TTFT に乗る"""
+    started = time.perf_counter()
+    if first:
+        chat_session = await get_or_create_chat_session(db, chat_session.user_id, chat_session.id, "general", persist=False)
+    await get_chat_messages(db, chat_session.id)
+    await writer.add_message(chat_session.id, message, MessageSender.USER, user_id=chat_session.user_id)
+    await _first_token()
+    ttft = time.perf_counter() - started
+    await writer.add_message(chat_session.id, "reply", MessageSender.AI)
+    return ttft
+
+
+def _make_session() -> ChatSession:
+    return ChatSession(
+        id=uuid.uuid4(), user_id=uuid.uuid4(), title="bench",
+        status=SessionStatus.ACTIVE, chat_type=ChatType.GENERAL,
+    )
+
+
+async def run(rtt_ms: float, turns: int, concurrency: int):
+    rtt = rtt_ms / 1000
+    writer_db_log = []
+
+    def writer_session_factory():
+        db = LatencyDB(rtt)
+        writer_db_log.append(db)
+        return db
+
+    writer = ChatWriteBehindQueue(session_factory=writer_session_factory)
+
+    async def legacy_connection():
+        chat_session = _make_session()
+        db = LatencyDB(rtt, chat_session)
+        return [await legacy_turn(db, chat_session, f"message {i}") for i in range(turns)]
+
+    async def write_behind_connection():
+        chat_session = _make_session()
+        db = LatencyDB(rtt, chat_session)
+        return [await write_behind_turn(db, writer, chat_session, f"message {i}", i == 0) for i in range(turns)]
+
+    legacy = [t for ts in await asyncio.gather(*(legacy_connection() for _ in range(concurrency))) for t in ts]
+    started = time.perf_counter()
+    new = [t for ts in await asyncio.gather(*(write_behind_connection() for _ in range(concurrency))) for t in ts]
+    await writer.close()
+    drained = time.perf_counter() - started
+
+    def fmt(samples):
+        samples = sorted(samples)
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        return f"mean {statistics.mean(samples) * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms"
+
+    print(f"--- rtt={rtt_ms} ms, turns={turns}, concurrency={concurrency} ---")
+    print(f"legacy       TTFT: {fmt(legacy)}")
+    print(f"write-behind TTFT: {fmt(new)}")
+    print(f"write-behind: {turns * concurrency * 2} messages in {len(writer_db_log)} transactions (drained in {drained:.2f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, nargs="+", default=[1.0, 5.0])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    for rtt_ms in args.rtt_ms:
+        asyncio.run(run(rtt_ms, args.turns, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
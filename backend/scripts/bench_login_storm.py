@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+ログイン集中時に、無関係なエンドポイントのレイテンシがどれだけ悪化するかの負荷試験。
+
+1 つのイベントループ上で bcrypt 検証を行うログインを --logins 件同時に流しながら、
+軽量なエンドポイント (/ping) を一定間隔で叩き、その p50 / p99 を計測する。
+ログイン側は旧実装 (イベントループ上で pwd_context.verify) と
+app.core.password_hasher (専用スレッドプール + 上限超過は 503) を比較する。
+
+    python scripts/bench_login_storm.py --logins 40 --pings 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Ensure project root is in PYTHONPATH
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if top_dir not in sys.path:
+    sys.path.append(top_dir)
+
+import httpx
+from fastapi import FastAPI
+
+from app.core.exceptions import ServiceUnavailableError
+from app.core.password_hasher import PasswordHasher
+from app.core.security import pwd_context
+
+
+def build_app(hasher: PasswordHasher, hashed: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.post("/login/legacy")
+    async def login_legacy():
+        return {"ok": pwd_context.verify("secret", hashed)}
+
+    @app.post("/login/pooled")
+    async def login_pooled():
+        try:
+            return {"ok": await hasher.verify_password("secret", hashed)}
+        except ServiceUnavailableError:
+            return {"ok": False, "rejected": True}
+
+    return app
+
+
+async def run(mode: str, logins: int, pings: int, interval: float, hasher: PasswordHasher, hashed: str):
+    app = build_app(hasher, hashed)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def login():
+            response = await client.post(f"/login/{mode}")
+            return response.json().get("rejected", False)
+
+        async def ping_loop():
+            # 予定時刻からの遅れで測る (ループが止まっている間に送れなかった時間も含める)
+            samples = []
+            started = time.perf_counter()
+            for i in range(pings):
+                scheduled = started + i * interval
+                await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+                await client.get("/ping")
+                samples.append(time.perf_counter() - scheduled)
+            return samples
+
+        storm_started = time.perf_counter()
+        ping_task = asyncio.create_task(ping_loop())
+        rejected = await asyncio.gather(*(login() for _ in range(logins)))
+        storm = time.perf_counter() - storm_started
+        samples = await ping_task
+
+    samples.sort()
+    p99 = samples[max(int(len(samples) * 0.99) - 1, 0)]
+    print(
+        f"{mode:7s} /ping p50 {statistics.median(samples) * 1000:8.2f} ms  p99 {p99 * 1000:8.2f} ms  "
+        f"max {samples[-1] * 1000:8.2f} ms | {logins} logins in {storm:.2f} s, rejected {sum(rejected)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--pings", type=int, default=100)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-queue", type=int, default=32)
+    args = parser.parse_args()
+
+    hashed = pwd_context.hash("secret")
+    hasher = PasswordHasher(max_workers=args.workers, max_pending=args.workers + args.max_queue)
+    try:
+        for mode in ("legacy", "pooled"):
+            asyncio.run(run(mode, args.logins, args.pings, args.interval_ms / 1000, hasher, hashed))
+    finally:
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
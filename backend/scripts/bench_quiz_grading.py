@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+クイズ提出の採点ベンチマーク。
+
+DB を往復遅延 (--rtt-ms) とコネクション数 (--pool-size) だけを持つフェイクに置き換え、
+--submissions 件の提出を同時に流して、全件の所要時間と 1 件あたりの p50 / p99 を比較する。
+
+- legacy: 旧 submit_quiz_attempt の往復パターン (挑戦・全問題の読み込みに加えて、
+  回答ごとに問題と選択肢を 1 回ずつ引く)
+- engine: app.crud.quiz.submit_quiz_attempt から解答キーのキャッシュを外したもの
+  (提出ごとに解答キーを 1 回で読み込み、メモリ上で採点して挑戦の確定と回答の一括 INSERT)
+- cached: app.crud.quiz.submit_quiz_attempt (解答キーは quiz_definition_cache から取り、
+  DB は挑戦の確定と回答の INSERT だけ)
+
+    python scripts/bench_quiz_grading.py --submissions 10000 --questions 50 --rtt-ms 1
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+# Ensure project root is in PYTHONPATH
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if top_dir not in sys.path:
+    sys.path.append(top_dir)
+
+from app.crud import quiz as crud_quiz
+from app.services.quiz_definition_cache import quiz_definition_cache
+from app.services.quiz_grading import load_answer_key
+
+VERSION = datetime(2026, 1, 1)
+
+
+def build_quiz(questions: int):
+    """answer_key_query と同じ形の行と、全問正解の回答を作る"""
+    quiz_id = uuid.uuid4()
+    rows, answers = [], []
+    for _ in range(questions):
+        question_id = uuid.uuid4()
+        choices = [uuid.uuid4() for _ in range(4)]
+        for i, answer_id in enumerate(choices):
+            rows.append(SimpleNamespace(
+                quiz_id=quiz_id, updated_at=VERSION, is_active=True, max_attempts=None, pass_percentage=70.0,
+                question_id=question_id, question_type="single_choice", points=1,
+                answer_id=answer_id, is_correct=i == 0, text=f"choice {i}",
+            ))
+        answers.append({"question_id": str(question_id), "selected_answer_id": str(choices[0])})
+    return quiz_id, rows, answers
+
+
+class FakeSession:
+    """往復ごとにプールのコネクションを 1 本使い、rtt だけ待つ"""
+
+    def __init__(self, pool: asyncio.Semaphore, rtt: float, rows):
+        self.pool = pool
+        self.rtt = rtt
+        self.rows = rows
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        async with self.pool:
+            await asyncio.sleep(self.rtt)
+
+    async def execute(self, stmt, params=None):
+        await self._round_trip()
+        attempt = SimpleNamespace(id=uuid.uuid4(), version=VERSION)
+        return SimpleNamespace(
+            all=lambda: self.rows,
+            first=lambda: attempt,
+            scalars=lambda: SimpleNamespace(first=lambda: attempt),
+        )
+
+    async def commit(self):
+        await self._round_trip()
+
+    async def rollback(self):
+        await self._round_trip()
+
+
+get_quiz_definition = crud_quiz.get_quiz_definition
+
+
+async def legacy_submit(db: FakeSession, answers) -> None:
+    await db.execute(None)  # 挑戦 + クイズ
+    await db.execute(None)  # 全問題
+    for _ in answers:
+        await db.execute(None)  # 問題 + 選択肢
+        await db.execute(None)  # 選ばれた選択肢
+    await db.commit()  # UserQuizAnswer の flush + コミット
+
+
+async def run(mode: str, submissions: int, questions: int, rtt: float, pool_size: int):
+    quiz_id, rows, answers = build_quiz(questions)
+    quiz_definition_cache.clear()
+    # engine は提出ごとに解答キーを読み込む (キャッシュ導入前の動作)
+    crud_quiz.get_quiz_definition = load_answer_key if mode == "engine" else get_quiz_definition
+    pool = asyncio.Semaphore(pool_size)
+    latencies = []
+    round_trips = []
+
+    async def submit():
+        db = FakeSession(pool, rtt, rows)
+        started = time.perf_counter()
+        if mode == "legacy":
+            await legacy_submit(db, answers)
+        else:
+            await crud_quiz.submit_quiz_attempt(db, uuid.uuid4(), quiz_id, answers)
+        latencies.append(time.perf_counter() - started)
+        round_trips.append(db.round_trips)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(submit() for _ in range(submissions)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+    print(
+        f"{mode:6s} {submissions} submissions in {elapsed:7.2f} s ({submissions / elapsed:8.1f}/s)  "
+        f"p50 {statistics.median(latencies) * 1000:9.2f} ms  p99 {p99 * 1000:9.2f} ms | "
+        f"{statistics.median(round_trips):.0f} round trips (median)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=10000)
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=1.0)
+    parser.add_argument("--pool-size", type=int, default=20)
+    modes = ["legacy", "engine", "cached"]
+    parser.add_argument("--modes", nargs="+", default=modes, choices=modes)
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        asyncio.run(run(mode, args.submissions, args.questions, args.rtt_ms / 1000, args.pool_size))
+
+
+if __name__ == "__main__":
+    main()
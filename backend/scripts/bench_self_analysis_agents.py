@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+自己分析 (LangGraph) 1 ターンあたりのエージェント構築コストのベンチマーク。
+
+旧実装は run_*_step のたびにステップエージェント (ChatOpenAI / プロンプト / AgentExecutor) を、
+チャットのメッセージごとに SelfAnalysisOrchestrator を作り直していた。
+LLM 呼び出しは比較対象外なので行わず、構築部分だけを
+旧実装 (毎ターン構築) と get_step_agent による共有インスタンスで比較する。
+
+    python scripts/bench_self_analysis_agents.py --turns 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Ensure project root is in PYTHONPATH
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if top_dir not in sys.path:
+    sys.path.append(top_dir)
+
+# API は呼ばないのでダミーのキーで構築できるようにする
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from app.services.agents.self_analysis_langchain import main as self_analysis
+
+
+def legacy_turn(step: str) -> float:
+    started = time.perf_counter()
+    self_analysis.SelfAnalysisOrchestrator()
+    self_analysis.STEP_AGENT_CLASSES[step]()
+    return time.perf_counter() - started
+
+
+def shared_turn(step: str) -> float:
+    started = time.perf_counter()
+    _ = self_analysis.self_analysis_orchestrator
+    self_analysis.get_step_agent(step)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=100)
+    args = parser.parse_args()
+
+    steps = list(self_analysis.STEP_AGENT_CLASSES)
+    # import 直後の初回構築 (遅延 import など) を計測から外す
+    legacy_turn(steps[0])
+    started = time.perf_counter()
+    self_analysis.warm_up_step_agents()
+    warm_up = time.perf_counter() - started
+
+    legacy = [legacy_turn(steps[i % len(steps)]) for i in range(args.turns)]
+    shared = [shared_turn(steps[i % len(steps)]) for i in range(args.turns)]
+
+    def fmt(samples):
+        samples = sorted(samples)
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        return f"mean {statistics.mean(samples) * 1000:8.3f} ms  p95 {p95 * 1000:8.3f} ms"
+
+    print(f"--- turns={args.turns} ---")
+    print(f"per-turn build (legacy): {fmt(legacy)}")
+    print(f"shared agents          : {fmt(shared)}")
+    print(f"one-time warm-up of {len(steps)} step agents: {warm_up * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
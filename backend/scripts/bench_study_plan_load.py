@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+学習計画の更新が集中しているときに、同じプロセスのチャットストリームの
+トークン間隔がどれだけ乱れるかの負荷試験。
+
+DB を往復遅延 (--rtt-ms) だけを持つフェイクに置き換え、app.crud.study_plan の
+update_study_progress を --updates 件同時に流しながら、一定間隔でトークンを送る
+ストリーミングエンドポイントを読み、各トークンを送り出した時刻の予定からの遅れの
+p50 / p99 を計測する (ASGITransport は応答をまとめて返すので、遅れはサーバー側で測る)。
+学習計画側は旧実装 (同期 Session。往復のたびにイベントループが止まる) と
+AsyncSession (往復中は他のリクエストに譲る) を比較する。
+
+    python scripts/bench_study_plan_load.py --updates 200 --rtt-ms 2 --tokens 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+# Ensure project root is in PYTHONPATH
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if top_dir not in sys.path:
+    sys.path.append(top_dir)
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.crud.study_plan import update_study_progress
+from app.schemas.study_plan import StudyProgressUpdate
+
+
+def _plan(goals: int):
+    today = date.today()
+    return SimpleNamespace(
+        id=uuid.uuid4(), title="bench", start_date=today - timedelta(days=10), end_date=today + timedelta(days=20),
+        is_active=True,
+        goals=[
+            SimpleNamespace(
+                id=uuid.uuid4(), title=f"goal {i}", completed=i % 2 == 0, priority=1,
+                target_date=None, completion_date=None,
+            )
+            for i in range(goals)
+        ],
+    )
+
+
+class _FakeResult:
+    def __init__(self, plan):
+        self._plan = plan
+        self.rowcount = len(plan.goals)
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self._plan
+
+
+class FakeAsyncSession:
+    """往復ごとに rtt だけ待つ AsyncSession の代わり (待つ間は他のタスクが動く)"""
+
+    def __init__(self, rtt: float, plan):
+        self.rtt = rtt
+        self.plan = plan
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        await asyncio.sleep(self.rtt)
+
+    async def execute(self, stmt):
+        await self._round_trip()
+        return _FakeResult(self.plan)
+
+    async def commit(self):
+        await self._round_trip()
+
+    async def rollback(self):
+        await self._round_trip()
+
+
+class BlockingSession(FakeAsyncSession):
+    """旧実装: async def の中から同期 Session を呼ぶのと同じく、往復の間イベントループを止める"""
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.rtt)
+
+
+def build_app(
+    mode: str, rtt: float, goals: int, token_interval: float, tokens: int, samples: list, streaming: asyncio.Event
+) -> FastAPI:
+    app = FastAPI()
+    session_class = BlockingSession if mode == "sync" else FakeAsyncSession
+
+    @app.get("/chat/stream")
+    async def chat_stream():
+        async def generate():
+            # 予定時刻からの遅れで測る (ループが止まっている間に送れなかった時間も含める)
+            started = time.perf_counter()
+            streaming.set()
+            for i in range(1, tokens + 1):
+                scheduled = started + i * token_interval
+                await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+                samples.append(time.perf_counter() - scheduled)
+                yield f"{i}\n"
+        return StreamingResponse(generate(), media_type="text/plain")
+
+    @app.post("/study-plans/{plan_id}/progress")
+    async def progress(plan_id: uuid.UUID):
+        db = session_class(rtt, _plan(goals))
+        await update_study_progress(db, plan_id, StudyProgressUpdate(completed=True))
+        return {"round_trips": db.round_trips}
+
+    return app
+
+
+async def run(mode: str, updates: int, concurrency: int, rtt: float, goals: int, token_interval: float, tokens: int):
+    samples = []
+    streaming = asyncio.Event()
+    app = build_app(mode, rtt, goals, token_interval, tokens, samples, streaming)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def stream():
+            response = await client.get("/chat/stream")
+            response.raise_for_status()
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def update():
+            async with semaphore:
+                response = await client.post(f"/study-plans/{uuid.uuid4()}/progress")
+                return response.json()["round_trips"]
+
+        # ストリームが始まってから負荷をかける
+        stream_task = asyncio.create_task(stream())
+        await streaming.wait()
+        load_started = time.perf_counter()
+        round_trips = await asyncio.gather(*(update() for _ in range(updates)))
+        load = time.perf_counter() - load_started
+        await stream_task
+
+    samples.sort()
+    p99 = samples[max(int(len(samples) * 0.99) - 1, 0)]
+    print(
+        f"{mode:5s} stream delay p50 {statistics.median(samples) * 1000:8.2f} ms  p99 {p99 * 1000:8.2f} ms  "
+        f"max {samples[-1] * 1000:8.2f} ms | {updates} updates in {load:.2f} s, "
+        f"{round_trips[0]} round trips each"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--goals", type=int, default=10)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-interval-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    for mode in ("sync", "async"):
+        asyncio.run(run(
+            mode, args.updates, args.concurrency, args.rtt_ms / 1000, args.goals,
+            args.token_interval_ms / 1000, args.tokens,
+        ))
+
+
+if __name__ == "__main__":
+    main()
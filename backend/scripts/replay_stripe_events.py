@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+保存しておいた Stripe のイベント (JSON) を、Webhook と同じ経路でローカルの DB に流し直すツール。
+
+署名検証だけを省き、stripe_webhook_events への保存 (event.id で重複排除) と
+StripeWebhookQueue.process による処理を同期的に行って結果を表示する。
+同じイベントを 2 回以上流すと、2 回目以降は duplicate になり何も処理されない。
+
+    python scripts/replay_stripe_events.py fixtures/stripe/*.json
+    python scripts/replay_stripe_events.py fixtures/stripe/ --times 2
+
+ファイルは 1 イベントの JSON、またはイベントの配列 (stripe events list の data など)。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+# Ensure project root is in PYTHONPATH
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if top_dir not in sys.path:
+    sys.path.append(top_dir)
+
+from app.crud import subscription as crud_subscription
+from app.database.database import AsyncSessionLocal
+from app.services.stripe_client import stripe_catalog_cache
+from app.services.stripe_webhook_handlers import ordering_key_for
+from app.services.stripe_webhook_queue import stripe_webhook_queue
+
+
+def load_events(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        files = sorted(Path(path).glob("*.json")) if Path(path).is_dir() else [Path(path)]
+        for file in files:
+            data = json.loads(file.read_text())
+            if isinstance(data, dict) and data.get("object") == "list":
+                data = data.get("data", [])
+            # Stripe の一覧は新しい順なので、発生順に並べ直す
+            events = sorted(data, key=lambda e: e.get("created", 0)) if isinstance(data, list) else [data]
+            yield from events
+
+
+async def replay(paths: List[str], times: int) -> None:
+    events = list(load_events(paths))
+    for round_no in range(1, times + 1):
+        for event in events:
+            stripe_catalog_cache.invalidate_for_event(event["type"])
+            async with AsyncSessionLocal() as db:
+                event_row_id = await crud_subscription.record_webhook_event(
+                    db, event["id"], event["type"], ordering_key_for(event), event
+                )
+            stripe_webhook_queue.record_received(duplicate=event_row_id is None)
+            if event_row_id is None:
+                result = "duplicate"
+            else:
+                result = await stripe_webhook_queue.process(event_row_id) or "skipped"
+            print(f"[{round_no}] {event['id']} {event['type']:40s} {result}")
+    print(json.dumps(stripe_webhook_queue.metrics(), ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="イベントの JSON ファイル、またはそれを含むディレクトリ")
+    parser.add_argument("--times", type=int, default=1, help="同じイベントを流す回数 (2 以上で冪等性の確認)")
+    args = parser.parse_args()
+    asyncio.run(replay(args.paths, args.times))
+
+
+if __name__ == "__main__":
+    main()